@@ -0,0 +1,3 @@
+"""
+Нагрузочные проверки и сравнение планов запросов
+"""
@@ -0,0 +1,112 @@
+"""
+Заглушка Telegram Bot API для локальных нагрузочных тестов
+
+Отвечает на вызовы бота (getMe, setWebhook, getFile, send* и т.д.) без обращения
+к Telegram и отдает содержимое файлов случайными байтами. Вместе с
+benchmarks.replay_updates позволяет прогнать webhook-режим полностью локально.
+
+Запуск:
+    python -m benchmarks.fake_bot_api --port 8081
+    TELEGRAM_API_BASE_URL=http://127.0.0.1:8081 BOT_MODE=webhook python main.py
+"""
+import argparse
+import hashlib
+import time
+from aiohttp import web
+
+BOT_ID = 1000000001
+
+
+def bot_user() -> dict:
+    """Пользователь-бот для getMe"""
+    return {
+        "id": BOT_ID,
+        "is_bot": True,
+        "first_name": "Fake Bot",
+        "username": "fake_bot",
+        "can_join_groups": True,
+        "can_read_all_group_messages": True,
+        "supports_inline_queries": False
+    }
+
+
+class FakeBotApi:
+    """Обработчики методов Bot API"""
+
+    def __init__(self, file_size: int):
+        """Инициализация заглушки"""
+        self.file_size = file_size
+        self.calls = {}
+        self._message_id = 0
+
+    def build_app(self) -> web.Application:
+        """Создание aiohttp-приложения"""
+        app = web.Application()
+        app.router.add_route("*", "/bot{token}/{method}", self._handle_method)
+        app.router.add_get("/file/bot{token}/{path:.+}", self._handle_file)
+        app.router.add_get("/stats", self._handle_stats)
+        return app
+
+    async def _params(self, request: web.Request) -> dict:
+        """Параметры вызова: JSON, form-data или query string"""
+        if request.content_type == "application/json":
+            return await request.json()
+        if request.method == "POST":
+            return dict(await request.post())
+        return dict(request.query)
+
+    async def _handle_method(self, request: web.Request) -> web.Response:
+        """Ответ на вызов метода Bot API"""
+        method = request.match_info["method"]
+        params = await self._params(request)
+        self.calls[method] = self.calls.get(method, 0) + 1
+
+        name = method.lower()
+        if name == "getme":
+            result = bot_user()
+        elif name == "getfile":
+            file_id = str(params.get("file_id", ""))
+            result = {
+                "file_id": file_id,
+                "file_unique_id": hashlib.md5(file_id.encode()).hexdigest()[:16],
+                "file_size": self.file_size,
+                "file_path": f"documents/{file_id}"
+            }
+        elif name.startswith("send"):
+            self._message_id += 1
+            result = {
+                "message_id": self._message_id,
+                "date": int(time.time()),
+                "chat": {"id": int(params.get("chat_id", 0) or 0), "type": "private"},
+                "from": bot_user()
+            }
+        else:
+            # setWebhook, deleteWebhook, answerCallbackQuery и прочие
+            result = True
+
+        return web.json_response({"ok": True, "result": result})
+
+    async def _handle_file(self, request: web.Request) -> web.Response:
+        """Содержимое файла: детерминированные байты по пути"""
+        seed = hashlib.sha256(request.match_info["path"].encode()).digest()
+        body = (seed * (self.file_size // len(seed) + 1))[:self.file_size]
+        return web.Response(body=body, content_type="application/octet-stream")
+
+    async def _handle_stats(self, request: web.Request) -> web.Response:
+        """Количество вызовов по методам"""
+        return web.json_response(self.calls)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1", help="Адрес для прослушивания")
+    parser.add_argument("--port", type=int, default=8081, help="Порт")
+    parser.add_argument("--file-size", type=int, default=4096, help="Размер отдаваемых файлов в байтах")
+    args = parser.parse_args()
+
+    api = FakeBotApi(args.file_size)
+    web.run_app(api.build_app(), host=args.host, port=args.port, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+Нагрузочный прогон webhook-режима записанными или синтетическими обновлениями
+
+Отправляет Update JSON на webhook-эндпоинт бота с заголовком
+X-Telegram-Bot-Api-Secret-Token и выводит пропускную способность и задержки.
+Файлы обновлений - JSON Lines (одно обновление в строке) или JSON-массив.
+
+Запуск:
+    python -m benchmarks.replay_updates --url http://127.0.0.1:8080/telegram/webhook \\
+        --secret SECRET updates.jsonl
+    python -m benchmarks.replay_updates --url http://127.0.0.1:8080/telegram/webhook \\
+        --secret SECRET --synthetic 10000 --chats 50 --concurrency 40
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from typing import Iterator, List
+from aiohttp import ClientSession, ClientTimeout, TCPConnector
+
+
+def load_updates(paths: List[str]) -> List[dict]:
+    """Чтение обновлений из файлов JSON Lines или JSON-массивов"""
+    updates = []
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            content = f.read().strip()
+        if content.startswith("["):
+            updates.extend(json.loads(content))
+        else:
+            updates.extend(json.loads(line) for line in content.splitlines() if line.strip())
+    return updates
+
+
+def synthetic_updates(count: int, chats: int) -> Iterator[dict]:
+    """Текстовые сообщения в группах от нескольких пользователей"""
+    now = int(time.time())
+    for i in range(count):
+        chat_id = -1001000000000 - (i % chats)
+        user_id = 100000 + (i % 997)
+        yield {
+            "update_id": i + 1,
+            "message": {
+                "message_id": i // chats + 1,
+                "date": now,
+                "chat": {"id": chat_id, "type": "supergroup", "title": f"Chat {i % chats}"},
+                "from": {"id": user_id, "is_bot": False, "first_name": f"User {user_id}"},
+                "text": f"Synthetic message {i}"
+            }
+        }
+
+
+def renumber(updates: List[dict], repeat: int) -> Iterator[dict]:
+    """Повтор обновлений с уникальными update_id и message_id в каждом проходе"""
+    max_message_id = max((u.get("message", {}).get("message_id", 0) for u in updates), default=0)
+    update_id = 0
+    for round_no in range(repeat):
+        for update in updates:
+            update_id += 1
+            update = json.loads(json.dumps(update))
+            update["update_id"] = update_id
+            for key in ("message", "edited_message", "channel_post"):
+                if key in update:
+                    update[key]["message_id"] += round_no * max_message_id
+            yield update
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """Перцентиль отсортированного списка"""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+async def replay(url: str, secret: str, updates: Iterator[dict], concurrency: int) -> dict:
+    """Отправка обновлений с ограничением числа одновременных запросов"""
+    headers = {"X-Telegram-Bot-Api-Secret-Token": secret}
+    latencies = []
+    errors = {}
+    queue = asyncio.Queue(maxsize=concurrency * 2)
+
+    async def producer():
+        for update in updates:
+            await queue.put(update)
+        for _ in range(concurrency):
+            await queue.put(None)
+
+    async def sender(session: ClientSession):
+        while True:
+            update = await queue.get()
+            if update is None:
+                return
+            started = time.perf_counter()
+            try:
+                async with session.post(url, json=update, headers=headers) as response:
+                    await response.read()
+                    status = response.status
+            except Exception as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - started)
+            if status != 200:
+                errors[status] = errors.get(status, 0) + 1
+
+    connector = TCPConnector(limit=concurrency)
+    async with ClientSession(connector=connector, timeout=ClientTimeout(total=30)) as session:
+        started = time.perf_counter()
+        await asyncio.gather(producer(), *(sender(session) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {"sent": len(latencies), "errors": errors, "elapsed": elapsed, "latencies": latencies}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="*", help="Файлы с обновлениями (JSON Lines или JSON-массив)")
+    parser.add_argument("--url", required=True, help="URL webhook-эндпоинта бота")
+    parser.add_argument("--secret", required=True, help="WEBHOOK_SECRET_TOKEN бота")
+    parser.add_argument("--synthetic", type=int, default=0, help="Сгенерировать N текстовых сообщений")
+    parser.add_argument("--chats", type=int, default=10, help="Количество чатов для --synthetic")
+    parser.add_argument("--repeat", type=int, default=1, help="Сколько раз повторить записанные обновления")
+    parser.add_argument("--concurrency", type=int, default=40, help="Одновременных запросов")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        updates = synthetic_updates(args.synthetic, args.chats)
+    elif args.files:
+        updates = renumber(load_updates(args.files), args.repeat)
+    else:
+        print("Укажите файлы с обновлениями или --synthetic N", file=sys.stderr)
+        sys.exit(1)
+
+    result = asyncio.run(replay(args.url, args.secret, updates, args.concurrency))
+    latencies = result["latencies"]
+    rate = result["sent"] / result["elapsed"] if result["elapsed"] else 0.0
+
+    print(f"Отправлено:     {result['sent']}")
+    print(f"Ошибки:         {result['errors'] or 'нет'}")
+    print(f"Время:          {result['elapsed']:.2f} с")
+    print(f"Обновлений/с:   {rate:.0f}")
+    print(f"Задержка p50:   {percentile(latencies, 0.50) * 1000:.1f} мс")
+    print(f"Задержка p95:   {percentile(latencies, 0.95) * 1000:.1f} мс")
+    print(f"Задержка p99:   {percentile(latencies, 0.99) * 1000:.1f} мс")
+
+
+if __name__ == "__main__":
+    main()
@@ -8,6 +8,17 @@ from dotenv import load_dotenv
 load_dotenv()
 
 
+def _parse_mapping(value: str, cast=str) -> dict:
+    """Разбор строки вида "ключ:значение,ключ:значение" в словарь"""
+    mapping = {}
+    for item in (value or "").split(","):
+        if ":" not in item:
+            continue
+        key, _, item_value = item.rpartition(":")
+        mapping[key.strip()] = cast(item_value.strip())
+    return mapping
+
+
 class Config:
     """Класс для хранения конфигурации приложения"""
     
@@ -22,13 +33,171 @@ class Config:
     DB_USER = os.getenv("DB_USER", "postgres")
     DB_PASSWORD = os.getenv("DB_PASSWORD", "")
     
+    # Помесячные секции messages/documents/reactions: на сколько месяцев вперед
+    # создавать секции и интервал проверки (сек)
+    PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))
+    PARTITION_CHECK_INTERVAL = float(os.getenv("PARTITION_CHECK_INTERVAL", "86400"))
+    
+    # Срок хранения сообщений в БД (месяцев, 0 - без ограничения), отдельно для чатов
+    # (-1001234567890:6); старые месяцы переносятся в архив ARCHIVE_PATH
+    RETENTION_MONTHS = int(os.getenv("RETENTION_MONTHS", "0"))
+    RETENTION_CHAT_MONTHS = _parse_mapping(os.getenv("RETENTION_CHAT_MONTHS", ""), int)
+    RETENTION_CHECK_INTERVAL = float(os.getenv("RETENTION_CHECK_INTERVAL", "86400"))
+    ARCHIVE_PATH = os.getenv("ARCHIVE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "archive"))
+    # Хранить файлы вложений перенесенных в архив сообщений (false - файлы освобождаются
+    # и удаляются при очистке хранилища, если на них не ссылаются документы в БД)
+    RETENTION_KEEP_MEDIA = os.getenv("RETENTION_KEEP_MEDIA", "true").lower() in ("1", "true", "yes")
+    
+    # Полнотекстовый поиск /search: результатов на странице
+    SEARCH_PAGE_SIZE = int(os.getenv("SEARCH_PAGE_SIZE", "10"))
+    
+    # Потоковый экспорт /export, /export_date: сообщений в странице выборки, размер
+    # файла в памяти до сброса на диск (байт) и каталог временных файлов экспорта
+    EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "1000"))
+    EXPORT_SPOOL_SIZE = int(os.getenv("EXPORT_SPOOL_SIZE", str(1024 * 1024)))
+    EXPORT_PATH = os.getenv("EXPORT_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "exports"))
+    # Максимальный размер файла экспорта (байт): больший экспорт делится на части.
+    # 50 МБ - лимит загрузки Bot API (локальный сервер Bot API - до 2000 МБ)
+    EXPORT_UPLOAD_LIMIT = int(os.getenv("EXPORT_UPLOAD_LIMIT", str(50 * 1000 * 1000)))
+    
+    # Кэш готовых файлов экспорта: общий размер, байт (0 - кэш отключен),
+    # время жизни записи, сек, и каталог
+    EXPORT_CACHE_SIZE = int(os.getenv("EXPORT_CACHE_SIZE", str(1024 * 1024 * 1024)))
+    EXPORT_CACHE_TTL = float(os.getenv("EXPORT_CACHE_TTL", "86400"))
+    EXPORT_CACHE_PATH = os.getenv("EXPORT_CACHE_PATH", os.path.join(EXPORT_PATH, "cache"))
+    
+    # Ответы админ-бота: запросов в секунду всего, в один чат и подряд в чат без
+    # ожидания, одновременных загрузок файлов, попыток и начальная задержка повтора (сек)
+    SEND_RATE = float(os.getenv("SEND_RATE", "30"))
+    SEND_CHAT_RATE = float(os.getenv("SEND_CHAT_RATE", "1"))
+    SEND_CHAT_BURST = float(os.getenv("SEND_CHAT_BURST", "3"))
+    SEND_MAX_UPLOADS = int(os.getenv("SEND_MAX_UPLOADS", "3"))
+    SEND_MAX_ATTEMPTS = int(os.getenv("SEND_MAX_ATTEMPTS", "5"))
+    SEND_RETRY_DELAY = float(os.getenv("SEND_RETRY_DELAY", "1"))
+    
+    # Нечеткий поиск /find_chat, /find_user, /find_file: минимальное сходство
+    # (word_similarity pg_trgm, 0-1) и число результатов
+    FIND_SIMILARITY_THRESHOLD = float(os.getenv("FIND_SIMILARITY_THRESHOLD", "0.3"))
+    FIND_RESULTS_LIMIT = int(os.getenv("FIND_RESULTS_LIMIT", "10"))
+    
+    # Пакетная запись в БД: максимальный размер пакета и интервал сброса (сек)
+    WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", "500"))
+    WRITE_FLUSH_INTERVAL = float(os.getenv("WRITE_FLUSH_INTERVAL", "0.2"))
+    
+    # Кэш пользователей и чатов: максимальное число записей и время жизни (сек)
+    IDENTITY_CACHE_SIZE = int(os.getenv("IDENTITY_CACHE_SIZE", "10000"))
+    IDENTITY_CACHE_TTL = float(os.getenv("IDENTITY_CACHE_TTL", "3600"))
+    
     # Путь для хранения скачанных файлов
     DOWNLOAD_PATH = os.getenv("DOWNLOAD_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "downloads"))
     
+    # Фоновое скачивание файлов: число обработчиков (общий лимит одновременных загрузок)
+    # и лимит одновременных загрузок из одного чата
+    DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", "4"))
+    DOWNLOAD_PER_CHAT_LIMIT = int(os.getenv("DOWNLOAD_PER_CHAT_LIMIT", "2"))
+    # Повторы: число попыток и начальная задержка (сек), задержка удваивается с каждой попыткой
+    DOWNLOAD_MAX_ATTEMPTS = int(os.getenv("DOWNLOAD_MAX_ATTEMPTS", "5"))
+    DOWNLOAD_RETRY_DELAY = float(os.getenv("DOWNLOAD_RETRY_DELAY", "30"))
+    # Интервал опроса очереди (сек) и время, после которого зависшее задание берется повторно
+    DOWNLOAD_POLL_INTERVAL = float(os.getenv("DOWNLOAD_POLL_INTERVAL", "5"))
+    DOWNLOAD_JOB_TIMEOUT = float(os.getenv("DOWNLOAD_JOB_TIMEOUT", "900"))
+    # Сколько при остановке ждать завершения начатых загрузок (сек), затем они прерываются
+    DOWNLOAD_DRAIN_TIMEOUT = float(os.getenv("DOWNLOAD_DRAIN_TIMEOUT", "30"))
+    # Считать SHA-256 скачанных файлов, чтобы не хранить одинаковое содержимое дважды
+    MEDIA_CONTENT_HASH = os.getenv("MEDIA_CONTENT_HASH", "true").lower() in ("1", "true", "yes")
+    # Интервал удаления файлов, на которые не ссылается ни один документ (сек, 0 - не удалять)
+    MEDIA_CLEANUP_INTERVAL = float(os.getenv("MEDIA_CLEANUP_INTERVAL", "86400"))
+    # Порядок скачивания по типам файлов (внутри типа - сначала меньшие файлы)
+    DOWNLOAD_TYPE_PRIORITY = [
+        item.strip() for item in
+        os.getenv("DOWNLOAD_TYPE_PRIORITY", "voice,photo,sticker,video_note,audio,document,video").split(",")
+        if item.strip()
+    ]
+    
+    # Политика скачивания файлов: eager - сразу, lazy - по запросу администратора,
+    # never - только метаданные. Режим чата важнее режима типа файла
+    MEDIA_DOWNLOAD_MODE = os.getenv("MEDIA_DOWNLOAD_MODE", "eager")
+    MEDIA_TYPE_MODES = _parse_mapping(os.getenv("MEDIA_TYPE_MODES", ""))  # video:lazy,sticker:never
+    MEDIA_CHAT_MODES = _parse_mapping(os.getenv("MEDIA_CHAT_MODES", ""))  # -1001234567890:lazy
+    # Файлы больше этого размера (байт) в режиме eager скачиваются по запросу
+    MEDIA_EAGER_MAX_SIZE = int(os.getenv("MEDIA_EAGER_MAX_SIZE", str(20 * 1024 * 1024)))
+    MEDIA_TYPE_EAGER_MAX_SIZE = _parse_mapping(os.getenv("MEDIA_TYPE_EAGER_MAX_SIZE", ""), int)
+    # Сколько ждать скачивания файлов по запросу (сек)
+    MEDIA_FETCH_TIMEOUT = float(os.getenv("MEDIA_FETCH_TIMEOUT", "120"))
+    
+    def get_media_mode(self, chat_id: int, document_type: str, file_size: int = None) -> str:
+        """
+        Режим скачивания файла: 'eager', 'lazy' или 'never'
+        
+        Режим чата (MEDIA_CHAT_MODES) важнее режима типа (MEDIA_TYPE_MODES), затем
+        действует MEDIA_DOWNLOAD_MODE. Файлы больше порога скачиваются по запросу.
+        """
+        mode = (self.MEDIA_CHAT_MODES.get(str(chat_id))
+                or self.MEDIA_TYPE_MODES.get(document_type)
+                or self.MEDIA_DOWNLOAD_MODE)
+        if mode == "eager" and file_size:
+            max_size = self.MEDIA_TYPE_EAGER_MAX_SIZE.get(document_type, self.MEDIA_EAGER_MAX_SIZE)
+            if file_size > max_size:
+                return "lazy"
+        return mode
+    
+    # Сколько обновлений обрабатывается одновременно (обновления одного чата - всегда
+    # по порядку); 1 - строго последовательная обработка
+    UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "16"))
+    
+    # Позиция обработанных обновлений: файл, интервал его записи (сек) и сколько
+    # недавно обработанных update_id помнить для пропуска повторов после перезапуска
+    UPDATE_OFFSET_FILE = os.getenv(
+        "UPDATE_OFFSET_FILE",
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "state", "update_offset.json")
+    )
+    UPDATE_OFFSET_FLUSH_INTERVAL = float(os.getenv("UPDATE_OFFSET_FLUSH_INTERVAL", "1"))
+    UPDATE_SEEN_SIZE = int(os.getenv("UPDATE_SEEN_SIZE", "10000"))
+    # Отбрасывать обновления, накопившиеся в Telegram, пока бот не работал
+    DROP_PENDING_UPDATES = os.getenv("DROP_PENDING_UPDATES", "false").lower() in ("1", "true", "yes")
+    
+    # Процессы-обработчики: 0 - все в одном процессе; N - основной процесс принимает
+    # обновления и раздает их N процессам по chat_id
+    WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", "0"))
+    WORKER_QUEUE_SIZE = int(os.getenv("WORKER_QUEUE_SIZE", "10000"))
+    WORKER_SHUTDOWN_TIMEOUT = float(os.getenv("WORKER_SHUTDOWN_TIMEOUT", "60"))
+    
+    # Журнал операций записи на диске: операции сохраняются в нем до записи в БД и
+    # дописываются в БД после ее недоступности
+    JOURNAL_ENABLED = os.getenv("JOURNAL_ENABLED", "true").lower() in ("1", "true", "yes")
+    JOURNAL_PATH = os.getenv("JOURNAL_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "journal"))
+    JOURNAL_SEGMENT_SIZE = int(os.getenv("JOURNAL_SEGMENT_SIZE", str(64 * 1024 * 1024)))
+    # Задержка перед повтором записи при недоступной БД, сек (удваивается до максимума)
+    JOURNAL_RETRY_DELAY = float(os.getenv("JOURNAL_RETRY_DELAY", "5"))
+    JOURNAL_MAX_RETRY_DELAY = float(os.getenv("JOURNAL_MAX_RETRY_DELAY", "60"))
+    
+    # Режим получения обновлений: polling или webhook
+    BOT_MODE = os.getenv("BOT_MODE", "polling")
+    
+    # Webhook: публичный адрес (без пути; если пуст, webhook в Telegram не регистрируется),
+    # адрес и порт HTTP-сервера, путь для обновлений и секретный токен
+    WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+    WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+    WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+    WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+    WEBHOOK_SECRET_TOKEN = os.getenv("WEBHOOK_SECRET_TOKEN", "")
+    # Максимум одновременных соединений Telegram к webhook (1-100)
+    WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+    HEALTH_PATH = os.getenv("HEALTH_PATH", "/health")
+    
+    # Адрес Bot API (по умолчанию api.telegram.org), например для локальной проверки
+    # с benchmarks/fake_bot_api.py
+    TELEGRAM_API_BASE_URL = os.getenv("TELEGRAM_API_BASE_URL", "")
+    
     @property
     def DATABASE_URL(self):
         """Формирует URL для подключения к базе данных"""
         return f"postgresql://{self.DB_USER}:{self.DB_PASSWORD}@{self.DB_HOST}:{self.DB_PORT}/{self.DB_NAME}"
+    
+    @property
+    def ASYNC_DATABASE_URL(self):
+        """Формирует URL для асинхронного подключения к базе данных (драйвер asyncpg)"""
+        return f"postgresql+asyncpg://{self.DB_USER}:{self.DB_PASSWORD}@{self.DB_HOST}:{self.DB_PORT}/{self.DB_NAME}"
 
 
 # Создаем экземпляр конфигурации
@@ -2,9 +2,15 @@
 Модуль для работы с базой данных
 """
 from .db_manager import DatabaseManager
-from .models import Base, User, Chat, Message, Reaction, Document
+from .async_db_manager import AsyncDatabaseManager
+from .write_queue import WriteBehindQueue
+from .archive import MessageArchive
+from .retention import RetentionJob
+from .models import (Base, User, Chat, Message, Reaction, ReactionCount, Document, DownloadJob, MediaBlob,
+                     ChatActivityDaily, UserActivityDaily)
 
-__all__ = ['DatabaseManager', 'Base', 'User', 'Chat', 'Message', 'Reaction', 'Document']
+__all__ = ['DatabaseManager', 'AsyncDatabaseManager', 'WriteBehindQueue', 'MessageArchive', 'RetentionJob', 'Base', 'User', 'Chat', 'Message', 'Reaction', 'Document',
+           'ReactionCount', 'DownloadJob', 'MediaBlob', 'ChatActivityDaily', 'UserActivityDaily']
 
 
 
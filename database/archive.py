@@ -0,0 +1,322 @@
+"""
+Архив старых сообщений вне PostgreSQL
+
+Сообщения, перенесенные из БД по сроку хранения (см. retention.py), хранятся
+в сжатых файлах JSONL по чатам и месяцам:
+
+    ARCHIVE_PATH/chat_<id>/YYYY-MM.jsonl.gz  - сообщения месяца с вложениями и реакциями
+    ARCHIVE_PATH/chat_<id>/index.json        - месяцы чата: число сообщений, первая и последняя дата
+
+Файл месяца перезаписывается атомарно (временный файл и os.replace): новые
+сообщения сливаются потоком со старым файлом, оба упорядочены по дате, поэтому
+в памяти находится одна страница сообщений. Повторный перенос того же сообщения
+заменяет запись, а не дублирует ее. Прочитанные записи превращаются в несвязанные
+с сессией объекты Message, поэтому экспорт работает с ними так же, как
+с сообщениями из БД.
+"""
+import gzip
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional
+from sqlalchemy.orm.attributes import set_committed_value
+from config import config
+from .models import User, Message, Document, Reaction, ReactionCount
+from .partitions import iter_months, month_start
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE = "index.json"
+
+# Поля документа, сохраняемые в архиве
+DOCUMENT_FIELDS = ("id", "file_id", "file_unique_id", "file_name", "mime_type", "file_size",
+                   "document_type", "file_path", "download_policy")
+
+
+def _format_date(value: datetime) -> str:
+    """Дата в ISO-формате (None остается None)"""
+    return value.isoformat() if value is not None else None
+
+
+def _parse_date(value: str) -> datetime:
+    """Дата из ISO-формата"""
+    return datetime.fromisoformat(value) if value else None
+
+
+def dump_message(message: Message) -> dict:
+    """Запись архива из сообщения с загруженными user, documents, reactions и reaction_counts"""
+    user = message.user
+    return {
+        "id": message.id,
+        "message_id": message.message_id,
+        "user_id": message.user_id,
+        "user": {
+            "id": user.id,
+            "username": user.username,
+            "first_name": user.first_name,
+            "last_name": user.last_name
+        } if user is not None else None,
+        "text": message.text,
+        "message_date": _format_date(message.message_date),
+        "edited_date": _format_date(message.edited_date),
+        "documents": [
+            {field: getattr(document, field) for field in DOCUMENT_FIELDS}
+            for document in message.documents
+        ],
+        "reactions": [
+            {"user_id": reaction.user_id, "emoji": reaction.emoji}
+            for reaction in message.reactions
+        ],
+        "reaction_counts": [
+            {"emoji": reaction_count.emoji, "count": reaction_count.count}
+            for reaction_count in message.reaction_counts
+        ]
+    }
+
+
+def load_message(chat_id: int, record: dict) -> Message:
+    """Несвязанный с сессией объект Message из записи архива"""
+    message_date = _parse_date(record["message_date"])
+    message = Message(
+        id=record.get("id"),
+        message_id=record["message_id"],
+        chat_id=chat_id,
+        user_id=record.get("user_id"),
+        text=record.get("text"),
+        message_date=message_date,
+        edited_date=_parse_date(record.get("edited_date"))
+    )
+    # Связи заполняются без событий обратных ссылок (user.messages, document.message):
+    # иначе объекты образуют циклы и при потоковом чтении освобождаются только
+    # сборщиком мусора
+    set_committed_value(message, "user", User(**record["user"]) if record.get("user") else None)
+    set_committed_value(message, "documents", [
+        Document(message_date=message_date, **document) for document in record.get("documents") or []
+    ])
+    set_committed_value(message, "reactions", [
+        Reaction(message_date=message_date, **reaction) for reaction in record.get("reactions") or []
+    ])
+    set_committed_value(message, "reaction_counts", [
+        ReactionCount(message_date=message_date, **reaction_count)
+        for reaction_count in sorted(record.get("reaction_counts") or [],
+                                     key=lambda item: (-item["count"], item["emoji"]))
+    ])
+    return message
+
+
+class ArchiveMonthWriter:
+    """
+    Запись месяца архива: слияние страниц сообщений со старым файлом месяца
+
+    Страницы передаются в write() по возрастанию message_date. Записи с одной
+    датой собираются вместе (новая запись заменяет старую с тем же message_id) и
+    пишутся по возрастанию message_id. commit() дописывает оставшиеся старые
+    записи и заменяет файл, close() без commit() удаляет временный файл.
+    """
+
+    def __init__(self, archive: "MessageArchive", chat_id: int, month: datetime):
+        """Открытие временного файла и старого файла месяца (блокирует архив до close)"""
+        self.archive = archive
+        self.chat_id = chat_id
+        self.month = month_start(month)
+        self.path = archive._month_path(chat_id, self.month)
+        self.tmp_path = f"{self.path}.tmp"
+        self.count = 0
+        self.first = None
+        self.last = None
+        archive._lock.acquire()
+        try:
+            os.makedirs(archive._chat_dir(chat_id), exist_ok=True)
+            self._old = archive._iter_file(self.path)
+            self._old_next = None
+            self._raw = open(self.tmp_path, "wb")
+            self._file = gzip.GzipFile(fileobj=self._raw, mode="wb")
+        except BaseException:
+            archive._lock.release()
+            raise
+        # Новые записи с текущей датой: message_id -> запись
+        self._group_date = None
+        self._group = {}
+        self._closed = False
+
+    def _peek_old(self) -> Optional[dict]:
+        """Следующая запись старого файла (без извлечения)"""
+        if self._old_next is None:
+            self._old_next = next(self._old, None)
+        return self._old_next
+
+    def _emit(self, record: dict):
+        """Запись в новый файл месяца"""
+        self._file.write(json.dumps(record, ensure_ascii=False).encode("utf-8"))
+        self._file.write(b"\n")
+        self.count += 1
+        self.first = self.first or record["message_date"]
+        self.last = record["message_date"]
+
+    def _emit_old_before(self, message_date: Optional[datetime]):
+        """Старые записи с датой раньше message_date (None - все)"""
+        while self._peek_old() is not None:
+            if message_date is not None and _parse_date(self._old_next["message_date"]) >= message_date:
+                return
+            self._emit(self._old_next)
+            self._old_next = None
+
+    def _flush_group(self):
+        """Запись новых и старых записей текущей даты"""
+        if self._group_date is None:
+            return
+        self._emit_old_before(self._group_date)
+        while self._peek_old() is not None and _parse_date(self._old_next["message_date"]) == self._group_date:
+            self._group.setdefault(self._old_next["message_id"], self._old_next)
+            self._old_next = None
+        for message_id in sorted(self._group):
+            self._emit(self._group[message_id])
+        self._group_date = None
+        self._group = {}
+
+    def write(self, messages: List[Message]):
+        """Страница сообщений месяца (по возрастанию message_date)"""
+        for message in messages:
+            if message.message_date != self._group_date:
+                self._flush_group()
+                self._group_date = message.message_date
+            self._group[message.message_id] = dump_message(message)
+
+    def commit(self) -> int:
+        """
+        Окончание записи: файл месяца и индекс заменяются после fsync
+
+        Returns:
+            Число сообщений в файле месяца
+        """
+        self._flush_group()
+        self._emit_old_before(None)
+        self._file.close()
+        self._raw.flush()
+        os.fsync(self._raw.fileno())
+        self._raw.close()
+        os.replace(self.tmp_path, self.path)
+
+        index = self.archive.get_months(self.chat_id)
+        index[f"{self.month:%Y-%m}"] = {"count": self.count, "first": self.first, "last": self.last}
+        self.archive._write_index(self.chat_id, index)
+        self._release()
+        return self.count
+
+    def close(self):
+        """Отмена записи (если commit не вызывался)"""
+        if self._closed:
+            return
+        self._file.close()
+        self._raw.close()
+        os.remove(self.tmp_path)
+        self._release()
+
+    def _release(self):
+        """Закрытие старого файла и снятие блокировки архива"""
+        self._old.close()
+        self._closed = True
+        self.archive._lock.release()
+
+
+class MessageArchive:
+    """Архив сообщений: gzip JSONL по чатам и месяцам"""
+
+    def __init__(self, path: str = None):
+        """
+        Инициализация
+
+        Args:
+            path: Каталог архива (по умолчанию ARCHIVE_PATH)
+        """
+        self.path = path or config.ARCHIVE_PATH
+        # Запись месяца - чтение старого файла, слияние и замена (см. ArchiveMonthWriter)
+        self._lock = threading.Lock()
+
+    def _chat_dir(self, chat_id: int) -> str:
+        """Каталог чата"""
+        return os.path.join(self.path, f"chat_{chat_id}")
+
+    def _month_path(self, chat_id: int, month: datetime) -> str:
+        """Файл месяца"""
+        return os.path.join(self._chat_dir(chat_id), f"{month:%Y-%m}.jsonl.gz")
+
+    def get_months(self, chat_id: int) -> Dict[str, dict]:
+        """Индекс чата: 'YYYY-MM' -> {count, first, last}"""
+        try:
+            with open(os.path.join(self._chat_dir(chat_id), INDEX_FILE), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def open_month(self, chat_id: int, month: datetime) -> ArchiveMonthWriter:
+        """
+        Начало записи месяца (уже архивированные записи месяца сохраняются)
+
+        После commit() записи на диске (fsync файла и индекса): сообщения можно
+        удалять из БД.
+        """
+        return ArchiveMonthWriter(self, chat_id, month)
+
+    def read(self, chat_id: int, start_date: datetime, end_date: datetime) -> List[Message]:
+        """Сообщения чата за период (границы включительно), по возрастанию даты"""
+        return [message for page in self.iter_pages(chat_id, start_date, end_date) for message in page]
+
+    def iter_pages(self, chat_id: int, start_date: datetime, end_date: datetime,
+                   page_size: int = None) -> Iterator[List[Message]]:
+        """
+        Сообщения чата за период страницами по возрастанию (message_date, message_id)
+
+        Файлы месяцев читаются построчно, в памяти находится не больше одной страницы.
+        """
+        page_size = page_size or config.EXPORT_PAGE_SIZE
+        index = self.get_months(chat_id)
+        page = []
+        for month in iter_months(start_date, end_date):
+            if f"{month:%Y-%m}" not in index:
+                continue
+            for record in self._iter_file(self._month_path(chat_id, month)):
+                message_date = _parse_date(record["message_date"])
+                if start_date <= message_date <= end_date:
+                    page.append(load_message(chat_id, record))
+                    if len(page) >= page_size:
+                        yield page
+                        page = []
+        if page:
+            yield page
+
+    def get_stats(self) -> dict:
+        """Число чатов, месяцев и сообщений в архиве"""
+        stats = {"chats": 0, "months": 0, "messages": 0}
+        if not os.path.isdir(self.path):
+            return stats
+        for name in os.listdir(self.path):
+            if not name.startswith("chat_"):
+                continue
+            index = self.get_months(int(name[len("chat_"):]))
+            stats["chats"] += 1
+            stats["months"] += len(index)
+            stats["messages"] += sum(month["count"] for month in index.values())
+        return stats
+
+    @staticmethod
+    def _iter_file(path: str) -> Iterator[dict]:
+        """Записи файла месяца (пустой поток, если файла нет)"""
+        if not os.path.exists(path):
+            return
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def _write_index(self, chat_id: int, index: dict):
+        """Атомарная запись индекса чата"""
+        path = os.path.join(self._chat_dir(chat_id), INDEX_FILE)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(dict(sorted(index.items())), f, ensure_ascii=False, indent=1)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
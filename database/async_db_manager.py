@@ -0,0 +1,331 @@
+"""
+Асинхронный менеджер для работы с базой данных
+"""
+import asyncio
+import logging
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.exc import SQLAlchemyError
+from datetime import date, datetime
+from typing import AsyncIterator, Dict, List, Tuple
+from config import config
+from .models import User, Chat, Message, Reaction, Document
+from .operations import SessionOperations
+from .db_manager import DatabaseManager
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncDatabaseManager(SessionOperations):
+    """
+    Класс для управления подключением и операциями с БД без блокировки event loop
+
+    Повторяет интерфейс DatabaseManager, но все методы - корутины. Работает через
+    AsyncEngine/AsyncSession и асинхронный драйвер asyncpg.
+    """
+
+    def __init__(self):
+        """Инициализация менеджера БД"""
+        self.engine = None
+        self.SessionLocal = None
+        self._initialized = False
+        self._init_identity_caches()
+
+    def _initialize_database(self):
+        """Инициализация подключения к БД"""
+        if self._initialized:
+            return
+
+        try:
+            self.engine = create_async_engine(config.ASYNC_DATABASE_URL, echo=False)
+            # Объекты остаются доступными после commit и закрытия сессии
+            self.SessionLocal = async_sessionmaker(bind=self.engine, expire_on_commit=False)
+            self._initialized = True
+        except Exception as e:
+            logger.error(f"Ошибка при подключении к БД: {e}")
+            raise
+
+    async def create_tables(self):
+        """
+        Создание и обновление таблиц в БД через версионированные миграции
+
+        Миграции управляют транзакциями сами и используют CREATE INDEX CONCURRENTLY,
+        поэтому выполняются синхронным менеджером в отдельном потоке.
+        """
+        sync_manager = DatabaseManager()
+        try:
+            await asyncio.to_thread(sync_manager.create_tables)
+        finally:
+            if sync_manager.engine is not None:
+                sync_manager.engine.dispose()
+
+    def get_session(self) -> AsyncSession:
+        """Получение асинхронной сессии БД"""
+        if not self._initialized:
+            self._initialize_database()
+        return self.SessionLocal()
+
+    async def close(self):
+        """Закрытие пула соединений"""
+        if self._initialized:
+            await self.engine.dispose()
+            self._initialized = False
+
+    async def _run(self, operation, *args, error_message: str, commit: bool = True, **kwargs):
+        """Выполнение операции из SessionOperations в отдельной сессии"""
+        async with self.get_session() as session:
+            try:
+                result = await session.run_sync(operation, *args, **kwargs)
+                if commit:
+                    await session.commit()
+                    self._commit_identities(session)
+                return result
+            except SQLAlchemyError as e:
+                await session.rollback()
+                self._discard_identities(session)
+                logger.error(f"{error_message}: {e}")
+                raise
+
+    async def save_user(self, user_id: int, username: str = None,
+                        first_name: str = None, last_name: str = None) -> User:
+        """Сохранение или обновление пользователя"""
+        return await self._run(
+            self._apply_user, user_id, username, first_name, last_name,
+            error_message="Ошибка при сохранении пользователя"
+        )
+
+    async def save_chat(self, chat_id: int, title: str = None, chat_type: str = None) -> Chat:
+        """Сохранение или обновление чата"""
+        return await self._run(
+            self._apply_chat, chat_id, title, chat_type,
+            error_message="Ошибка при сохранении чата"
+        )
+
+    async def save_message(self, message_id: int, chat_id: int, user_id: int = None,
+                           text: str = None, message_date: datetime = None,
+                           edited_date: datetime = None) -> Message:
+        """Сохранение сообщения"""
+        return await self._run(
+            self._apply_message, message_id, chat_id, user_id, text, message_date, edited_date,
+            error_message="Ошибка при сохранении сообщения"
+        )
+
+    async def save_messages_bulk(self, rows: List[dict]) -> Dict[Tuple[int, int], int]:
+        """Сохранение списка сообщений одним INSERT ... ON CONFLICT (см. DatabaseManager.save_messages_bulk)"""
+        return await self._run(
+            self._upsert_messages, rows,
+            error_message="Ошибка при сохранении сообщений"
+        )
+
+    async def save_reaction(self, message_db_id: int, emoji: str = None,
+                            user_id: int = None) -> Reaction:
+        """Сохранение реакции на сообщение"""
+        return await self._run(
+            self._apply_reaction, message_db_id, emoji, user_id,
+            error_message="Ошибка при сохранении реакции"
+        )
+
+    async def save_document(self, message_db_id: int, file_id: str,
+                            file_unique_id: str = None, file_name: str = None,
+                            mime_type: str = None, file_size: int = None,
+                            document_type: str = None, file_path: str = None) -> Document:
+        """Сохранение документа/файла"""
+        return await self._run(
+            self._apply_document, message_db_id, file_id, file_unique_id, file_name,
+            mime_type, file_size, document_type, file_path,
+            error_message="Ошибка при сохранении документа"
+        )
+
+    async def save_batch(self, operations: List[dict]) -> list:
+        """Сохранение пакета операций записи одной транзакцией (см. DatabaseManager.save_batch)"""
+        if not operations:
+            return []
+        return await self._run(
+            self._apply_batch, operations,
+            error_message=f"Ошибка при сохранении пакета из {len(operations)} операций"
+        )
+
+    async def claim_download_jobs(self, limit: int, exclude_chat_ids: List[int] = None) -> List[dict]:
+        """Захват заданий на скачивание файлов (см. DatabaseManager.claim_download_jobs)"""
+        return await self._run(
+            self._claim_download_jobs, limit, exclude_chat_ids,
+            error_message="Ошибка при получении заданий на скачивание"
+        )
+
+    async def complete_download_job(self, job_id: int, document_id: int, file_path: str,
+                                    file_unique_id: str = None, file_size: int = None,
+                                    sha256: str = None) -> str:
+        """Сохранение пути к скачанному файлу и удаление задания (см. DatabaseManager.complete_download_job)"""
+        return await self._run(
+            self._complete_download_job, job_id, document_id, file_path,
+            file_unique_id, file_size, sha256,
+            error_message="Ошибка при завершении задания на скачивание"
+        )
+
+    async def fail_download_job(self, job_id: int, error: str, retry_at: datetime = None,
+                                count_attempt: bool = True):
+        """Отметка неудачной попытки скачивания (повтор в retry_at или статус 'failed')"""
+        await self._run(
+            self._fail_download_job, job_id, error, retry_at, count_attempt,
+            error_message="Ошибка при обновлении задания на скачивание"
+        )
+
+    async def release_download_jobs(self, job_ids: List[int]):
+        """Возврат незавершенных заданий на скачивание в очередь"""
+        await self._run(
+            self._release_download_jobs, job_ids,
+            error_message="Ошибка при возврате заданий на скачивание"
+        )
+
+    async def request_downloads(self, document_ids: List[int]) -> List[int]:
+        """Скачивание файлов документов по запросу (см. DatabaseManager.request_downloads)"""
+        return await self._run(
+            self._request_downloads, document_ids,
+            error_message="Ошибка при постановке файлов в очередь скачивания"
+        )
+
+    async def get_document_paths(self, document_ids: List[int]) -> Dict[int, str]:
+        """Пути к скачанным файлам документов"""
+        return await self._run(
+            self._get_document_paths, document_ids,
+            error_message="Ошибка при получении путей к файлам", commit=False
+        )
+
+    async def release_media_blobs(self, document_ids: List[int]):
+        """Уменьшение счетчиков ссылок на файлы перед удалением документов"""
+        await self._run(
+            self._release_media_blobs, document_ids,
+            error_message="Ошибка при освобождении файлов"
+        )
+
+    async def delete_unreferenced_media_blobs(self) -> List[str]:
+        """Удаление из индекса файлов без ссылок (см. DatabaseManager.delete_unreferenced_media_blobs)"""
+        return await self._run(
+            self._delete_unreferenced_media_blobs,
+            error_message="Ошибка при удалении неиспользуемых файлов"
+        )
+
+    async def ensure_partitions(self, start: datetime = None, end: datetime = None) -> List[str]:
+        """Создание недостающих помесячных секций (см. DatabaseManager.ensure_partitions)"""
+        return await self._run(
+            self._ensure_partitions, start, end,
+            error_message="Ошибка при создании секций"
+        )
+
+    async def get_messages_by_date_range(self, chat_id: int, start_date: datetime,
+                                         end_date: datetime) -> List[Message]:
+        """Получение сообщений за указанный период"""
+        return await self._run(
+            self._query_messages_by_date_range, chat_id, start_date, end_date,
+            error_message="Ошибка при получении сообщений", commit=False
+        )
+
+    async def iter_messages_by_date_range(self, chat_id: int, start_date: datetime, end_date: datetime,
+                                          page_size: int = None, after: Tuple[datetime, int] = None,
+                                          with_reactions: bool = False) -> AsyncIterator[List[Message]]:
+        """Сообщения за период страницами (см. DatabaseManager.iter_messages_by_date_range)"""
+        page_size = page_size or config.EXPORT_PAGE_SIZE
+        while True:
+            page = await self._run(
+                self._query_messages_page, chat_id, start_date, end_date, after, page_size, with_reactions,
+                error_message="Ошибка при получении сообщений", commit=False
+            )
+            if not page:
+                return
+            yield page
+            if len(page) < page_size:
+                return
+            after = (page[-1].message_date, page[-1].id)
+
+    async def iter_documents_by_date_range(self, chat_id: int, start_date: datetime, end_date: datetime,
+                                           page_size: int = None) -> AsyncIterator[List[dict]]:
+        """Документы чата за период страницами (см. DatabaseManager.iter_documents_by_date_range)"""
+        page_size = page_size or config.EXPORT_PAGE_SIZE
+        after = None
+        while True:
+            page = await self._run(
+                self._query_documents_page, chat_id, start_date, end_date, after, page_size,
+                error_message="Ошибка при получении документов", commit=False
+            )
+            if not page:
+                return
+            yield page
+            if len(page) < page_size:
+                return
+            after = (page[-1]["message_date"], page[-1]["id"])
+
+    async def get_export_watermark(self, chat_id: int, start_date: datetime, end_date: datetime,
+                                   last: Tuple[datetime, int] = None,
+                                   max_edited: datetime = None) -> Dict[str, int]:
+        """Изменения за период относительно отметки экспорта (см. SessionOperations._get_export_watermark)"""
+        return await self._run(
+            self._get_export_watermark, chat_id, start_date, end_date, last, max_edited,
+            error_message="Ошибка при проверке кэша экспорта", commit=False
+        )
+
+    async def search_messages(self, query: str, chat_id: int = None, start_date: datetime = None,
+                              end_date: datetime = None, limit: int = 10,
+                              cursor: str = None) -> Tuple[List[dict], str]:
+        """Полнотекстовый поиск по сообщениям (см. SessionOperations._search_messages)"""
+        return await self._run(
+            self._search_messages, query, chat_id, start_date, end_date, limit, cursor,
+            error_message="Ошибка при поиске сообщений", commit=False
+        )
+
+    async def find_chats(self, query: str, limit: int = 10) -> List[dict]:
+        """Нечеткий поиск чатов по названию (см. SessionOperations._find_chats)"""
+        return await self._run(
+            self._find_chats, query, limit,
+            error_message="Ошибка при поиске чатов", commit=False
+        )
+
+    async def find_users(self, query: str, limit: int = 10) -> List[dict]:
+        """Нечеткий поиск пользователей по имени (см. SessionOperations._find_users)"""
+        return await self._run(
+            self._find_users, query, limit,
+            error_message="Ошибка при поиске пользователей", commit=False
+        )
+
+    async def find_files(self, query: str, chat_id: int = None, user_id: int = None,
+                         limit: int = 10) -> List[dict]:
+        """Нечеткий поиск файлов по имени (см. SessionOperations._find_files)"""
+        return await self._run(
+            self._find_files, query, chat_id, user_id, limit,
+            error_message="Ошибка при поиске файлов", commit=False
+        )
+
+    async def get_activity_stats(self, chat_id: int, start_day: date, end_day: date,
+                                 top_users: int = 10) -> dict:
+        """Активность чата за период по дневным счетчикам (см. SessionOperations._get_activity_stats)"""
+        return await self._run(
+            self._get_activity_stats, chat_id, start_day, end_day, top_users,
+            error_message="Ошибка при получении статистики", commit=False
+        )
+
+    async def get_archive_months(self, chat_id: int, before: datetime) -> List[datetime]:
+        """Месяцы, в которых у чата есть сообщения старше before"""
+        return await self._run(
+            self._get_archive_months, chat_id, before,
+            error_message="Ошибка при поиске сообщений для архива", commit=False
+        )
+
+    async def delete_archived_messages(self, chat_id: int, start_date: datetime, end_date: datetime,
+                                       message_ids: List[int], release_media: bool = False) -> int:
+        """Удаление перенесенных в архив сообщений чата за период [start_date, end_date) по ID записей"""
+        return await self._run(
+            self._delete_archived_messages, chat_id, start_date, end_date, message_ids, release_media,
+            error_message="Ошибка при удалении перенесенных в архив сообщений"
+        )
+
+    async def drop_empty_partitions(self, before: datetime) -> List[str]:
+        """Удаление пустых секций месяцев, закончившихся до before"""
+        return await self._run(
+            self._drop_empty_partitions, before,
+            error_message="Ошибка при удалении секций"
+        )
+
+    async def get_chat_list(self) -> List[Chat]:
+        """Получение списка всех чатов"""
+        return await self._run(
+            self._query_chat_list,
+            error_message="Ошибка при получении списка чатов", commit=False
+        )
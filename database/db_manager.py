@@ -1,16 +1,21 @@
 """
 Менеджер для работы с базой данных
 """
+import logging
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, Session, joinedload
+from sqlalchemy.orm import sessionmaker, Session
 from sqlalchemy.exc import SQLAlchemyError
-from datetime import datetime, timezone
-from typing import List
+from datetime import date, datetime
+from typing import Dict, Iterator, List, Tuple
 from config import config
-from .models import Base, User, Chat, Message, Reaction, Document
+from .models import User, Chat, Message, Reaction, Document
+from .operations import SessionOperations
+from .migrations import run_migrations
 
+logger = logging.getLogger(__name__)
 
-class DatabaseManager:
+
+class DatabaseManager(SessionOperations):
     """Класс для управления подключением и операциями с БД"""
     
     def __init__(self):
@@ -18,6 +23,7 @@ class DatabaseManager:
         self.engine = None
         self.SessionLocal = None
         self._initialized = False
+        self._init_identity_caches()
     
     def _initialize_database(self):
         """Инициализация подключения к БД"""
@@ -34,12 +40,15 @@ class DatabaseManager:
             raise
     
     def create_tables(self):
-        """Создание всех таблиц в БД"""
+        """Создание и обновление таблиц в БД через версионированные миграции"""
         if not self._initialized:
             self._initialize_database()
         
         try:
-            Base.metadata.create_all(self.engine)
+            applied = run_migrations(self.engine)
+            if applied:
+                print(f"Применены миграции схемы: {', '.join(map(str, applied))}")
+            self.ensure_partitions()
             print("Таблицы успешно созданы")
         except Exception as e:
             print(f"Ошибка при создании таблиц: {e}")
@@ -56,29 +65,13 @@ class DatabaseManager:
         """Сохранение или обновление пользователя"""
         session = self.get_session()
         try:
-            user = session.query(User).filter(User.id == user_id).first()
-            if user:
-                # Обновляем данные пользователя
-                if username:
-                    user.username = username
-                if first_name:
-                    user.first_name = first_name
-                if last_name:
-                    user.last_name = last_name
-            else:
-                # Создаем нового пользователя
-                user = User(
-                    id=user_id,
-                    username=username,
-                    first_name=first_name,
-                    last_name=last_name
-                )
-                session.add(user)
-            
+            user = self._apply_user(session, user_id, username, first_name, last_name)
             session.commit()
+            self._commit_identities(session)
             return user
         except SQLAlchemyError as e:
             session.rollback()
+            self._discard_identities(session)
             print(f"Ошибка при сохранении пользователя: {e}")
             raise
         finally:
@@ -88,101 +81,13 @@ class DatabaseManager:
         """Сохранение или обновление чата"""
         session = self.get_session()
         try:
-            import logging
-            logger = logging.getLogger(__name__)
-            
-            # Сначала проверяем, есть ли чат с таким ID
-            chat = session.query(Chat).filter(Chat.id == chat_id).first()
-            
-            if chat:
-                # Обновляем существующий чат
-                if title:
-                    chat.title = title
-                if chat_type:
-                    chat.chat_type = chat_type
-            else:
-                # Если чата с таким ID нет, проверяем преобразование group -> supergroup
-                if title and chat_type == 'supergroup':
-                    # Ищем group с таким же названием
-                    existing_group = session.query(Chat).filter(
-                        Chat.title == title,
-                        Chat.chat_type == 'group'
-                    ).first()
-                    
-                    if existing_group:
-                        # Обновляем старый group на supergroup и меняем ID
-                        old_chat_id = existing_group.id
-                        
-                        # Сначала обновляем все сообщения, связанные со старым чатом
-                        # Это нужно сделать ДО изменения ID чата, чтобы избежать нарушения foreign key
-                        from .models import Message
-                        from sqlalchemy import text
-                        
-                        messages_count = session.query(Message).filter(
-                            Message.chat_id == old_chat_id
-                        ).count()
-                        
-                        if messages_count > 0:
-                            # Сначала создаем новый чат с новым ID
-                            # Это нужно для того, чтобы foreign key constraint был удовлетворен
-                            new_chat = Chat(id=chat_id, title=title, chat_type='supergroup')
-                            session.add(new_chat)
-                            session.flush()  # Сохраняем новый чат в БД
-                            
-                            # Теперь обновляем все сообщения на новый chat_id
-                            session.execute(
-                                text("UPDATE messages SET chat_id = :new_id WHERE chat_id = :old_id"),
-                                {"new_id": chat_id, "old_id": old_chat_id}
-                            )
-                            session.flush()
-                            
-                            # Удаляем старый чат
-                            session.delete(existing_group)
-                            session.flush()
-                            
-                            chat = new_chat
-                        else:
-                            # Если сообщений нет, просто обновляем ID и тип чата
-                            # Используем временный ID для обхода foreign key constraint
-                            import random
-                            temp_id = -abs(old_chat_id) - random.randint(1000000, 9999999)
-                            
-                            # Шаг 1: Обновляем чат на временный ID
-                            session.execute(
-                                text("UPDATE chats SET id = :temp_id WHERE id = :old_id"),
-                                {"temp_id": temp_id, "old_id": old_chat_id}
-                            )
-                            session.flush()
-                            
-                            # Шаг 2: Обновляем на финальный ID и тип
-                            session.execute(
-                                text("UPDATE chats SET id = :new_id, chat_type = 'supergroup' WHERE id = :temp_id"),
-                                {"new_id": chat_id, "temp_id": temp_id}
-                            )
-                            session.flush()
-                            
-                            chat = session.query(Chat).filter(Chat.id == chat_id).first()
-                    else:
-                        # Создаем новый чат
-                        chat = Chat(
-                            id=chat_id,
-                            title=title,
-                            chat_type=chat_type
-                        )
-                        session.add(chat)
-                else:
-                    # Создаем новый чат
-                    chat = Chat(
-                        id=chat_id,
-                        title=title,
-                        chat_type=chat_type
-                    )
-                    session.add(chat)
-            
+            chat = self._apply_chat(session, chat_id, title, chat_type)
             session.commit()
+            self._commit_identities(session)
             return chat
         except SQLAlchemyError as e:
             session.rollback()
+            self._discard_identities(session)
             print(f"Ошибка при сохранении чата: {e}")
             raise
         finally:
@@ -194,45 +99,8 @@ class DatabaseManager:
         """Сохранение сообщения"""
         session = self.get_session()
         try:
-            # Проверяем, существует ли уже такое сообщение
-            existing = session.query(Message).filter(
-                Message.message_id == message_id,
-                Message.chat_id == chat_id
-            ).first()
-            
-            if existing:
-                # Если это редактирование, обновляем текст и дату редактирования
-                if edited_date is not None:
-                    if text is not None:
-                        existing.text = text
-                    
-                    # Убеждаемся, что дата редактирования в UTC
-                    if edited_date.tzinfo is not None:
-                        edited_date = edited_date.astimezone(timezone.utc).replace(tzinfo=None)
-                    existing.edited_date = edited_date
-                    session.commit()
-                    session.refresh(existing)
-                return existing
-            
-            # Убеждаемся, что дата в UTC и без timezone info
-            if message_date and message_date.tzinfo is not None:
-                message_date = message_date.astimezone(timezone.utc).replace(tzinfo=None)
-            elif not message_date:
-                message_date = datetime.utcnow()
-            
-            # Обрабатываем дату редактирования
-            if edited_date and edited_date.tzinfo is not None:
-                edited_date = edited_date.astimezone(timezone.utc).replace(tzinfo=None)
-            
-            message = Message(
-                message_id=message_id,
-                chat_id=chat_id,
-                user_id=user_id,
-                text=text,
-                message_date=message_date,
-                edited_date=edited_date
-            )
-            session.add(message)
+            message = self._apply_message(session, message_id, chat_id, user_id,
+                                          text, message_date, edited_date)
             session.commit()
             session.refresh(message)
             return message
@@ -243,17 +111,35 @@ class DatabaseManager:
         finally:
             session.close()
     
+    def save_messages_bulk(self, rows: List[dict]) -> Dict[Tuple[int, int], int]:
+        """
+        Сохранение списка сообщений одним INSERT ... ON CONFLICT
+        
+        Args:
+            rows: Словари с полями save_message (message_id, chat_id, user_id,
+                text, message_date, edited_date)
+            
+        Returns:
+            Словарь (chat_id, message_id) -> ID записи messages
+        """
+        session = self.get_session()
+        try:
+            ids = self._upsert_messages(session, rows)
+            session.commit()
+            return ids
+        except SQLAlchemyError as e:
+            session.rollback()
+            print(f"Ошибка при сохранении сообщений: {e}")
+            raise
+        finally:
+            session.close()
+    
     def save_reaction(self, message_db_id: int, emoji: str = None, 
                      user_id: int = None) -> Reaction:
         """Сохранение реакции на сообщение"""
         session = self.get_session()
         try:
-            reaction = Reaction(
-                message_id=message_db_id,
-                emoji=emoji,
-                user_id=user_id
-            )
-            session.add(reaction)
+            reaction = self._apply_reaction(session, message_db_id, emoji, user_id)
             session.commit()
             return reaction
         except SQLAlchemyError as e:
@@ -270,17 +156,10 @@ class DatabaseManager:
         """Сохранение документа/файла"""
         session = self.get_session()
         try:
-            document = Document(
-                message_id=message_db_id,
-                file_id=file_id,
-                file_unique_id=file_unique_id,
-                file_name=file_name,
-                mime_type=mime_type,
-                file_size=file_size,
-                document_type=document_type,
-                file_path=file_path
+            document = self._apply_document(
+                session, message_db_id, file_id, file_unique_id, file_name,
+                mime_type, file_size, document_type, file_path
             )
-            session.add(document)
             session.commit()
             return document
         except SQLAlchemyError as e:
@@ -290,37 +169,385 @@ class DatabaseManager:
         finally:
             session.close()
     
+    def save_batch(self, operations: List[dict]) -> list:
+        """
+        Сохранение пакета операций записи одной транзакцией
+        
+        Args:
+            operations: Список операций (словарей с ключом 'op': 'user', 'chat',
+                'message', 'document', 'reaction' или 'reaction_change')
+            
+        Returns:
+            Список результатов в порядке операций: ID записи messages для операций
+            'message', None для остальных
+        """
+        if not operations:
+            return []
+        
+        session = self.get_session()
+        try:
+            results = self._apply_batch(session, operations)
+            session.commit()
+            self._commit_identities(session)
+            return results
+        except SQLAlchemyError as e:
+            session.rollback()
+            self._discard_identities(session)
+            logger.error(f"Ошибка при сохранении пакета из {len(operations)} операций: {e}")
+            raise
+        finally:
+            session.close()
+    
+    def claim_download_jobs(self, limit: int, exclude_chat_ids: List[int] = None) -> List[dict]:
+        """
+        Захват заданий на скачивание файлов
+        
+        Args:
+            limit: Максимальное количество заданий
+            exclude_chat_ids: Чаты, задания которых не брать (достигнут лимит загрузок)
+            
+        Returns:
+            Список словарей: id, document_id, chat_id, file_id, file_size,
+            attempts, document_type, file_name
+        """
+        session = self.get_session()
+        try:
+            jobs = self._claim_download_jobs(session, limit, exclude_chat_ids)
+            session.commit()
+            return jobs
+        except SQLAlchemyError as e:
+            session.rollback()
+            logger.error(f"Ошибка при получении заданий на скачивание: {e}")
+            raise
+        finally:
+            session.close()
+    
+    def complete_download_job(self, job_id: int, document_id: int, file_path: str,
+                              file_unique_id: str = None, file_size: int = None,
+                              sha256: str = None) -> str:
+        """
+        Сохранение пути к скачанному файлу и удаление задания
+        
+        Args:
+            job_id: ID задания
+            document_id: ID документа задания
+            file_path: Путь к скачанному файлу
+            file_unique_id: Telegram file_unique_id (файл регистрируется в media_blobs)
+            file_size: Размер файла в байтах
+            sha256: Хэш содержимого
+            
+        Returns:
+            Итоговый путь к файлу: если файл с таким file_unique_id или содержимым
+            уже был в хранилище, возвращается его путь, а скачанную копию можно удалить
+        """
+        session = self.get_session()
+        try:
+            file_path = self._complete_download_job(
+                session, job_id, document_id, file_path, file_unique_id, file_size, sha256
+            )
+            session.commit()
+            return file_path
+        except SQLAlchemyError as e:
+            session.rollback()
+            logger.error(f"Ошибка при завершении задания на скачивание: {e}")
+            raise
+        finally:
+            session.close()
+    
+    def fail_download_job(self, job_id: int, error: str, retry_at: datetime = None,
+                          count_attempt: bool = True):
+        """Отметка неудачной попытки скачивания (повтор в retry_at или статус 'failed')"""
+        session = self.get_session()
+        try:
+            self._fail_download_job(session, job_id, error, retry_at, count_attempt)
+            session.commit()
+        except SQLAlchemyError as e:
+            session.rollback()
+            logger.error(f"Ошибка при обновлении задания на скачивание: {e}")
+            raise
+        finally:
+            session.close()
+    
+    def release_download_jobs(self, job_ids: List[int]):
+        """Возврат незавершенных заданий на скачивание в очередь"""
+        session = self.get_session()
+        try:
+            self._release_download_jobs(session, job_ids)
+            session.commit()
+        except SQLAlchemyError as e:
+            session.rollback()
+            logger.error(f"Ошибка при возврате заданий на скачивание: {e}")
+            raise
+        finally:
+            session.close()
+    
+    def request_downloads(self, document_ids: List[int]) -> List[int]:
+        """
+        Постановка файлов документов в начало очереди скачивания (политика lazy)
+        
+        Returns:
+            ID заданий на скачивание, завершения которых нужно дождаться
+        """
+        session = self.get_session()
+        try:
+            job_ids = self._request_downloads(session, document_ids)
+            session.commit()
+            return job_ids
+        except SQLAlchemyError as e:
+            session.rollback()
+            logger.error(f"Ошибка при постановке файлов в очередь скачивания: {e}")
+            raise
+        finally:
+            session.close()
+    
+    def get_document_paths(self, document_ids: List[int]) -> Dict[int, str]:
+        """Пути к скачанным файлам документов"""
+        session = self.get_session()
+        try:
+            return self._get_document_paths(session, document_ids)
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка при получении путей к файлам: {e}")
+            raise
+        finally:
+            session.close()
+    
+    def release_media_blobs(self, document_ids: List[int]):
+        """Уменьшение счетчиков ссылок на файлы перед удалением документов"""
+        session = self.get_session()
+        try:
+            self._release_media_blobs(session, document_ids)
+            session.commit()
+        except SQLAlchemyError as e:
+            session.rollback()
+            logger.error(f"Ошибка при освобождении файлов: {e}")
+            raise
+        finally:
+            session.close()
+    
+    def delete_unreferenced_media_blobs(self) -> List[str]:
+        """
+        Удаление из индекса файлов, на которые не ссылается ни один документ
+        
+        Returns:
+            Пути к файлам, которые можно удалить с диска
+        """
+        session = self.get_session()
+        try:
+            paths = self._delete_unreferenced_media_blobs(session)
+            session.commit()
+            return paths
+        except SQLAlchemyError as e:
+            session.rollback()
+            logger.error(f"Ошибка при удалении неиспользуемых файлов: {e}")
+            raise
+        finally:
+            session.close()
+    
+    def ensure_partitions(self, start: datetime = None, end: datetime = None) -> List[str]:
+        """
+        Создание недостающих помесячных секций messages, documents и reactions
+        
+        По умолчанию - от текущего месяца на PARTITION_MONTHS_AHEAD месяцев вперед.
+        
+        Returns:
+            Имена созданных секций
+        """
+        session = self.get_session()
+        try:
+            created = self._ensure_partitions(session, start, end)
+            session.commit()
+            return created
+        except SQLAlchemyError as e:
+            session.rollback()
+            logger.error(f"Ошибка при создании секций: {e}")
+            raise
+        finally:
+            session.close()
+    
     def get_messages_by_date_range(self, chat_id: int, start_date: datetime, 
                                    end_date: datetime) -> List[Message]:
         """Получение сообщений за указанный период"""
         session = self.get_session()
         try:
-            # Загружаем сообщения вместе с связанными объектами (user, documents, reactions)
-            messages = session.query(Message).options(
-                joinedload(Message.user),
-                joinedload(Message.documents),
-                joinedload(Message.reactions)
-            ).filter(
-                Message.chat_id == chat_id,
-                Message.message_date >= start_date,
-                Message.message_date <= end_date
-            ).order_by(Message.message_date).all()
-            
-            return messages
+            return self._query_messages_by_date_range(session, chat_id, start_date, end_date)
         except SQLAlchemyError as e:
-            import logging
-            logger = logging.getLogger(__name__)
             logger.error(f"Ошибка при получении сообщений: {e}")
             raise
         finally:
             session.close()
     
+    def iter_messages_by_date_range(self, chat_id: int, start_date: datetime, end_date: datetime,
+                                    page_size: int = None, after: Tuple[datetime, int] = None,
+                                    with_reactions: bool = False) -> Iterator[List[Message]]:
+        """
+        Сообщения за период страницами по возрастанию (message_date, id)
+
+        Каждая страница читается в отдельной сессии (см. SessionOperations._query_messages_page):
+        в памяти одновременно находится не больше одной страницы. after -
+        (message_date, id), после которого начинать; with_reactions - загрузить
+        и реакции по пользователям.
+        """
+        page_size = page_size or config.EXPORT_PAGE_SIZE
+        while True:
+            session = self.get_session()
+            try:
+                page = self._query_messages_page(session, chat_id, start_date, end_date, after, page_size,
+                                                 with_reactions)
+            except SQLAlchemyError as e:
+                logger.error(f"Ошибка при получении сообщений: {e}")
+                raise
+            finally:
+                session.close()
+            if not page:
+                return
+            yield page
+            if len(page) < page_size:
+                return
+            after = (page[-1].message_date, page[-1].id)
+    
+    def iter_documents_by_date_range(self, chat_id: int, start_date: datetime, end_date: datetime,
+                                     page_size: int = None) -> Iterator[List[dict]]:
+        """
+        Документы чата за период страницами по возрастанию (message_date, id)
+
+        Текст сообщений не читается (см. SessionOperations._query_documents_page),
+        каждая страница читается в отдельной сессии.
+        """
+        page_size = page_size or config.EXPORT_PAGE_SIZE
+        after = None
+        while True:
+            session = self.get_session()
+            try:
+                page = self._query_documents_page(session, chat_id, start_date, end_date, after, page_size)
+            except SQLAlchemyError as e:
+                logger.error(f"Ошибка при получении документов: {e}")
+                raise
+            finally:
+                session.close()
+            if not page:
+                return
+            yield page
+            if len(page) < page_size:
+                return
+            after = (page[-1]["message_date"], page[-1]["id"])
+    
+    def get_export_watermark(self, chat_id: int, start_date: datetime, end_date: datetime,
+                             last: Tuple[datetime, int] = None, max_edited: datetime = None) -> Dict[str, int]:
+        """Изменения за период относительно отметки экспорта (см. SessionOperations._get_export_watermark)"""
+        session = self.get_session()
+        try:
+            return self._get_export_watermark(session, chat_id, start_date, end_date, last, max_edited)
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка при проверке кэша экспорта: {e}")
+            raise
+        finally:
+            session.close()
+    
+    def search_messages(self, query: str, chat_id: int = None, start_date: datetime = None,
+                        end_date: datetime = None, limit: int = 10,
+                        cursor: str = None) -> Tuple[List[dict], str]:
+        """Полнотекстовый поиск по сообщениям (см. SessionOperations._search_messages)"""
+        session = self.get_session()
+        try:
+            return self._search_messages(session, query, chat_id, start_date, end_date, limit, cursor)
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка при поиске сообщений: {e}")
+            raise
+        finally:
+            session.close()
+    
+    def find_chats(self, query: str, limit: int = 10) -> List[dict]:
+        """Нечеткий поиск чатов по названию (см. SessionOperations._find_chats)"""
+        session = self.get_session()
+        try:
+            return self._find_chats(session, query, limit)
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка при поиске чатов: {e}")
+            raise
+        finally:
+            session.close()
+    
+    def find_users(self, query: str, limit: int = 10) -> List[dict]:
+        """Нечеткий поиск пользователей по имени (см. SessionOperations._find_users)"""
+        session = self.get_session()
+        try:
+            return self._find_users(session, query, limit)
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка при поиске пользователей: {e}")
+            raise
+        finally:
+            session.close()
+    
+    def find_files(self, query: str, chat_id: int = None, user_id: int = None,
+                   limit: int = 10) -> List[dict]:
+        """Нечеткий поиск файлов по имени (см. SessionOperations._find_files)"""
+        session = self.get_session()
+        try:
+            return self._find_files(session, query, chat_id, user_id, limit)
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка при поиске файлов: {e}")
+            raise
+        finally:
+            session.close()
+    
+    def get_activity_stats(self, chat_id: int, start_day: date, end_day: date,
+                           top_users: int = 10) -> dict:
+        """Активность чата за период по дневным счетчикам (см. SessionOperations._get_activity_stats)"""
+        session = self.get_session()
+        try:
+            return self._get_activity_stats(session, chat_id, start_day, end_day, top_users)
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка при получении статистики: {e}")
+            raise
+        finally:
+            session.close()
+    
+    def get_archive_months(self, chat_id: int, before: datetime) -> List[datetime]:
+        """Месяцы, в которых у чата есть сообщения старше before"""
+        session = self.get_session()
+        try:
+            return self._get_archive_months(session, chat_id, before)
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка при поиске сообщений для архива: {e}")
+            raise
+        finally:
+            session.close()
+    
+    def delete_archived_messages(self, chat_id: int, start_date: datetime, end_date: datetime,
+                                 message_ids: List[int], release_media: bool = False) -> int:
+        """Удаление перенесенных в архив сообщений чата за период [start_date, end_date) по ID записей"""
+        session = self.get_session()
+        try:
+            deleted = self._delete_archived_messages(session, chat_id, start_date, end_date,
+                                                     message_ids, release_media)
+            session.commit()
+            return deleted
+        except SQLAlchemyError as e:
+            session.rollback()
+            logger.error(f"Ошибка при удалении перенесенных в архив сообщений: {e}")
+            raise
+        finally:
+            session.close()
+    
+    def drop_empty_partitions(self, before: datetime) -> List[str]:
+        """Удаление пустых секций месяцев, закончившихся до before"""
+        session = self.get_session()
+        try:
+            dropped = self._drop_empty_partitions(session, before)
+            session.commit()
+            return dropped
+        except SQLAlchemyError as e:
+            session.rollback()
+            logger.error(f"Ошибка при удалении секций: {e}")
+            raise
+        finally:
+            session.close()
+    
     def get_chat_list(self) -> List[Chat]:
         """Получение списка всех чатов"""
         session = self.get_session()
         try:
-            chats = session.query(Chat).all()
-            return chats
+            return self._query_chat_list(session)
         except SQLAlchemyError as e:
             print(f"Ошибка при получении списка чатов: {e}")
             raise
@@ -0,0 +1,75 @@
+"""
+Кэш последних записанных данных пользователей и чатов
+"""
+import time
+from collections import OrderedDict
+from typing import Hashable, Optional, Tuple
+
+
+class IdentityCache:
+    """
+    Ограниченный LRU-кэш с временем жизни записей
+
+    Хранит последние записанные в БД значения (например, (username, first_name,
+    last_name) пользователя или (title, chat_type) чата), чтобы не обращаться
+    к БД, когда данные не изменились.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        """
+        Инициализация кэша
+
+        Args:
+            max_size: Максимальное количество записей
+            ttl: Время жизни записи в секундах
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # ключ -> (значения, момент устаревания)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[Tuple]:
+        """Получение значений по ключу (None, если записи нет или она устарела)"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        values, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return values
+
+    def put(self, key: Hashable, values: Tuple):
+        """Сохранение значений по ключу"""
+        self._entries[key] = (values, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        """Удаление записи из кэша"""
+        self._entries.pop(key, None)
+
+    def clear(self):
+        """Очистка кэша"""
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        """Счетчики попаданий и промахов"""
+        total = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0
+        }
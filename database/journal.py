@@ -0,0 +1,330 @@
+"""
+Журнал упреждающей записи (WAL) операций очереди записи
+"""
+import json
+import logging
+import os
+import time
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from config import config
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_SUFFIX = ".wal"
+CHECKPOINT_FILE = "checkpoint.json"
+LOCK_FILE = "journal.lock"
+DATETIME_KEY = "__datetime__"
+
+# Сколько байт с конца сегмента читать при поиске последней записи
+TAIL_CHUNK_SIZE = 64 * 1024
+
+
+def _encode(value):
+    """Сериализация значений, которых нет в JSON"""
+    if isinstance(value, datetime):
+        return {DATETIME_KEY: value.isoformat()}
+    raise TypeError(f"Тип {type(value).__name__} не сериализуется в журнал")
+
+
+def _decode(obj: dict):
+    """Восстановление datetime при чтении журнала"""
+    if len(obj) == 1 and DATETIME_KEY in obj:
+        return datetime.fromisoformat(obj[DATETIME_KEY])
+    return obj
+
+
+class WriteAheadJournal:
+    """
+    Журнал операций записи на диске: сегменты JSON Lines с возрастающим номером (LSN)
+
+    Каждая операция получает LSN и дописывается в текущий сегмент. sync() сбрасывает
+    записанное на диск (fsync) одним вызовом на пакет и при необходимости начинает
+    новый сегмент. checkpoint(lsn) отмечает операции до lsn как записанные в БД;
+    сегменты, целиком попавшие под контрольную точку, удаляются.
+
+    Файлы сегментов называются по LSN первой записи: 00000000000000000001.wal.
+    Недописанная последняя строка (после аварийной остановки) отбрасывается при открытии.
+    """
+
+    def __init__(self, directory: str, segment_size: int = None):
+        """Инициализация журнала"""
+        self.directory = directory
+        self.segment_size = segment_size or config.JOURNAL_SEGMENT_SIZE
+        self.last_lsn = 0
+        self.checkpoint_lsn = 0
+        self._file = None
+        self._lock_file = None
+        self._segment_start = None
+        self._dirty = False
+        # Позиция чтения: (LSN последней прочитанной записи, начало сегмента, смещение)
+        self._cursor = None
+
+    def open(self):
+        """Открытие журнала: восстановление LSN и контрольной точки"""
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock()
+        self.checkpoint_lsn = self._read_checkpoint(self.directory)
+        segments = self._list_segments(self.directory)
+        if segments:
+            self._segment_start = segments[-1]
+            path = self._segment_path(self._segment_start)
+            self.last_lsn = self._recover_segment(path, self._segment_start)
+        else:
+            self.last_lsn = self.checkpoint_lsn
+            self._segment_start = self.last_lsn + 1
+        self.last_lsn = max(self.last_lsn, self.checkpoint_lsn)
+        self._file = open(self._segment_path(self._segment_start), "ab")
+        if self.lag:
+            logger.warning(f"Журнал {self.directory}: не записано в БД операций: {self.lag}")
+
+    def close(self):
+        """Сброс на диск и закрытие текущего сегмента"""
+        if self._file is not None:
+            self.sync()
+            self._file.close()
+            self._file = None
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    @property
+    def lag(self) -> int:
+        """Количество операций в журнале, еще не записанных в БД"""
+        return self.last_lsn - self.checkpoint_lsn
+
+    def append(self, operation: dict) -> int:
+        """Добавление операции (без fsync); возвращает LSN"""
+        self.last_lsn += 1
+        record = {"lsn": self.last_lsn, "ts": time.time(), "op": operation}
+        line = json.dumps(record, ensure_ascii=False, default=_encode, separators=(",", ":"))
+        self._file.write(line.encode("utf-8") + b"\n")
+        self._dirty = True
+        return self.last_lsn
+
+    def sync(self):
+        """fsync накопленных записей и переход на новый сегмент при превышении размера"""
+        if not self._dirty:
+            return
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._dirty = False
+        if self._file.tell() >= self.segment_size:
+            self._file.close()
+            self._segment_start = self.last_lsn + 1
+            self._file = open(self._segment_path(self._segment_start), "ab")
+
+    def checkpoint(self, lsn: int):
+        """Отметка операций до lsn включительно как записанных в БД"""
+        if lsn <= self.checkpoint_lsn:
+            return
+        self.checkpoint_lsn = lsn
+        # Без fsync: устаревшая контрольная точка лишь повторит идемпотентные операции
+        path = os.path.join(self.directory, CHECKPOINT_FILE)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"lsn": lsn}, f)
+        os.replace(tmp_path, path)
+        self._remove_old_segments()
+
+    def read(self, after_lsn: int, limit: int) -> List[Tuple[int, dict]]:
+        """
+        Чтение до limit операций с LSN больше after_lsn
+
+        Записанное, но не сброшенное через sync(), тоже читается (flush).
+        """
+        if self._file is not None and self._dirty:
+            self._file.flush()
+
+        segments = self._list_segments(self.directory)
+        if self._cursor and self._cursor[0] == after_lsn and self._cursor[1] in segments:
+            _, segment_start, offset = self._cursor
+        else:
+            segment_start, offset = self._find_segment(after_lsn + 1), 0
+
+        records = []
+        while segment_start is not None and len(records) < limit:
+            path = self._segment_path(segment_start)
+            with open(path, "rb") as f:
+                f.seek(offset)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        # Запись дописывается прямо сейчас
+                        break
+                    offset += len(line)
+                    record = json.loads(line, object_hook=_decode)
+                    if record["lsn"] <= after_lsn:
+                        continue
+                    records.append((record["lsn"], record["op"]))
+                    after_lsn = record["lsn"]
+                    if len(records) >= limit:
+                        break
+            if len(records) >= limit:
+                break
+            following = [start for start in segments if start > segment_start]
+            if not following:
+                break
+            segment_start, offset = following[0], 0
+
+        if segment_start is not None:
+            self._cursor = (after_lsn, segment_start, offset)
+        return records
+
+    def get_status(self) -> dict:
+        """Состояние журнала (см. read_status)"""
+        return self.read_status(self.directory, self.last_lsn, self.checkpoint_lsn)
+
+    @classmethod
+    def read_status(cls, directory: str, last_lsn: int = None, checkpoint_lsn: int = None) -> dict:
+        """
+        Состояние журнала по файлам на диске (в том числе журнала другого процесса)
+
+        Returns:
+            Словарь: last_lsn, checkpoint_lsn, lag (операций не записано в БД),
+            oldest_pending (время самой старой незаписанной операции или None),
+            segments, size_bytes
+        """
+        segments = cls._list_segments(directory)
+        if checkpoint_lsn is None:
+            checkpoint_lsn = cls._read_checkpoint(directory)
+        if last_lsn is None:
+            last_lsn = checkpoint_lsn
+            if segments:
+                last_lsn = max(last_lsn, cls._read_last_lsn(
+                    os.path.join(directory, f"{segments[-1]:020d}{SEGMENT_SUFFIX}"), segments[-1] - 1
+                ))
+
+        oldest_pending = None
+        if last_lsn > checkpoint_lsn:
+            oldest_pending = cls._read_timestamp(directory, segments, checkpoint_lsn + 1)
+
+        size = sum(
+            os.path.getsize(os.path.join(directory, f"{start:020d}{SEGMENT_SUFFIX}"))
+            for start in segments
+        )
+        return {
+            "last_lsn": last_lsn,
+            "checkpoint_lsn": checkpoint_lsn,
+            "lag": last_lsn - checkpoint_lsn,
+            "oldest_pending": datetime.fromtimestamp(oldest_pending) if oldest_pending else None,
+            "segments": len(segments),
+            "size_bytes": size
+        }
+
+    @staticmethod
+    def find_journals(path: str) -> Dict[str, str]:
+        """Журналы в каталоге JOURNAL_PATH: имя -> каталог"""
+        if not os.path.isdir(path):
+            return {}
+        return {
+            name: os.path.join(path, name)
+            for name in sorted(os.listdir(path))
+            if os.path.isdir(os.path.join(path, name))
+        }
+
+    def _lock(self):
+        """Журнал пишет только один процесс"""
+        self._lock_file = open(os.path.join(self.directory, LOCK_FILE), "w")
+        if fcntl is None:
+            return
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self._lock_file.close()
+            self._lock_file = None
+            raise RuntimeError(f"Журнал {self.directory} уже используется другим процессом")
+
+    def _segment_path(self, start: int) -> str:
+        """Путь к файлу сегмента"""
+        return os.path.join(self.directory, f"{start:020d}{SEGMENT_SUFFIX}")
+
+    def _find_segment(self, lsn: int) -> Optional[int]:
+        """Сегмент, в котором находится запись lsn (или первый после нее)"""
+        segments = self._list_segments(self.directory)
+        candidates = [start for start in segments if start <= lsn]
+        if candidates:
+            return candidates[-1]
+        return segments[0] if segments else None
+
+    def _remove_old_segments(self):
+        """Удаление сегментов, все записи которых записаны в БД"""
+        segments = self._list_segments(self.directory)
+        for start, next_start in zip(segments, segments[1:]):
+            if next_start - 1 > self.checkpoint_lsn:
+                break
+            os.remove(self._segment_path(start))
+
+    def _recover_segment(self, path: str, start: int) -> int:
+        """Отбрасывание недописанной строки в конце сегмента; возвращает последний LSN"""
+        last_lsn = start - 1
+        valid_size = 0
+        with open(path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    last_lsn = json.loads(line)["lsn"]
+                except (ValueError, KeyError):
+                    break
+                valid_size += len(line)
+        if valid_size < os.path.getsize(path):
+            logger.warning(f"Журнал {path}: отброшена недописанная запись")
+            with open(path, "r+b") as f:
+                f.truncate(valid_size)
+        return last_lsn
+
+    @staticmethod
+    def _list_segments(directory: str) -> List[int]:
+        """LSN первых записей сегментов по возрастанию"""
+        if not os.path.isdir(directory):
+            return []
+        return sorted(
+            int(name[:-len(SEGMENT_SUFFIX)])
+            for name in os.listdir(directory)
+            if name.endswith(SEGMENT_SUFFIX)
+        )
+
+    @staticmethod
+    def _read_checkpoint(directory: str) -> int:
+        """LSN контрольной точки"""
+        try:
+            with open(os.path.join(directory, CHECKPOINT_FILE), "r", encoding="utf-8") as f:
+                return json.load(f)["lsn"]
+        except (OSError, ValueError, KeyError):
+            return 0
+
+    @staticmethod
+    def _read_last_lsn(path: str, default: int) -> int:
+        """LSN последней полной записи сегмента (чтение с конца файла)"""
+        with open(path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            f.seek(max(0, size - TAIL_CHUNK_SIZE))
+            lines = f.read().split(b"\n")
+        # После последнего \n - пустая строка или недописанная запись
+        for line in reversed(lines[:-1]):
+            try:
+                return json.loads(line)["lsn"]
+            except (ValueError, KeyError):
+                continue
+        return default
+
+    @classmethod
+    def _read_timestamp(cls, directory: str, segments: List[int], lsn: int) -> Optional[float]:
+        """Время записи операции lsn"""
+        candidates = [start for start in segments if start <= lsn]
+        if not candidates:
+            return None
+        with open(os.path.join(directory, f"{candidates[-1]:020d}{SEGMENT_SUFFIX}"), "rb") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    return None
+                if record["lsn"] >= lsn:
+                    return record["ts"]
+        return None
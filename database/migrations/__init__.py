@@ -0,0 +1,109 @@
+"""
+Версионированные миграции схемы БД
+
+Каждая миграция - модуль с атрибутами VERSION, DESCRIPTION, TRANSACTIONAL и
+функцией upgrade. Транзакционные миграции получают соединение внутри открытой
+транзакции, нетранзакционные (например, с CREATE INDEX CONCURRENTLY) - Engine
+и сами управляют соединениями и транзакциями.
+"""
+import logging
+from typing import List
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from . import (
+    m001_initial_schema,
+    m002_message_unique_key,
+    m003_hot_path_indexes,
+    m004_bigint_keys,
+    m005_download_jobs,
+    m006_media_blobs,
+    m007_download_policy,
+    m008_reaction_counts,
+    m009_idempotent_keys,
+    m010_partition_by_month,
+    m011_message_search,
+    m012_trigram_lookup,
+    m013_activity_rollups,
+)
+
+logger = logging.getLogger(__name__)
+
+# Миграции в порядке применения
+MIGRATIONS = [
+    m001_initial_schema,
+    m002_message_unique_key,
+    m003_hot_path_indexes,
+    m004_bigint_keys,
+    m005_download_jobs,
+    m006_media_blobs,
+    m007_download_policy,
+    m008_reaction_counts,
+    m009_idempotent_keys,
+    m010_partition_by_month,
+    m011_message_search,
+    m012_trigram_lookup,
+    m013_activity_rollups,
+]
+
+# Ключ advisory lock, чтобы миграции не выполнялись одновременно несколькими процессами
+MIGRATION_LOCK_ID = 7205310001
+
+
+def get_applied_versions(engine: Engine) -> List[int]:
+    """Получение списка примененных версий миграций"""
+    with engine.begin() as connection:
+        connection.execute(text("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                description VARCHAR(255),
+                applied_at TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc')
+            )
+        """))
+        return [row[0] for row in connection.execute(
+            text("SELECT version FROM schema_migrations ORDER BY version")
+        )]
+
+
+def run_migrations(engine: Engine, target: int = None) -> List[int]:
+    """
+    Применение непримененных миграций
+
+    Args:
+        engine: Синхронный Engine SQLAlchemy
+        target: Версия, до которой применять миграции (по умолчанию - последняя)
+
+    Returns:
+        Список примененных в этом запуске версий
+    """
+    applied_now = []
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as lock_connection:
+        lock_connection.execute(text("SELECT pg_advisory_lock(:id)"), {"id": MIGRATION_LOCK_ID})
+        try:
+            applied = set(get_applied_versions(engine))
+            for migration in MIGRATIONS:
+                if migration.VERSION in applied:
+                    continue
+                if target is not None and migration.VERSION > target:
+                    break
+
+                logger.info(f"Применение миграции {migration.VERSION}: {migration.DESCRIPTION}")
+                if migration.TRANSACTIONAL:
+                    with engine.begin() as connection:
+                        migration.upgrade(connection)
+                        _record(connection, migration)
+                else:
+                    migration.upgrade(engine)
+                    with engine.begin() as connection:
+                        _record(connection, migration)
+                applied_now.append(migration.VERSION)
+        finally:
+            lock_connection.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": MIGRATION_LOCK_ID})
+    return applied_now
+
+
+def _record(connection, migration):
+    """Отметка миграции как примененной"""
+    connection.execute(
+        text("INSERT INTO schema_migrations (version, description) VALUES (:version, :description)"),
+        {"version": migration.VERSION, "description": migration.DESCRIPTION}
+    )
@@ -0,0 +1,95 @@
+"""
+Вспомогательные функции для миграций, выполняемых без долгих блокировок
+"""
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+
+def create_index_concurrently(engine: Engine, name: str, table: str, definition: str,
+                              unique: bool = False):
+    """
+    Создание индекса без блокировки записи в таблицу
+
+    Индекс, оставшийся невалидным после прерванного CREATE INDEX CONCURRENTLY,
+    удаляется и строится заново.
+    """
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        valid = connection.execute(text("""
+            SELECT i.indisvalid FROM pg_index i
+            JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE c.relname = :name
+        """), {"name": name}).scalar()
+        if valid:
+            return
+        if valid is not None:
+            connection.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+        connection.execute(text(
+            f"CREATE {'UNIQUE ' if unique else ''}INDEX CONCURRENTLY {name} ON {table} {definition}"
+        ))
+
+
+def column_data_type(connection, table: str, column: str) -> str:
+    """Тип данных колонки (None, если колонки нет)"""
+    return connection.execute(text("""
+        SELECT data_type FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = :table AND column_name = :column
+    """), {"table": table, "column": column}).scalar()
+
+
+def constraint_exists(connection, name: str) -> bool:
+    """Проверка существования ограничения"""
+    return connection.execute(
+        text("SELECT 1 FROM pg_constraint WHERE conname = :name"), {"name": name}
+    ).first() is not None
+
+
+def backfill_in_batches(engine: Engine, table: str, assignments: str, condition: str,
+                        batch_size: int = 10000):
+    """
+    Заполнение колонок по диапазонам id, каждый диапазон - отдельная транзакция
+
+    Args:
+        table: Имя таблицы
+        assignments: Выражение SET (например, "id_new = id")
+        condition: Условие, отбирающее еще не заполненные строки
+        batch_size: Размер диапазона id
+    """
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        low, high = connection.execute(text(f"SELECT min(id), max(id) FROM {table}")).one()
+        if low is None:
+            return
+        for start in range(low, high + 1, batch_size):
+            connection.execute(
+                text(f"UPDATE {table} SET {assignments} "
+                     f"WHERE id >= :start AND id < :end AND ({condition})"),
+                {"start": start, "end": start + batch_size}
+            )
+
+
+def create_partitioned_index(engine: Engine, name: str, table: str, definition: str):
+    """
+    Индекс секционированной таблицы без блокировки записи
+
+    CREATE INDEX CONCURRENTLY не поддерживается для секционированных таблиц, поэтому
+    индекс создается только на родительской таблице (ON ONLY, пока невалиден), на
+    каждой секции строится конкурентно и присоединяется; после присоединения всех
+    секций индекс становится валидным. Новые секции получают индекс автоматически.
+    """
+    with engine.begin() as connection:
+        connection.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON ONLY {table} {definition}"))
+        partitions = list(connection.execute(text("""
+            SELECT c.relname FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = to_regclass(:table)
+        """), {"table": table}).scalars())
+
+    for partition in partitions:
+        partition_index = f"{name}_{partition}"
+        create_index_concurrently(engine, partition_index, partition, definition)
+        with engine.begin() as connection:
+            attached = connection.execute(text("""
+                SELECT 1 FROM pg_inherits
+                WHERE inhrelid = to_regclass(:index) AND inhparent = to_regclass(:parent)
+            """), {"index": partition_index, "parent": name}).first()
+            if attached is None:
+                connection.execute(text(f"ALTER INDEX {name} ATTACH PARTITION {partition_index}"))
@@ -0,0 +1,65 @@
+"""
+Исходная схема: users, chats, messages, reactions, documents
+
+Для БД, созданных ранее через Base.metadata.create_all, ничего не меняет.
+"""
+from sqlalchemy import text
+
+VERSION = 1
+DESCRIPTION = "Исходная схема"
+TRANSACTIONAL = True
+
+
+def upgrade(connection):
+    connection.execute(text("""
+        CREATE TABLE IF NOT EXISTS users (
+            id BIGINT PRIMARY KEY,
+            username VARCHAR(255),
+            first_name VARCHAR(255),
+            last_name VARCHAR(255),
+            created_at TIMESTAMP
+        )
+    """))
+    connection.execute(text("""
+        CREATE TABLE IF NOT EXISTS chats (
+            id BIGINT PRIMARY KEY,
+            title VARCHAR(255),
+            chat_type VARCHAR(50),
+            created_at TIMESTAMP
+        )
+    """))
+    connection.execute(text("""
+        CREATE TABLE IF NOT EXISTS messages (
+            id SERIAL PRIMARY KEY,
+            message_id BIGINT NOT NULL,
+            chat_id BIGINT NOT NULL REFERENCES chats (id),
+            user_id BIGINT REFERENCES users (id),
+            text TEXT,
+            message_date TIMESTAMP NOT NULL,
+            edited_date TIMESTAMP,
+            created_at TIMESTAMP
+        )
+    """))
+    connection.execute(text("""
+        CREATE TABLE IF NOT EXISTS reactions (
+            id SERIAL PRIMARY KEY,
+            message_id INTEGER NOT NULL REFERENCES messages (id),
+            emoji VARCHAR(50),
+            user_id BIGINT,
+            created_at TIMESTAMP
+        )
+    """))
+    connection.execute(text("""
+        CREATE TABLE IF NOT EXISTS documents (
+            id SERIAL PRIMARY KEY,
+            message_id INTEGER NOT NULL REFERENCES messages (id),
+            file_id VARCHAR(255) NOT NULL,
+            file_unique_id VARCHAR(255),
+            file_name VARCHAR(255),
+            mime_type VARCHAR(100),
+            file_size INTEGER,
+            document_type VARCHAR(50),
+            file_path VARCHAR(500),
+            created_at TIMESTAMP
+        )
+    """))
@@ -0,0 +1,43 @@
+"""
+Уникальный ключ messages (chat_id, message_id) для INSERT ... ON CONFLICT
+
+Таблицы, созданные до появления ключа, могут содержать дубли: файлы и реакции
+дублей переносятся на самую раннюю запись, сами дубли удаляются.
+"""
+import logging
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+VERSION = 2
+DESCRIPTION = "Уникальный ключ messages (chat_id, message_id)"
+TRANSACTIONAL = True
+
+
+def upgrade(connection):
+    exists = connection.execute(
+        text("SELECT 1 FROM pg_constraint WHERE conname = 'uq_messages_chat_message'")
+    ).first()
+    if exists:
+        return
+    
+    connection.execute(text("""
+        CREATE TEMP TABLE message_duplicates ON COMMIT DROP AS
+        SELECT id, keep_id FROM (
+            SELECT id, min(id) OVER (PARTITION BY chat_id, message_id) AS keep_id
+            FROM messages
+        ) ranked
+        WHERE id <> keep_id
+    """))
+    for table in ('documents', 'reactions'):
+        connection.execute(text(
+            f"UPDATE {table} t SET message_id = d.keep_id "
+            f"FROM message_duplicates d WHERE t.message_id = d.id"
+        ))
+    connection.execute(text(
+        "DELETE FROM messages m USING message_duplicates d WHERE m.id = d.id"
+    ))
+    connection.execute(text(
+        "ALTER TABLE messages ADD CONSTRAINT uq_messages_chat_message UNIQUE (chat_id, message_id)"
+    ))
+    logger.info("Добавлен уникальный ключ messages (chat_id, message_id)")
@@ -0,0 +1,22 @@
+"""
+Индексы для частых запросов
+
+- messages (chat_id, message_date): выборка за период в get_messages_by_date_range
+- reactions (message_id, user_id, emoji): загрузка реакций сообщения и удаление
+  старых реакций пользователя
+- documents (message_id): загрузка файлов сообщения
+
+Поиск сообщения по (chat_id, message_id) уже обслуживает уникальный ключ из миграции 2.
+"""
+from .helpers import create_index_concurrently
+
+VERSION = 3
+DESCRIPTION = "Индексы для выборки по периоду, реакций и файлов"
+TRANSACTIONAL = False
+
+
+def upgrade(engine):
+    create_index_concurrently(engine, "ix_messages_chat_date", "messages", "(chat_id, message_date)")
+    create_index_concurrently(engine, "ix_reactions_message_user_emoji", "reactions",
+                              "(message_id, user_id, emoji)")
+    create_index_concurrently(engine, "ix_documents_message_id", "documents", "(message_id)")
@@ -0,0 +1,194 @@
+"""
+Перевод суррогатных ключей messages, reactions и documents на BIGINT без простоя
+
+ALTER COLUMN ... TYPE BIGINT переписывает таблицу под эксклюзивной блокировкой,
+поэтому миграция выполняется по шагам:
+
+1. Добавляются колонки <col>_new BIGINT и триггер, копирующий в них значения
+   при вставке и обновлении, а также CHECK (<col>_new IS NOT NULL) NOT VALID.
+2. Существующие строки заполняются пакетами по диапазонам id.
+3. Конкурентно строятся индексы по новым колонкам, CHECK-ограничения проверяются
+   без блокировки записи.
+4. В одной короткой транзакции колонки меняются местами: PRIMARY KEY создается
+   по готовому индексу, SET NOT NULL опирается на проверенный CHECK, внешние
+   ключи добавляются как NOT VALID.
+5. Внешние ключи проверяются без блокировки записи.
+
+Прерванная миграция безопасно продолжается со следующего запуска.
+"""
+import logging
+from sqlalchemy import text
+from .helpers import (
+    backfill_in_batches,
+    column_data_type,
+    constraint_exists,
+    create_index_concurrently,
+)
+
+logger = logging.getLogger(__name__)
+
+VERSION = 4
+DESCRIPTION = "BIGINT для messages.id, reactions.id/message_id, documents.id/message_id/file_size"
+TRANSACTIONAL = False
+
+# Колонки, расширяемые до BIGINT, по таблицам
+TABLES = {
+    'messages': ['id'],
+    'reactions': ['id', 'message_id'],
+    'documents': ['id', 'message_id', 'file_size'],
+}
+NOT_NULL_COLUMNS = {'id', 'message_id'}
+
+# Внешние ключи на messages.id
+FOREIGN_KEYS = {
+    'reactions': 'reactions_message_id_fkey',
+    'documents': 'documents_message_id_fkey',
+}
+
+# Индексы по новым колонкам: имя после переименования -> (таблица, определение)
+INDEXES = {
+    'ix_reactions_message_user_emoji': ('reactions', '(message_id_new, user_id, emoji)'),
+    'ix_documents_message_id': ('documents', '(message_id_new)'),
+}
+
+LOCK_TIMEOUT = '10s'
+
+
+def upgrade(engine):
+    with engine.connect() as connection:
+        pending = {
+            table: [column for column in columns
+                    if column_data_type(connection, table, column) != 'bigint']
+            for table, columns in TABLES.items()
+        }
+    pending = {table: columns for table, columns in pending.items() if columns}
+
+    if pending:
+        _add_shadow_columns(engine, pending)
+        _backfill(engine, pending)
+        _build_indexes(engine, pending)
+        _swap_columns(engine, pending)
+    _validate_foreign_keys(engine)
+
+
+def _add_shadow_columns(engine, pending):
+    """Шаг 1: теневые колонки, триггеры синхронизации и CHECK NOT VALID"""
+    with engine.begin() as connection:
+        connection.execute(text(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}'"))
+        for table, columns in pending.items():
+            for column in columns:
+                connection.execute(text(
+                    f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column}_new BIGINT"
+                ))
+                check_name = f"{table}_{column}_new_not_null"
+                if column in NOT_NULL_COLUMNS and not constraint_exists(connection, check_name):
+                    connection.execute(text(
+                        f"ALTER TABLE {table} ADD CONSTRAINT {check_name} "
+                        f"CHECK ({column}_new IS NOT NULL) NOT VALID"
+                    ))
+
+            copy_values = " ".join(f"NEW.{column}_new := NEW.{column};" for column in columns)
+            connection.execute(text(f"""
+                CREATE OR REPLACE FUNCTION {table}_bigint_sync() RETURNS trigger AS $$
+                BEGIN
+                    {copy_values}
+                    RETURN NEW;
+                END
+                $$ LANGUAGE plpgsql
+            """))
+            connection.execute(text(f"DROP TRIGGER IF EXISTS {table}_bigint_sync ON {table}"))
+            connection.execute(text(
+                f"CREATE TRIGGER {table}_bigint_sync BEFORE INSERT OR UPDATE ON {table} "
+                f"FOR EACH ROW EXECUTE FUNCTION {table}_bigint_sync()"
+            ))
+
+
+def _backfill(engine, pending):
+    """Шаг 2: заполнение теневых колонок существующих строк"""
+    for table, columns in pending.items():
+        logger.info(f"Заполнение BIGINT-колонок таблицы {table}")
+        backfill_in_batches(
+            engine, table,
+            assignments=", ".join(f"{column}_new = {column}" for column in columns),
+            condition=" OR ".join(f"{column}_new IS DISTINCT FROM {column}" for column in columns)
+        )
+
+
+def _build_indexes(engine, pending):
+    """Шаг 3: индексы по новым колонкам и проверка CHECK-ограничений"""
+    for table, columns in pending.items():
+        if 'id' in columns:
+            create_index_concurrently(engine, f"{table}_id_new_key", table, "(id_new)", unique=True)
+    for name, (table, definition) in INDEXES.items():
+        if 'message_id' in pending.get(table, []):
+            create_index_concurrently(engine, f"{name}_new", table, definition)
+
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        for table, columns in pending.items():
+            for column in columns:
+                if column in NOT_NULL_COLUMNS:
+                    connection.execute(text(
+                        f"ALTER TABLE {table} VALIDATE CONSTRAINT {table}_{column}_new_not_null"
+                    ))
+
+
+def _swap_columns(engine, pending):
+    """Шаг 4: замена колонок в одной короткой транзакции"""
+    with engine.begin() as connection:
+        connection.execute(text(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}'"))
+        connection.execute(text(
+            "LOCK TABLE messages, reactions, documents IN ACCESS EXCLUSIVE MODE"
+        ))
+        for table, constraint in FOREIGN_KEYS.items():
+            connection.execute(text(f"ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {constraint}"))
+
+        for table, columns in pending.items():
+            connection.execute(text(f"DROP TRIGGER {table}_bigint_sync ON {table}"))
+            connection.execute(text(f"DROP FUNCTION {table}_bigint_sync()"))
+
+            sequence = None
+            if 'id' in columns:
+                sequence = connection.execute(
+                    text("SELECT pg_get_serial_sequence(:table, 'id')"), {"table": table}
+                ).scalar()
+                # Иначе последовательность удалится вместе со старой колонкой
+                connection.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY NONE"))
+                connection.execute(text(f"ALTER TABLE {table} DROP CONSTRAINT {table}_pkey"))
+
+            for column in columns:
+                connection.execute(text(f"ALTER TABLE {table} DROP COLUMN {column}"))
+                connection.execute(text(f"ALTER TABLE {table} RENAME COLUMN {column}_new TO {column}"))
+                if column in NOT_NULL_COLUMNS:
+                    # Проверенный CHECK позволяет не сканировать таблицу
+                    connection.execute(text(f"ALTER TABLE {table} ALTER COLUMN {column} SET NOT NULL"))
+                    connection.execute(text(
+                        f"ALTER TABLE {table} DROP CONSTRAINT {table}_{column}_new_not_null"
+                    ))
+
+            if sequence:
+                connection.execute(text(
+                    f"ALTER TABLE {table} ADD CONSTRAINT {table}_pkey "
+                    f"PRIMARY KEY USING INDEX {table}_id_new_key"
+                ))
+                connection.execute(text(f"ALTER SEQUENCE {sequence} AS BIGINT"))
+                connection.execute(text(
+                    f"ALTER TABLE {table} ALTER COLUMN id SET DEFAULT nextval('{sequence}')"
+                ))
+                connection.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY {table}.id"))
+
+        for name, (table, _) in INDEXES.items():
+            if 'message_id' in pending.get(table, []):
+                connection.execute(text(f"ALTER INDEX {name}_new RENAME TO {name}"))
+
+        for table, constraint in FOREIGN_KEYS.items():
+            connection.execute(text(
+                f"ALTER TABLE {table} ADD CONSTRAINT {constraint} "
+                f"FOREIGN KEY (message_id) REFERENCES messages (id) NOT VALID"
+            ))
+
+
+def _validate_foreign_keys(engine):
+    """Шаг 5: проверка внешних ключей без блокировки записи"""
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        for table, constraint in FOREIGN_KEYS.items():
+            connection.execute(text(f"ALTER TABLE {table} VALIDATE CONSTRAINT {constraint}"))
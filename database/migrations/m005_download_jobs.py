@@ -0,0 +1,36 @@
+"""
+Постоянная очередь скачивания файлов
+
+Сообщения и документы сохраняются сразу, а файлы скачиваются фоновыми
+обработчиками по заданиям из download_jobs, которые заполняют documents.file_path.
+"""
+from sqlalchemy import text
+
+VERSION = 5
+DESCRIPTION = "Очередь скачивания файлов"
+TRANSACTIONAL = True
+
+
+def upgrade(connection):
+    connection.execute(text("""
+        CREATE TABLE IF NOT EXISTS download_jobs (
+            id BIGSERIAL PRIMARY KEY,
+            document_id BIGINT NOT NULL UNIQUE REFERENCES documents (id) ON DELETE CASCADE,
+            chat_id BIGINT NOT NULL,
+            file_id VARCHAR(255) NOT NULL,
+            file_size BIGINT,
+            priority INTEGER NOT NULL DEFAULT 0,
+            status VARCHAR(20) NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+            locked_at TIMESTAMP,
+            last_error TEXT,
+            created_at TIMESTAMP
+        )
+    """))
+    # Таблица новая и пустая, поэтому индекс строится в транзакции
+    connection.execute(text("""
+        CREATE INDEX IF NOT EXISTS ix_download_jobs_queue
+        ON download_jobs (priority, file_size, id)
+        WHERE status <> 'failed'
+    """))
@@ -0,0 +1,56 @@
+"""
+Хранилище файлов, адресуемое по file_unique_id
+
+media_blobs - индекс скачанных файлов со счетчиком ссылок из documents.
+Повторное вложение того же файла привязывается к существующей записи без
+скачивания. Уже скачанные файлы переносятся в индекс как есть (без перемещения).
+"""
+from sqlalchemy import text
+from .helpers import create_index_concurrently
+
+VERSION = 6
+DESCRIPTION = "Индекс скачанных файлов по file_unique_id"
+TRANSACTIONAL = False
+
+
+def upgrade(engine):
+    with engine.begin() as connection:
+        connection.execute(text("""
+            CREATE TABLE IF NOT EXISTS media_blobs (
+                file_unique_id VARCHAR(255) PRIMARY KEY,
+                file_path VARCHAR(500) NOT NULL,
+                file_size BIGINT,
+                sha256 VARCHAR(64),
+                ref_count INTEGER NOT NULL DEFAULT 0,
+                created_at TIMESTAMP
+            )
+        """))
+        connection.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_media_blobs_sha256 ON media_blobs (sha256)"
+        ))
+        connection.execute(text(
+            "ALTER TABLE download_jobs ADD COLUMN IF NOT EXISTS file_unique_id VARCHAR(255)"
+        ))
+        connection.execute(text("""
+            UPDATE download_jobs j SET file_unique_id = d.file_unique_id
+            FROM documents d
+            WHERE d.id = j.document_id AND j.file_unique_id IS NULL
+        """))
+        # Для каждого file_unique_id берем последний скачанный файл,
+        # ссылки считаем по документам с этим же путем
+        connection.execute(text("""
+            INSERT INTO media_blobs (file_unique_id, file_path, file_size, ref_count, created_at)
+            SELECT DISTINCT ON (file_unique_id)
+                   file_unique_id, file_path, file_size,
+                   count(*) OVER (PARTITION BY file_unique_id, file_path),
+                   now() AT TIME ZONE 'utc'
+            FROM documents
+            WHERE file_unique_id IS NOT NULL AND file_path IS NOT NULL
+            ORDER BY file_unique_id, id DESC
+            ON CONFLICT (file_unique_id) DO NOTHING
+        """))
+
+    create_index_concurrently(engine, "ix_download_jobs_file_unique_id", "download_jobs",
+                              "(file_unique_id)")
+    create_index_concurrently(engine, "ix_documents_unique_id_pending", "documents",
+                              "(file_unique_id) WHERE file_path IS NULL")
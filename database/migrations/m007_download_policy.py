@@ -0,0 +1,17 @@
+"""
+Политика скачивания файла документа
+
+eager - файл скачивается при получении, lazy - по запросу администратора,
+never - хранятся только метаданные. Для существующих документов NULL (eager).
+"""
+from sqlalchemy import text
+
+VERSION = 7
+DESCRIPTION = "Политика скачивания файлов"
+TRANSACTIONAL = True
+
+
+def upgrade(connection):
+    connection.execute(text(
+        "ALTER TABLE documents ADD COLUMN IF NOT EXISTS download_policy VARCHAR(10)"
+    ))
@@ -0,0 +1,31 @@
+"""
+Счетчики реакций по сообщениям
+
+reaction_counts хранит (message_id, emoji) -> количество, чтобы экспорт и
+статистика не загружали все строки reactions. Заполняется по существующим реакциям.
+"""
+from sqlalchemy import text
+
+VERSION = 8
+DESCRIPTION = "Счетчики реакций по сообщениям"
+TRANSACTIONAL = True
+
+
+def upgrade(connection):
+    connection.execute(text("""
+        CREATE TABLE IF NOT EXISTS reaction_counts (
+            message_id BIGINT NOT NULL REFERENCES messages (id) ON DELETE CASCADE,
+            emoji VARCHAR(50) NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (message_id, emoji)
+        )
+    """))
+    # Блокируем запись реакций, чтобы счетчики совпали с таблицей reactions
+    connection.execute(text("LOCK TABLE reactions IN SHARE MODE"))
+    connection.execute(text("""
+        INSERT INTO reaction_counts (message_id, emoji, count)
+        SELECT message_id, emoji, count(*) FROM reactions
+        WHERE emoji IS NOT NULL
+        GROUP BY message_id, emoji
+        ON CONFLICT (message_id, emoji) DO UPDATE SET count = excluded.count
+    """))
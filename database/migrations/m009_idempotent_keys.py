@@ -0,0 +1,85 @@
+"""
+Уникальные ключи реакций и документов
+
+Повторная запись операций из журнала (WriteAheadJournal) не должна создавать
+дубликаты: реакция уникальна по (message_id, user_id, emoji), документ - по
+(message_id, file_unique_id). Существующие дубликаты удаляются с поправкой
+reaction_counts и счетчиков ссылок media_blobs.
+"""
+from sqlalchemy import text
+from .helpers import create_index_concurrently
+
+VERSION = 9
+DESCRIPTION = "Уникальные ключи реакций и документов"
+TRANSACTIONAL = False
+
+
+def upgrade(engine):
+    with engine.begin() as connection:
+        # Блокируем запись реакций, чтобы счетчики совпали с таблицей reactions
+        connection.execute(text("LOCK TABLE reactions IN SHARE ROW EXCLUSIVE MODE"))
+        connection.execute(text("""
+            WITH duplicates AS (
+                SELECT id FROM (
+                    SELECT id, row_number() OVER (
+                        PARTITION BY message_id, user_id, emoji ORDER BY id
+                    ) AS position
+                    FROM reactions
+                ) ranked
+                WHERE position > 1
+            ), deleted AS (
+                DELETE FROM reactions r USING duplicates d
+                WHERE r.id = d.id
+                RETURNING r.message_id, r.emoji
+            )
+            UPDATE reaction_counts c SET count = c.count - d.removed
+            FROM (
+                SELECT message_id, emoji, count(*) AS removed FROM deleted
+                WHERE emoji IS NOT NULL
+                GROUP BY message_id, emoji
+            ) d
+            WHERE c.message_id = d.message_id AND c.emoji = d.emoji
+        """))
+        connection.execute(text("DELETE FROM reaction_counts WHERE count <= 0"))
+
+    with engine.begin() as connection:
+        connection.execute(text("LOCK TABLE documents IN SHARE ROW EXCLUSIVE MODE"))
+        # Задания на скачивание удаляются каскадно, ссылки на скачанные файлы уменьшаются
+        connection.execute(text("""
+            WITH duplicates AS (
+                SELECT id FROM (
+                    SELECT id, row_number() OVER (
+                        PARTITION BY message_id, file_unique_id ORDER BY id
+                    ) AS position
+                    FROM documents
+                    WHERE file_unique_id IS NOT NULL
+                ) ranked
+                WHERE position > 1
+            ), deleted AS (
+                DELETE FROM documents doc USING duplicates d
+                WHERE doc.id = d.id
+                RETURNING doc.file_unique_id, doc.file_path
+            )
+            UPDATE media_blobs b SET ref_count = GREATEST(b.ref_count - d.removed, 0)
+            FROM (
+                SELECT file_unique_id, count(*) AS removed FROM deleted
+                WHERE file_path IS NOT NULL
+                GROUP BY file_unique_id
+            ) d
+            WHERE b.file_unique_id = d.file_unique_id
+        """))
+        server_version = connection.execute(text("SHOW server_version_num")).scalar()
+
+    # NULLS NOT DISTINCT (PostgreSQL 15+): анонимные реакции тоже не повторяются
+    nulls = " NULLS NOT DISTINCT" if int(server_version) >= 150000 else ""
+    create_index_concurrently(
+        engine, "uq_reactions_message_user_emoji", "reactions",
+        f"(message_id, user_id, emoji){nulls}", unique=True
+    )
+    create_index_concurrently(
+        engine, "uq_documents_message_unique_id", "documents",
+        "(message_id, file_unique_id)", unique=True
+    )
+    # Неуникальный индекс с теми же колонками больше не нужен
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        connection.execute(text("DROP INDEX CONCURRENTLY IF EXISTS ix_reactions_message_user_emoji"))
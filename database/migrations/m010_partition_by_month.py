@@ -0,0 +1,209 @@
+"""
+Помесячное секционирование messages, documents и reactions по дате сообщения
+
+Секционированную таблицу нельзя получить из обычной через ALTER TABLE, поэтому:
+1. Старые таблицы переименовываются в *_unpartitioned, ссылающиеся на них
+   внешние ключи удаляются, последовательности id остаются у новых таблиц.
+2. Создаются секционированные таблицы с датой сообщения в ключах, секции всех
+   месяцев с данными, PARTITION_MONTHS_AHEAD месяцев вперед и секции по умолчанию.
+3. Данные копируются по месяцам, каждый месяц - отдельная транзакция
+   (ON CONFLICT DO NOTHING: прерванную миграцию можно запустить снова).
+4. reaction_counts и download_jobs получают дату сообщения и составные внешние
+   ключи, старые таблицы удаляются.
+"""
+from datetime import datetime
+from sqlalchemy import text
+from config import config
+from ..partitions import (
+    PARTITIONED_TABLES, add_months, create_default_partitions, create_month_partitions,
+    create_partitions, next_month
+)
+
+VERSION = 10
+DESCRIPTION = "Помесячное секционирование сообщений, вложений и реакций"
+TRANSACTIONAL = False
+
+OLD_SUFFIX = "_unpartitioned"
+
+
+def upgrade(engine):
+    with engine.begin() as connection:
+        if not _is_partitioned(connection, "messages"):
+            _replace_tables(connection)
+
+    # Секции только для месяцев с сообщениями и для ближайших месяцев
+    with engine.begin() as connection:
+        months = list(connection.execute(text(
+            f"SELECT DISTINCT date_trunc('month', message_date) FROM messages{OLD_SUFFIX} ORDER BY 1"
+        )).scalars()) if _exists(connection, f"messages{OLD_SUFFIX}") else []
+        now = datetime.utcnow()
+        create_partitions(connection, months)
+        create_month_partitions(connection, now, add_months(now, config.PARTITION_MONTHS_AHEAD))
+
+    for month in months:
+        with engine.begin() as connection:
+            _copy_month(connection, month, next_month(month))
+
+    with engine.begin() as connection:
+        if _exists(connection, f"messages{OLD_SUFFIX}"):
+            _finish(connection)
+
+
+def _exists(connection, table: str) -> bool:
+    """Проверка существования таблицы"""
+    return connection.execute(text("SELECT to_regclass(:table) IS NOT NULL"), {"table": table}).scalar()
+
+
+def _is_partitioned(connection, table: str) -> bool:
+    """Таблица уже секционирована"""
+    return connection.execute(
+        text("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(:table)"), {"table": table}
+    ).scalar()
+
+
+def _replace_tables(connection):
+    """Переименование старых таблиц и создание секционированных"""
+    connection.execute(text(
+        "LOCK TABLE messages, documents, reactions, reaction_counts, download_jobs IN ACCESS EXCLUSIVE MODE"
+    ))
+    for table, constraint in (("documents", "documents_message_id_fkey"),
+                              ("reactions", "reactions_message_id_fkey"),
+                              ("reaction_counts", "reaction_counts_message_id_fkey"),
+                              ("download_jobs", "download_jobs_document_id_fkey")):
+        connection.execute(text(f"ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {constraint}"))
+
+    for table in PARTITIONED_TABLES:
+        connection.execute(text(f"ALTER TABLE {table} RENAME TO {table}{OLD_SUFFIX}"))
+        # Имена индексов и ограничений освобождаются для новых таблиц
+        for (index,) in connection.execute(text(
+            "SELECT indexname FROM pg_indexes WHERE schemaname = current_schema() AND tablename = :table"
+        ), {"table": f"{table}{OLD_SUFFIX}"}).all():
+            connection.execute(text(f"ALTER INDEX {index} RENAME TO {index}{OLD_SUFFIX}"))
+        connection.execute(text(f"ALTER SEQUENCE {table}_id_seq OWNED BY NONE"))
+
+    server_version = int(connection.execute(text("SHOW server_version_num")).scalar())
+    nulls = " NULLS NOT DISTINCT" if server_version >= 150000 else ""
+
+    connection.execute(text("""
+        CREATE TABLE messages (
+            id BIGINT NOT NULL DEFAULT nextval('messages_id_seq'),
+            message_id BIGINT NOT NULL,
+            chat_id BIGINT NOT NULL REFERENCES chats (id),
+            user_id BIGINT REFERENCES users (id),
+            text TEXT,
+            message_date TIMESTAMP NOT NULL,
+            edited_date TIMESTAMP,
+            created_at TIMESTAMP,
+            PRIMARY KEY (id, message_date),
+            CONSTRAINT uq_messages_chat_message UNIQUE (chat_id, message_id, message_date)
+        ) PARTITION BY RANGE (message_date)
+    """))
+    connection.execute(text("CREATE INDEX ix_messages_chat_date ON messages (chat_id, message_date)"))
+
+    connection.execute(text("""
+        CREATE TABLE documents (
+            id BIGINT NOT NULL DEFAULT nextval('documents_id_seq'),
+            message_id BIGINT NOT NULL,
+            message_date TIMESTAMP NOT NULL,
+            file_id VARCHAR(255) NOT NULL,
+            file_unique_id VARCHAR(255),
+            file_name VARCHAR(255),
+            mime_type VARCHAR(100),
+            file_size BIGINT,
+            document_type VARCHAR(50),
+            file_path VARCHAR(500),
+            download_policy VARCHAR(10),
+            created_at TIMESTAMP,
+            PRIMARY KEY (id, message_date),
+            FOREIGN KEY (message_id, message_date) REFERENCES messages (id, message_date)
+        ) PARTITION BY RANGE (message_date)
+    """))
+    connection.execute(text("CREATE INDEX ix_documents_message_id ON documents (message_id)"))
+    connection.execute(text(
+        "CREATE UNIQUE INDEX uq_documents_message_unique_id ON documents (message_id, file_unique_id, message_date)"
+    ))
+    connection.execute(text(
+        "CREATE INDEX ix_documents_unique_id_pending ON documents (file_unique_id) WHERE file_path IS NULL"
+    ))
+
+    connection.execute(text("""
+        CREATE TABLE reactions (
+            id BIGINT NOT NULL DEFAULT nextval('reactions_id_seq'),
+            message_id BIGINT NOT NULL,
+            message_date TIMESTAMP NOT NULL,
+            emoji VARCHAR(50),
+            user_id BIGINT,
+            created_at TIMESTAMP,
+            PRIMARY KEY (id, message_date),
+            FOREIGN KEY (message_id, message_date) REFERENCES messages (id, message_date)
+        ) PARTITION BY RANGE (message_date)
+    """))
+    connection.execute(text(
+        f"CREATE UNIQUE INDEX uq_reactions_message_user_emoji ON reactions "
+        f"(message_id, user_id, emoji, message_date){nulls}"
+    ))
+
+    for table in PARTITIONED_TABLES:
+        connection.execute(text(f"ALTER SEQUENCE {table}_id_seq OWNED BY {table}.id"))
+    create_default_partitions(connection)
+
+    connection.execute(text("ALTER TABLE reaction_counts ADD COLUMN IF NOT EXISTS message_date TIMESTAMP"))
+    connection.execute(text("ALTER TABLE download_jobs ADD COLUMN IF NOT EXISTS message_date TIMESTAMP"))
+
+
+def _copy_month(connection, start: datetime, end: datetime):
+    """Перенос сообщений месяца вместе с их вложениями и реакциями"""
+    params = {"start": start, "end": end}
+    connection.execute(text(f"""
+        INSERT INTO messages (id, message_id, chat_id, user_id, text, message_date, edited_date, created_at)
+        SELECT id, message_id, chat_id, user_id, text, message_date, edited_date, created_at
+        FROM messages{OLD_SUFFIX}
+        WHERE message_date >= :start AND message_date < :end
+        ON CONFLICT DO NOTHING
+    """), params)
+    connection.execute(text(f"""
+        INSERT INTO documents (id, message_id, message_date, file_id, file_unique_id, file_name, mime_type,
+                               file_size, document_type, file_path, download_policy, created_at)
+        SELECT d.id, d.message_id, m.message_date, d.file_id, d.file_unique_id, d.file_name, d.mime_type,
+               d.file_size, d.document_type, d.file_path, d.download_policy, d.created_at
+        FROM documents{OLD_SUFFIX} d
+        JOIN messages{OLD_SUFFIX} m ON m.id = d.message_id
+        WHERE m.message_date >= :start AND m.message_date < :end
+        ON CONFLICT DO NOTHING
+    """), params)
+    connection.execute(text(f"""
+        INSERT INTO reactions (id, message_id, message_date, emoji, user_id, created_at)
+        SELECT r.id, r.message_id, m.message_date, r.emoji, r.user_id, r.created_at
+        FROM reactions{OLD_SUFFIX} r
+        JOIN messages{OLD_SUFFIX} m ON m.id = r.message_id
+        WHERE m.message_date >= :start AND m.message_date < :end
+        ON CONFLICT DO NOTHING
+    """), params)
+
+
+def _finish(connection):
+    """Составные внешние ключи reaction_counts и download_jobs, удаление старых таблиц"""
+    connection.execute(text("""
+        UPDATE reaction_counts c SET message_date = m.message_date
+        FROM messages m WHERE m.id = c.message_id AND c.message_date IS NULL
+    """))
+    connection.execute(text("DELETE FROM reaction_counts WHERE message_date IS NULL"))
+    connection.execute(text("ALTER TABLE reaction_counts ALTER COLUMN message_date SET NOT NULL"))
+    connection.execute(text("""
+        ALTER TABLE reaction_counts ADD CONSTRAINT reaction_counts_message_fkey
+        FOREIGN KEY (message_id, message_date) REFERENCES messages (id, message_date) ON DELETE CASCADE
+    """))
+
+    connection.execute(text("""
+        UPDATE download_jobs j SET message_date = d.message_date
+        FROM documents d WHERE d.id = j.document_id AND j.message_date IS NULL
+    """))
+    connection.execute(text("DELETE FROM download_jobs WHERE message_date IS NULL"))
+    connection.execute(text("ALTER TABLE download_jobs ALTER COLUMN message_date SET NOT NULL"))
+    connection.execute(text("""
+        ALTER TABLE download_jobs ADD CONSTRAINT download_jobs_document_fkey
+        FOREIGN KEY (document_id, message_date) REFERENCES documents (id, message_date) ON DELETE CASCADE
+    """))
+
+    for table in reversed(PARTITIONED_TABLES):
+        connection.execute(text(f"DROP TABLE {table}{OLD_SUFFIX}"))
@@ -0,0 +1,46 @@
+"""
+Полнотекстовый поиск по тексту сообщений
+
+Колонка messages.text_search (tsvector по конфигурациям russian и english)
+заполняется триггером при вставке и изменении текста, существующие строки -
+пакетами. GIN-индекс строится конкурентно по секциям.
+"""
+from sqlalchemy import text
+from .helpers import backfill_in_batches, create_partitioned_index
+
+VERSION = 11
+DESCRIPTION = "Полнотекстовый поиск по сообщениям"
+TRANSACTIONAL = False
+
+
+def upgrade(engine):
+    with engine.begin() as connection:
+        connection.execute(text("""
+            CREATE OR REPLACE FUNCTION messages_text_search_vector(value text) RETURNS tsvector
+            LANGUAGE sql IMMUTABLE AS $$
+                SELECT to_tsvector('russian', coalesce(value, ''))
+                    || to_tsvector('english', coalesce(value, ''))
+            $$
+        """))
+        connection.execute(text("ALTER TABLE messages ADD COLUMN IF NOT EXISTS text_search tsvector"))
+        connection.execute(text("""
+            CREATE OR REPLACE FUNCTION messages_text_search_update() RETURNS trigger
+            LANGUAGE plpgsql AS $$
+            BEGIN
+                NEW.text_search := messages_text_search_vector(NEW.text);
+                RETURN NEW;
+            END
+            $$
+        """))
+        connection.execute(text("DROP TRIGGER IF EXISTS messages_text_search ON messages"))
+        connection.execute(text("""
+            CREATE TRIGGER messages_text_search
+            BEFORE INSERT OR UPDATE OF text ON messages
+            FOR EACH ROW EXECUTE FUNCTION messages_text_search_update()
+        """))
+
+    backfill_in_batches(
+        engine, "messages", "text_search = messages_text_search_vector(text)",
+        "text IS NOT NULL AND text_search IS NULL"
+    )
+    create_partitioned_index(engine, "ix_messages_text_search", "messages", "USING gin (text_search)")
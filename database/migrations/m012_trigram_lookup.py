@@ -0,0 +1,53 @@
+"""
+Нечеткий поиск чатов, пользователей и файлов по триграммам (pg_trgm)
+
+- chats.title, имя пользователя (users_search_name: username, first_name,
+  last_name) и documents.file_name: GIN-индексы gin_trgm_ops
+- messages (user_id, message_date): последняя активность пользователя для
+  ранжирования результатов
+
+Расширение pg_trgm доверенное (PostgreSQL 13+), его может создать владелец БД.
+Если расширение не установлено на сервере (пакет postgresql-contrib), триграммные
+индексы пропускаются с предупреждением: запуск бота не блокируется, а миграцию
+можно применить повторно после установки (она идемпотентна).
+"""
+import logging
+from sqlalchemy import text
+from .helpers import create_index_concurrently, create_partitioned_index
+
+logger = logging.getLogger(__name__)
+
+VERSION = 12
+DESCRIPTION = "Триграммные индексы для поиска чатов, пользователей и файлов"
+TRANSACTIONAL = False
+
+
+def upgrade(engine):
+    with engine.begin() as connection:
+        connection.execute(text("""
+            CREATE OR REPLACE FUNCTION users_search_name(username text, first_name text, last_name text)
+            RETURNS text LANGUAGE sql IMMUTABLE AS $$
+                SELECT coalesce(username, '') || ' ' || coalesce(first_name, '') || ' ' || coalesce(last_name, '')
+            $$
+        """))
+    create_partitioned_index(engine, "ix_messages_user_date", "messages", "(user_id, message_date)")
+
+    with engine.begin() as connection:
+        available = connection.execute(
+            text("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        ).first() is not None
+        if not available:
+            logger.warning(
+                "Расширение pg_trgm не установлено на сервере PostgreSQL: триграммные индексы "
+                "не созданы, /find_chat, /find_user и /find_file недоступны"
+            )
+            return
+        connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+
+    create_index_concurrently(engine, "ix_chats_title_trgm", "chats", "USING gin (title gin_trgm_ops)")
+    create_index_concurrently(
+        engine, "ix_users_search_name_trgm", "users",
+        "USING gin (users_search_name(username, first_name, last_name) gin_trgm_ops)"
+    )
+    create_partitioned_index(engine, "ix_documents_file_name_trgm", "documents",
+                             "USING gin (file_name gin_trgm_ops)")
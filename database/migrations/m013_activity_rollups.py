@@ -0,0 +1,87 @@
+"""
+Счетчики активности по дням: chat_activity_daily и user_activity_daily
+
+Сообщения, правки, вложения, объем сохраненных файлов и реакции по чату (и по
+пользователю в чате) за день сообщения. Дальше счетчики поддерживаются при записи;
+здесь заполняются по существующим данным. Для истории до миграции правки считаются
+как число отредактированных сообщений: промежуточные правки в БД не сохранялись.
+"""
+from sqlalchemy import text
+
+VERSION = 13
+DESCRIPTION = "Счетчики активности чатов и пользователей по дням"
+TRANSACTIONAL = True
+
+ACTIVITY_COLUMNS = """
+    messages BIGINT NOT NULL DEFAULT 0,
+    edits BIGINT NOT NULL DEFAULT 0,
+    media BIGINT NOT NULL DEFAULT 0,
+    bytes_downloaded BIGINT NOT NULL DEFAULT 0,
+    reactions BIGINT NOT NULL DEFAULT 0
+"""
+
+SUMS = "sum(messages), sum(edits), sum(media), sum(bytes_downloaded), sum(reactions)"
+
+UPDATE_SET = """
+    messages = excluded.messages, edits = excluded.edits, media = excluded.media,
+    bytes_downloaded = excluded.bytes_downloaded, reactions = excluded.reactions
+"""
+
+
+def upgrade(connection):
+    connection.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS chat_activity_daily (
+            chat_id BIGINT NOT NULL,
+            day DATE NOT NULL,
+            {ACTIVITY_COLUMNS},
+            PRIMARY KEY (chat_id, day)
+        )
+    """))
+    connection.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS user_activity_daily (
+            chat_id BIGINT NOT NULL,
+            day DATE NOT NULL,
+            user_id BIGINT NOT NULL,
+            {ACTIVITY_COLUMNS},
+            PRIMARY KEY (chat_id, day, user_id)
+        )
+    """))
+
+    # Блокируем запись, чтобы счетчики совпали с таблицами
+    connection.execute(text("LOCK TABLE messages, documents, reactions IN SHARE MODE"))
+    connection.execute(text("""
+        CREATE TEMPORARY TABLE activity_backfill ON COMMIT DROP AS
+        SELECT chat_id, user_id, day, sum(messages) AS messages, sum(edits) AS edits, sum(media) AS media,
+               sum(bytes_downloaded) AS bytes_downloaded, sum(reactions) AS reactions
+        FROM (
+            SELECT chat_id, user_id, message_date::date AS day, count(*) AS messages,
+                   count(edited_date) AS edits, 0 AS media, 0 AS bytes_downloaded, 0 AS reactions
+            FROM messages
+            GROUP BY 1, 2, 3
+            UNION ALL
+            SELECT m.chat_id, m.user_id, m.message_date::date, 0, 0, count(*),
+                   coalesce(sum(d.file_size) FILTER (WHERE d.file_path IS NOT NULL), 0), 0
+            FROM documents d
+            JOIN messages m ON m.id = d.message_id AND m.message_date = d.message_date
+            GROUP BY 1, 2, 3
+            UNION ALL
+            SELECT m.chat_id, r.user_id, m.message_date::date, 0, 0, 0, 0, count(*)
+            FROM reactions r
+            JOIN messages m ON m.id = r.message_id AND m.message_date = r.message_date
+            GROUP BY 1, 2, 3
+        ) activity
+        GROUP BY chat_id, user_id, day
+    """))
+    connection.execute(text(f"""
+        INSERT INTO chat_activity_daily (chat_id, day, messages, edits, media, bytes_downloaded, reactions)
+        SELECT chat_id, day, {SUMS} FROM activity_backfill
+        GROUP BY chat_id, day
+        ON CONFLICT (chat_id, day) DO UPDATE SET {UPDATE_SET}
+    """))
+    connection.execute(text(f"""
+        INSERT INTO user_activity_daily (chat_id, day, user_id, messages, edits, media, bytes_downloaded, reactions)
+        SELECT chat_id, day, user_id, {SUMS} FROM activity_backfill
+        WHERE user_id IS NOT NULL
+        GROUP BY chat_id, day, user_id
+        ON CONFLICT (chat_id, day, user_id) DO UPDATE SET {UPDATE_SET}
+    """))
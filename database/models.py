@@ -1,9 +1,11 @@
 """
 SQLAlchemy модели для базы данных
 """
-from sqlalchemy import Column, Integer, String, DateTime, Text, ForeignKey, BigInteger
+from sqlalchemy import (Column, String, Date, DateTime, Text, ForeignKey, ForeignKeyConstraint, BigInteger, Integer,
+                        UniqueConstraint, Index, text)
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.orm import relationship, deferred
 from datetime import datetime
 
 Base = declarative_base()
@@ -12,6 +14,12 @@ Base = declarative_base()
 class User(Base):
     """Модель пользователя Telegram"""
     __tablename__ = 'users'
+    __table_args__ = (
+        # Нечеткий поиск по имени (см. миграцию m012_trigram_lookup)
+        Index('ix_users_search_name_trgm',
+              text("users_search_name(username, first_name, last_name) gin_trgm_ops"),
+              postgresql_using='gin'),
+    )
     
     id = Column(BigInteger, primary_key=True)  # Telegram user ID
     username = Column(String(255), nullable=True)
@@ -26,6 +34,9 @@ class User(Base):
 class Chat(Base):
     """Модель чата/группы Telegram"""
     __tablename__ = 'chats'
+    __table_args__ = (
+        Index('ix_chats_title_trgm', 'title', postgresql_using='gin', postgresql_ops={'title': 'gin_trgm_ops'}),
+    )
     
     id = Column(BigInteger, primary_key=True)  # Telegram chat ID
     title = Column(String(255), nullable=True)
@@ -37,31 +48,60 @@ class Chat(Base):
 
 
 class Message(Base):
-    """Модель сообщения из Telegram"""
+    """
+    Модель сообщения из Telegram
+    
+    Таблица секционирована по месяцам message_date (см. database/partitions.py),
+    поэтому дата входит в первичный и уникальный ключи. Дата сообщения в Telegram
+    не меняется, и повторы одного сообщения попадают в ту же секцию.
+    """
     __tablename__ = 'messages'
+    __table_args__ = (
+        # Одно сообщение Telegram - одна запись (ключ для INSERT ... ON CONFLICT)
+        UniqueConstraint('chat_id', 'message_id', 'message_date', name='uq_messages_chat_message'),
+        Index('ix_messages_chat_date', 'chat_id', 'message_date'),
+        # Полнотекстовый поиск (см. миграцию m011_message_search)
+        Index('ix_messages_text_search', 'text_search', postgresql_using='gin'),
+        # Последняя активность пользователя
+        Index('ix_messages_user_date', 'user_id', 'message_date'),
+        {'postgresql_partition_by': 'RANGE (message_date)'},
+    )
     
-    id = Column(Integer, primary_key=True, autoincrement=True)
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
     message_id = Column(BigInteger, nullable=False)  # ID сообщения в Telegram
     chat_id = Column(BigInteger, ForeignKey('chats.id'), nullable=False)
     user_id = Column(BigInteger, ForeignKey('users.id'), nullable=True)
     text = Column(Text, nullable=True)
-    message_date = Column(DateTime, nullable=False)
+    message_date = Column(DateTime, primary_key=True)  # Ключ секционирования
     edited_date = Column(DateTime, nullable=True)  # Дата последнего редактирования
     created_at = Column(DateTime, default=datetime.utcnow)
+    # Поисковый вектор по тексту (russian + english), заполняется триггером в БД
+    text_search = deferred(Column(TSVECTOR, nullable=True))
     
     # Связи
     chat = relationship("Chat", back_populates="messages")
     user = relationship("User", back_populates="messages")
     reactions = relationship("Reaction", back_populates="message", cascade="all, delete-orphan")
+    reaction_counts = relationship("ReactionCount", back_populates="message",
+                                   cascade="all, delete-orphan", passive_deletes=True,
+                                   order_by="(ReactionCount.count.desc(), ReactionCount.emoji)")
     documents = relationship("Document", back_populates="message", cascade="all, delete-orphan")
 
 
 class Reaction(Base):
-    """Модель реакции на сообщение"""
+    """Модель реакции на сообщение (секционирована по дате сообщения)"""
     __tablename__ = 'reactions'
+    __table_args__ = (
+        ForeignKeyConstraint(['message_id', 'message_date'], ['messages.id', 'messages.message_date']),
+        # Одна реакция пользователя каждым эмодзи (ключ для ON CONFLICT DO NOTHING)
+        Index('uq_reactions_message_user_emoji', 'message_id', 'user_id', 'emoji', 'message_date',
+              unique=True, postgresql_nulls_not_distinct=True),
+        {'postgresql_partition_by': 'RANGE (message_date)'},
+    )
     
-    id = Column(Integer, primary_key=True, autoincrement=True)
-    message_id = Column(Integer, ForeignKey('messages.id'), nullable=False)
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    message_id = Column(BigInteger, nullable=False)
+    message_date = Column(DateTime, primary_key=True)  # Дата сообщения, ключ секционирования
     emoji = Column(String(50), nullable=True)
     user_id = Column(BigInteger, nullable=True)  # Кто поставил реакцию
     created_at = Column(DateTime, default=datetime.utcnow)
@@ -70,21 +110,136 @@ class Reaction(Base):
     message = relationship("Message", back_populates="reactions")
 
 
+class ReactionCount(Base):
+    """Количество реакций каждого эмодзи на сообщение (поддерживается при записи реакций)"""
+    __tablename__ = 'reaction_counts'
+    __table_args__ = (
+        ForeignKeyConstraint(['message_id', 'message_date'], ['messages.id', 'messages.message_date'],
+                             ondelete='CASCADE'),
+    )
+    
+    message_id = Column(BigInteger, primary_key=True)
+    emoji = Column(String(50), primary_key=True)
+    message_date = Column(DateTime, nullable=False)  # Дата сообщения (для ссылки на секцию)
+    count = Column(Integer, nullable=False, default=0)
+    
+    # Связи
+    message = relationship("Message", back_populates="reaction_counts")
+
+
 class Document(Base):
-    """Модель документа/файла, прикрепленного к сообщению"""
+    """Модель документа/файла, прикрепленного к сообщению (секционирована по дате сообщения)"""
     __tablename__ = 'documents'
+    __table_args__ = (
+        ForeignKeyConstraint(['message_id', 'message_date'], ['messages.id', 'messages.message_date']),
+        Index('ix_documents_message_id', 'message_id'),
+        # Вложение сообщения записывается один раз (повтор операций из журнала)
+        Index('uq_documents_message_unique_id', 'message_id', 'file_unique_id', 'message_date', unique=True),
+        # Документы, ожидающие скачивания файла (привязка к скачанному файлу)
+        Index('ix_documents_unique_id_pending', 'file_unique_id',
+              postgresql_where=text("file_path IS NULL")),
+        Index('ix_documents_file_name_trgm', 'file_name', postgresql_using='gin',
+              postgresql_ops={'file_name': 'gin_trgm_ops'}),
+        {'postgresql_partition_by': 'RANGE (message_date)'},
+    )
     
-    id = Column(Integer, primary_key=True, autoincrement=True)
-    message_id = Column(Integer, ForeignKey('messages.id'), nullable=False)
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    message_id = Column(BigInteger, nullable=False)
+    message_date = Column(DateTime, primary_key=True)  # Дата сообщения, ключ секционирования
     file_id = Column(String(255), nullable=False)  # Telegram file_id
     file_unique_id = Column(String(255), nullable=True)
     file_name = Column(String(255), nullable=True)
     mime_type = Column(String(100), nullable=True)
-    file_size = Column(Integer, nullable=True)
+    file_size = Column(BigInteger, nullable=True)
     document_type = Column(String(50), nullable=True)  # 'photo', 'document', 'video', 'audio', 'voice', 'sticker'
     file_path = Column(String(500), nullable=True)  # Локальный путь к скачанному файлу
+    download_policy = Column(String(10), nullable=True)  # 'eager', 'lazy', 'never' (None - eager)
     created_at = Column(DateTime, default=datetime.utcnow)
     
     # Связи
     message = relationship("Message", back_populates="documents")
+    download_job = relationship("DownloadJob", back_populates="document", uselist=False,
+                                cascade="all, delete-orphan")
+
+
+class DownloadJob(Base):
+    """Задание на скачивание файла документа (постоянная очередь загрузок)"""
+    __tablename__ = 'download_jobs'
+    __table_args__ = (
+        # Порядок выборки заданий: приоритет типа, затем меньшие файлы
+        Index('ix_download_jobs_queue', 'priority', 'file_size', 'id',
+              postgresql_where=text("status <> 'failed'")),
+        Index('ix_download_jobs_file_unique_id', 'file_unique_id'),
+        ForeignKeyConstraint(['document_id', 'message_date'], ['documents.id', 'documents.message_date'],
+                             ondelete='CASCADE'),
+    )
+    
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    document_id = Column(BigInteger, nullable=False, unique=True)
+    message_date = Column(DateTime, nullable=False)  # Дата сообщения документа (для ссылки на секцию)
+    chat_id = Column(BigInteger, nullable=False)
+    file_id = Column(String(255), nullable=False)  # Telegram file_id
+    file_unique_id = Column(String(255), nullable=True)
+    file_size = Column(BigInteger, nullable=True)
+    priority = Column(Integer, nullable=False, default=0)  # Меньше - раньше
+    status = Column(String(20), nullable=False, default='pending')  # 'pending', 'running', 'failed'
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    locked_at = Column(DateTime, nullable=True)  # Когда задание взято в работу
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    # Связи
+    document = relationship("Document", back_populates="download_job")
+
+
+
+class MediaBlob(Base):
+    """Скачанный файл в хранилище, адресуемом по file_unique_id"""
+    __tablename__ = 'media_blobs'
+    __table_args__ = (
+        Index('ix_media_blobs_sha256', 'sha256'),
+    )
+    
+    file_unique_id = Column(String(255), primary_key=True)  # Telegram file_unique_id
+    file_path = Column(String(500), nullable=False)  # Локальный путь к файлу
+    file_size = Column(BigInteger, nullable=True)
+    sha256 = Column(String(64), nullable=True)  # Хэш содержимого
+    ref_count = Column(Integer, nullable=False, default=0)  # Сколько документов ссылается на файл
+    created_at = Column(DateTime, default=datetime.utcnow)
+
 
+class ChatActivityDaily(Base):
+    """
+    Счетчики активности чата за день (UTC) сообщений
+    
+    Поддерживаются при записи вместе с данными (см. SessionOperations._update_activity)
+    и не уменьшаются при переносе сообщений в архив.
+    """
+    __tablename__ = 'chat_activity_daily'
+    
+    chat_id = Column(BigInteger, primary_key=True)
+    day = Column(Date, primary_key=True)  # День сообщения
+    messages = Column(BigInteger, nullable=False, default=0, server_default='0')
+    edits = Column(BigInteger, nullable=False, default=0, server_default='0')
+    media = Column(BigInteger, nullable=False, default=0, server_default='0')  # Вложений
+    bytes_downloaded = Column(BigInteger, nullable=False, default=0, server_default='0')  # Объем сохраненных файлов
+    reactions = Column(BigInteger, nullable=False, default=0, server_default='0')  # Реакций (с учетом снятых)
+
+
+class UserActivityDaily(Base):
+    """
+    Счетчики активности пользователя в чате за день (UTC) сообщений
+    
+    Сообщения, правки и вложения считаются автору сообщения, реакции - поставившему их.
+    """
+    __tablename__ = 'user_activity_daily'
+    
+    chat_id = Column(BigInteger, primary_key=True)
+    day = Column(Date, primary_key=True)
+    user_id = Column(BigInteger, primary_key=True)
+    messages = Column(BigInteger, nullable=False, default=0, server_default='0')
+    edits = Column(BigInteger, nullable=False, default=0, server_default='0')
+    media = Column(BigInteger, nullable=False, default=0, server_default='0')
+    bytes_downloaded = Column(BigInteger, nullable=False, default=0, server_default='0')
+    reactions = Column(BigInteger, nullable=False, default=0, server_default='0')
@@ -0,0 +1,1428 @@
+"""
+Операции с БД в рамках сессии, общие для синхронного и асинхронного менеджеров
+"""
+import logging
+import os
+from collections import Counter
+from sqlalchemy import (text, tuple_, case, false, func, literal, literal_column, select, update, delete, or_, and_,
+                        not_)
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session, joinedload, selectinload, with_loader_criteria
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, List, Tuple
+from config import config
+from .identity_cache import IdentityCache
+from .partitions import add_months, create_month_partitions, drop_empty_partitions
+from .models import (User, Chat, Message, Reaction, ReactionCount, Document, DownloadJob, MediaBlob,
+                     ChatActivityDaily, UserActivityDaily)
+
+logger = logging.getLogger(__name__)
+
+# Максимум строк в одном INSERT/SELECT (лимит параметров запроса у драйверов)
+BULK_CHUNK_SIZE = 1000
+
+# Приоритет заданий на скачивание по запросу администратора (раньше всех остальных)
+ON_DEMAND_PRIORITY = -1
+
+# Счетчики активности по дням (chat_activity_daily, user_activity_daily)
+ACTIVITY_FIELDS = ('messages', 'edits', 'media', 'bytes_downloaded', 'reactions')
+
+# Конфигурации полнотекстового поиска (как в messages_text_search_vector, миграция m011)
+SEARCH_CONFIGS = ('russian', 'english')
+
+# Маркеры найденных слов во фрагменте результата поиска
+HIGHLIGHT_START = '\x02'
+HIGHLIGHT_STOP = '\x03'
+SEARCH_HEADLINE_OPTIONS = (
+    f'StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_STOP}, MaxWords=35, MinWords=15'
+)
+
+# Ранжирование нечеткого поиска (find_chats, find_users, find_files): к сходству
+# строки добавляется до FIND_RECENCY_WEIGHT за недавнюю активность; бонус вдвое
+# меньше, если последняя активность была FIND_RECENCY_DAYS дней назад
+FIND_RECENCY_WEIGHT = 0.3
+FIND_RECENCY_DAYS = 30
+
+
+class SessionOperations:
+    """
+    Операции записи и чтения, выполняемые на синхронной сессии SQLAlchemy
+
+    DatabaseManager вызывает их напрямую, AsyncDatabaseManager - через
+    AsyncSession.run_sync, поэтому логика сохранения существует в одном экземпляре.
+    """
+    
+    def _init_identity_caches(self):
+        """Создание кэшей последних записанных данных пользователей и чатов"""
+        self.user_cache = IdentityCache(config.IDENTITY_CACHE_SIZE, config.IDENTITY_CACHE_TTL)
+        self.chat_cache = IdentityCache(config.IDENTITY_CACHE_SIZE, config.IDENTITY_CACHE_TTL)
+    
+    def get_cache_stats(self) -> dict:
+        """Счетчики попаданий и промахов кэшей пользователей и чатов"""
+        return {
+            'users': self.user_cache.stats(),
+            'chats': self.chat_cache.stats()
+        }
+    
+    @staticmethod
+    def _stage_identity(session: Session, cache: IdentityCache, key: int, values: Tuple):
+        """Запоминание записанных значений до фиксации транзакции"""
+        session.info.setdefault('identity_updates', []).append((cache, key, values))
+    
+    @staticmethod
+    def _commit_identities(session: Session):
+        """Перенос записанных значений в кэш после успешной фиксации транзакции"""
+        for cache, key, values in session.info.pop('identity_updates', []):
+            cache.put(key, values)
+    
+    @staticmethod
+    def _discard_identities(session: Session):
+        """Сброс запомненных значений после отката транзакции"""
+        session.info.pop('identity_updates', None)
+    
+    @staticmethod
+    def _identity_unchanged(cache: IdentityCache, key: int, values: Tuple) -> bool:
+        """Проверка, что запись в БД не изменит последние записанные значения"""
+        cached = cache.get(key)
+        if cached is None:
+            return False
+        # Пустые значения не перезаписывают сохраненные (как в _apply_user/_apply_chat)
+        return all(not value or value == old for value, old in zip(values, cached))
+    
+    @staticmethod
+    def _to_naive_utc(value: datetime) -> datetime:
+        """Приведение даты к UTC без timezone info"""
+        if value is not None and value.tzinfo is not None:
+            return value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
+    
+    def _apply_user(self, session: Session, user_id: int, username: str = None,
+                    first_name: str = None, last_name: str = None) -> User:
+        """Создание или обновление пользователя в рамках сессии (один INSERT ... ON CONFLICT)"""
+        return self._upsert_users(session, [{
+            'id': user_id,
+            'username': username,
+            'first_name': first_name,
+            'last_name': last_name
+        }])[0]
+    
+    def _upsert_users(self, session: Session, rows: List[dict]) -> List[User]:
+        """
+        Пакетный upsert пользователей
+        
+        Пустые значения не перезаписывают сохраненные. Записанные значения
+        запоминаются для кэша пользователей.
+        """
+        users = []
+        for chunk in self._chunks(rows):
+            stmt = pg_insert(User).values(chunk)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[User.id],
+                set_={
+                    'username': func.coalesce(func.nullif(stmt.excluded.username, ''), User.username),
+                    'first_name': func.coalesce(func.nullif(stmt.excluded.first_name, ''), User.first_name),
+                    'last_name': func.coalesce(func.nullif(stmt.excluded.last_name, ''), User.last_name)
+                }
+            ).returning(User)
+            for user in session.scalars(stmt, execution_options={'populate_existing': True}):
+                self._stage_identity(session, self.user_cache, user.id,
+                                     (user.username, user.first_name, user.last_name))
+                users.append(user)
+        return users
+    
+    def _apply_chat(self, session: Session, chat_id: int, title: str = None,
+                    chat_type: str = None) -> Chat:
+        """Создание или обновление чата в рамках сессии (с учетом group -> supergroup)"""
+        stmt = pg_insert(Chat).values(id=chat_id, title=title, chat_type=chat_type)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Chat.id],
+            set_={
+                'title': func.coalesce(func.nullif(stmt.excluded.title, ''), Chat.title),
+                'chat_type': func.coalesce(func.nullif(stmt.excluded.chat_type, ''), Chat.chat_type)
+            }
+        ).returning(Chat, literal_column('xmax = 0').label('inserted'))
+        chat, inserted = session.execute(
+            stmt, execution_options={'populate_existing': True}
+        ).one()
+        
+        # Новая supergroup могла появиться из group с таким же названием:
+        # переносим сообщения, задания на скачивание и счетчики активности старого чата
+        # и удаляем его
+        if inserted and title and chat_type == 'supergroup':
+            existing_group = session.query(Chat).filter(
+                Chat.title == title,
+                Chat.chat_type == 'group',
+                Chat.id != chat_id
+            ).first()
+            
+            if existing_group:
+                old_chat_id = existing_group.id
+                # Старый ID больше не существует в БД
+                self.chat_cache.invalidate(old_chat_id)
+                
+                session.execute(
+                    text("UPDATE messages SET chat_id = :new_id WHERE chat_id = :old_id"),
+                    {"new_id": chat_id, "old_id": old_chat_id}
+                )
+                session.execute(
+                    text("UPDATE download_jobs SET chat_id = :new_id WHERE chat_id = :old_id"),
+                    {"new_id": chat_id, "old_id": old_chat_id}
+                )
+                self._move_chat_activity(session, old_chat_id, chat_id)
+                # Сохраняем дату появления чата
+                session.execute(
+                    text("UPDATE chats SET created_at = :created_at WHERE id = :new_id"),
+                    {"created_at": existing_group.created_at, "new_id": chat_id}
+                )
+                session.delete(existing_group)
+                session.flush()
+                session.refresh(chat)
+        
+        self._stage_identity(session, self.chat_cache, chat_id, (chat.title, chat.chat_type))
+        return chat
+    
+    @staticmethod
+    def _move_chat_activity(session: Session, old_chat_id: int, new_chat_id: int):
+        """Перенос счетчиков активности в новый чат (group -> supergroup) со сложением по дням"""
+        counters = ", ".join(ACTIVITY_FIELDS)
+        for table, keys in (("chat_activity_daily", "day"), ("user_activity_daily", "day, user_id")):
+            added = ", ".join(f"{field} = {table}.{field} + excluded.{field}" for field in ACTIVITY_FIELDS)
+            session.execute(
+                text(f"""
+                    INSERT INTO {table} (chat_id, {keys}, {counters})
+                    SELECT :new_id, {keys}, {counters} FROM {table} WHERE chat_id = :old_id
+                    ON CONFLICT (chat_id, {keys}) DO UPDATE SET {added}
+                """),
+                {"new_id": new_chat_id, "old_id": old_chat_id}
+            )
+            session.execute(text(f"DELETE FROM {table} WHERE chat_id = :old_id"), {"old_id": old_chat_id})
+    
+    def _apply_message(self, session: Session, message_id: int, chat_id: int,
+                       user_id: int = None, text: str = None,
+                       message_date: datetime = None, edited_date: datetime = None) -> Message:
+        """Создание сообщения или применение правки в рамках сессии"""
+        refs = self._upsert_message_refs(session, [{
+            'message_id': message_id,
+            'chat_id': chat_id,
+            'user_id': user_id,
+            'text': text,
+            'message_date': message_date,
+            'edited_date': edited_date
+        }])
+        return session.get(Message, refs[(chat_id, message_id)], populate_existing=True)
+    
+    def _upsert_messages(self, session: Session, rows: List[dict]) -> Dict[Tuple[int, int], int]:
+        """
+        Пакетный upsert сообщений (см. _upsert_message_refs)
+        
+        Returns:
+            Словарь (chat_id, message_id) -> ID записи messages
+        """
+        return {key: ref[0] for key, ref in self._upsert_message_refs(session, rows).items()}
+    
+    def _upsert_message_refs(self, session: Session,
+                             rows: List[dict]) -> Dict[Tuple[int, int], Tuple[int, datetime]]:
+        """
+        Пакетный upsert сообщений по уникальному ключу (chat_id, message_id, message_date)
+        
+        Новые сообщения вставляются, у существующих при правке (edited_date задан)
+        обновляются текст (если передан) и дата редактирования, остальные повторы
+        не изменяют запись. Дата сообщения входит в ключ секционированной таблицы,
+        поэтому строка без даты получает дату уже записанного сообщения.
+        
+        Returns:
+            Словарь (chat_id, message_id) -> (ID записи messages, дата сообщения)
+        """
+        # Повторы одного сообщения в пакете сворачиваем в одну строку:
+        # ON CONFLICT не может изменить одну запись дважды в одном запросе
+        merged = {}
+        for row in rows:
+            key = (row['chat_id'], row['message_id'])
+            edited_date = self._to_naive_utc(row.get('edited_date'))
+            if key not in merged:
+                merged[key] = {
+                    'message_id': row['message_id'],
+                    'chat_id': row['chat_id'],
+                    'user_id': row.get('user_id'),
+                    'text': row.get('text'),
+                    # Убеждаемся, что даты в UTC и без timezone info
+                    'message_date': self._to_naive_utc(row.get('message_date')),
+                    'edited_date': edited_date
+                }
+            elif edited_date is not None:
+                # Правка: обновляем текст и дату редактирования
+                if row.get('text') is not None:
+                    merged[key]['text'] = row['text']
+                merged[key]['edited_date'] = edited_date
+        
+        undated = [key for key, row in merged.items() if row['message_date'] is None]
+        if undated:
+            for key, (_, message_date) in self._get_message_refs(session, undated).items():
+                merged[key]['message_date'] = message_date
+        # Общее время создания строк запроса отличает вставленные строки от
+        # измененных в RETURNING (xmax недоступен для секционированной таблицы)
+        created_at = datetime.utcnow()
+        for row in merged.values():
+            row['message_date'] = row['message_date'] or created_at
+            row['created_at'] = created_at
+        
+        refs = {}
+        activity = Counter()
+        for chunk in self._chunks(list(merged.values())):
+            stmt = pg_insert(Message).values(chunk)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[Message.chat_id, Message.message_id, Message.message_date],
+                set_={
+                    'text': func.coalesce(stmt.excluded.text, Message.text),
+                    'edited_date': stmt.excluded.edited_date
+                },
+                # Повтор той же правки (из журнала) запись не меняет
+                where=and_(
+                    stmt.excluded.edited_date.isnot(None),
+                    Message.edited_date.is_distinct_from(stmt.excluded.edited_date)
+                )
+            ).returning(Message.id, Message.chat_id, Message.message_id, Message.message_date,
+                        Message.user_id, Message.created_at)
+            for db_id, chat_id, message_id, message_date, user_id, row_created_at in session.execute(stmt):
+                refs[(chat_id, message_id)] = (db_id, message_date)
+                if row_created_at == created_at:
+                    activity[(chat_id, user_id, message_date.date(), 'messages')] += 1
+                if merged[(chat_id, message_id)]['edited_date'] is not None:
+                    activity[(chat_id, user_id, message_date.date(), 'edits')] += 1
+        self._update_activity(session, activity)
+        
+        # Повторы без правки не возвращаются из RETURNING - дочитываем их ID,
+        # условие на дату оставляет в запросе только секции нужных месяцев
+        missing = [
+            (chat_id, message_id, merged[(chat_id, message_id)]['message_date'])
+            for chat_id, message_id in set(merged) - set(refs)
+        ]
+        for chunk in self._chunks(missing):
+            for db_id, chat_id, message_id, message_date in session.execute(
+                select(Message.id, Message.chat_id, Message.message_id, Message.message_date).where(
+                    tuple_(Message.chat_id, Message.message_id, Message.message_date).in_(chunk)
+                )
+            ):
+                refs[(chat_id, message_id)] = (db_id, message_date)
+        return refs
+    
+    def _get_message_refs(self, session: Session, keys) -> Dict[Tuple[int, int], Tuple[int, datetime]]:
+        """Получение ID и дат записей messages по парам (chat_id, message_id)"""
+        refs = {}
+        for chunk in self._chunks(list(keys)):
+            for db_id, chat_id, message_id, message_date in session.execute(
+                select(Message.id, Message.chat_id, Message.message_id, Message.message_date)
+                .where(tuple_(Message.chat_id, Message.message_id).in_(chunk))
+            ):
+                refs[(chat_id, message_id)] = (db_id, message_date)
+        return refs
+    
+    def _get_message_dates(self, session: Session, message_db_ids) -> Dict[int, datetime]:
+        """Даты сообщений по ID записей messages (ключ секции вложений и реакций)"""
+        dates = {}
+        for chunk in self._chunks(list(set(message_db_ids))):
+            dates.update(session.execute(
+                select(Message.id, Message.message_date).where(Message.id.in_(chunk))
+            ).all())
+        return dates
+    
+    def _get_message_owners(self, session: Session, keys) -> Dict[Tuple[int, datetime], Tuple[int, int]]:
+        """Чат и автор сообщений по ключам (ID записи messages, дата сообщения)"""
+        owners = {}
+        for chunk in self._chunks(sorted(keys)):
+            for db_id, message_date, chat_id, user_id in session.execute(
+                select(Message.id, Message.message_date, Message.chat_id, Message.user_id)
+                .where(tuple_(Message.id, Message.message_date).in_(chunk))
+            ):
+                owners[(db_id, message_date)] = (chat_id, user_id)
+        return owners
+    
+    def _update_activity(self, session: Session, deltas: Counter):
+        """
+        Применение изменений счетчиков активности
+        
+        Args:
+            deltas: (chat_id, user_id, день, поле из ACTIVITY_FIELDS) -> +/-N;
+                user_id None - только в счетчиках чата
+        """
+        chat_rows = {}
+        user_rows = {}
+        for (chat_id, user_id, day, field), delta in deltas.items():
+            if not delta:
+                continue
+            chat_rows.setdefault((chat_id, day), Counter())[field] += delta
+            if user_id is not None:
+                user_rows.setdefault((chat_id, day, user_id), Counter())[field] += delta
+        self._upsert_activity(session, ChatActivityDaily, ('chat_id', 'day'), chat_rows)
+        self._upsert_activity(session, UserActivityDaily, ('chat_id', 'day', 'user_id'), user_rows)
+    
+    def _upsert_activity(self, session: Session, model, key_columns: Tuple[str, ...], rows: dict):
+        """Прибавление счетчиков к строкам активности (в порядке ключей - без взаимных блокировок)"""
+        values = [
+            dict(zip(key_columns, key), **{field: counts[field] for field in ACTIVITY_FIELDS})
+            for key, counts in sorted(rows.items())
+        ]
+        for chunk in self._chunks(values):
+            stmt = pg_insert(model).values(chunk)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=list(key_columns),
+                set_={field: getattr(model, field) + getattr(stmt.excluded, field) for field in ACTIVITY_FIELDS}
+            )
+            session.execute(stmt)
+    
+    @staticmethod
+    def _chunks(rows: list, size: int = BULK_CHUNK_SIZE):
+        """Разбиение строк на части, чтобы не превысить лимит параметров запроса"""
+        for index in range(0, len(rows), size):
+            yield rows[index:index + size]
+    
+    def _apply_reaction(self, session: Session, message_db_id: int, emoji: str = None,
+                        user_id: int = None) -> Reaction:
+        """Добавление реакции в рамках сессии"""
+        return self._apply_reaction_diff(session, [], [{
+            'message_id': message_db_id,
+            'message_date': self._get_message_dates(session, [message_db_id])[message_db_id],
+            'emoji': emoji,
+            'user_id': user_id
+        }])[0]
+    
+    def _apply_reaction_diff(self, session: Session, deletes: List[Tuple[int, datetime, int, str]],
+                             inserts: List[dict]) -> List[Reaction]:
+        """
+        Удаление и добавление реакций пакетом с обновлением reaction_counts
+        
+        Args:
+            deletes: Ключи (message_id, message_date, user_id, emoji) удаляемых реакций
+            inserts: Строки новых реакций (message_id, message_date, emoji, user_id)
+            
+        Returns:
+            Добавленные реакции
+        """
+        # Счетчики меняем по фактически удаленным и добавленным строкам
+        deltas = Counter()
+        user_deltas = Counter()  # (message_id, message_date, user_id) -> +/-N
+        for chunk in self._chunks(sorted(set(deletes))):
+            stmt = delete(Reaction).where(
+                tuple_(Reaction.message_id, Reaction.message_date, Reaction.user_id, Reaction.emoji).in_(chunk)
+            ).returning(Reaction.message_id, Reaction.message_date, Reaction.emoji, Reaction.user_id)
+            for message_id, message_date, emoji, user_id in session.execute(
+                stmt, execution_options={'synchronize_session': False}
+            ):
+                deltas[(message_id, message_date, emoji)] -= 1
+                user_deltas[(message_id, message_date, user_id)] -= 1
+        
+        reactions = []
+        for chunk in self._chunks(inserts):
+            # Уже существующие реакции (повтор операций из журнала) пропускаются
+            stmt = pg_insert(Reaction).values(chunk).on_conflict_do_nothing().returning(Reaction)
+            for reaction in session.scalars(stmt):
+                deltas[(reaction.message_id, reaction.message_date, reaction.emoji)] += 1
+                user_deltas[(reaction.message_id, reaction.message_date, reaction.user_id)] += 1
+                reactions.append(reaction)
+        
+        self._update_reaction_counts(session, deltas)
+        
+        # Реакции считаются в активности поставившего их пользователя
+        owners = self._get_message_owners(session, {key[:2] for key, delta in user_deltas.items() if delta})
+        activity = Counter()
+        for (message_id, message_date, user_id), delta in user_deltas.items():
+            if delta and (message_id, message_date) in owners:
+                chat_id = owners[(message_id, message_date)][0]
+                activity[(chat_id, user_id, message_date.date(), 'reactions')] += delta
+        self._update_activity(session, activity)
+        return reactions
+    
+    def _update_reaction_counts(self, session: Session, deltas: Counter):
+        """Применение изменений количества реакций (message_id, message_date, emoji) -> +/-N"""
+        rows = [
+            {'message_id': message_id, 'message_date': message_date, 'emoji': emoji, 'count': delta}
+            for (message_id, message_date, emoji), delta in sorted(deltas.items())
+            if delta and emoji is not None
+        ]
+        for chunk in self._chunks(rows):
+            stmt = pg_insert(ReactionCount).values(chunk)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[ReactionCount.message_id, ReactionCount.emoji],
+                set_={'count': ReactionCount.count + stmt.excluded.count}
+            )
+            session.execute(stmt)
+            session.execute(
+                delete(ReactionCount).where(
+                    tuple_(ReactionCount.message_id, ReactionCount.emoji).in_(
+                        [(row['message_id'], row['emoji']) for row in chunk]
+                    ),
+                    ReactionCount.count <= 0
+                ),
+                execution_options={'synchronize_session': False}
+            )
+    
+    def _apply_document(self, session: Session, message_db_id: int, file_id: str,
+                        file_unique_id: str = None, file_name: str = None,
+                        mime_type: str = None, file_size: int = None,
+                        document_type: str = None, file_path: str = None,
+                        download_policy: str = None, message_date: datetime = None,
+                        record_activity: bool = True) -> Document:
+        """
+        Добавление документа в рамках сессии (дата сообщения читается из БД, если не передана)
+        
+        record_activity=False - счетчики активности обновит вызывающий код
+        (см. _record_document_activity)
+        """
+        if message_date is None:
+            message_date = self._get_message_dates(session, [message_db_id])[message_db_id]
+        document = Document(
+            message_id=message_db_id,
+            message_date=message_date,
+            file_id=file_id,
+            file_unique_id=file_unique_id,
+            file_name=file_name,
+            mime_type=mime_type,
+            file_size=file_size,
+            document_type=document_type,
+            file_path=file_path,
+            download_policy=download_policy
+        )
+        session.add(document)
+        if record_activity:
+            self._record_document_activity(session, [document])
+        return document
+    
+    def _record_document_activity(self, session: Session, documents: List[Document]):
+        """Счетчики вложений и объема сохраненных файлов по новым документам"""
+        owners = self._get_message_owners(session, {
+            (document.message_id, document.message_date) for document in documents
+        })
+        activity = Counter()
+        for document in documents:
+            owner = owners.get((document.message_id, document.message_date))
+            if owner is None:
+                continue
+            key = (owner[0], owner[1], document.message_date.date())
+            activity[key + ('media',)] += 1
+            if document.file_path and document.file_size:
+                activity[key + ('bytes_downloaded',)] += document.file_size
+        self._update_activity(session, activity)
+    
+    @staticmethod
+    def _download_priority(document_type: str) -> int:
+        """Приоритет скачивания по типу файла (меньше - раньше)"""
+        if document_type in config.DOWNLOAD_TYPE_PRIORITY:
+            return config.DOWNLOAD_TYPE_PRIORITY.index(document_type)
+        return len(config.DOWNLOAD_TYPE_PRIORITY)
+    
+    def _add_download_job(self, session: Session, document: Document, chat_id: int) -> DownloadJob:
+        """Постановка файла документа в очередь скачивания в рамках сессии"""
+        job = DownloadJob(
+            document=document,
+            chat_id=chat_id,
+            file_id=document.file_id,
+            file_unique_id=document.file_unique_id,
+            file_size=document.file_size,
+            priority=self._download_priority(document.document_type),
+            status='pending',
+            attempts=0
+        )
+        session.add(job)
+        return job
+    
+    def _claim_download_jobs(self, session: Session, limit: int,
+                             exclude_chat_ids: List[int] = None) -> List[dict]:
+        """
+        Захват заданий на скачивание в порядке приоритета
+        
+        Берутся ожидающие задания, у которых наступило время попытки, и задания,
+        зависшие в работе дольше DOWNLOAD_JOB_TIMEOUT (например, после падения
+        процесса). Строки блокируются с SKIP LOCKED, поэтому несколько обработчиков
+        не получат одно задание.
+        
+        Returns:
+            Список словарей с полями задания и документа; blob_path задан,
+            если файл с таким file_unique_id уже скачан
+        """
+        now = datetime.utcnow()
+        stale_before = now - timedelta(seconds=config.DOWNLOAD_JOB_TIMEOUT)
+        query = select(
+            DownloadJob, Document.document_type, Document.file_name, MediaBlob.file_path
+        ).join(
+            Document,
+            and_(Document.id == DownloadJob.document_id, Document.message_date == DownloadJob.message_date)
+        ).outerjoin(
+            MediaBlob, MediaBlob.file_unique_id == DownloadJob.file_unique_id
+        ).where(
+            or_(
+                and_(DownloadJob.status == 'pending', DownloadJob.next_attempt_at <= now),
+                and_(DownloadJob.status == 'running', DownloadJob.locked_at < stale_before)
+            )
+        )
+        if exclude_chat_ids:
+            query = query.where(DownloadJob.chat_id.notin_(exclude_chat_ids))
+        query = query.order_by(
+            DownloadJob.priority, DownloadJob.file_size, DownloadJob.id
+        ).limit(limit).with_for_update(skip_locked=True, of=DownloadJob)
+        
+        jobs = []
+        for job, document_type, file_name, blob_path in session.execute(query):
+            job.status = 'running'
+            job.attempts += 1
+            job.locked_at = now
+            jobs.append({
+                'id': job.id,
+                'document_id': job.document_id,
+                'chat_id': job.chat_id,
+                'file_id': job.file_id,
+                'file_unique_id': job.file_unique_id,
+                'file_size': job.file_size,
+                'attempts': job.attempts,
+                'document_type': document_type,
+                'file_name': file_name,
+                # Файл уже есть в хранилище - скачивать не нужно
+                'blob_path': blob_path
+            })
+        return jobs
+    
+    def _request_downloads(self, session: Session, document_ids: List[int]) -> List[int]:
+        """
+        Постановка файлов в начало очереди скачивания по запросу администратора
+        
+        Документы, файл которых уже есть в хранилище, сразу получают путь к нему.
+        Для остальных (кроме политики 'never') создается задание или поднимается
+        приоритет существующего, в том числе завершившегося ошибкой.
+        
+        Returns:
+            ID заданий, завершения которых нужно дождаться
+        """
+        documents = session.scalars(
+            select(Document).where(
+                Document.id.in_(document_ids),
+                Document.file_path.is_(None),
+                or_(Document.download_policy.is_(None), Document.download_policy != 'never')
+            )
+        ).all()
+        if not documents:
+            return []
+        
+        blob_paths, _ = self._find_known_files(session, [
+            {'file_unique_id': document.file_unique_id} for document in documents
+        ])
+        chat_ids = dict(session.execute(
+            select(Message.id, Message.chat_id).where(
+                tuple_(Message.id, Message.message_date).in_(
+                    {(document.message_id, document.message_date) for document in documents}
+                )
+            )
+        ).all())
+        
+        job_ids = set()
+        for document in documents:
+            if document.file_unique_id in blob_paths:
+                document.file_path = blob_paths[document.file_unique_id]
+                session.execute(
+                    update(MediaBlob).where(MediaBlob.file_unique_id == document.file_unique_id)
+                    .values(ref_count=MediaBlob.ref_count + 1)
+                )
+                continue
+            
+            # Одно задание на файл: документ без своего задания получит путь
+            # после скачивания файла по заданию другого документа
+            job = session.scalar(
+                select(DownloadJob).where(DownloadJob.document_id == document.id)
+            )
+            if job is None and document.file_unique_id:
+                job = session.scalar(
+                    select(DownloadJob).where(
+                        DownloadJob.file_unique_id == document.file_unique_id
+                    ).order_by(DownloadJob.status == 'failed').limit(1)
+                )
+            if job is None:
+                job = self._add_download_job(session, document, chat_ids[document.message_id])
+            job.priority = ON_DEMAND_PRIORITY
+            if job.status != 'running':
+                job.status = 'pending'
+                job.next_attempt_at = datetime.utcnow()
+                if job.attempts >= config.DOWNLOAD_MAX_ATTEMPTS:
+                    job.attempts = 0
+            session.flush()
+            job_ids.add(job.id)
+        return list(job_ids)
+    
+    def _get_document_paths(self, session: Session, document_ids: List[int]) -> Dict[int, str]:
+        """Пути к скачанным файлам документов (только для документов с файлом)"""
+        paths = {}
+        for chunk in self._chunks(list(document_ids)):
+            paths.update(session.execute(
+                select(Document.id, Document.file_path).where(
+                    Document.id.in_(chunk), Document.file_path.isnot(None)
+                )
+            ).all())
+        return paths
+    
+    def _complete_download_job(self, session: Session, job_id: int, document_id: int,
+                               file_path: str, file_unique_id: str = None,
+                               file_size: int = None, sha256: str = None) -> str:
+        """
+        Сохранение пути к скачанному файлу и удаление задания
+        
+        Файл с file_unique_id регистрируется в media_blobs, если файл с таким же
+        содержимым (sha256) уже есть, используется существующий. Путь получают
+        документ задания и все ожидающие документы с тем же file_unique_id,
+        счетчик ссылок увеличивается на их количество.
+        
+        Returns:
+            Итоговый путь к файлу (отличается от file_path, если файл уже был
+            в хранилище и скачанная копия не нужна)
+        """
+        # Задание удаляем первым: если пакет с новым документом этого файла держит
+        # блокировку задания (см. _find_known_files), ждем его фиксации, чтобы
+        # следующий UPDATE увидел и этот документ
+        session.query(DownloadJob).filter(DownloadJob.id == job_id).delete(synchronize_session=False)
+        if file_unique_id:
+            if sha256:
+                same_content = session.scalar(
+                    select(MediaBlob.file_path).where(MediaBlob.sha256 == sha256).limit(1)
+                )
+                if same_content and os.path.exists(same_content):
+                    file_path = same_content
+            session.execute(pg_insert(MediaBlob).values(
+                file_unique_id=file_unique_id,
+                file_path=file_path,
+                file_size=file_size,
+                sha256=sha256,
+                ref_count=0,
+                created_at=datetime.utcnow()
+            ).on_conflict_do_nothing(index_elements=[MediaBlob.file_unique_id]))
+            stored_path = session.scalar(
+                select(MediaBlob.file_path).where(MediaBlob.file_unique_id == file_unique_id)
+            )
+            if stored_path != file_path and not os.path.exists(stored_path):
+                # Файла записи больше нет на диске - запись и ее документы получают новый файл
+                session.execute(
+                    update(MediaBlob).where(MediaBlob.file_unique_id == file_unique_id)
+                    .values(file_path=file_path, file_size=file_size, sha256=sha256)
+                )
+                session.execute(
+                    update(Document).where(
+                        Document.file_unique_id == file_unique_id, Document.file_path == stored_path
+                    ).values(file_path=file_path),
+                    execution_options={'synchronize_session': False}
+                )
+                stored_path = file_path
+            file_path = stored_path
+            linked = session.execute(
+                update(Document).where(
+                    or_(
+                        Document.id == document_id,
+                        and_(Document.file_unique_id == file_unique_id, Document.file_path.is_(None))
+                    )
+                ).values(file_path=file_path)
+                .returning(Document.message_id, Document.message_date, Document.file_size),
+                execution_options={'synchronize_session': False}
+            ).all()
+            session.execute(
+                update(MediaBlob).where(MediaBlob.file_unique_id == file_unique_id)
+                .values(ref_count=MediaBlob.ref_count + len(linked))
+            )
+        else:
+            linked = session.execute(
+                update(Document).where(Document.id == document_id).values(file_path=file_path)
+                .returning(Document.message_id, Document.message_date, Document.file_size),
+                execution_options={'synchronize_session': False}
+            ).all()
+        
+        # Объем сохраненных файлов - по всем документам, получившим файл
+        owners = self._get_message_owners(session, {
+            (message_id, message_date) for message_id, message_date, _ in linked
+        })
+        activity = Counter()
+        for message_id, message_date, document_size in linked:
+            owner = owners.get((message_id, message_date))
+            size = document_size or file_size
+            if owner is not None and size:
+                activity[(owner[0], owner[1], message_date.date(), 'bytes_downloaded')] += size
+        self._update_activity(session, activity)
+        return file_path
+    
+    def _release_media_blobs(self, session: Session, document_ids: List[int]):
+        """
+        Уменьшение счетчиков ссылок на файлы перед удалением документов
+        
+        Сами файлы удаляются отдельно (см. _delete_unreferenced_media_blobs).
+        """
+        for chunk in self._chunks(list(document_ids)):
+            released = session.execute(
+                select(MediaBlob.file_unique_id, func.count()).join(
+                    Document,
+                    and_(Document.file_unique_id == MediaBlob.file_unique_id,
+                         Document.file_path == MediaBlob.file_path)
+                ).where(Document.id.in_(chunk)).group_by(MediaBlob.file_unique_id)
+            ).all()
+            for file_unique_id, count in released:
+                session.execute(
+                    update(MediaBlob).where(MediaBlob.file_unique_id == file_unique_id)
+                    .values(ref_count=MediaBlob.ref_count - count)
+                )
+    
+    def _delete_unreferenced_media_blobs(self, session: Session) -> List[str]:
+        """
+        Удаление из индекса файлов, на которые не ссылается ни один документ
+        
+        Returns:
+            Пути к файлам, которые можно удалить с диска (путь не используется
+            другими записями media_blobs и документами)
+        """
+        paths = session.scalars(
+            delete(MediaBlob).where(MediaBlob.ref_count <= 0).returning(MediaBlob.file_path)
+        ).all()
+        if not paths:
+            return []
+        still_used = set(session.scalars(
+            select(MediaBlob.file_path).where(MediaBlob.file_path.in_(paths))
+        )) | set(session.scalars(
+            select(Document.file_path).where(Document.file_path.in_(paths))
+        ))
+        return [path for path in set(paths) if path not in still_used]
+    
+    def _fail_download_job(self, session: Session, job_id: int, error: str,
+                           retry_at: datetime = None, count_attempt: bool = True):
+        """
+        Отметка неудачной попытки скачивания
+        
+        Если задан retry_at, задание вернется в очередь к этому времени,
+        иначе остается в статусе 'failed'. При count_attempt=False попытка
+        не учитывается (например, при ограничении частоты запросов).
+        """
+        values = {'last_error': error, 'locked_at': None}
+        if not count_attempt:
+            values['attempts'] = DownloadJob.attempts - 1
+        if retry_at is not None:
+            values.update(status='pending', next_attempt_at=retry_at)
+        else:
+            values.update(status='failed')
+        session.execute(update(DownloadJob).where(DownloadJob.id == job_id).values(**values))
+    
+    def _release_download_jobs(self, session: Session, job_ids: List[int]):
+        """Возврат незавершенных заданий в очередь без учета попытки (при остановке)"""
+        if job_ids:
+            session.execute(
+                update(DownloadJob).where(
+                    DownloadJob.id.in_(job_ids), DownloadJob.status == 'running'
+                ).values(status='pending', locked_at=None, attempts=DownloadJob.attempts - 1)
+            )
+    
+    def _find_known_files(self, session: Session, document_ops: List[dict]) -> Tuple[Dict[str, str], set]:
+        """
+        Поиск файлов документов пакета, которые не нужно скачивать заново
+        
+        Returns:
+            (file_unique_id -> путь к скачанному файлу,
+             множество file_unique_id, для которых уже есть задание на скачивание)
+        """
+        unique_ids = list({
+            op['file_unique_id'] for op in document_ops
+            if op.get('file_unique_id') and not op.get('file_path')
+        })
+        blob_paths = {}
+        queued = set()
+        for chunk in self._chunks(unique_ids):
+            blob_paths.update(session.execute(
+                select(MediaBlob.file_unique_id, MediaBlob.file_path)
+                .where(MediaBlob.file_unique_id.in_(chunk))
+            ).all())
+            # Блокировка заданий не дает им завершиться до фиксации пакета,
+            # иначе новый документ не получит путь к файлу
+            queued.update(session.scalars(
+                select(DownloadJob.file_unique_id).where(
+                    DownloadJob.file_unique_id.in_(chunk), DownloadJob.status != 'failed'
+                ).with_for_update(read=True)
+            ))
+        return blob_paths, queued
+    
+    def _find_existing_documents(self, session: Session, keys: List[Tuple[int, datetime, str]]) -> set:
+        """Уже записанные документы по ключам (ID сообщения, дата сообщения, file_unique_id)"""
+        existing = set()
+        for chunk in self._chunks(sorted(set(keys))):
+            existing.update(
+                (message_id, file_unique_id) for message_id, file_unique_id in session.execute(
+                    select(Document.message_id, Document.file_unique_id).where(
+                        tuple_(Document.message_id, Document.message_date, Document.file_unique_id).in_(chunk)
+                    )
+                )
+            )
+        return existing
+    
+    def _apply_batch(self, session: Session, operations: List[dict]) -> list:
+        """Применение пакета операций записи в рамках сессии (см. save_batch)"""
+        results = [None] * len(operations)
+        
+        # Пользователи: один upsert на весь пакет, повторы объединяем,
+        # неизменившиеся (по кэшу) пропускаем
+        users = {}
+        for op in operations:
+            if op['op'] == 'user':
+                values = (op.get('username'), op.get('first_name'), op.get('last_name'))
+                if self._identity_unchanged(self.user_cache, op['user_id'], values):
+                    continue
+                merged = users.setdefault(op['user_id'], {})
+                for field in ('username', 'first_name', 'last_name'):
+                    if op.get(field):
+                        merged[field] = op[field]
+        if users:
+            self._upsert_users(session, [
+                {
+                    'id': user_id,
+                    'username': fields.get('username'),
+                    'first_name': fields.get('first_name'),
+                    'last_name': fields.get('last_name')
+                }
+                for user_id, fields in users.items()
+            ])
+        
+        # Чаты: их немного, но нужна логика преобразования group -> supergroup
+        chats = {}
+        for op in operations:
+            if op['op'] == 'chat':
+                values = (op.get('title'), op.get('chat_type'))
+                if self._identity_unchanged(self.chat_cache, op['chat_id'], values):
+                    continue
+                chats[op['chat_id']] = op
+        for op in chats.values():
+            self._apply_chat(session, op['chat_id'], op.get('title'), op.get('chat_type'))
+        
+        # Сообщения: один INSERT ... ON CONFLICT на весь пакет
+        message_refs = self._upsert_message_refs(session, [
+            op for op in operations if op['op'] == 'message'
+        ])
+        
+        # Сообщения, на которые ссылаются вложения/реакции, но которых нет в пакете
+        missing_keys = {
+            (op['chat_id'], op['message_id'])
+            for op in operations
+            if op['op'] in ('document', 'reaction', 'reaction_change')
+            and not op.get('message_db_id')
+        } - set(message_refs)
+        if missing_keys:
+            message_refs.update(self._get_message_refs(session, missing_keys))
+        # Дата сообщения нужна как ключ секции вложений и реакций
+        message_dates = {db_id: message_date for db_id, message_date in message_refs.values()}
+        message_dates.update(self._get_message_dates(session, {
+            op['message_db_id'] for op in operations if op.get('message_db_id')
+        } - set(message_dates)))
+        
+        # Реакции пакета: изменения одного пользователя на одном сообщении сводим
+        # к итоговым удалениям и добавлениям, которые применяются двумя запросами
+        reaction_changes = {}  # (ID сообщения, user_id) -> (удаляемые эмодзи, добавляемые эмодзи)
+        reaction_inserts = []
+        
+        # Файлы, которые уже скачаны или ждут скачивания по другому документу
+        document_ops = [op for op in operations if op['op'] == 'document']
+        blob_paths, queued_unique_ids = self._find_known_files(session, document_ops)
+        # Документы, уже записанные ранее (повтор операций из журнала)
+        document_refs = [
+            (op.get('message_db_id') or message_refs.get((op['chat_id'], op['message_id']), (None,))[0],
+             op.get('file_unique_id'))
+            for op in document_ops
+        ]
+        existing_documents = self._find_existing_documents(session, [
+            (message_db_id, message_dates[message_db_id], file_unique_id)
+            for message_db_id, file_unique_id in document_refs
+            if file_unique_id and message_db_id in message_dates
+        ])
+        new_documents = []
+        
+        for index, op in enumerate(operations):
+            kind = op['op']
+            if kind == 'message':
+                results[index] = message_refs[(op['chat_id'], op['message_id'])][0]
+                continue
+            if kind not in ('document', 'reaction', 'reaction_change'):
+                continue
+            
+            message_db_id = op.get('message_db_id') or message_refs.get(
+                (op['chat_id'], op['message_id']), (None,)
+            )[0]
+            message_date = message_dates.get(message_db_id)
+            if not message_db_id or message_date is None:
+                logger.warning(
+                    f"Сообщение {op['message_id']} в чате {op['chat_id']} не найдено, "
+                    f"операция '{kind}' пропущена"
+                )
+                continue
+            
+            if kind == 'document':
+                file_unique_id = op.get('file_unique_id')
+                if file_unique_id:
+                    if (message_db_id, file_unique_id) in existing_documents:
+                        continue
+                    existing_documents.add((message_db_id, file_unique_id))
+                file_path = op.get('file_path') or blob_paths.get(file_unique_id)
+                download_policy = op.get('download_policy')
+                document = self._apply_document(
+                    session, message_db_id, op['file_id'], file_unique_id,
+                    op.get('file_name'), op.get('mime_type'), op.get('file_size'),
+                    op.get('document_type'), file_path, download_policy, message_date,
+                    record_activity=False
+                )
+                new_documents.append(document)
+                if file_unique_id in blob_paths and not op.get('file_path'):
+                    # Повторное вложение: ссылаемся на уже скачанный файл
+                    session.execute(
+                        update(MediaBlob).where(MediaBlob.file_unique_id == file_unique_id)
+                        .values(ref_count=MediaBlob.ref_count + 1)
+                    )
+                elif (not file_path and download_policy in (None, 'eager')
+                      and file_unique_id not in queued_unique_ids):
+                    # Файл скачивается фоновыми обработчиками после записи пакета,
+                    # lazy-файлы - по запросу (см. _request_downloads)
+                    self._add_download_job(session, document, op['chat_id'])
+                    if file_unique_id:
+                        queued_unique_ids.add(file_unique_id)
+            elif kind == 'reaction':
+                reaction_inserts.append({
+                    'message_id': message_db_id,
+                    'message_date': message_date,
+                    'emoji': op.get('emoji'),
+                    'user_id': op.get('user_id')
+                })
+            else:
+                # Старые реакции пользователя удаляются, новые добавляются; реакция,
+                # добавленная и снятая в пределах пакета, до БД не доходит
+                removed, added = reaction_changes.setdefault(
+                    (message_db_id, message_date, op['user_id']), (set(), [])
+                )
+                for emoji in op.get('old_emojis') or []:
+                    if emoji in added:
+                        added.remove(emoji)
+                    else:
+                        removed.add(emoji)
+                for emoji in op.get('new_emojis') or []:
+                    if emoji not in added:
+                        added.append(emoji)
+        
+        if reaction_changes or reaction_inserts:
+            deletes = []
+            for (message_db_id, message_date, user_id), (removed, added) in reaction_changes.items():
+                deletes.extend((message_db_id, message_date, user_id, emoji) for emoji in removed)
+                reaction_inserts.extend(
+                    {'message_id': message_db_id, 'message_date': message_date,
+                     'emoji': emoji, 'user_id': user_id}
+                    for emoji in added
+                )
+            self._apply_reaction_diff(session, deletes, reaction_inserts)
+        
+        if new_documents:
+            self._record_document_activity(session, new_documents)
+        
+        return results
+    
+    def _query_messages_by_date_range(self, session: Session, chat_id: int,
+                                      start_date: datetime, end_date: datetime) -> List[Message]:
+        """Выборка сообщений за период вместе со связанными объектами"""
+        # Загружаем сообщения вместе с связанными объектами (user, documents,
+        # счетчики реакций вместо всех строк reactions). Условие на дату документов
+        # оставляет в плане только секции documents за период
+        return session.query(Message).options(
+            joinedload(Message.user),
+            joinedload(Message.documents),
+            joinedload(Message.reaction_counts),
+            with_loader_criteria(Document, and_(
+                Document.message_date >= start_date, Document.message_date <= end_date
+            ))
+        ).filter(
+            Message.chat_id == chat_id,
+            Message.message_date >= start_date,
+            Message.message_date <= end_date
+        ).order_by(Message.message_date).all()
+
+    def _query_messages_page(self, session: Session, chat_id: int, start_date: datetime,
+                             end_date: datetime, after: Tuple[datetime, int] = None,
+                             limit: int = None, with_reactions: bool = False) -> List[Message]:
+        """
+        Страница сообщений за период для потокового экспорта
+
+        Страницы идут по ключу (message_date, id): следующая начинается после
+        последнего сообщения предыдущей, поэтому каждая страница - короткий запрос
+        по индексу (chat_id, message_date) без OFFSET. Память ограничена размером
+        страницы; коллекции загружаются selectinload одним запросом на страницу.
+
+        Args:
+            after: (message_date, id) последнего сообщения предыдущей страницы
+            limit: Размер страницы (по умолчанию EXPORT_PAGE_SIZE)
+            with_reactions: Загрузить и реакции по пользователям (перенос в архив)
+        """
+        conditions = [
+            Message.chat_id == chat_id,
+            Message.message_date >= start_date,
+            Message.message_date <= end_date
+        ]
+        if after is not None:
+            conditions.append(tuple_(Message.message_date, Message.id) > tuple_(*after))
+        options = [
+            joinedload(Message.user),
+            selectinload(Message.documents),
+            selectinload(Message.reaction_counts),
+            with_loader_criteria(Document, and_(
+                Document.message_date >= start_date, Document.message_date <= end_date
+            ))
+        ]
+        if with_reactions:
+            options += [
+                selectinload(Message.reactions),
+                with_loader_criteria(Reaction, and_(
+                    Reaction.message_date >= start_date, Reaction.message_date <= end_date
+                ))
+            ]
+        return session.scalars(
+            select(Message).options(*options).where(*conditions)
+            .order_by(Message.message_date, Message.id)
+            .limit(limit or config.EXPORT_PAGE_SIZE)
+        ).all()
+
+    def _query_documents_page(self, session: Session, chat_id: int, start_date: datetime,
+                              end_date: datetime, after: Tuple[datetime, int] = None,
+                              limit: int = None) -> List[dict]:
+        """
+        Страница документов чата за период для выгрузки файлов
+
+        Запрос к documents с соединением по ключу сообщения: из messages берутся
+        только message_id и user_id, текст сообщений не читается. Страницы идут по
+        ключу (message_date, id) документа, как в _query_messages_page.
+
+        Returns:
+            Словари с полями документа, message_id (Telegram) и user_id
+        """
+        conditions = [
+            Message.chat_id == chat_id,
+            Message.message_date >= start_date,
+            Message.message_date <= end_date,
+            Document.message_date >= start_date,
+            Document.message_date <= end_date
+        ]
+        if after is not None:
+            conditions.append(tuple_(Document.message_date, Document.id) > tuple_(*after))
+        rows = session.execute(
+            select(
+                Document.id, Document.message_date, Message.message_id, Message.user_id,
+                Document.file_id, Document.file_unique_id, Document.file_name, Document.mime_type,
+                Document.file_size, Document.document_type, Document.file_path, Document.download_policy
+            ).join(Message, and_(Message.id == Document.message_id,
+                                 Message.message_date == Document.message_date))
+            .where(*conditions)
+            .order_by(Document.message_date, Document.id)
+            .limit(limit or config.EXPORT_PAGE_SIZE)
+        ).all()
+        return [dict(row._mapping) for row in rows]
+
+    def _get_export_watermark(self, session: Session, chat_id: int, start_date: datetime,
+                              end_date: datetime, last: Tuple[datetime, int] = None,
+                              max_edited: datetime = None) -> Dict[str, int]:
+        """
+        Изменения сообщений чата за период относительно отметки кэшированного экспорта
+
+        Отметка - ключ (message_date, id) последнего выгруженного сообщения и
+        наибольшая дата редактирования среди выгруженных.
+
+        Returns:
+            head - сообщений до отметки включительно (отличие от числа выгруженных
+            значит вставку или удаление в середине), head_edited - из них
+            отредактированных после отметки, tail - сообщений после отметки
+        """
+        head = tuple_(Message.message_date, Message.id) <= tuple_(*last) if last else false()
+        edited = Message.edited_date > max_edited if max_edited else Message.edited_date.isnot(None)
+        row = session.execute(
+            select(
+                func.count().filter(head),
+                func.count().filter(and_(head, edited)),
+                func.count().filter(not_(head))
+            ).where(
+                Message.chat_id == chat_id,
+                Message.message_date >= start_date,
+                Message.message_date <= end_date
+            )
+        ).one()
+        return {"head": row[0], "head_edited": row[1], "tail": row[2]}
+
+    def _get_archive_months(self, session: Session, chat_id: int, before: datetime) -> List[datetime]:
+        """Месяцы, в которых у чата есть сообщения старше before"""
+        month = func.date_trunc('month', Message.message_date)
+        return list(session.scalars(
+            select(month).where(Message.chat_id == chat_id, Message.message_date < before)
+            .group_by(month).order_by(month)
+        ))
+    
+    def _delete_archived_messages(self, session: Session, chat_id: int, start_date: datetime,
+                                  end_date: datetime, message_ids: List[int],
+                                  release_media: bool = False) -> int:
+        """
+        Удаление перенесенных в архив сообщений чата за период [start_date, end_date)
+        по ID записей (сообщения, пришедшие после записи архива, остаются)
+        
+        Задания на скачивание и счетчики реакций удаляются каскадно. Счетчики ссылок
+        media_blobs уменьшаются только при release_media: иначе на файлы продолжают
+        ссылаться записи архива.
+        
+        Returns:
+            Число удаленных сообщений
+        """
+        deleted = 0
+        options = {'synchronize_session': False}
+        for chunk in self._chunks(message_ids):
+            chunk = list(chunk)
+            session.execute(delete(Reaction).where(
+                Reaction.message_id.in_(chunk),
+                Reaction.message_date >= start_date, Reaction.message_date < end_date
+            ), execution_options=options)
+            documents = and_(
+                Document.message_id.in_(chunk),
+                Document.message_date >= start_date, Document.message_date < end_date
+            )
+            if release_media:
+                self._release_media_blobs(session, session.scalars(select(Document.id).where(documents)).all())
+            session.execute(delete(Document).where(documents), execution_options=options)
+            deleted += session.execute(delete(Message).where(
+                Message.id.in_(chunk), Message.chat_id == chat_id,
+                Message.message_date >= start_date, Message.message_date < end_date
+            ), execution_options=options).rowcount
+        return deleted
+    
+    def _drop_empty_partitions(self, session: Session, before: datetime) -> List[str]:
+        """Удаление пустых секций месяцев до before (см. partitions.drop_empty_partitions)"""
+        return drop_empty_partitions(session.connection(), before)
+    
+    @staticmethod
+    def _search_query(query: str):
+        """tsquery из строки поиска в синтаксисе websearch (слова, "фраза", OR, -слово)"""
+        tsquery = None
+        for name in SEARCH_CONFIGS:
+            part = func.websearch_to_tsquery(literal_column(f"'{name}'::regconfig"), query)
+            tsquery = part if tsquery is None else tsquery.op('||')(part)
+        return tsquery
+    
+    @staticmethod
+    def encode_search_cursor(message_date: datetime, message_db_id: int) -> str:
+        """Курсор страницы поиска: дата и ID последнего показанного сообщения"""
+        return f"{message_date:%Y%m%d%H%M%S%f}_{message_db_id}"
+    
+    @staticmethod
+    def decode_search_cursor(cursor: str) -> Tuple[datetime, int]:
+        """Дата и ID сообщения из курсора (ValueError для некорректного курсора)"""
+        date_part, _, id_part = cursor.partition('_')
+        return datetime.strptime(date_part, '%Y%m%d%H%M%S%f'), int(id_part)
+    
+    def _search_messages(self, session: Session, query: str, chat_id: int = None,
+                         start_date: datetime = None, end_date: datetime = None,
+                         limit: int = 10, cursor: str = None) -> Tuple[List[dict], str]:
+        """
+        Полнотекстовый поиск по сообщениям, от новых к старым
+        
+        Совпадения отбираются по GIN-индексу ix_messages_text_search; условия на
+        чат и даты сужают выборку и оставляют в плане только секции периода.
+        Страницы - по ключу (message_date, id) без OFFSET, фрагменты с выделением
+        (ts_headline) строятся только для строк страницы.
+        
+        Returns:
+            Результаты (словари с полями сообщения, чата, автора и фрагментом snippet,
+            найденные слова выделены HIGHLIGHT_START/HIGHLIGHT_STOP) и курсор
+            следующей страницы (None, если страница последняя)
+        """
+        tsquery = self._search_query(query)
+        conditions = [Message.text_search.op('@@')(tsquery)]
+        if chat_id is not None:
+            conditions.append(Message.chat_id == chat_id)
+        if start_date is not None:
+            conditions.append(Message.message_date >= start_date)
+        if end_date is not None:
+            conditions.append(Message.message_date <= end_date)
+        if cursor:
+            cursor_date, cursor_id = self.decode_search_cursor(cursor)
+            # Отдельное условие на дату - для отсечения секций новее курсора
+            conditions.append(Message.message_date <= cursor_date)
+            conditions.append(tuple_(Message.message_date, Message.id) < tuple_(cursor_date, cursor_id))
+        
+        page = select(
+            Message.id, Message.chat_id, Message.message_id, Message.user_id,
+            Message.text, Message.message_date
+        ).where(*conditions).order_by(
+            Message.message_date.desc(), Message.id.desc()
+        ).limit(limit + 1).subquery('page')
+        
+        rows = session.execute(
+            select(
+                page.c.id, page.c.chat_id, page.c.message_id, page.c.user_id, page.c.message_date,
+                Chat.title.label('chat_title'), User.username, User.first_name, User.last_name,
+                func.ts_headline(
+                    literal_column(f"'{SEARCH_CONFIGS[0]}'::regconfig"), page.c.text,
+                    self._search_query(query), SEARCH_HEADLINE_OPTIONS
+                ).label('snippet')
+            ).outerjoin(Chat, Chat.id == page.c.chat_id)
+            .outerjoin(User, User.id == page.c.user_id)
+            .order_by(page.c.message_date.desc(), page.c.id.desc())
+        ).mappings().all()
+        
+        results = [dict(row) for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            last = results[-1]
+            next_cursor = self.encode_search_cursor(last['message_date'], last['id'])
+        return results, next_cursor
+    
+    @staticmethod
+    def _set_similarity_threshold(session: Session):
+        """Порог сходства оператора <% (pg_trgm) до конца транзакции"""
+        session.execute(
+            text("SELECT set_config('pg_trgm.word_similarity_threshold', :threshold, true)"),
+            {'threshold': str(config.FIND_SIMILARITY_THRESHOLD)}
+        )
+    
+    @staticmethod
+    def _rank_candidates(session: Session, candidates, limit: int) -> List[dict]:
+        """
+        Лучшие кандидаты по сходству и давности активности
+        
+        candidates - подзапрос с колонками similarity и last_activity (может быть NULL).
+        """
+        age_days = func.extract(
+            'epoch', func.timezone('utc', func.now()) - candidates.c.last_activity
+        ) / 86400
+        recency = case(
+            (candidates.c.last_activity.is_(None), 0),
+            else_=1.0 / (1.0 + func.greatest(age_days, 0) / FIND_RECENCY_DAYS)
+        )
+        score = (candidates.c.similarity + FIND_RECENCY_WEIGHT * recency).label('score')
+        rows = session.execute(
+            select(candidates, score).order_by(score.desc(), candidates.c.last_activity.desc().nulls_last())
+            .limit(limit)
+        ).mappings().all()
+        return [dict(row) for row in rows]
+    
+    def _find_chats(self, session: Session, query: str, limit: int = 10) -> List[dict]:
+        """
+        Чаты с названием, похожим на query (индекс ix_chats_title_trgm)
+        
+        Returns:
+            Словари id, title, chat_type, similarity, last_activity (дата последнего
+            сообщения), score - от лучшего совпадения
+        """
+        self._set_similarity_threshold(session)
+        candidates = select(
+            Chat.id, Chat.title, Chat.chat_type,
+            func.word_similarity(query, Chat.title).label('similarity'),
+            select(func.max(Message.message_date)).where(Message.chat_id == Chat.id)
+            .scalar_subquery().label('last_activity')
+        ).where(literal(query).op('<%')(Chat.title)).subquery('candidates')
+        return self._rank_candidates(session, candidates, limit)
+    
+    def _find_users(self, session: Session, query: str, limit: int = 10) -> List[dict]:
+        """
+        Пользователи с username или именем, похожим на query (индекс ix_users_search_name_trgm)
+        
+        Returns:
+            Словари id, username, first_name, last_name, similarity, last_activity
+            (дата последнего сообщения), score - от лучшего совпадения
+        """
+        self._set_similarity_threshold(session)
+        name = func.users_search_name(User.username, User.first_name, User.last_name)
+        candidates = select(
+            User.id, User.username, User.first_name, User.last_name,
+            func.word_similarity(query, name).label('similarity'),
+            select(func.max(Message.message_date)).where(Message.user_id == User.id)
+            .scalar_subquery().label('last_activity')
+        ).where(literal(query).op('<%')(name)).subquery('candidates')
+        return self._rank_candidates(session, candidates, limit)
+    
+    def _find_files(self, session: Session, query: str, chat_id: int = None,
+                    user_id: int = None, limit: int = 10) -> List[dict]:
+        """
+        Файлы с именем, похожим на query (индекс ix_documents_file_name_trgm)
+        
+        Args:
+            chat_id: Только файлы из чата
+            user_id: Только файлы, отправленные пользователем
+        
+        Returns:
+            Словари с полями документа (id, file_name, document_type, file_size,
+            file_path), сообщения (chat_id, message_id, user_id), названием чата,
+            именем автора, similarity, last_activity (дата сообщения) и score
+        """
+        self._set_similarity_threshold(session)
+        conditions = [literal(query).op('<%')(Document.file_name)]
+        if chat_id is not None:
+            conditions.append(Message.chat_id == chat_id)
+        if user_id is not None:
+            conditions.append(Message.user_id == user_id)
+        matches = select(
+            Document.id, Document.file_name, Document.document_type, Document.file_size,
+            Document.file_path, Message.chat_id, Message.message_id, Message.user_id,
+            func.word_similarity(query, Document.file_name).label('similarity'),
+            Document.message_date.label('last_activity')
+        ).join(Message, and_(
+            Message.id == Document.message_id, Message.message_date == Document.message_date
+        )).where(*conditions).subquery('matches')
+        candidates = select(
+            matches, Chat.title.label('chat_title'), User.username, User.first_name, User.last_name
+        ).outerjoin(Chat, Chat.id == matches.c.chat_id).outerjoin(
+            User, User.id == matches.c.user_id
+        ).subquery('candidates')
+        return self._rank_candidates(session, candidates, limit)
+    
+    def _get_activity_stats(self, session: Session, chat_id: int, start_day: date, end_day: date,
+                            top_users: int = 10) -> dict:
+        """
+        Активность чата за дни [start_day, end_day] по счетчикам chat_activity_daily
+        и user_activity_daily (время не зависит от объема истории)
+        
+        Returns:
+            Словарь: totals - суммы полей ACTIVITY_FIELDS, days - список (день, счетчики)
+            по дням с активностью, top_users - самые активные по числу сообщений
+            (user_id, имя, счетчики)
+        """
+        days = session.execute(
+            select(ChatActivityDaily).where(
+                ChatActivityDaily.chat_id == chat_id,
+                ChatActivityDaily.day >= start_day,
+                ChatActivityDaily.day <= end_day
+            ).order_by(ChatActivityDaily.day)
+        ).scalars().all()
+        totals = Counter()
+        day_rows = []
+        for row in days:
+            counts = {field: getattr(row, field) for field in ACTIVITY_FIELDS}
+            totals.update(counts)
+            day_rows.append((row.day, counts))
+        
+        sums = [func.sum(getattr(UserActivityDaily, field)).label(field) for field in ACTIVITY_FIELDS]
+        per_user = select(UserActivityDaily.user_id, *sums).where(
+            UserActivityDaily.chat_id == chat_id,
+            UserActivityDaily.day >= start_day,
+            UserActivityDaily.day <= end_day
+        ).group_by(UserActivityDaily.user_id).order_by(
+            func.sum(UserActivityDaily.messages).desc(), UserActivityDaily.user_id
+        ).limit(top_users).subquery('per_user')
+        users = session.execute(
+            select(per_user, User.username, User.first_name, User.last_name)
+            .outerjoin(User, User.id == per_user.c.user_id)
+            .order_by(per_user.c.messages.desc(), per_user.c.user_id)
+        ).mappings().all()
+        
+        return {
+            'totals': {field: int(totals[field]) for field in ACTIVITY_FIELDS},
+            'days': day_rows,
+            'top_users': [
+                dict(row, **{field: int(row[field]) for field in ACTIVITY_FIELDS}) for row in users
+            ]
+        }
+    
+    def _query_chat_list(self, session: Session) -> List[Chat]:
+        """Выборка всех чатов"""
+        return session.query(Chat).all()
+    
+    def _ensure_partitions(self, session: Session, start: datetime = None, end: datetime = None) -> List[str]:
+        """
+        Создание секций месяцев от start до end (по умолчанию - от текущего
+        месяца на PARTITION_MONTHS_AHEAD месяцев вперед)
+        
+        Returns:
+            Имена созданных секций
+        """
+        now = datetime.utcnow()
+        return create_month_partitions(
+            session.connection(), start or now, end or add_months(now, config.PARTITION_MONTHS_AHEAD)
+        )
@@ -0,0 +1,137 @@
+"""
+Помесячные секции таблиц messages, documents и reactions
+
+Таблицы секционированы по RANGE (message_date): у каждого месяца своя секция
+<таблица>_pYYYY_MM, строки вне созданных месяцев попадают в <таблица>_default.
+Вложения и реакции хранят дату своего сообщения и лежат в секции того же месяца.
+Запросы с условием на message_date читают только секции нужных месяцев.
+"""
+import logging
+from datetime import datetime
+from typing import Iterable, Iterator, List
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+logger = logging.getLogger(__name__)
+
+# Секционированные таблицы в порядке создания секций (сначала родительская)
+PARTITIONED_TABLES = ("messages", "documents", "reactions")
+
+
+def month_start(value: datetime) -> datetime:
+    """Начало месяца даты"""
+    return datetime(value.year, value.month, 1)
+
+
+def next_month(value: datetime) -> datetime:
+    """Начало следующего месяца"""
+    if value.month == 12:
+        return datetime(value.year + 1, 1, 1)
+    return datetime(value.year, value.month + 1, 1)
+
+
+def add_months(value: datetime, months: int) -> datetime:
+    """Начало месяца через months месяцев"""
+    index = value.year * 12 + value.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def iter_months(start: datetime, end: datetime) -> Iterator[datetime]:
+    """Начала месяцев от месяца start до месяца end включительно"""
+    month = month_start(start)
+    while month <= end:
+        yield month
+        month = next_month(month)
+
+
+def partition_name(table: str, month: datetime) -> str:
+    """Имя секции месяца"""
+    return f"{table}_p{month:%Y_%m}"
+
+
+def list_partitions(connection, table: str) -> List[str]:
+    """Имена существующих секций таблицы"""
+    return list(connection.execute(text("""
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relname = :table AND p.relnamespace = to_regnamespace(current_schema())
+        ORDER BY c.relname
+    """), {"table": table}).scalars())
+
+
+def create_default_partitions(connection):
+    """Секции для строк вне созданных месяцев"""
+    for table in PARTITIONED_TABLES:
+        connection.execute(text(f"CREATE TABLE IF NOT EXISTS {table}_default PARTITION OF {table} DEFAULT"))
+
+
+def create_month_partitions(connection, start: datetime, end: datetime) -> List[str]:
+    """Создание недостающих секций месяцев от start до end включительно"""
+    return create_partitions(connection, iter_months(start, end))
+
+
+def create_partitions(connection, months: Iterable[datetime]) -> List[str]:
+    """
+    Создание недостающих секций указанных месяцев
+    
+    Каждая секция создается в своей точке сохранения: если в секции по умолчанию
+    уже есть строки этого месяца, PostgreSQL не даст создать секцию - ошибка
+    пишется в лог, остальные месяцы создаются.
+    
+    Returns:
+        Имена созданных секций
+    """
+    created = []
+    existing = {table: set(list_partitions(connection, table)) for table in PARTITIONED_TABLES}
+    for month in sorted({month_start(month) for month in months}):
+        for table in PARTITIONED_TABLES:
+            name = partition_name(table, month)
+            if name in existing[table]:
+                continue
+            try:
+                with connection.begin_nested():
+                    connection.execute(text(
+                        f"CREATE TABLE {name} PARTITION OF {table} "
+                        f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{next_month(month):%Y-%m-%d}')"
+                    ))
+            except DBAPIError as e:
+                logger.error(f"Не удалось создать секцию {name}: {e.orig}")
+                continue
+            created.append(name)
+    if created:
+        logger.info(f"Созданы секции: {', '.join(created)}")
+    return created
+
+
+def drop_empty_partitions(connection, before: datetime) -> List[str]:
+    """
+    Удаление пустых секций месяцев, закончившихся до before
+
+    Секция месяца удаляется во всех трех таблицах сразу и только если все три
+    пусты (например, после переноса месяца в архив).
+
+    Returns:
+        Имена удаленных секций
+    """
+    dropped = []
+    for name in list_partitions(connection, "messages"):
+        try:
+            month = datetime.strptime(name[len("messages_p"):], "%Y_%m")
+        except ValueError:
+            # Секция по умолчанию
+            continue
+        if next_month(month) > before:
+            continue
+        names = {table: partition_name(table, month) for table in reversed(PARTITIONED_TABLES)}
+        if any(connection.execute(text(f"SELECT EXISTS (SELECT 1 FROM {name})")).scalar()
+               for name in names.values()):
+            continue
+        # На секционированные таблицы ссылаются внешние ключи: секцию сначала отсоединяем
+        for table, name in names.items():
+            connection.execute(text(f"ALTER TABLE {table} DETACH PARTITION {name}"))
+            connection.execute(text(f"DROP TABLE {name}"))
+        dropped.extend(names.values())
+    if dropped:
+        logger.info(f"Удалены пустые секции: {', '.join(dropped)}")
+    return dropped
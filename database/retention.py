@@ -0,0 +1,103 @@
+"""
+Перенос старых сообщений из PostgreSQL в архив по сроку хранения
+
+Срок хранения в БД задается в месяцах: RETENTION_MONTHS для всех чатов и
+RETENTION_CHAT_MONTHS для отдельных (0 - хранить в БД без ограничения). Месяцы
+старше срока переносятся целиком: сообщения записываются в архив (MessageArchive)
+и только после записи файла удаляются из БД. Секции, опустевшие после переноса,
+удаляются. При RETENTION_KEEP_MEDIA=false файлы вложений перенесенных сообщений
+освобождаются (ref_count в media_blobs) и удаляются очисткой хранилища.
+"""
+import asyncio
+import logging
+from array import array
+from datetime import datetime, timedelta
+from typing import Dict
+from config import config
+from .archive import MessageArchive
+from .async_db_manager import AsyncDatabaseManager
+from .partitions import add_months, month_start, next_month
+
+logger = logging.getLogger(__name__)
+
+
+def get_retention_months(chat_id: int) -> int:
+    """Срок хранения сообщений чата в БД, месяцев (0 - без ограничения)"""
+    return config.RETENTION_CHAT_MONTHS.get(str(chat_id), config.RETENTION_MONTHS)
+
+
+def retention_enabled() -> bool:
+    """Задан ли срок хранения хотя бы для одного чата"""
+    return config.RETENTION_MONTHS > 0 or any(months > 0 for months in config.RETENTION_CHAT_MONTHS.values())
+
+
+class RetentionJob:
+    """Перенос сообщений старше срока хранения в архив"""
+
+    def __init__(self, db_manager: AsyncDatabaseManager, archive: MessageArchive):
+        """Инициализация"""
+        self.db_manager = db_manager
+        self.archive = archive
+        self.last_run = None
+        self.last_stats = {}
+
+    async def run(self, now: datetime = None) -> Dict[str, int]:
+        """
+        Один проход по всем чатам
+
+        Returns:
+            Счетчики: перенесено месяцев и сообщений, удалено секций
+        """
+        now = now or datetime.utcnow()
+        stats = {"months": 0, "messages": 0, "partitions_dropped": 0}
+        latest_cutoff = None
+        for chat in await self.db_manager.get_chat_list():
+            months = get_retention_months(chat.id)
+            if months <= 0:
+                continue
+            # Переносятся только закончившиеся месяцы целиком
+            cutoff = add_months(month_start(now), -months)
+            latest_cutoff = max(latest_cutoff or cutoff, cutoff)
+            for month in await self.db_manager.get_archive_months(chat.id, cutoff):
+                stats["messages"] += await self._archive_month(chat.id, month)
+                stats["months"] += 1
+
+        if latest_cutoff is not None:
+            dropped = await self.db_manager.drop_empty_partitions(latest_cutoff)
+            stats["partitions_dropped"] = len(dropped)
+
+        self.last_run = now
+        self.last_stats = stats
+        if stats["messages"]:
+            logger.info(
+                f"Перенесено в архив сообщений: {stats['messages']} "
+                f"(месяцев: {stats['months']}, удалено секций: {stats['partitions_dropped']})"
+            )
+        return stats
+
+    async def _archive_month(self, chat_id: int, month: datetime) -> int:
+        """
+        Перенос сообщений чата за месяц: запись в архив, затем удаление из БД
+
+        Сообщения читаются страницами (EXPORT_PAGE_SIZE) и сразу дописываются в файл
+        месяца; в памяти остаются только ID записей (8 байт на сообщение) для удаления.
+        """
+        end = next_month(month)
+        message_ids = array("q")
+        writer = await asyncio.to_thread(self.archive.open_month, chat_id, month)
+        try:
+            # Граница периода включительно: последняя микросекунда месяца
+            async for page in self.db_manager.iter_messages_by_date_range(
+                    chat_id, month, end - timedelta(microseconds=1), with_reactions=True):
+                await asyncio.to_thread(writer.write, page)
+                message_ids.extend(message.id for message in page)
+            if not message_ids:
+                return 0
+            await asyncio.to_thread(writer.commit)
+        finally:
+            await asyncio.to_thread(writer.close)
+        # Удаляются только записанные в архив сообщения: пришедшие позже
+        # перенесутся при следующем проходе
+        return await self.db_manager.delete_archived_messages(
+            chat_id, month, end, message_ids, release_media=not config.RETENTION_KEEP_MEDIA
+        )
@@ -0,0 +1,469 @@
+"""
+Очередь отложенной записи (write-behind) для операций с БД
+"""
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime
+from typing import Callable, List, Optional
+from sqlalchemy.exc import DBAPIError, InterfaceError, OperationalError
+from config import config
+from .async_db_manager import AsyncDatabaseManager
+from .journal import WriteAheadJournal
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindQueue:
+    """
+    Очередь операций записи, которые фоновый обработчик сохраняет пакетами
+
+    Операции накапливаются в памяти и записываются одной транзакцией, когда
+    набирается WRITE_BATCH_SIZE операций или проходит WRITE_FLUSH_INTERVAL
+    секунд с момента появления первой операции в пакете.
+
+    С журналом (WriteAheadJournal) каждая операция сначала дописывается в журнал на
+    диске, журнал сбрасывается (fsync) перед записью пакета в БД, а после фиксации
+    транзакции сдвигается контрольная точка. Если БД недоступна, очередь переходит
+    в режим догонки: новые операции пишутся только в журнал, а обработчик
+    повторяет запись из журнала по порядку, пока не догонит его конец.
+
+    Без журнала очередь - единственная копия операций: пока БД недоступна, пакет
+    повторяется с растущей задержкой, а следующие операции ждут в памяти.
+
+    call_when_durable сообщает, когда поставленные операции переживут аварийную
+    остановку: с журналом - после его сброса на диск, без журнала - после записи
+    пакета в БД.
+    """
+
+    def __init__(self, db_manager: AsyncDatabaseManager, max_batch_size: int = None,
+                 flush_interval: float = None, journal: WriteAheadJournal = None):
+        """Инициализация очереди"""
+        self.db_manager = db_manager
+        self.max_batch_size = max_batch_size or config.WRITE_BATCH_SIZE
+        self.flush_interval = (flush_interval if flush_interval is not None
+                               else config.WRITE_FLUSH_INTERVAL)
+        self.journal = journal
+        self._pending = []  # Список (операция, future или None, LSN в журнале или None)
+        self._event = None
+        self._flusher_task = None
+        self._closing = False
+        self._flush_listeners = []
+        # Режим догонки: операции берутся из журнала, а не из памяти
+        self._replaying = False
+        # Номер последней поставленной операции и последней сохраненной (в журнале
+        # на диске или в БД), ожидающие сохранения подписчики: (номер, callback)
+        self._sequence = 0
+        self._durable_sequence = 0
+        self._durable_waiters = deque()
+        # Без журнала: операции потеряны (остановка при недоступной БД), следующие
+        # операции уже не считаются сохраненными
+        self._lost = False
+
+    def add_flush_listener(self, callback: Callable[[List[dict]], None]):
+        """
+        Подписка на успешную запись пакета
+
+        callback вызывается со списком записанных операций после фиксации транзакции.
+        """
+        self._flush_listeners.append(callback)
+
+    async def start(self):
+        """Запуск фонового обработчика"""
+        if self._flusher_task is None:
+            self._closing = False
+            self._event = asyncio.Event()
+            if self.journal is not None:
+                self.journal.open()
+                # Операции, не дошедшие до БД при прошлом запуске
+                self._replaying = self.journal.lag > 0
+            self._flusher_task = asyncio.create_task(self._run())
+            logger.info(
+                f"Очередь записи запущена (пакет: {self.max_batch_size}, "
+                f"интервал: {self.flush_interval} сек)"
+            )
+
+    async def stop(self):
+        """Остановка фонового обработчика с записью всех накопленных операций"""
+        if self._flusher_task is None:
+            return
+        self._closing = True
+        self._event.set()
+        await self._flusher_task
+        self._flusher_task = None
+        if self.journal is not None:
+            # Операции, не записанные в БД при недоступной БД, остаются в журнале
+            self.sync_journal()
+            if self.journal.lag:
+                logger.warning(f"В журнале остались операции, не записанные в БД: {self.journal.lag}")
+            self.journal.close()
+        logger.info("Очередь записи остановлена")
+
+    def _enqueue(self, operation: dict, with_result: bool = False) -> Optional[asyncio.Future]:
+        """Добавление операции в очередь"""
+        future = asyncio.get_running_loop().create_future() if with_result else None
+        lsn = self.journal.append(operation) if self.journal is not None else None
+        self._sequence += 1
+        if self._replaying:
+            # Операция будет записана из журнала, ID записи не возвращается
+            if future is not None:
+                future.set_result(None)
+        else:
+            self._pending.append((operation, future, lsn))
+        self._event.set()
+        return future
+
+    def save_user(self, user_id: int, username: str = None,
+                  first_name: str = None, last_name: str = None):
+        """Постановка в очередь сохранения пользователя"""
+        self._enqueue({
+            'op': 'user',
+            'user_id': user_id,
+            'username': username,
+            'first_name': first_name,
+            'last_name': last_name
+        })
+
+    def save_chat(self, chat_id: int, title: str = None, chat_type: str = None):
+        """Постановка в очередь сохранения чата"""
+        self._enqueue({
+            'op': 'chat',
+            'chat_id': chat_id,
+            'title': title,
+            'chat_type': chat_type
+        })
+
+    def save_message(self, message_id: int, chat_id: int, user_id: int = None,
+                     text: str = None, message_date: datetime = None,
+                     edited_date: datetime = None) -> asyncio.Future:
+        """
+        Постановка в очередь сохранения сообщения
+
+        Returns:
+            Future, который получит ID записи в таблице messages после записи
+            пакета (или None при ошибке записи)
+        """
+        return self._enqueue({
+            'op': 'message',
+            'message_id': message_id,
+            'chat_id': chat_id,
+            'user_id': user_id,
+            'text': text,
+            'message_date': message_date,
+            'edited_date': edited_date
+        }, with_result=True)
+
+    def save_document(self, chat_id: int, message_id: int, file_id: str,
+                      file_unique_id: str = None, file_name: str = None,
+                      mime_type: str = None, file_size: int = None,
+                      document_type: str = None, file_path: str = None,
+                      download_policy: str = None):
+        """
+        Постановка в очередь сохранения документа
+
+        Документ привязывается к сообщению по (chat_id, message_id): ID записи
+        сообщения подставляется при записи пакета. download_policy ('eager',
+        'lazy' или 'never') определяет, скачивать ли файл сразу.
+        """
+        self._enqueue({
+            'op': 'document',
+            'chat_id': chat_id,
+            'message_id': message_id,
+            'file_id': file_id,
+            'file_unique_id': file_unique_id,
+            'file_name': file_name,
+            'mime_type': mime_type,
+            'file_size': file_size,
+            'document_type': document_type,
+            'file_path': file_path,
+            'download_policy': download_policy
+        })
+
+    def save_reaction(self, chat_id: int, message_id: int, emoji: str = None,
+                      user_id: int = None):
+        """Постановка в очередь сохранения реакции на сообщение"""
+        self._enqueue({
+            'op': 'reaction',
+            'chat_id': chat_id,
+            'message_id': message_id,
+            'emoji': emoji,
+            'user_id': user_id
+        })
+
+    def apply_reaction_change(self, chat_id: int, message_id: int, user_id: int,
+                              old_emojis: List[str], new_emojis: List[str]):
+        """Постановка в очередь замены реакций пользователя на сообщение"""
+        self._enqueue({
+            'op': 'reaction_change',
+            'chat_id': chat_id,
+            'message_id': message_id,
+            'user_id': user_id,
+            'old_emojis': list(old_emojis),
+            'new_emojis': list(new_emojis)
+        })
+
+    @property
+    def pending_count(self) -> int:
+        """Количество операций, ожидающих записи"""
+        if self._replaying:
+            return self.journal.lag
+        return len(self._pending)
+
+    @property
+    def replaying(self) -> bool:
+        """Очередь догоняет журнал после недоступности БД"""
+        return self._replaying
+
+    def get_journal_status(self) -> Optional[dict]:
+        """Состояние журнала (см. WriteAheadJournal.read_status) или None без журнала"""
+        if self.journal is None:
+            return None
+        status = self.journal.get_status()
+        status["replaying"] = self._replaying
+        return status
+
+    def sync_journal(self):
+        """Сброс журнала на диск: поставленные в очередь операции переживут аварийную остановку"""
+        if self.journal is not None and self.journal._file is not None:
+            self.journal.sync()
+            self._mark_durable(self._sequence)
+
+    def call_when_durable(self, callback: Callable[[], None]):
+        """
+        Вызов callback, когда все уже поставленные операции сохранены
+
+        С журналом операции сохранены после его сброса на диск (sync_journal,
+        запись пакета или догонка), без журнала - после записи их пакета в БД
+        (операции, которые БД отвергла, пропускаются: повтор их не исправит). Если
+        пакет потерян при остановке очереди, callback больше не вызывается. Если
+        ожидать нечего, callback вызывается сразу.
+        """
+        if self._sequence <= self._durable_sequence:
+            callback()
+        else:
+            self._durable_waiters.append((self._sequence, callback))
+
+    def _mark_durable(self, sequence: int):
+        """Операции до sequence включительно сохранены: вызов дождавшихся подписчиков"""
+        if sequence <= self._durable_sequence or self._lost:
+            return
+        self._durable_sequence = sequence
+        while self._durable_waiters and self._durable_waiters[0][0] <= sequence:
+            _, callback = self._durable_waiters.popleft()
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Ошибка в обработчике сохранения операций: {e}", exc_info=True)
+
+    async def _run(self):
+        """Основной цикл фонового обработчика"""
+        loop = asyncio.get_running_loop()
+        while True:
+            if self._replaying:
+                if not await self._replay_journal():
+                    # Остановка при недоступной БД: операции остаются в журнале
+                    return
+                continue
+
+            if not self._pending:
+                if self._closing:
+                    return
+                self._event.clear()
+                await self._event.wait()
+                continue
+
+            # Даём пакету наполниться до нужного размера или истечения интервала
+            deadline = loop.time() + self.flush_interval
+            while len(self._pending) < self.max_batch_size and not self._closing:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                self._event.clear()
+                try:
+                    await asyncio.wait_for(self._event.wait(), timeout)
+                except asyncio.TimeoutError:
+                    break
+
+            batch = self._pending[:self.max_batch_size]
+            self._pending = self._pending[self.max_batch_size:]
+            # Без журнала очередь - единственная копия операций, они записываются по порядку
+            written = self._sequence - len(self._pending)
+            if not await self._write_batch(batch):
+                self._lost = True
+            elif self.journal is None:
+                self._mark_durable(written)
+
+    async def _write_batch(self, batch: list) -> bool:
+        """
+        Запись пакета операций одной транзакцией
+
+        Returns:
+            False, если операции потеряны: без журнала БД недоступна при остановке
+        """
+        operations = [operation for operation, _, _ in batch]
+        if self.journal is not None:
+            # Пакет на диске до записи в БД
+            self.sync_journal()
+        try:
+            results = await self.db_manager.save_batch(operations)
+        except Exception as e:
+            logger.error(f"Ошибка при записи пакета из {len(batch)} операций: {e}", exc_info=True)
+            results = [None] * len(batch)
+            if self.journal is not None:
+                # Пакет и все последующие операции повторяются из журнала
+                logger.warning("Запись в БД не удалась, операции сохраняются в журнал до восстановления")
+                self._start_replay()
+            else:
+                results = await self._retry_batch(operations, e)
+        else:
+            if self.journal is not None:
+                self.journal.checkpoint(batch[-1][2])
+            self._notify_listeners(operations)
+
+        for (_, future, _), result in zip(batch, results or [None] * len(batch)):
+            if future is not None and not future.done():
+                future.set_result(result)
+        return results is not None
+
+    async def _retry_batch(self, operations: List[dict], error: Exception) -> Optional[list]:
+        """
+        Повтор записи пакета без журнала
+
+        Пока БД недоступна, пакет повторяется с растущей задержкой. Пакет, который БД
+        отвергает (ошибка в данных), записывается по одной операции: отвергнутые
+        операции пропускаются с записью в лог.
+
+        Returns:
+            Результаты операций или None, если БД недоступна при остановке очереди
+        """
+        delay = config.JOURNAL_RETRY_DELAY
+        while self._is_unavailable(error):
+            if self._closing:
+                logger.error(f"БД недоступна при остановке, потеряно операций: {len(operations)}")
+                return None
+            logger.warning(f"БД недоступна, повтор записи пакета через {delay:.0f} сек")
+            await self._sleep_unless_closing(delay)
+            delay = min(delay * 2, config.JOURNAL_MAX_RETRY_DELAY)
+            try:
+                results = await self.db_manager.save_batch(operations)
+            except Exception as e:
+                error = e
+            else:
+                self._notify_listeners(operations)
+                return results
+
+        results = []
+        for operation in operations:
+            while True:
+                try:
+                    result = await self.db_manager.save_batch([operation])
+                except Exception as e:
+                    if not self._is_unavailable(e):
+                        logger.error(f"Операция отвергнута БД и пропущена: {operation}")
+                        results.append(None)
+                        break
+                    if self._closing:
+                        logger.error("БД недоступна при остановке, операции пакета потеряны")
+                        return None
+                    await self._sleep_unless_closing(config.JOURNAL_RETRY_DELAY)
+                else:
+                    self._notify_listeners([operation])
+                    results.extend(result)
+                    break
+        return results
+
+    def _notify_listeners(self, operations: List[dict]):
+        """Вызов подписчиков на запись пакета"""
+        for callback in self._flush_listeners:
+            try:
+                callback(operations)
+            except Exception as e:
+                logger.error(f"Ошибка в обработчике записи пакета: {e}", exc_info=True)
+
+    def _start_replay(self):
+        """Переход в режим догонки: операции из памяти уже есть в журнале"""
+        self._replaying = True
+        for _, future, _ in self._pending:
+            if future is not None and not future.done():
+                future.set_result(None)
+        self._pending = []
+
+    async def _replay_journal(self) -> bool:
+        """
+        Запись операций из журнала в БД по порядку до конца журнала
+
+        Пока БД недоступна, запись повторяется с растущей задержкой. Пакет, который
+        БД отвергает (ошибка в данных), записывается по одной операции: отвергнутые
+        операции пропускаются с записью в лог. При остановке очереди догонка
+        прекращается после первой неудачи - журнал дописывается при следующем запуске.
+
+        Returns:
+            True, если журнал записан полностью
+        """
+        delay = config.JOURNAL_RETRY_DELAY
+        logger.info(f"Запись операций из журнала в БД: {self.journal.lag}")
+        while True:
+            self.sync_journal()
+            records = self.journal.read(self.journal.checkpoint_lsn, self.max_batch_size)
+            if not records:
+                # Новые операции больше не пишутся только в журнал
+                self._replaying = False
+                logger.info("Журнал записан в БД, очередь работает в обычном режиме")
+                return True
+
+            operations = [operation for _, operation in records]
+            try:
+                await self.db_manager.save_batch(operations)
+            except Exception as e:
+                if self._is_unavailable(e):
+                    if self._closing:
+                        return False
+                    logger.warning(f"БД недоступна, повтор через {delay:.0f} сек "
+                                   f"(в журнале {self.journal.lag} операций)")
+                    await self._sleep_unless_closing(delay)
+                    delay = min(delay * 2, config.JOURNAL_MAX_RETRY_DELAY)
+                    continue
+                if not await self._replay_one_by_one(records):
+                    return False
+            else:
+                self.journal.checkpoint(records[-1][0])
+                self._notify_listeners(operations)
+            delay = config.JOURNAL_RETRY_DELAY
+
+    async def _replay_one_by_one(self, records: list) -> bool:
+        """
+        Запись пакета из журнала по одной операции с пропуском отвергнутых БД
+
+        Returns:
+            False, если БД стала недоступна во время остановки очереди
+        """
+        for lsn, operation in records:
+            while True:
+                try:
+                    await self.db_manager.save_batch([operation])
+                except Exception as e:
+                    if not self._is_unavailable(e):
+                        logger.error(f"Операция {lsn} из журнала отвергнута БД и пропущена: {operation}")
+                        break
+                    if self._closing:
+                        return False
+                    await self._sleep_unless_closing(config.JOURNAL_RETRY_DELAY)
+                else:
+                    self._notify_listeners([operation])
+                    break
+            self.journal.checkpoint(lsn)
+        return True
+
+    async def _sleep_unless_closing(self, delay: float):
+        """Пауза перед повтором, прерываемая остановкой очереди"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + delay
+        while not self._closing and loop.time() < deadline:
+            await asyncio.sleep(min(0.5, deadline - loop.time()))
+
+    @staticmethod
+    def _is_unavailable(error: Exception) -> bool:
+        """Ошибка доступности БД (в отличие от ошибки в данных)"""
+        if isinstance(error, (OperationalError, InterfaceError, OSError, asyncio.TimeoutError)):
+            return True
+        return isinstance(error, DBAPIError) and error.connection_invalidated
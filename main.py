@@ -1,11 +1,25 @@
+import asyncio
 import logging
+import os
+import signal
 from telegram import Update
-from telegram.ext import Application, MessageHandler, filters, ContextTypes
+from telegram.ext import Application, ApplicationHandlerStop, MessageHandler, TypeHandler, filters, ContextTypes
 from telegram.error import Conflict
 from config import config
-from database.db_manager import DatabaseManager
+from database.async_db_manager import AsyncDatabaseManager
+from database.write_queue import WriteBehindQueue
+from database.journal import WriteAheadJournal
+from database.archive import MessageArchive
+from database.retention import RetentionJob, retention_enabled
 from telegram_collector.collector import MessageCollector
+from telegram_collector.downloader import DownloadManager
+from telegram_collector.webhook import WebhookServer
+from telegram_collector.polling import UpdatePoller
+from telegram_collector.update_processor import ChatOrderedUpdateProcessor
+from telegram_collector.offsets import UpdateOffsetTracker
+from telegram_collector.sharding import ShardedDispatcher
 from telegram_admin.admin_bot import AdminBot
+from telegram_admin.export_cache import ExportCache
 
 # Настройка логирования
 logging.basicConfig(
@@ -14,15 +28,37 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Типы обновлений для сбора сообщений
+ALLOWED_UPDATES = ["message", "callback_query", "channel_post", "edited_message", "message_reaction"]
+
 
 class TelegramCollectorBot:
     """Главный класс бота, объединяющий все модули"""
     
     def __init__(self):
         """Инициализация бота"""
-        self.db_manager = DatabaseManager()
-        self.collector = MessageCollector(self.db_manager)
-        self.admin_bot = AdminBot(self.db_manager)
+        self.db_manager = AsyncDatabaseManager()
+        # Операции записи сначала попадают в журнал на диске (переживают недоступность БД)
+        journal = (WriteAheadJournal(os.path.join(config.JOURNAL_PATH, "main"))
+                   if config.JOURNAL_ENABLED else None)
+        self.write_queue = WriteBehindQueue(self.db_manager, journal=journal)
+        # Обновление засчитывается в позицию только после сохранения его данных
+        # (сброса журнала на диск или, без журнала, записи пакета в БД)
+        self.offset_tracker = UpdateOffsetTracker(before_flush=self.write_queue.sync_journal,
+                                                  when_durable=self.write_queue.call_when_durable)
+        self.download_manager = DownloadManager(self.db_manager)
+        # Обработчики загрузок просыпаются сразу после записи новых документов
+        self.write_queue.add_flush_listener(self.download_manager.on_batch_written)
+        self.collector = MessageCollector(self.write_queue)
+        # Сообщения старше срока хранения переносятся из БД в архив, экспорт читает оба
+        self.archive = MessageArchive()
+        self.retention_job = RetentionJob(self.db_manager, self.archive) if retention_enabled() else None
+        # Готовые файлы экспорта переиспользуются и дописываются новыми сообщениями
+        export_cache = ExportCache() if config.EXPORT_CACHE_SIZE > 0 else None
+        self.admin_bot = AdminBot(self.db_manager, self.download_manager, self.archive, export_cache)
+        # Сохранение сообщений в отдельных процессах (WORKER_PROCESSES > 0)
+        self.dispatcher = ShardedDispatcher() if config.WORKER_PROCESSES > 0 else None
+        self.maintenance_tasks = []
         self.application = None
     
     def setup_application(self):
@@ -32,18 +68,38 @@ class TelegramCollectorBot:
             raise ValueError("TELEGRAM_BOT_TOKEN не установлен в .env файле")
         if not config.ADMIN_ID or config.ADMIN_ID == 0:
             raise ValueError("ADMIN_ID не установлен в .env файле")
-        
-        # Создаем таблицы в БД
-        try:
-            self.db_manager.create_tables()
-            logger.info("База данных инициализирована")
-        except Exception as e:
-            logger.error(f"Ошибка при инициализации БД: {e}")
-            logger.error("Убедитесь, что PostgreSQL запущен и база данных создана")
-            raise
+        if config.BOT_MODE == "webhook" and not config.WEBHOOK_SECRET_TOKEN:
+            raise ValueError("WEBHOOK_SECRET_TOKEN не установлен в .env файле")
         
         # Создаем приложение Telegram
-        self.application = Application.builder().token(config.TELEGRAM_BOT_TOKEN).build()
+        builder = (
+            Application.builder()
+            .token(config.TELEGRAM_BOT_TOKEN)
+            .post_init(self._post_init)
+            .post_shutdown(self._post_shutdown)
+        )
+        # Разные чаты обрабатываются параллельно, обновления одного чата - по порядку;
+        # уже обработанные обновления (повтор после перезапуска) пропускаются
+        builder = builder.concurrent_updates(
+            ChatOrderedUpdateProcessor(config.UPDATE_CONCURRENCY, self.offset_tracker)
+        )
+        if config.TELEGRAM_API_BASE_URL:
+            base_url = config.TELEGRAM_API_BASE_URL.rstrip("/")
+            builder = builder.base_url(f"{base_url}/bot").base_file_url(f"{base_url}/file/bot")
+        # Обновления получает WebhookServer или UpdatePoller: Updater PTB подтверждает
+        # getUpdates до сохранения данных обновлений
+        builder = builder.updater(None)
+        self.application = builder.build()
+        
+        # Обновления для сборщика передаются процессам-обработчикам до всех остальных обработчиков
+        if self.dispatcher:
+            async def shard_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+                if await self.dispatcher.route(update.to_dict()):
+                    # Обновление завершится подтверждением процесса-обработчика
+                    self.offset_tracker.forward(update.update_id)
+                    raise ApplicationHandlerStop
+            
+            self.application.add_handler(TypeHandler(Update, shard_handler), group=-1)
         
         # Добавляем обработчики команд администратора
         for handler in self.admin_bot.get_handlers():
@@ -98,6 +154,138 @@ class TelegramCollectorBot:
         
         
         logger.info("Бот инициализирован")
+    
+    async def _post_init(self, application: Application):
+        """Инициализация БД и запуск фоновых задач после инициализации приложения"""
+        # Создаем таблицы в БД
+        try:
+            await self.db_manager.create_tables()
+            logger.info("База данных инициализирована")
+        except Exception as e:
+            logger.error(f"Ошибка при инициализации БД: {e}")
+            logger.error("Убедитесь, что PostgreSQL запущен и база данных создана")
+            raise
+        
+        await self.write_queue.start()
+        await self.download_manager.start(application.bot)
+        self.maintenance_tasks.append(asyncio.create_task(self._maintain_partitions()))
+        if self.retention_job:
+            self.maintenance_tasks.append(asyncio.create_task(self._apply_retention()))
+        if config.MEDIA_CLEANUP_INTERVAL > 0:
+            self.maintenance_tasks.append(asyncio.create_task(self._cleanup_media()))
+        if self.dispatcher:
+            await self.dispatcher.start(on_documents=self.download_manager.notify,
+                                        on_acknowledged=self.offset_tracker.complete)
+        
+        self.offset_tracker.load(application.bot.id)
+        await self.offset_tracker.start()
+    
+    async def _post_shutdown(self, application: Application):
+        """
+        Остановка фоновых задач с записью накопленных данных
+        
+        К этому моменту Application дождался выполняемых обработчиков. Затем
+        дописываются начатые загрузки, очередь записи сбрасывается в БД и последней
+        сохраняется позиция обработанных обновлений.
+        """
+        for task in self.maintenance_tasks:
+            task.cancel()
+        await asyncio.gather(*self.maintenance_tasks, return_exceptions=True)
+        if self.dispatcher:
+            await self.dispatcher.stop()
+        await self.download_manager.stop()
+        await self.write_queue.stop()
+        await self.offset_tracker.stop()
+        await self.db_manager.close()
+    
+    async def _maintain_partitions(self):
+        """Периодическое создание секций следующих месяцев (PARTITION_MONTHS_AHEAD вперед)"""
+        while True:
+            await asyncio.sleep(config.PARTITION_CHECK_INTERVAL)
+            try:
+                await self.db_manager.ensure_partitions()
+            except Exception as e:
+                # Строки без секции месяца попадут в секцию по умолчанию
+                logger.error(f"Ошибка при создании секций: {e}")
+    
+    async def _apply_retention(self):
+        """Перенос старых сообщений в архив при запуске и раз в RETENTION_CHECK_INTERVAL"""
+        while True:
+            try:
+                await self.retention_job.run()
+            except Exception as e:
+                # Месяц, запись которого в архив не завершилась, перенесется повторно
+                logger.error(f"Ошибка при переносе сообщений в архив: {e}")
+            await asyncio.sleep(config.RETENTION_CHECK_INTERVAL)
+    
+    async def _cleanup_media(self):
+        """Периодическое удаление файлов, на которые не ссылается ни один документ"""
+        while True:
+            await asyncio.sleep(config.MEDIA_CLEANUP_INTERVAL)
+            try:
+                removed = await self.download_manager.cleanup_media()
+                if removed:
+                    logger.info(f"Удалено неиспользуемых файлов: {removed}")
+            except Exception as e:
+                # Записи без ссылок останутся до следующего прохода
+                logger.error(f"Ошибка при очистке хранилища файлов: {e}")
+    
+    def get_health(self) -> dict:
+        """Состояние фоновых очередей для health-эндпоинта"""
+        health = {
+            "write_queue": self.write_queue.pending_count,
+            "write_queue_replaying": self.write_queue.replaying,
+            "downloads_active": self.download_manager.active_count,
+            "update_offset": self.offset_tracker.get_stats()
+        }
+        update_processor = self.application.update_processor
+        if isinstance(update_processor, ChatOrderedUpdateProcessor):
+            health["updates"] = update_processor.get_stats()
+        if self.dispatcher:
+            health["workers"] = self.dispatcher.get_stats()
+        if self.retention_job and self.retention_job.last_run:
+            health["retention"] = {
+                "last_run": self.retention_job.last_run.isoformat(),
+                **self.retention_job.last_stats
+            }
+        return health
+    
+    def run(self):
+        """Запуск бота (блокирующий вызов)"""
+        asyncio.run(self._run())
+    
+    async def _run(self):
+        """Жизненный цикл приложения: HTTP-сервер (webhook) или getUpdates (UpdatePoller)"""
+        application = self.application
+        if config.BOT_MODE == "webhook":
+            router = self.dispatcher.route if self.dispatcher else None
+            source = WebhookServer(application, self.get_health, ALLOWED_UPDATES, router)
+        else:
+            # Накопившиеся обновления не отбрасываются: повторы пропускает offset_tracker
+            source = UpdatePoller(application, self.offset_tracker, ALLOWED_UPDATES)
+        
+        # Повторяем порядок run_polling: initialize, post_init, start ... stop, shutdown, post_shutdown
+        await application.initialize()
+        await application.post_init(application)
+        await application.start()
+        try:
+            await source.start()
+            
+            stop_event = asyncio.Event()
+            loop = asyncio.get_running_loop()
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                try:
+                    loop.add_signal_handler(sig, stop_event.set)
+                except NotImplementedError:
+                    # Windows: остановка по KeyboardInterrupt
+                    pass
+            await stop_event.wait()
+            logger.info("Получен сигнал остановки")
+        finally:
+            await source.stop()
+            await application.stop()
+            await application.shutdown()
+            await application.post_shutdown(application)
 
 
 def main():
@@ -124,10 +312,7 @@ def main():
         
         # Запускаем бота (блокирующий вызов)
         # allowed_updates включает все типы обновлений для сбора сообщений
-        bot.application.run_polling(
-            drop_pending_updates=True,
-            allowed_updates=["message", "callback_query", "channel_post", "edited_message", "message_reaction"]
-        )
+        bot.run()
         
     except KeyboardInterrupt:
         logger.info("Получен сигнал остановки")
@@ -1,31 +1,137 @@
 """
 Модуль для реализации админ-интерфейса бота
 """
+import asyncio
+import html
 import os
-from telegram import Update
-from telegram.ext import ContextTypes, CommandHandler
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.constants import ParseMode
+from telegram.ext import ContextTypes, CommandHandler, CallbackQueryHandler
 from datetime import datetime, timedelta
-from typing import List
+from typing import AsyncIterator, BinaryIO, List, Tuple
 from config import config
-from database.db_manager import DatabaseManager
+from database.async_db_manager import AsyncDatabaseManager
+from database.archive import DOCUMENT_FIELDS, MessageArchive
 from database.models import Message, Chat
+from database.journal import WriteAheadJournal
+from database.operations import HIGHLIGHT_START, HIGHLIGHT_STOP
+from telegram_collector.downloader import DownloadManager
+from .export_cache import ExportCache
+from .export_formats import ExportFormat, ExportWriter, TextFormat, format_names, parse_export_format
+from .file_archive import ZipVolumeWriter
+from .sender import OutboundSender
+
+# Сколько файлов /files отправляет по одному (без zip)
+FILES_SEND_LIMIT = 50
 
 
 class AdminBot:
     """Класс для обработки команд администратора"""
     
-    def __init__(self, db_manager: DatabaseManager):
+    def __init__(self, db_manager: AsyncDatabaseManager, download_manager: DownloadManager = None,
+                 archive: MessageArchive = None, export_cache: ExportCache = None,
+                 sender: OutboundSender = None):
         """Инициализация админ-бота"""
         self.db_manager = db_manager
+        # Скачивание файлов по запросу (политика lazy)
+        self.download_manager = download_manager
+        # Сообщения, перенесенные из БД по сроку хранения
+        self.archive = archive
+        # Готовые файлы экспорта (None - экспорт каждый раз собирается заново)
+        self.export_cache = export_cache
+        # Все ответы бота: ограничение частоты, параллельные загрузки и повторы
+        self.sender = sender or OutboundSender()
     
     def is_admin(self, user_id: int) -> bool:
         """Проверка, является ли пользователь администратором"""
         return user_id == config.ADMIN_ID
     
+    async def _get_messages(self, chat_id: int, start_date: datetime, end_date: datetime) -> List[Message]:
+        """Сообщения за период из БД и, для перенесенных месяцев, из архива"""
+        return [message async for page in self._iter_messages(chat_id, start_date, end_date) for message in page]
+
+    async def _iter_messages(self, chat_id: int, start_date: datetime, end_date: datetime,
+                             after: Tuple[datetime, int] = None,
+                             watermark: dict = None) -> AsyncIterator[List[Message]]:
+        """
+        Сообщения за период из БД и архива страницами по возрастанию даты
+
+        Оба источника читаются страницами и сливаются на лету. Сообщение, пришедшее
+        с правкой после переноса, есть и в БД, и в архиве (с той же датой) - берется
+        версия из БД: архивная запись выдается только после сообщений БД с той же
+        датой и пропускается, если ее message_id среди них.
+
+        Args:
+            after: (message_date, id) сообщения БД, после которого начинать (из архива -
+                сообщения с более поздней датой)
+            watermark: Отметка выгруженных из БД сообщений для кэша экспорта
+                (count, last, max_edited), обновляется по мере чтения
+        """
+        db_pages = self._track_watermark(
+            self.db_manager.iter_messages_by_date_range(chat_id, start_date, end_date, after=after), watermark
+        )
+        if self.archive is None or not await asyncio.to_thread(self.archive.get_months, chat_id):
+            async for page in db_pages:
+                yield page
+            return
+
+        archived_pages = self.archive.iter_pages(chat_id, after[0] if after else start_date, end_date)
+        archived = deque()
+
+        async def peek_archived():
+            while not archived:
+                page = await asyncio.to_thread(next, archived_pages, None)
+                if page is None:
+                    return None
+                archived.extend(message for message in page
+                                if after is None or message.message_date > after[0])
+            return archived[0]
+
+        # message_id сообщений БД с последней встреченной датой
+        last_date, last_ids = None, set()
+        async for page in db_pages:
+            merged = []
+            for message in page:
+                candidate = await peek_archived()
+                while candidate is not None and candidate.message_date < message.message_date:
+                    archived.popleft()
+                    if candidate.message_date != last_date or candidate.message_id not in last_ids:
+                        merged.append(candidate)
+                    candidate = await peek_archived()
+                if message.message_date != last_date:
+                    last_date, last_ids = message.message_date, set()
+                last_ids.add(message.message_id)
+                merged.append(message)
+            yield merged
+
+        while await peek_archived() is not None:
+            tail = [candidate for candidate in archived
+                    if candidate.message_date != last_date or candidate.message_id not in last_ids]
+            archived.clear()
+            if tail:
+                yield tail
+
+    @staticmethod
+    async def _track_watermark(pages: AsyncIterator[List[Message]],
+                               watermark: dict = None) -> AsyncIterator[List[Message]]:
+        """Страницы из БД с обновлением отметки выгруженных сообщений"""
+        async for page in pages:
+            if watermark is not None:
+                watermark["count"] += len(page)
+                watermark["last"] = (page[-1].message_date, page[-1].id)
+                for message in page:
+                    if message.edited_date and (watermark["max_edited"] is None
+                                                or message.edited_date > watermark["max_edited"]):
+                        watermark["max_edited"] = message.edited_date
+            yield page
+    
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик команды /start"""
         if not self.is_admin(update.effective_user.id):
-            await update.message.reply_text("У вас нет доступа к этому боту.")
+            await self.sender.reply_text(update.message, "У вас нет доступа к этому боту.")
             return
         
         welcome_text = """
@@ -34,27 +140,39 @@ class AdminBot:
 Доступные команды:
 /start - Показать это сообщение
 /chats - Список всех чатов
-/export <chat_id> <days> - Экспорт сообщений за последние N дней
-/export_date <chat_id> <start_date> <end_date> - Экспорт за период (формат: YYYY-MM-DD)
-/files <chat_id> <days> - Получить файлы за последние N дней
+/export <chat_id> <days> [format] - Экспорт сообщений за последние N дней
+/export_date <chat_id> <start_date> <end_date> [format] - Экспорт за период (формат: YYYY-MM-DD)
+/files <chat_id> <days> [zip] - Получить файлы за последние N дней (zip - архивами)
+/journal - Состояние журнала записи (операции, еще не записанные в БД)
+/search [chat:<chat_id>] [from:<date>] [to:<date>] <запрос> - Поиск по тексту сообщений
+/find_chat <название> - Найти чат по названию (с опечатками)
+/find_user <имя> - Найти пользователя по username или имени
+/find_file [chat:<chat_id>] [user:<user_id>] <имя файла> - Найти файл по имени
+/stats <chat_id> <days> - Активность чата за последние N дней
+/stats <chat_id> <start_date> <end_date> - Активность чата за период (формат: YYYY-MM-DD)
 
 Примеры:
 /export -5148403988 1 - Экспорт за последний день
 /export_date -5148403988 2026-01-01 2026-01-31 - Экспорт за период
+/export -5148403988 30 csv.gz - Экспорт в CSV со сжатием gzip
 /files -5148403988 7 - Получить файлы за последние 7 дней
+/files -5148403988 30 zip - Все файлы за 30 дней zip-архивами
+/search chat:-5148403988 from:2026-01-01 отчет "по продажам" - Поиск в чате с начала года
+/find_file user:123456789 договор pdf - Файлы пользователя с похожим именем
+/stats -5148403988 30 - Активность за последние 30 дней
         """
-        await update.message.reply_text(welcome_text)
+        await self.sender.reply_text(update.message, welcome_text)
     
     async def chats_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик команды /chats - список всех чатов"""
         if not self.is_admin(update.effective_user.id):
-            await update.message.reply_text("У вас нет доступа к этой команде.")
+            await self.sender.reply_text(update.message, "У вас нет доступа к этой команде.")
             return
         
         try:
-            chats = self.db_manager.get_chat_list()
+            chats = await self.db_manager.get_chat_list()
             if not chats:
-                await update.message.reply_text("Чаты не найдены.")
+                await self.sender.reply_text(update.message, "Чаты не найдены.")
                 return
             
             # Если один чат сохранен и как group и как supergroup, оставляем только supergroup
@@ -86,7 +204,7 @@ class AdminBot:
                 filtered_chats[chat.id] = chat
             
             if not filtered_chats:
-                await update.message.reply_text("Группы и супергруппы не найдены.")
+                await self.sender.reply_text(update.message, "Группы и супергруппы не найдены.")
                 return
             
             response = "📋 Список чатов:\n\n"
@@ -101,28 +219,36 @@ class AdminBot:
             if len(response) > 4000:
                 chunks = [response[i:i+4000] for i in range(0, len(response), 4000)]
                 for chunk in chunks:
-                    await update.message.reply_text(chunk)
+                    await self.sender.reply_text(update.message, chunk)
             else:
-                await update.message.reply_text(response)
+                await self.sender.reply_text(update.message, response)
         
         except Exception as e:
-            await update.message.reply_text(f"Ошибка при получении списка чатов: {e}")
+            await self.sender.reply_text(update.message, f"Ошибка при получении списка чатов: {e}")
     
     async def export_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик команды /export - экспорт за последние N дней"""
         if not self.is_admin(update.effective_user.id):
-            await update.message.reply_text("У вас нет доступа к этой команде.")
+            await self.sender.reply_text(update.message, "У вас нет доступа к этой команде.")
             return
         
         try:
             args = context.args
             if len(args) < 2:
-                await update.message.reply_text(
-                    "Использование: /export <chat_id> <days>\n"
-                    "Пример: /export 123456789 7"
+                await self.sender.reply_text(
+                    update.message,
+                    "Использование: /export <chat_id> <days> [format]\n"
+                    f"Форматы: {', '.join(format_names())}\n"
+                    "Пример: /export 123456789 7 csv.gz"
                 )
                 return
             
+            try:
+                export_format, compression = parse_export_format(args[2] if len(args) > 2 else TextFormat.name)
+            except ValueError as e:
+                await self.sender.reply_text(update.message, f"Ошибка: {e}")
+                return
+            
             # Поддерживаем как положительный, так и отрицательный ID
             # Если пользователь ввел положительный ID для группы, пробуем оба варианта
             chat_id = int(args[0])
@@ -130,66 +256,43 @@ class AdminBot:
             
             end_date = datetime.utcnow()
             start_date = end_date - timedelta(days=days)
+            if self.export_cache is not None:
+                # Начало периода - полночь: в течение дня повторный экспорт находит
+                # запись кэша и дописывает в нее только новые сообщения
+                start_date = start_date.replace(hour=0, minute=0, second=0, microsecond=0)
             
-            # Пробуем найти сообщения с указанным ID
-            messages = self.db_manager.get_messages_by_date_range(chat_id, start_date, end_date)
-            
-            # Если не найдено и ID положительный, пробуем отрицательный (для групп)
-            if not messages and chat_id > 0:
-                messages = self.db_manager.get_messages_by_date_range(-chat_id, start_date, end_date)
-                if messages:
-                    chat_id = -chat_id  # Обновляем для сообщения об ошибке
-            
-            if not messages:
-                await update.message.reply_text(
-                    f"Сообщения не найдены в чате {chat_id} за последние {days} дней."
-                )
-                return
-            
-            # Формируем экспорт
-            export_text = self._format_export(messages, start_date, end_date)
-            
-            # Отправляем файл, если сообщение слишком длинное
-            if len(export_text) > 4000:
-                # Сохраняем во временный файл
-                filename = f"export_{chat_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
-                with open(filename, 'w', encoding='utf-8') as f:
-                    f.write(export_text)
-                
-                try:
-                    with open(filename, 'rb') as file:
-                        await update.message.reply_document(
-                            document=file,
-                            filename=filename
-                        )
-                finally:
-                    # Удаляем временный файл
-                    if os.path.exists(filename):
-                        os.remove(filename)
-            else:
-                await update.message.reply_text(export_text)
+            await self._export(update, chat_id, start_date, end_date, f"за последние {days} дней",
+                               export_format, compression, rolling=self.export_cache is not None)
         
         except ValueError:
-            await update.message.reply_text("Ошибка: неверный формат аргументов.")
+            await self.sender.reply_text(update.message, "Ошибка: неверный формат аргументов.")
         except Exception as e:
-            await update.message.reply_text(f"Ошибка при экспорте: {e}")
+            await self.sender.reply_text(update.message, f"Ошибка при экспорте: {e}")
     
     async def export_date_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик команды /export_date - экспорт за период"""
         if not self.is_admin(update.effective_user.id):
-            await update.message.reply_text("У вас нет доступа к этой команде.")
+            await self.sender.reply_text(update.message, "У вас нет доступа к этой команде.")
             return
         
         try:
             args = context.args
             if len(args) < 3:
-                await update.message.reply_text(
-                    "Использование: /export_date <chat_id> <start_date> <end_date>\n"
+                await self.sender.reply_text(
+                    update.message,
+                    "Использование: /export_date <chat_id> <start_date> <end_date> [format]\n"
                     "Формат даты: YYYY-MM-DD\n"
-                    "Пример: /export_date 123456789 2026-01-01 2026-01-31"
+                    f"Форматы: {', '.join(format_names())}\n"
+                    "Пример: /export_date 123456789 2026-01-01 2026-01-31 parquet"
                 )
                 return
             
+            try:
+                export_format, compression = parse_export_format(args[3] if len(args) > 3 else TextFormat.name)
+            except ValueError as e:
+                await self.sender.reply_text(update.message, f"Ошибка: {e}")
+                return
+            
             # Поддерживаем как положительный, так и отрицательный ID
             chat_id = int(args[0])
             start_date = datetime.strptime(args[1], "%Y-%m-%d")
@@ -198,131 +301,186 @@ class AdminBot:
             start_date = start_date.replace(hour=0, minute=0, second=0)
             end_date = end_date.replace(hour=23, minute=59, second=59)
             
-            # Пробуем найти сообщения с указанным ID
-            messages = self.db_manager.get_messages_by_date_range(chat_id, start_date, end_date)
-            
-            # Если не найдено и ID положительный, пробуем отрицательный (для групп)
-            if not messages and chat_id > 0:
-                messages = self.db_manager.get_messages_by_date_range(-chat_id, start_date, end_date)
-                if messages:
-                    chat_id = -chat_id  # Обновляем для сообщения об ошибке
-            
-            if not messages:
-                await update.message.reply_text(
-                    f"Сообщения не найдены в чате {chat_id} за указанный период."
-                )
-                return
-            
-            # Формируем экспорт
-            export_text = self._format_export(messages, start_date, end_date)
-            
-            # Отправляем файл, если сообщение слишком длинное
-            if len(export_text) > 4000:
-                filename = f"export_{chat_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
-                with open(filename, 'w', encoding='utf-8') as f:
-                    f.write(export_text)
-                
-                try:
-                    with open(filename, 'rb') as file:
-                        await update.message.reply_document(
-                            document=file,
-                            filename=filename
-                        )
-                finally:
-                    # Удаляем временный файл
-                    if os.path.exists(filename):
-                        os.remove(filename)
-            else:
-                await update.message.reply_text(export_text)
+            await self._export(update, chat_id, start_date, end_date, "за указанный период",
+                               export_format, compression)
         
         except ValueError as e:
-            await update.message.reply_text(f"Ошибка формата: {e}")
+            await self.sender.reply_text(update.message, f"Ошибка формата: {e}")
         except Exception as e:
-            await update.message.reply_text(f"Ошибка при экспорте: {e}")
-    
-    def _format_export(self, messages: List[Message], start_date: datetime, 
-                      end_date: datetime) -> str:
-        """Форматирование экспорта сообщений"""
-        export_lines = []
-        export_lines.append("=" * 50)
-        export_lines.append(f"ЭКСПОРТ СООБЩЕНИЙ")
-        export_lines.append(f"Период: {start_date.strftime('%Y-%m-%d')} - {end_date.strftime('%Y-%m-%d')}")
-        export_lines.append(f"Всего сообщений: {len(messages)}")
-        export_lines.append("=" * 50)
-        export_lines.append("")
-        
-        for msg in messages:
-            # Показываем дату сообщения и дату редактирования, если есть
-            date_str = f"[{msg.message_date.strftime('%Y-%m-%d %H:%M:%S')}]"
-            # Проверяем наличие edited_date (может быть None)
-            if msg.edited_date:
-                date_str += f" (отредактировано: {msg.edited_date.strftime('%Y-%m-%d %H:%M:%S')})"
-            export_lines.append(date_str)
-            
-            if msg.user:
-                user_info = f"{msg.user.first_name or ''} {msg.user.last_name or ''}".strip()
-                if msg.user.username:
-                    user_info += f" (@{msg.user.username})"
-                export_lines.append(f"От: {user_info} (ID: {msg.user.id})")
-            
-            if msg.text:
-                export_lines.append(f"Текст: {msg.text}")
-            
-            if msg.documents:
-                export_lines.append("Файлы:")
-                for doc in msg.documents:
-                    # Показываем имя файла или тип, если имени нет
-                    display_name = doc.file_name or f"{doc.document_type}"
-                    doc_info = f"  - [{doc.document_type}] {display_name}"
-                    if doc.file_size:
-                        # Форматируем размер файла
-                        size_kb = doc.file_size / 1024
-                        if size_kb > 1024:
-                            doc_info += f" ({size_kb/1024:.1f} МБ)"
-                        else:
-                            doc_info += f" ({size_kb:.1f} КБ)"
-                    # Показываем путь к файлу на диске
-                    if doc.file_path:
-                        doc_info += f"\n    📁 Путь: {doc.file_path}"
-                    else:
-                        doc_info += f"\n    ⚠️ Файл не скачан (file_id: {doc.file_id[:20]}...)"
-                    export_lines.append(doc_info)
-            
-            # Проверяем наличие реакций
-            if hasattr(msg, 'reactions') and msg.reactions:
-                # Группируем реакции по эмодзи и показываем количество
-                reaction_counts = {}
-                for r in msg.reactions:
-                    emoji = r.emoji or "?"
-                    reaction_counts[emoji] = reaction_counts.get(emoji, 0) + 1
-                
-                reactions_parts = []
-                for emoji, count in reaction_counts.items():
-                    if count > 1:
-                        reactions_parts.append(f"{emoji} x{count}")
-                    else:
-                        reactions_parts.append(emoji)
-                
-                reactions_str = ", ".join(reactions_parts)
-                export_lines.append(f"Реакции: {reactions_str} (всего: {len(msg.reactions)})")
-            
-            export_lines.append("-" * 50)
-            export_lines.append("")
-        
-        return "\n".join(export_lines)
+            await self.sender.reply_text(update.message, f"Ошибка при экспорте: {e}")
     
+    async def _export(self, update: Update, chat_id: int, start_date: datetime, end_date: datetime,
+                      period: str, export_format: type = TextFormat, compression: str = None,
+                      rolling: bool = False):
+        """
+        Экспорт сообщений чата за период в заданном формате
+
+        Args:
+            period: Описание периода для ответа "сообщения не найдены"
+            rolling: Период до текущего момента (/export): в кэше экспорта запись
+                ищется без учета end_date и дописывается новыми сообщениями
+        """
+        async with self._open_export(export_format, compression, chat_id, start_date, end_date,
+                                     rolling) as writer:
+            if writer.count or chat_id <= 0:
+                await self._send_export(update, writer, chat_id, period)
+                return
+        # Если не найдено и ID положительный, пробуем отрицательный (для групп)
+        async with self._open_export(export_format, compression, -chat_id, start_date, end_date,
+                                     rolling) as writer:
+            await self._send_export(update, writer, -chat_id, period)
+
+    async def _send_export(self, update: Update, writer: ExportWriter, chat_id: int, period: str):
+        """
+        Отправка готового экспорта
+
+        Короткий текстовый экспорт отправляется сообщением, остальные - файлами;
+        экспорт больше EXPORT_UPLOAD_LIMIT разделен на части.
+        """
+        if not writer.count:
+            await self.sender.reply_text(update.message, f"Сообщения не найдены в чате {chat_id} {period}.")
+            return
+
+        parts = writer.parts
+        # Короткий текстовый экспорт отправляем сообщением
+        if isinstance(writer.export_format, TextFormat) and len(parts) == 1:
+            parts[0].seek(0, os.SEEK_END)
+            size = parts[0].tell()
+            parts[0].seek(0)
+            if size <= 4000:
+                await self.sender.reply_text(update.message, parts[0].read().decode("utf-8"))
+                return
+
+        # Части отправляются по порядку: следующая после доставки предыдущей
+        name = f"export_{chat_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        for number, file in enumerate(parts, start=1):
+            await self.sender.reply_document(
+                update.message, file,
+                filename=f"{name}_part{number}.{writer.extension}" if len(parts) > 1
+                else f"{name}.{writer.extension}"
+            )
+
+    @asynccontextmanager
+    async def _open_export(self, export_format: type, compression: str, chat_id: int,
+                           start_date: datetime, end_date: datetime, rolling: bool = False):
+        """
+        Готовый экспорт (ExportWriter, части записаны, позиция в начале)
+
+        Без кэша экспорт собирается во временные файлы, которые удаляются после
+        отправки. С кэшем запись используется монопольно до конца отправки.
+        """
+        export = export_format(chat_id, start_date, end_date)
+        if self.export_cache is None:
+            writer = ExportWriter(export, compression)
+            try:
+                await self._fill_export(writer, chat_id, start_date, end_date)
+                yield writer
+            finally:
+                writer.close()
+            return
+
+        format_name = f"{export.name}.{compression}" if compression else export.name
+        key = self.export_cache.make_key(chat_id, start_date, None if rolling else end_date, format_name)
+        async with self.export_cache.use(key):
+            writer = await self._update_cached_export(key, export, compression, chat_id, start_date, end_date)
+            try:
+                yield writer
+            finally:
+                writer.close()
+
+    async def _update_cached_export(self, key: str, export: ExportFormat, compression: str, chat_id: int,
+                                    start_date: datetime, end_date: datetime) -> ExportWriter:
+        """
+        Запись кэша экспорта, актуальная на текущий момент
+
+        По отметке выгруженных сообщений (см. SessionOperations._get_export_watermark):
+        - в БД ничего не изменилось - файлы отдаются как есть;
+        - появились только сообщения после отметки - они дописываются в конец
+          последней части (если формат позволяет, см. ExportFormat.can_append);
+        - иначе (вставка в середину периода, правка выгруженного сообщения, перенос
+          в архив) экспорт собирается заново.
+        """
+        cache = self.export_cache
+        meta = await asyncio.to_thread(cache.get, key)
+        writer = ExportWriter(export, compression, directory=cache.entry_path(key))
+        try:
+            if meta is not None:
+                last = (datetime.fromisoformat(meta["last"][0]), meta["last"][1]) if meta["last"] else None
+                max_edited = datetime.fromisoformat(meta["max_edited"]) if meta["max_edited"] else None
+                changes = await self.db_manager.get_export_watermark(chat_id, start_date, end_date,
+                                                                     last, max_edited)
+                part_counts = [part["count"] for part in meta["parts"]]
+                if changes["head"] == meta["db_count"] and not changes["head_edited"]:
+                    if not changes["tail"]:
+                        await asyncio.to_thread(writer.reopen, part_counts)
+                        await asyncio.to_thread(writer.finish)
+                        await asyncio.to_thread(cache.save, key, meta)
+                        await cache.trim()
+                        return writer
+                    if last is not None and export.can_append(compression):
+                        await asyncio.to_thread(cache.begin_update, key)
+                        await asyncio.to_thread(writer.reopen, part_counts, True)
+                        watermark = {"count": meta["db_count"], "last": last, "max_edited": max_edited}
+                        await self._fill_export(writer, chat_id, start_date, end_date, last, watermark)
+                        await asyncio.to_thread(self._save_cached_export, key, writer, watermark,
+                                                meta["created_at"])
+                        await cache.trim()
+                        return writer
+
+            await asyncio.to_thread(cache.reset, key)
+            watermark = {"count": 0, "last": None, "max_edited": None}
+            await self._fill_export(writer, chat_id, start_date, end_date, watermark=watermark)
+            if writer.count:
+                await asyncio.to_thread(self._save_cached_export, key, writer, watermark, time.time())
+                await cache.trim()
+            else:
+                await asyncio.to_thread(cache.remove, key)
+            return writer
+        except BaseException:
+            writer.close()
+            raise
+
+    def _save_cached_export(self, key: str, writer: ExportWriter, watermark: dict, created_at: float):
+        """Описание записи кэша экспорта с отметкой выгруженных сообщений"""
+        last = watermark["last"]
+        self.export_cache.save(key, {
+            "chat_id": writer.export_format.chat_id,
+            "extension": writer.extension,
+            "created_at": created_at,
+            "count": writer.count,
+            "parts": [{"count": count, "size": size}
+                      for count, size in zip(writer.part_counts, writer.part_sizes())],
+            "db_count": watermark["count"],
+            "last": [last[0].isoformat(), last[1]] if last else None,
+            "max_edited": watermark["max_edited"].isoformat() if watermark["max_edited"] else None
+        })
+
+    async def _fill_export(self, writer: ExportWriter, chat_id: int, start_date: datetime,
+                           end_date: datetime, after: Tuple[datetime, int] = None, watermark: dict = None):
+        """
+        Потоковая запись сообщений в экспорт
+
+        Сообщения читаются страницами (см. _iter_messages) и дописываются в части
+        экспорта по мере чтения (см. ExportWriter): в памяти находится одна страница.
+        """
+        async for page in self._iter_messages(chat_id, start_date, end_date, after, watermark):
+            await asyncio.to_thread(writer.write_page, page)
+        await asyncio.to_thread(writer.finish)
+
     async def files_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик команды /files - отправка файлов за период"""
         if not self.is_admin(update.effective_user.id):
-            await update.message.reply_text("У вас нет доступа к этой команде.")
+            await self.sender.reply_text(update.message, "У вас нет доступа к этой команде.")
             return
         
         try:
             args = context.args
-            if len(args) < 2:
-                await update.message.reply_text(
-                    "Использование: /files <chat_id> <days>\n"
-                    "Пример: /files -5148403988 7"
+            if len(args) < 2 or (len(args) > 2 and args[2] != "zip"):
+                await self.sender.reply_text(
+                    update.message,
+                    "Использование: /files <chat_id> <days> [zip]\n"
+                    "Пример: /files -5148403988 7\n"
+                    "zip - все файлы zip-архивами со списком manifest.csv"
                 )
                 return
             
@@ -332,83 +490,608 @@ class AdminBot:
             end_date = datetime.utcnow()
             start_date = end_date - timedelta(days=days)
             
+            if len(args) > 2:
+                await self._send_files_archive(update, chat_id, start_date, end_date, f"за последние {days} дней")
+                return
+            
             # Получаем сообщения с документами
-            messages = self.db_manager.get_messages_by_date_range(chat_id, start_date, end_date)
+            messages = await self._get_messages(chat_id, start_date, end_date)
             
             # Если не найдено и ID положительный, пробуем отрицательный
             if not messages and chat_id > 0:
-                messages = self.db_manager.get_messages_by_date_range(-chat_id, start_date, end_date)
+                messages = await self._get_messages(-chat_id, start_date, end_date)
                 if messages:
                     chat_id = -chat_id
             
             if not messages:
-                await update.message.reply_text(
+                await self.sender.reply_text(
+                    update.message,
                     f"Сообщения не найдены в чате {chat_id} за последние {days} дней."
                 )
                 return
             
+            # Файлы, не скачанные при получении (политика lazy или превышен размер),
+            # скачиваем сейчас; документы с политикой never пропускаем
+            documents = [
+                (msg, doc) for msg in messages for doc in (msg.documents or [])
+                if doc.download_policy != 'never'
+            ]
+            if not self.download_manager:
+                documents = [
+                    (msg, doc) for msg, doc in documents
+                    if doc.file_path and os.path.exists(doc.file_path)
+                ]
+            # Скачиваются только файлы, которые будут отправлены
+            total = len(documents)
+            documents = documents[:FILES_SEND_LIMIT]
+            missing_ids = [
+                doc.id for _, doc in documents
+                if not (doc.file_path and os.path.exists(doc.file_path))
+            ]
+            fetched_paths = {}
+            if missing_ids and self.download_manager:
+                await self.sender.reply_text(
+                    update.message,
+                    f"⏳ Скачиваю файлы по запросу: {len(missing_ids)}..."
+                )
+                fetched_paths = await self.download_manager.fetch(missing_ids)
+            
             # Собираем все файлы
             files_to_send = []
-            for msg in messages:
-                if msg.documents:
-                    for doc in msg.documents:
-                        if doc.file_path and os.path.exists(doc.file_path):
-                            files_to_send.append({
-                                'path': doc.file_path,
-                                'name': doc.file_name or os.path.basename(doc.file_path),
-                                'type': doc.document_type,
-                                'date': msg.message_date
-                            })
+            for msg, doc in documents:
+                file_path = fetched_paths.get(doc.id) or doc.file_path
+                if file_path and os.path.exists(file_path):
+                    files_to_send.append({
+                        'path': file_path,
+                        'name': doc.file_name or os.path.basename(file_path),
+                        'type': doc.document_type,
+                        'date': msg.message_date
+                    })
             
             if not files_to_send:
-                await update.message.reply_text(
+                await self.sender.reply_text(
+                    update.message,
                     f"Файлы не найдены в чате {chat_id} за последние {days} дней.\n"
-                    "Возможно, файлы ещё не были скачаны (они скачиваются при получении новых сообщений)."
+                    "Возможно, файлы ещё не были скачаны или недоступны для скачивания ботом."
                 )
                 return
             
-            await update.message.reply_text(
-                f"📁 Найдено файлов: {len(files_to_send)}\n"
+            await self.sender.reply_text(
+                update.message,
+                f"📁 Найдено файлов: {total}\n"
                 f"Отправляю..."
             )
             
-            # Отправляем файлы (максимум 10 за раз, чтобы не превысить лимиты)
-            sent_count = 0
-            for file_info in files_to_send[:50]:  # Ограничиваем 50 файлами
+            async def send_file(file_info: dict) -> bool:
                 try:
                     with open(file_info['path'], 'rb') as f:
                         caption = f"📅 {file_info['date'].strftime('%Y-%m-%d %H:%M')}\n📎 {file_info['type']}"
-                        await update.message.reply_document(
-                            document=f,
+                        await self.sender.reply_document(
+                            update.message,
+                            f,
                             filename=file_info['name'],
                             caption=caption
                         )
-                        sent_count += 1
+                    return True
                 except Exception as e:
-                    await update.message.reply_text(
+                    await self.sender.reply_text(
+                        update.message,
                         f"⚠️ Не удалось отправить файл {file_info['name']}: {e}"
                     )
+                    return False
             
-            if len(files_to_send) > 50:
-                await update.message.reply_text(
-                    f"✅ Отправлено {sent_count} из {len(files_to_send)} файлов.\n"
-                    f"⚠️ Показаны первые 50 файлов. Используйте меньший период для получения остальных."
+            # Файлы отправляются по порядку дат
+            sent_count = 0
+            for file_info in files_to_send:
+                sent_count += await send_file(file_info)
+            
+            if total > FILES_SEND_LIMIT:
+                await self.sender.reply_text(
+                    update.message,
+                    f"✅ Отправлено {sent_count} из {total} файлов.\n"
+                    f"⚠️ Показаны первые {FILES_SEND_LIMIT} файлов. "
+                    "Используйте меньший период или zip для получения остальных."
                 )
             else:
-                await update.message.reply_text(f"✅ Отправлено файлов: {sent_count}")
+                await self.sender.reply_text(update.message, f"✅ Отправлено файлов: {sent_count}")
         
         except ValueError:
-            await update.message.reply_text("Ошибка: неверный формат аргументов.")
+            await self.sender.reply_text(update.message, "Ошибка: неверный формат аргументов.")
+        except Exception as e:
+            await self.sender.reply_text(update.message, f"Ошибка при получении файлов: {e}")
+    
+    async def _send_files_archive(self, update: Update, chat_id: int, start_date: datetime,
+                                  end_date: datetime, period: str):
+        """
+        Отправка файлов за период zip-томами (см. ZipVolumeWriter)
+
+        Документы читаются страницами (см. _iter_documents), файлы дописываются в
+        текущий том; законченный том отправляется сразу, на диске одновременно
+        находится не больше одного тома.
+        """
+        writer = await self._write_files_archive(update, chat_id, start_date, end_date)
+        # Если не найдено и ID положительный, пробуем отрицательный (для групп)
+        if not writer.documents and chat_id > 0:
+            chat_id = -chat_id
+            writer = await self._write_files_archive(update, chat_id, start_date, end_date)
+
+        volume = await asyncio.to_thread(writer.finish)
+        try:
+            if not writer.files:
+                await self.sender.reply_text(
+                    update.message,
+                    f"Файлы не найдены в чате {chat_id} {period}.\n"
+                    "Возможно, файлы ещё не были скачаны или недоступны для скачивания ботом."
+                )
+                return
+            await self._send_files_volume(update, writer, volume, writer.volumes, writer.volumes > 1)
+        finally:
+            if volume is not None:
+                volume.close()
+
+        summary = f"✅ Отправлено файлов: {writer.files}, архивов: {writer.volumes}"
+        if writer.skipped:
+            summary += f"\n⚠️ Без файла (см. manifest.csv): {writer.skipped}"
+        await self.sender.reply_text(update.message, summary)
+
+    async def _write_files_archive(self, update: Update, chat_id: int, start_date: datetime,
+                                   end_date: datetime) -> ZipVolumeWriter:
+        """
+        Запись файлов документов в тома с отправкой законченных; последний том не закрыт
+
+        Законченный том загружается, пока пишется следующий: одновременно существует
+        не больше двух томов.
+        """
+        writer = ZipVolumeWriter(chat_id)
+        sending = None
+        try:
+            async for page in self._iter_documents(chat_id, start_date, end_date):
+                if not writer.documents:
+                    await self.sender.reply_text(update.message, "📦 Собираю zip-архивы файлов...")
+                for document in page:
+                    path = document["file_path"]
+                    if path and os.path.exists(path):
+                        volume = await asyncio.to_thread(writer.add, document, path)
+                    else:
+                        volume = await asyncio.to_thread(writer.skip, document)
+                    if volume is not None:
+                        if sending is not None:
+                            await sending
+                        sending = asyncio.ensure_future(
+                            self._send_files_volume(update, writer, volume, writer.volumes - 1, True)
+                        )
+            if sending is not None:
+                await sending
+            return writer
+        except BaseException:
+            if sending is not None:
+                sending.cancel()
+            writer.close()
+            raise
+
+    async def _send_files_volume(self, update: Update, writer: ZipVolumeWriter, volume: BinaryIO,
+                                 number: int, numbered: bool):
+        """Отправка тома с файлами (временный файл тома закрывается)"""
+        name = f"files_{writer.chat_id}_{writer.created_at.strftime('%Y%m%d_%H%M%S')}"
+        suffix = f"_part{number}" if numbered else ""
+        try:
+            await self.sender.reply_document(update.message, volume, filename=f"{name}{suffix}.zip")
+        finally:
+            volume.close()
+
+    async def _iter_documents(self, chat_id: int, start_date: datetime,
+                              end_date: datetime) -> AsyncIterator[List[dict]]:
+        """
+        Документы за период страницами: из БД запросом к documents (без текста
+        сообщений), затем документы перенесенных месяцев из архива
+
+        Файлы, не скачанные при получении (политика lazy или превышен размер),
+        скачиваются по запросу постранично; документы с политикой never пропускаются.
+        Документ сообщения, которое есть и в БД, и в архиве (правка после
+        переноса), берется из БД.
+        """
+        months = set(await asyncio.to_thread(self.archive.get_months, chat_id)) if self.archive else set()
+        # Документы БД из перенесенных месяцев (Telegram message_id, file_id)
+        seen = set()
+        async for page in self.db_manager.iter_documents_by_date_range(chat_id, start_date, end_date):
+            page = [document for document in page if document["download_policy"] != 'never']
+            missing_ids = [
+                document["id"] for document in page
+                if not (document["file_path"] and os.path.exists(document["file_path"]))
+            ]
+            if missing_ids and self.download_manager:
+                fetched_paths = await self.download_manager.fetch(missing_ids)
+                for document in page:
+                    document["file_path"] = fetched_paths.get(document["id"]) or document["file_path"]
+            for document in page:
+                if f"{document['message_date']:%Y-%m}" in months:
+                    seen.add((document["message_id"], document["file_id"]))
+            if page:
+                yield page
+
+        if not months:
+            return
+        archived_pages = self.archive.iter_pages(chat_id, start_date, end_date)
+        while True:
+            messages = await asyncio.to_thread(next, archived_pages, None)
+            if messages is None:
+                return
+            page = [
+                dict({field: getattr(document, field) for field in DOCUMENT_FIELDS},
+                     message_id=message.message_id, message_date=message.message_date,
+                     user_id=message.user_id)
+                for message in messages for document in message.documents
+                if document.download_policy != 'never' and (message.message_id, document.file_id) not in seen
+            ]
+            if page:
+                yield page
+
+    async def journal_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обработчик команды /journal - отставание записи в БД от журнала"""
+        if not self.is_admin(update.effective_user.id):
+            await self.sender.reply_text(update.message, "У вас нет доступа к этой команде.")
+            return
+        
+        if not config.JOURNAL_ENABLED:
+            await self.sender.reply_text(update.message, "Журнал записи отключен (JOURNAL_ENABLED=false).")
+            return
+        
+        journals = WriteAheadJournal.find_journals(config.JOURNAL_PATH)
+        if not journals:
+            await self.sender.reply_text(update.message, "Журналы записи не найдены.")
+            return
+        
+        try:
+            response = "🗂 Журнал записи:\n\n"
+            for name, directory in journals.items():
+                status = WriteAheadJournal.read_status(directory)
+                response += f"{name}:\n"
+                response += f"Не записано в БД: {status['lag']}\n"
+                if status['oldest_pending']:
+                    age = datetime.now() - status['oldest_pending']
+                    response += f"Самая старая операция: {int(age.total_seconds())} сек назад\n"
+                response += f"Записано до LSN: {status['checkpoint_lsn']} из {status['last_lsn']}\n"
+                response += f"Сегментов: {status['segments']}, {status['size_bytes'] / 1024 / 1024:.1f} МБ\n"
+                response += "─" * 20 + "\n"
+            await self.sender.reply_text(update.message, response)
+        except Exception as e:
+            await self.sender.reply_text(update.message, f"Ошибка при чтении журнала: {e}")
+    
+    @staticmethod
+    def _parse_search_args(args: List[str]) -> dict:
+        """Фильтры chat:, from:, to: и текст запроса из аргументов /search"""
+        params = {'chat_id': None, 'start_date': None, 'end_date': None}
+        words = []
+        for arg in args:
+            name, _, value = arg.partition(':')
+            if name == 'chat' and value:
+                params['chat_id'] = int(value)
+            elif name == 'from' and value:
+                params['start_date'] = datetime.strptime(value, "%Y-%m-%d")
+            elif name == 'to' and value:
+                params['end_date'] = datetime.strptime(value, "%Y-%m-%d").replace(hour=23, minute=59, second=59)
+            else:
+                words.append(arg)
+        params['query'] = " ".join(words)
+        return params
+    
+    @staticmethod
+    def _format_search_result(result: dict) -> str:
+        """Результат поиска в HTML: чат, дата, автор и фрагмент с выделенными словами"""
+        author = f"{result['first_name'] or ''} {result['last_name'] or ''}".strip()
+        if result['username']:
+            author += f" (@{result['username']})"
+        snippet = html.escape(result['snippet'] or '')
+        snippet = snippet.replace(HIGHLIGHT_START, "<b>").replace(HIGHLIGHT_STOP, "</b>")
+        header = (
+            f"💬 <b>{html.escape(result['chat_title'] or str(result['chat_id']))}</b> · "
+            f"{result['message_date'].strftime('%Y-%m-%d %H:%M')}"
+        )
+        if author:
+            header += f" · {html.escape(author)}"
+        return f"{header}\n{snippet}"
+    
+    async def _send_search_page(self, message, search: dict, cursor: str = None):
+        """Отправка страницы результатов поиска с кнопкой следующей страницы"""
+        results, next_cursor = await self.db_manager.search_messages(
+            search['query'], search['chat_id'], search['start_date'], search['end_date'],
+            config.SEARCH_PAGE_SIZE, cursor
+        )
+        if not results:
+            await self.sender.reply_text(message, "Ничего не найдено." if cursor is None else "Больше результатов нет.")
+            return
+        
+        # Результаты, не поместившиеся в одно сообщение, переносятся на следующую страницу
+        blocks = []
+        length = 0
+        for index, result in enumerate(results):
+            block = self._format_search_result(result)
+            if blocks and length + len(block) + 2 > 4000:
+                last = results[index - 1]
+                next_cursor = self.db_manager.encode_search_cursor(last['message_date'], last['id'])
+                break
+            blocks.append(block)
+            length += len(block) + 2
+        
+        reply_markup = None
+        if next_cursor:
+            reply_markup = InlineKeyboardMarkup([[
+                InlineKeyboardButton("Дальше »", callback_data=f"search:{search['id']}:{next_cursor}")
+            ]])
+        await self.sender.reply_text(message, "\n\n".join(blocks), parse_mode=ParseMode.HTML,
+                                     reply_markup=reply_markup)
+    
+    async def search_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обработчик команды /search - полнотекстовый поиск по сообщениям"""
+        if not self.is_admin(update.effective_user.id):
+            await self.sender.reply_text(update.message, "У вас нет доступа к этой команде.")
+            return
+        
+        try:
+            search = self._parse_search_args(context.args)
+            if not search['query']:
+                await self.sender.reply_text(
+                    update.message,
+                    "Использование: /search [chat:<chat_id>] [from:<date>] [to:<date>] <запрос>\n"
+                    "Формат даты: YYYY-MM-DD. В запросе: \"фраза\", or, -исключить\n"
+                    "Пример: /search chat:-5148403988 from:2026-01-01 отчет -черновик"
+                )
+                return
+            
+            # Параметры последнего поиска для кнопки «Дальше»; ID отличает
+            # кнопки старых поисков
+            search['id'] = update.message.message_id
+            context.user_data['search'] = search
+            await self._send_search_page(update.message, search)
+        
+        except ValueError as e:
+            await self.sender.reply_text(update.message, f"Ошибка формата: {e}")
+        except Exception as e:
+            await self.sender.reply_text(update.message, f"Ошибка при поиске: {e}")
+    
+    async def search_page_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обработчик кнопки «Дальше» под результатами /search"""
+        query = update.callback_query
+        chat_id = query.message.chat_id if query.message else None
+        if not self.is_admin(query.from_user.id):
+            await self.sender.send(chat_id, lambda: query.answer("У вас нет доступа к этой команде.",
+                                                                 show_alert=True), idempotent=True)
+            return
+        
+        _, search_id, cursor = query.data.split(':', 2)
+        search = context.user_data.get('search')
+        if search is None or str(search['id']) != search_id:
+            await self.sender.send(chat_id, lambda: query.answer("Результаты устарели, повторите /search.",
+                                                                 show_alert=True), idempotent=True)
+            return
+        
+        await self.sender.send(chat_id, query.answer, idempotent=True)
+        try:
+            # Кнопка остается только под последней страницей
+            await self.sender.send(chat_id, lambda: query.edit_message_reply_markup(reply_markup=None),
+                                   idempotent=True)
+            await self._send_search_page(query.message, search, cursor)
+        except Exception as e:
+            await self.sender.reply_text(query.message, f"Ошибка при поиске: {e}")
+    
+    @staticmethod
+    def _format_user_name(username: str, first_name: str, last_name: str) -> str:
+        """Имя пользователя для результатов поиска"""
+        name = f"{first_name or ''} {last_name or ''}".strip()
+        if username:
+            name += f" (@{username})"
+        return name.strip() or "Без имени"
+    
+    @staticmethod
+    def _format_activity(last_activity: datetime) -> str:
+        """Дата последней активности для результатов поиска"""
+        return last_activity.strftime('%Y-%m-%d %H:%M') if last_activity else "нет сообщений"
+    
+    async def find_chat_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обработчик команды /find_chat - нечеткий поиск чата по названию"""
+        if not self.is_admin(update.effective_user.id):
+            await self.sender.reply_text(update.message, "У вас нет доступа к этой команде.")
+            return
+        
+        query = " ".join(context.args)
+        if not query:
+            await self.sender.reply_text(update.message, "Использование: /find_chat <название>\nПример: /find_chat продажи")
+            return
+        
+        try:
+            chats = await self.db_manager.find_chats(query, config.FIND_RESULTS_LIMIT)
+            if not chats:
+                await self.sender.reply_text(update.message, "Чаты не найдены.")
+                return
+            
+            response = f"🔎 Чаты по запросу «{query}»:\n\n"
+            for chat in chats:
+                response += f"ID: {chat['id']}\n"
+                response += f"Название: {chat['title'] or 'Без названия'} ({chat['chat_type']})\n"
+                response += f"Последнее сообщение: {self._format_activity(chat['last_activity'])}\n"
+                response += "─" * 20 + "\n"
+            await self.sender.reply_text(update.message, response)
+        except Exception as e:
+            await self.sender.reply_text(update.message, f"Ошибка при поиске чатов: {e}")
+    
+    async def find_user_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обработчик команды /find_user - нечеткий поиск пользователя по имени"""
+        if not self.is_admin(update.effective_user.id):
+            await self.sender.reply_text(update.message, "У вас нет доступа к этой команде.")
+            return
+        
+        query = " ".join(context.args)
+        if not query:
+            await self.sender.reply_text(update.message, "Использование: /find_user <имя или username>\nПример: /find_user иван")
+            return
+        
+        try:
+            users = await self.db_manager.find_users(query, config.FIND_RESULTS_LIMIT)
+            if not users:
+                await self.sender.reply_text(update.message, "Пользователи не найдены.")
+                return
+            
+            response = f"🔎 Пользователи по запросу «{query}»:\n\n"
+            for user in users:
+                response += f"ID: {user['id']}\n"
+                response += f"Имя: {self._format_user_name(user['username'], user['first_name'], user['last_name'])}\n"
+                response += f"Последнее сообщение: {self._format_activity(user['last_activity'])}\n"
+                response += "─" * 20 + "\n"
+            await self.sender.reply_text(update.message, response)
+        except Exception as e:
+            await self.sender.reply_text(update.message, f"Ошибка при поиске пользователей: {e}")
+    
+    async def find_file_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обработчик команды /find_file - нечеткий поиск файла по имени"""
+        if not self.is_admin(update.effective_user.id):
+            await self.sender.reply_text(update.message, "У вас нет доступа к этой команде.")
+            return
+        
+        try:
+            chat_id = None
+            user_id = None
+            words = []
+            for arg in context.args:
+                name, _, value = arg.partition(':')
+                if name == 'chat' and value:
+                    chat_id = int(value)
+                elif name == 'user' and value:
+                    user_id = int(value)
+                else:
+                    words.append(arg)
+            query = " ".join(words)
+            if not query:
+                await self.sender.reply_text(
+                    update.message,
+                    "Использование: /find_file [chat:<chat_id>] [user:<user_id>] <имя файла>\n"
+                    "Пример: /find_file user:123456789 договор pdf"
+                )
+                return
+            
+            files = await self.db_manager.find_files(query, chat_id, user_id, config.FIND_RESULTS_LIMIT)
+            if not files:
+                await self.sender.reply_text(update.message, "Файлы не найдены.")
+                return
+            
+            response = f"🔎 Файлы по запросу «{query}»:\n\n"
+            for file in files:
+                response += f"📄 {file['file_name']} [{file['document_type']}]"
+                if file['file_size']:
+                    size_kb = file['file_size'] / 1024
+                    response += f" ({size_kb / 1024:.1f} МБ)" if size_kb > 1024 else f" ({size_kb:.1f} КБ)"
+                response += "\n"
+                response += f"Чат: {file['chat_title'] or 'Без названия'} (ID: {file['chat_id']})\n"
+                response += f"От: {self._format_user_name(file['username'], file['first_name'], file['last_name'])}"
+                response += f" (ID: {file['user_id']})\n" if file['user_id'] else "\n"
+                response += f"Дата: {self._format_activity(file['last_activity'])}\n"
+                response += f"📁 Путь: {file['file_path']}\n" if file['file_path'] else "⚠️ Файл не скачан\n"
+                response += "─" * 20 + "\n"
+            await self.sender.reply_text(update.message, response)
+        except ValueError as e:
+            await self.sender.reply_text(update.message, f"Ошибка формата: {e}")
+        except Exception as e:
+            await self.sender.reply_text(update.message, f"Ошибка при поиске файлов: {e}")
+    
+    @staticmethod
+    def _format_bytes(size: int) -> str:
+        """Объем файлов в КБ, МБ или ГБ"""
+        size_mb = size / 1024 / 1024
+        if size_mb >= 1024:
+            return f"{size_mb / 1024:.1f} ГБ"
+        if size_mb >= 1:
+            return f"{size_mb:.1f} МБ"
+        return f"{size / 1024:.1f} КБ"
+    
+    async def stats_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обработчик команды /stats - активность чата за период по дневным счетчикам"""
+        if not self.is_admin(update.effective_user.id):
+            await self.sender.reply_text(update.message, "У вас нет доступа к этой команде.")
+            return
+        
+        try:
+            args = context.args
+            if len(args) < 2:
+                await self.sender.reply_text(
+                    update.message,
+                    "Использование: /stats <chat_id> <days>\n"
+                    "или: /stats <chat_id> <start_date> <end_date> (формат даты: YYYY-MM-DD)\n"
+                    "Пример: /stats 123456789 30"
+                )
+                return
+            
+            chat_id = int(args[0])
+            if len(args) >= 3:
+                start_day = datetime.strptime(args[1], "%Y-%m-%d").date()
+                end_day = datetime.strptime(args[2], "%Y-%m-%d").date()
+            else:
+                # Последние N дней, включая сегодняшний (дни в UTC)
+                end_day = datetime.utcnow().date()
+                start_day = end_day - timedelta(days=int(args[1]) - 1)
+            
+            stats = await self.db_manager.get_activity_stats(chat_id, start_day, end_day)
+            # Если не найдено и ID положительный, пробуем отрицательный (для групп)
+            if not stats['days'] and chat_id > 0:
+                negative = await self.db_manager.get_activity_stats(-chat_id, start_day, end_day)
+                if negative['days']:
+                    chat_id, stats = -chat_id, negative
+            
+            if not stats['days']:
+                await self.sender.reply_text(update.message, f"Нет активности в чате {chat_id} за указанный период.")
+                return
+            
+            totals = stats['totals']
+            period_days = (end_day - start_day).days + 1
+            busiest_day, busiest = max(stats['days'], key=lambda item: item[1]['messages'])
+            response = f"📊 Активность чата {chat_id}\n"
+            response += f"Период: {start_day.strftime('%Y-%m-%d')} - {end_day.strftime('%Y-%m-%d')}\n\n"
+            response += f"Сообщений: {totals['messages']} (в среднем {totals['messages'] / period_days:.1f} в день)\n"
+            response += f"Правок: {totals['edits']}\n"
+            response += f"Вложений: {totals['media']}, сохранено файлов: {self._format_bytes(totals['bytes_downloaded'])}\n"
+            response += f"Реакций: {totals['reactions']}\n"
+            response += f"Дней с активностью: {len(stats['days'])} из {period_days}\n"
+            response += f"Самый активный день: {busiest_day.strftime('%Y-%m-%d')} ({busiest['messages']} сообщ.)\n"
+            
+            if stats['top_users']:
+                response += "\n👥 Самые активные участники:\n"
+                for index, user in enumerate(stats['top_users'], 1):
+                    name = self._format_user_name(user['username'], user['first_name'], user['last_name'])
+                    response += (
+                        f"{index}. {name} (ID: {user['user_id']}): {user['messages']} сообщ., "
+                        f"{user['media']} влож., {user['reactions']} реакц.\n"
+                    )
+            
+            # По дням - для периодов до месяца
+            if period_days <= 31:
+                response += "\n📅 По дням (сообщений / правок / вложений / реакций):\n"
+                for day, counts in stats['days']:
+                    response += (
+                        f"{day.strftime('%Y-%m-%d')}: {counts['messages']} / {counts['edits']} / "
+                        f"{counts['media']} / {counts['reactions']}\n"
+                    )
+            
+            await self.sender.reply_text(update.message, response)
+        
+        except ValueError as e:
+            await self.sender.reply_text(update.message, f"Ошибка формата: {e}")
         except Exception as e:
-            await update.message.reply_text(f"Ошибка при получении файлов: {e}")
+            await self.sender.reply_text(update.message, f"Ошибка при получении статистики: {e}")
     
     def get_handlers(self):
         """Получение обработчиков команд для бота"""
+        # Долгие выгрузки выполняются отдельной задачей: обновление с командой
+        # завершается сразу и не держит позицию подтвержденных обновлений
         return [
             CommandHandler("start", self.start_command),
             CommandHandler("chats", self.chats_command),
-            CommandHandler("export", self.export_command),
-            CommandHandler("export_date", self.export_date_command),
-            CommandHandler("files", self.files_command),
+            CommandHandler("export", self.export_command, block=False),
+            CommandHandler("export_date", self.export_date_command, block=False),
+            CommandHandler("files", self.files_command, block=False),
+            CommandHandler("journal", self.journal_command),
+            CommandHandler("search", self.search_command),
+            CommandHandler("find_chat", self.find_chat_command),
+            CommandHandler("find_user", self.find_user_command),
+            CommandHandler("find_file", self.find_file_command),
+            CommandHandler("stats", self.stats_command),
+            CallbackQueryHandler(self.search_page_callback, pattern=r"^search:"),
         ]
 
@@ -0,0 +1,209 @@
+"""
+Кэш файлов экспорта на диске
+
+Готовые части экспорта хранятся по ключу (chat_id, период, формат):
+
+    EXPORT_CACHE_PATH/<ключ>/part1.<ext>, part2.<ext>, ...  - части экспорта
+    EXPORT_CACHE_PATH/<ключ>/meta.json                       - описание записи
+
+meta.json записывается последним: запись без него (прерванная сборка или
+дописывание) считается отсутствующей и удаляется. Кроме частей meta.json хранит
+отметку выгруженных из БД сообщений (ключ (message_date, id) последнего,
+их число и наибольшую дату редактирования): по ней AdminBot решает, отдать ли
+файлы как есть, дописать новые сообщения в конец или собрать экспорт заново.
+
+Общий размер кэша ограничен EXPORT_CACHE_SIZE: при превышении удаляются
+записи, которые дольше всего не запрашивались (см. trim). Запись старше EXPORT_CACHE_TTL
+собирается заново - так в экспорт попадают изменившиеся реакции и пути
+скачанных файлов, которые отметка не отслеживает.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import AbstractSet, Dict, List, Optional
+from config import config
+
+logger = logging.getLogger(__name__)
+
+META_FILE = "meta.json"
+
+
+class ExportCache:
+    """Кэш частей экспорта с вытеснением давно не запрашиваемых записей"""
+
+    def __init__(self, path: str = None, max_size: int = None, ttl: float = None):
+        """
+        Инициализация
+
+        Args:
+            path: Каталог кэша (по умолчанию EXPORT_CACHE_PATH)
+            max_size: Максимальный общий размер, байт (по умолчанию EXPORT_CACHE_SIZE)
+            ttl: Время жизни записи с момента сборки, сек (по умолчанию EXPORT_CACHE_TTL)
+        """
+        self.path = path or config.EXPORT_CACHE_PATH
+        self.max_size = max_size if max_size is not None else config.EXPORT_CACHE_SIZE
+        self.ttl = ttl if ttl is not None else config.EXPORT_CACHE_TTL
+        # Запись используется (собирается, дописывается или отправляется) под
+        # блокировкой своего ключа и не вытесняется; число использующих задач
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._users: Dict[str, int] = {}
+
+    @staticmethod
+    def make_key(chat_id: int, start_date: datetime, end_date: Optional[datetime], format_name: str) -> str:
+        """Ключ записи (end_date=None - период до текущего момента)"""
+        end = end_date.isoformat() if end_date is not None else "now"
+        return hashlib.sha1(f"{chat_id}|{start_date.isoformat()}|{end}|{format_name}".encode("utf-8")).hexdigest()
+
+    @asynccontextmanager
+    async def use(self, key: str):
+        """Монопольное использование записи: сборка, дописывание и отправка"""
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        self._users[key] = self._users.get(key, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._users[key] -= 1
+            if not self._users[key]:
+                del self._users[key]
+                del self._locks[key]
+
+    def entry_path(self, key: str) -> str:
+        """Каталог записи"""
+        return os.path.join(self.path, key)
+
+    @staticmethod
+    def part_path(directory: str, number: int, extension: str) -> str:
+        """Файл части"""
+        return os.path.join(directory, f"part{number}.{extension}")
+
+    def get(self, key: str) -> Optional[dict]:
+        """
+        Описание записи (None - записи нет, она повреждена или устарела)
+
+        Файлы частей должны иметь размер, записанный в meta.json: иначе запись
+        изменялась без обновления описания.
+        """
+        directory = self.entry_path(key)
+        try:
+            with open(os.path.join(directory, META_FILE), encoding="utf-8") as f:
+                meta = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+        valid = time.time() - meta["created_at"] <= self.ttl
+        for number, part in enumerate(meta["parts"], start=1):
+            path = self.part_path(directory, number, meta["extension"])
+            if not valid or not os.path.exists(path) or os.path.getsize(path) != part["size"]:
+                valid = False
+                break
+        if not valid:
+            self.remove(key)
+            return None
+        return meta
+
+    def reset(self, key: str) -> str:
+        """Пустой каталог для новой сборки записи"""
+        self.remove(key)
+        directory = self.entry_path(key)
+        os.makedirs(directory, exist_ok=True)
+        return directory
+
+    def begin_update(self, key: str):
+        """Начало дописывания: до сохранения нового описания запись недействительна"""
+        try:
+            os.remove(os.path.join(self.entry_path(key), META_FILE))
+        except FileNotFoundError:
+            pass
+
+    def save(self, key: str, meta: dict):
+        """Атомарная запись описания (вытеснение сверх лимита - trim)"""
+        directory = self.entry_path(key)
+        meta["last_used"] = time.time()
+        meta["size"] = sum(part["size"] for part in meta["parts"])
+        tmp_path = os.path.join(directory, f"{META_FILE}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp_path, os.path.join(directory, META_FILE))
+
+    def remove(self, key: str):
+        """Удаление записи"""
+        shutil.rmtree(self.entry_path(key), ignore_errors=True)
+
+    async def trim(self) -> List[str]:
+        """
+        Вытеснение записей сверх EXPORT_CACHE_SIZE в отдельном потоке
+
+        Используемые ключи копируются в цикле событий: use() изменяет их без
+        блокировок, и поток не должен обходить словарь одновременно с ним.
+        """
+        return await asyncio.to_thread(self.evict, frozenset(self._users))
+
+    def evict(self, in_use: AbstractSet[str] = frozenset()) -> List[str]:
+        """
+        Удаление записей сверх EXPORT_CACHE_SIZE, начиная с давно не запрашиваемых
+
+        Каталоги без meta.json (прерванная сборка) удаляются, если не используются.
+
+        Args:
+            in_use: Используемые записи (не удаляются, но их размер учитывается)
+
+        Returns:
+            Ключи удаленных записей
+        """
+        if not os.path.isdir(self.path):
+            return []
+        entries = []
+        removed = []
+        for key in os.listdir(self.path):
+            if key in in_use:
+                continue
+            try:
+                with open(os.path.join(self.entry_path(key), META_FILE), encoding="utf-8") as f:
+                    meta = json.load(f)
+            except (FileNotFoundError, NotADirectoryError, ValueError):
+                self.remove(key)
+                removed.append(key)
+                continue
+            entries.append((meta["last_used"], meta["size"], key))
+
+        total = sum(size for _, size, _ in entries) + self._size_in_use(in_use)
+        for _, size, key in sorted(entries):
+            if total <= self.max_size:
+                break
+            self.remove(key)
+            removed.append(key)
+            total -= size
+        if removed:
+            logger.info(f"Из кэша экспорта удалено записей: {len(removed)}")
+        return removed
+
+    def _size_in_use(self, in_use: AbstractSet[str]) -> int:
+        """Размер используемых записей (их нельзя удалить, но они занимают место)"""
+        size = 0
+        for key in in_use:
+            directory = self.entry_path(key)
+            if os.path.isdir(directory):
+                size += sum(entry.stat().st_size for entry in os.scandir(directory) if entry.is_file())
+        return size
+
+    def get_stats(self) -> dict:
+        """Число записей и их общий размер"""
+        stats = {"entries": 0, "size": 0}
+        if not os.path.isdir(self.path):
+            return stats
+        for key in os.listdir(self.path):
+            try:
+                with open(os.path.join(self.entry_path(key), META_FILE), encoding="utf-8") as f:
+                    meta = json.load(f)
+            except (FileNotFoundError, NotADirectoryError, ValueError):
+                continue
+            stats["entries"] += 1
+            stats["size"] += meta["size"]
+        return stats
@@ -0,0 +1,672 @@
+"""
+Форматы экспорта сообщений
+
+Все форматы получают сообщения из одного потокового источника (страницы
+AdminBot._iter_messages) и пишут их в части - временные файлы не больше
+EXPORT_UPLOAD_LIMIT байт, каждая из которых - самостоятельный файл формата
+(со своим заголовком CSV, HTML-страницей или метаданными Parquet):
+
+    text     - текст для чтения (по умолчанию)
+    jsonl    - JSON Lines, одно сообщение в строке
+    csv      - CSV, вложения и реакции - JSON в отдельных колонках
+    html     - самостоятельная HTML-страница со стилями
+    parquet  - колоночный формат для аналитики (нужен pyarrow)
+
+JSONL и CSV сжимаются gzip или zstd (суффикс .gz или .zst, для zstd нужен
+zstandard): csv.gz, jsonl.zst.
+"""
+import csv
+import gzip
+import html
+import io
+import json
+import os
+import tempfile
+import zlib
+from datetime import datetime
+from typing import BinaryIO, List, Tuple
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+from config import config
+from database.models import Message
+
+# Ширина места под число сообщений в заголовке текстового экспорта
+EXPORT_COUNT_WIDTH = 12
+
+# Запас на окончание части (закрывающие теги, конец сжатого потока, метаданные Parquet)
+PART_FOOTER_RESERVE = 64 * 1024
+
+# Сжатые данные сбрасываются в файл каждые COMPRESSION_FLUSH_SIZE байт исходных
+# данных: размер части известен с точностью до несброшенного остатка
+COMPRESSION_FLUSH_SIZE = 1024 * 1024
+
+# Сжатие колонок Parquet
+PARQUET_COMPRESSION = "zstd"
+
+# Колонки CSV
+CSV_COLUMNS = ("message_id", "chat_id", "date", "edited_date", "user_id", "username",
+               "first_name", "last_name", "text", "documents", "reactions")
+
+
+def _format_date(value: datetime) -> str:
+    """Дата в ISO-формате (None остается None)"""
+    return value.isoformat() if value is not None else None
+
+
+def message_record(message: Message) -> dict:
+    """Сообщение в виде словаря для структурированных форматов"""
+    user = message.user
+    return {
+        "message_id": message.message_id,
+        "chat_id": message.chat_id,
+        "date": message.message_date,
+        "edited_date": message.edited_date,
+        "user_id": message.user_id,
+        "username": user.username if user is not None else None,
+        "first_name": user.first_name if user is not None else None,
+        "last_name": user.last_name if user is not None else None,
+        "text": message.text,
+        "documents": [
+            {
+                "type": document.document_type,
+                "file_name": document.file_name,
+                "mime_type": document.mime_type,
+                "file_size": document.file_size,
+                "file_path": document.file_path,
+                "file_id": document.file_id
+            }
+            for document in message.documents
+        ],
+        "reactions": [
+            {"emoji": reaction_count.emoji, "count": reaction_count.count}
+            for reaction_count in message.reaction_counts
+        ]
+    }
+
+
+def format_file_size(size: int) -> str:
+    """Размер файла в КБ или МБ"""
+    size_kb = size / 1024
+    if size_kb > 1024:
+        return f"{size_kb/1024:.1f} МБ"
+    return f"{size_kb:.1f} КБ"
+
+
+class ExportFormat:
+    """
+    Формат экспорта
+
+    Потоковые форматы описываются тремя методами: header - начало части, render -
+    одно сообщение, footer - окончание части. Колоночные форматы переопределяют
+    open_part.
+    """
+
+    name = None
+    extension = None
+    # Допустимое сжатие: 'gz', 'zst'
+    compressions = ()
+    # Установлены ли пакеты, нужные формату
+    available = True
+
+    def __init__(self, chat_id: int, start_date: datetime, end_date: datetime):
+        """Параметры экспорта"""
+        self.chat_id = chat_id
+        self.start_date = start_date
+        self.end_date = end_date
+
+    def header(self) -> bytes:
+        """Начало части"""
+        return b""
+
+    def render(self, message: Message) -> bytes:
+        """Одно сообщение"""
+        raise NotImplementedError
+
+    def footer(self, count: int) -> bytes:
+        """Окончание части (count - сообщений в части)"""
+        return b""
+
+    def finalize(self, file: BinaryIO, total: int):
+        """Дописывание части после окончания экспорта (total - всего сообщений)"""
+
+    def can_append(self, compression: str = None) -> bool:
+        """
+        Можно ли дописывать сообщения в конец готовой части
+
+        Окончание несжатой части отрезается перед дописыванием; в сжатый поток
+        дописывается новый блок gzip/zstd, поэтому окончание должно быть пустым.
+        """
+        return compression is None or not self.footer(0)
+
+    def open_part(self, file: BinaryIO, compression: str = None, count: int = None) -> "ExportPart":
+        """Начало новой части в файле или, если задано count, продолжение готовой"""
+        return StreamPart(self, file, compression, count)
+
+
+class TextFormat(ExportFormat):
+    """Текст для чтения: заголовок с периодом и блоки сообщений"""
+
+    name = "text"
+    extension = "txt"
+
+    def _header(self, total: int = None) -> bytes:
+        """Заголовок с периодом и числом сообщений"""
+        return "\n".join([
+            "=" * 50,
+            "ЭКСПОРТ СООБЩЕНИЙ",
+            f"Период: {self.start_date.strftime('%Y-%m-%d')} - {self.end_date.strftime('%Y-%m-%d')}",
+            f"Всего сообщений: {'' if total is None else total:<{EXPORT_COUNT_WIDTH}}",
+            "=" * 50,
+            "",
+            ""
+        ]).encode("utf-8")
+
+    def header(self) -> bytes:
+        """
+        Заголовок части
+
+        Число сообщений известно только в конце экспорта, поэтому под него
+        оставляется место фиксированной ширины (заполняется в finalize).
+        """
+        return self._header()
+
+    def finalize(self, file: BinaryIO, total: int):
+        """Период и число сообщений всего экспорта в заголовке части (длина заголовка не меняется)"""
+        file.seek(0)
+        file.write(self._header(total))
+
+    def render(self, message: Message) -> bytes:
+        """Блок сообщения"""
+        export_lines = []
+        # Показываем дату сообщения и дату редактирования, если есть
+        date_str = f"[{message.message_date.strftime('%Y-%m-%d %H:%M:%S')}]"
+        # Проверяем наличие edited_date (может быть None)
+        if message.edited_date:
+            date_str += f" (отредактировано: {message.edited_date.strftime('%Y-%m-%d %H:%M:%S')})"
+        export_lines.append(date_str)
+
+        if message.user:
+            user_info = f"{message.user.first_name or ''} {message.user.last_name or ''}".strip()
+            if message.user.username:
+                user_info += f" (@{message.user.username})"
+            export_lines.append(f"От: {user_info} (ID: {message.user.id})")
+
+        if message.text:
+            export_lines.append(f"Текст: {message.text}")
+
+        if message.documents:
+            export_lines.append("Файлы:")
+            for doc in message.documents:
+                # Показываем имя файла или тип, если имени нет
+                display_name = doc.file_name or f"{doc.document_type}"
+                doc_info = f"  - [{doc.document_type}] {display_name}"
+                if doc.file_size:
+                    doc_info += f" ({format_file_size(doc.file_size)})"
+                # Показываем путь к файлу на диске
+                if doc.file_path:
+                    doc_info += f"\n    📁 Путь: {doc.file_path}"
+                else:
+                    doc_info += f"\n    ⚠️ Файл не скачан (file_id: {doc.file_id[:20]}...)"
+                export_lines.append(doc_info)
+
+        # Реакции: количество по каждому эмодзи из reaction_counts
+        if message.reaction_counts:
+            reactions_parts = []
+            for reaction_count in message.reaction_counts:
+                if reaction_count.count > 1:
+                    reactions_parts.append(f"{reaction_count.emoji} x{reaction_count.count}")
+                else:
+                    reactions_parts.append(reaction_count.emoji)
+
+            reactions_str = ", ".join(reactions_parts)
+            total = sum(reaction_count.count for reaction_count in message.reaction_counts)
+            export_lines.append(f"Реакции: {reactions_str} (всего: {total})")
+
+        export_lines.append("-" * 50)
+        export_lines.append("")
+
+        return ("\n".join(export_lines) + "\n").encode("utf-8")
+
+
+class JsonlFormat(ExportFormat):
+    """JSON Lines: одно сообщение - один JSON-объект в строке"""
+
+    name = "jsonl"
+    extension = "jsonl"
+    compressions = ("gz", "zst")
+
+    def render(self, message: Message) -> bytes:
+        """Строка JSON"""
+        return json.dumps(message_record(message), ensure_ascii=False, default=_format_date).encode("utf-8") + b"\n"
+
+
+class CsvFormat(ExportFormat):
+    """CSV с заголовком в каждой части; вложения и реакции - JSON в своих колонках"""
+
+    name = "csv"
+    extension = "csv"
+    compressions = ("gz", "zst")
+
+    @staticmethod
+    def _row(values) -> bytes:
+        """Строка CSV"""
+        buffer = io.StringIO()
+        csv.writer(buffer).writerow(values)
+        return buffer.getvalue().encode("utf-8")
+
+    def header(self) -> bytes:
+        """Заголовок колонок"""
+        return self._row(CSV_COLUMNS)
+
+    def render(self, message: Message) -> bytes:
+        """Строка сообщения"""
+        record = message_record(message)
+        record["date"] = _format_date(record["date"])
+        record["edited_date"] = _format_date(record["edited_date"])
+        record["documents"] = json.dumps(record["documents"], ensure_ascii=False) if record["documents"] else ""
+        record["reactions"] = json.dumps(record["reactions"], ensure_ascii=False) if record["reactions"] else ""
+        return self._row(record[column] for column in CSV_COLUMNS)
+
+
+class HtmlFormat(ExportFormat):
+    """Самостоятельная HTML-страница: стили встроены, внешних ресурсов нет"""
+
+    name = "html"
+    extension = "html"
+
+    STYLE = (
+        "body{font-family:-apple-system,'Segoe UI',Roboto,sans-serif;background:#f4f4f5;"
+        "color:#1f2328;margin:0;padding:24px}"
+        "main{max-width:820px;margin:0 auto}"
+        "h1{font-size:20px;margin:0 0 4px}"
+        ".period{color:#6b7280;margin-bottom:20px}"
+        ".message{background:#fff;border-radius:10px;padding:10px 14px;margin:0 0 8px;"
+        "box-shadow:0 1px 2px rgba(0,0,0,.06)}"
+        ".meta{font-size:13px;color:#6b7280;margin-bottom:4px}"
+        ".author{font-weight:600;color:#2563eb;margin-right:8px}"
+        ".text{white-space:pre-wrap;word-wrap:break-word}"
+        ".files{margin:6px 0 0;padding-left:18px;font-size:14px}"
+        ".path{color:#6b7280;font-size:12px}"
+        ".reactions{margin-top:6px;font-size:14px}"
+        "footer{color:#6b7280;margin-top:16px}"
+    )
+
+    def header(self) -> bytes:
+        """Начало страницы"""
+        period = f"{self.start_date.strftime('%Y-%m-%d')} - {self.end_date.strftime('%Y-%m-%d')}"
+        return (
+            "<!DOCTYPE html>\n<html lang=\"ru\">\n<head>\n<meta charset=\"utf-8\">\n"
+            f"<title>Экспорт чата {self.chat_id}</title>\n<style>{self.STYLE}</style>\n</head>\n<body>\n<main>\n"
+            f"<h1>Экспорт чата {self.chat_id}</h1>\n<div class=\"period\">Период: {period}</div>\n"
+        ).encode("utf-8")
+
+    def render(self, message: Message) -> bytes:
+        """Карточка сообщения"""
+        parts = ["<div class=\"message\">", "<div class=\"meta\">"]
+        if message.user:
+            user_info = f"{message.user.first_name or ''} {message.user.last_name or ''}".strip()
+            if message.user.username:
+                user_info += f" (@{message.user.username})"
+            parts.append(f"<span class=\"author\">{html.escape(user_info or str(message.user.id))}</span>")
+        date_str = message.message_date.strftime('%Y-%m-%d %H:%M:%S')
+        if message.edited_date:
+            date_str += f" (отредактировано: {message.edited_date.strftime('%Y-%m-%d %H:%M:%S')})"
+        parts.append(f"{date_str}</div>")
+
+        if message.text:
+            parts.append(f"<div class=\"text\">{html.escape(message.text)}</div>")
+
+        if message.documents:
+            parts.append("<ul class=\"files\">")
+            for doc in message.documents:
+                doc_info = f"[{html.escape(doc.document_type or '')}] {html.escape(doc.file_name or doc.document_type or '')}"
+                if doc.file_size:
+                    doc_info += f" ({format_file_size(doc.file_size)})"
+                if doc.file_path:
+                    doc_info += f"<div class=\"path\">{html.escape(doc.file_path)}</div>"
+                else:
+                    doc_info += "<div class=\"path\">Файл не скачан</div>"
+                parts.append(f"<li>{doc_info}</li>")
+            parts.append("</ul>")
+
+        if message.reaction_counts:
+            reactions = ", ".join(
+                f"{html.escape(reaction_count.emoji)} x{reaction_count.count}" if reaction_count.count > 1
+                else html.escape(reaction_count.emoji)
+                for reaction_count in message.reaction_counts
+            )
+            parts.append(f"<div class=\"reactions\">{reactions}</div>")
+
+        parts.append("</div>\n")
+        return "".join(parts).encode("utf-8")
+
+    def footer(self, count: int) -> bytes:
+        """Окончание страницы"""
+        return f"<footer>Сообщений: {count}</footer>\n</main>\n</body>\n</html>\n".encode("utf-8")
+
+    def finalize(self, file: BinaryIO, total: int):
+        """Период в заголовке части (даты фиксированной ширины - длина не меняется)"""
+        file.seek(0)
+        file.write(self.header())
+
+
+class ParquetFormat(ExportFormat):
+    """Parquet: группа строк на страницу сообщений, вложения и реакции - вложенные списки"""
+
+    name = "parquet"
+    extension = "parquet"
+    available = pyarrow is not None
+
+    @staticmethod
+    def schema():
+        """Схема таблицы"""
+        return pyarrow.schema([
+            ("message_id", pyarrow.int64()),
+            ("chat_id", pyarrow.int64()),
+            ("date", pyarrow.timestamp("us")),
+            ("edited_date", pyarrow.timestamp("us")),
+            ("user_id", pyarrow.int64()),
+            ("username", pyarrow.string()),
+            ("first_name", pyarrow.string()),
+            ("last_name", pyarrow.string()),
+            ("text", pyarrow.string()),
+            ("documents", pyarrow.list_(pyarrow.struct([
+                ("type", pyarrow.string()),
+                ("file_name", pyarrow.string()),
+                ("mime_type", pyarrow.string()),
+                ("file_size", pyarrow.int64()),
+                ("file_path", pyarrow.string()),
+                ("file_id", pyarrow.string())
+            ]))),
+            ("reactions", pyarrow.list_(pyarrow.struct([
+                ("emoji", pyarrow.string()),
+                ("count", pyarrow.int64())
+            ])))
+        ])
+
+    def can_append(self, compression: str = None) -> bool:
+        """Метаданные Parquet записываются в конце файла - дописывать нельзя"""
+        return False
+
+    def open_part(self, file: BinaryIO, compression: str = None, count: int = None) -> "ExportPart":
+        """Новая часть - отдельный файл Parquet"""
+        return ParquetPart(self, file)
+
+
+# Форматы по имени
+EXPORT_FORMATS = {
+    export_format.name: export_format
+    for export_format in (TextFormat, JsonlFormat, CsvFormat, HtmlFormat, ParquetFormat)
+}
+
+
+def parse_export_format(spec: str) -> Tuple[type, str]:
+    """
+    Формат и сжатие из аргумента команды ('csv', 'jsonl.gz', 'csv.zst')
+
+    Raises:
+        ValueError: неизвестный формат, недопустимое сжатие или нет нужного пакета
+    """
+    name, _, compression = spec.lower().partition(".")
+    export_format = EXPORT_FORMATS.get(name)
+    if export_format is None:
+        raise ValueError(f"неизвестный формат {spec}, доступны: {', '.join(format_names())}")
+    if compression and compression not in export_format.compressions:
+        raise ValueError(f"формат {name} не поддерживает сжатие {compression}")
+    if not export_format.available:
+        raise ValueError(f"для формата {name} нужен пакет pyarrow")
+    if compression == "zst" and zstandard is None:
+        raise ValueError("для сжатия zst нужен пакет zstandard")
+    return export_format, compression or None
+
+
+def format_names() -> List[str]:
+    """Допустимые значения аргумента формата"""
+    names = []
+    for name, export_format in EXPORT_FORMATS.items():
+        names.append(name)
+        names.extend(f"{name}.{compression}" for compression in export_format.compressions)
+    return names
+
+
+class ExportPart:
+    """Одна часть экспорта (временный файл или файл записи кэша)"""
+
+    def __init__(self, export_format: ExportFormat, file: BinaryIO):
+        """Инициализация"""
+        self.export_format = export_format
+        self.file = file
+        self.count = 0
+
+    def add(self, messages: List[Message], limit: int) -> int:
+        """
+        Запись сообщений, пока часть не больше limit байт
+
+        Returns:
+            Сколько сообщений с начала списка записано
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """Окончание части"""
+        raise NotImplementedError
+
+
+class StreamPart(ExportPart):
+    """Часть потокового формата, при необходимости сжатая"""
+
+    def __init__(self, export_format: ExportFormat, file: BinaryIO, compression: str = None,
+                 count: int = None):
+        """
+        Начало части (заголовок формата) или продолжение готовой части
+
+        Args:
+            count: Сообщений в готовой части - запись продолжается после них
+        """
+        super().__init__(export_format, file)
+        if count is not None:
+            self.count = count
+            file.seek(0, os.SEEK_END)
+            if compression is None:
+                file.seek(-len(export_format.footer(count)), os.SEEK_END)
+                file.truncate()
+        if compression == "gz":
+            # Имя файла части (запись кэша) в заголовок gzip не попадает
+            self.stream = gzip.GzipFile(filename="", fileobj=file, mode="wb", mtime=0)
+        elif compression == "zst":
+            self.stream = zstandard.ZstdCompressor().stream_writer(file, closefd=False)
+        else:
+            self.stream = None
+        # Исходные байты, еще не сброшенные компрессором в файл
+        self.unflushed = 0
+        if count is None:
+            self._write(export_format.header())
+
+    def _write(self, data: bytes):
+        """Запись в файл или через компрессор"""
+        if self.stream is None:
+            self.file.write(data)
+            return
+        self.stream.write(data)
+        self.unflushed += len(data)
+        if self.unflushed >= COMPRESSION_FLUSH_SIZE:
+            if isinstance(self.stream, gzip.GzipFile):
+                self.stream.flush(zlib.Z_SYNC_FLUSH)
+            else:
+                self.stream.flush()
+            self.unflushed = 0
+
+    def add(self, messages: List[Message], limit: int) -> int:
+        """Запись сообщений по одному, пока размер части с запасом на окончание не больше limit"""
+        written = 0
+        for message in messages:
+            data = self.export_format.render(message)
+            # Сжатые данные не длиннее исходных (с точностью до заголовков блоков)
+            if self.count and self.file.tell() + self.unflushed + len(data) + PART_FOOTER_RESERVE > limit:
+                break
+            self._write(data)
+            self.count += 1
+            written += 1
+        return written
+
+    def close(self):
+        """Окончание формата и сжатого потока"""
+        self._write(self.export_format.footer(self.count))
+        if self.stream is not None:
+            self.stream.close()
+
+
+class ParquetPart(ExportPart):
+    """Часть Parquet: группы строк по страницам сообщений"""
+
+    def __init__(self, export_format: ParquetFormat, file: BinaryIO):
+        """Начало файла Parquet"""
+        super().__init__(export_format, file)
+        self.writer = pyarrow.parquet.ParquetWriter(file, export_format.schema(),
+                                                    compression=PARQUET_COMPRESSION)
+
+    def add(self, messages: List[Message], limit: int) -> int:
+        """
+        Запись группы строк
+
+        Размер закодированной группы заранее неизвестен; оценка сверху - размер
+        таблицы в памяти, по ней выбирается, сколько строк поместится в часть.
+        """
+        table = pyarrow.Table.from_pylist([message_record(message) for message in messages],
+                                          schema=self.export_format.schema())
+        available = limit - PART_FOOTER_RESERVE - self.file.tell()
+        rows = len(messages)
+        if table.nbytes > available:
+            rows = int(rows * max(available, 0) / table.nbytes)
+            if rows == 0 and not self.count:
+                rows = 1
+        if rows:
+            self.writer.write_table(table.slice(0, rows))
+            self.count += rows
+        return rows
+
+    def close(self):
+        """Метаданные в конце файла"""
+        self.writer.close()
+
+
+class ExportWriter:
+    """
+    Запись экспорта в части не больше EXPORT_UPLOAD_LIMIT байт
+
+    Без каталога части - SpooledTemporaryFile в EXPORT_PATH: до EXPORT_SPOOL_SIZE
+    байт файл держится в памяти, затем переносится на диск. С каталогом (запись
+    кэша экспорта) части - файлы part1.<ext>, part2.<ext>, ... в нем.
+    """
+
+    def __init__(self, export_format: ExportFormat, compression: str = None, limit: int = None,
+                 directory: str = None):
+        """
+        Инициализация
+
+        Args:
+            export_format: Формат с параметрами экспорта
+            compression: 'gz', 'zst' или None
+            limit: Максимальный размер части, байт (по умолчанию EXPORT_UPLOAD_LIMIT)
+            directory: Каталог файлов частей (None - временные файлы)
+        """
+        self.export_format = export_format
+        self.compression = compression
+        self.limit = limit or config.EXPORT_UPLOAD_LIMIT
+        self.directory = directory
+        self.parts = []
+        # Сообщений в каждой части
+        self.part_counts = []
+        self.count = 0
+        self._part = None
+
+    @property
+    def extension(self) -> str:
+        """Расширение файлов экспорта"""
+        if self.compression:
+            return f"{self.export_format.extension}.{self.compression}"
+        return self.export_format.extension
+
+    def _part_path(self, number: int) -> str:
+        """Файл части в каталоге"""
+        return os.path.join(self.directory, f"part{number}.{self.extension}")
+
+    def _open_part(self) -> ExportPart:
+        """Новая часть"""
+        if self.directory is None:
+            os.makedirs(config.EXPORT_PATH, exist_ok=True)
+            file = tempfile.SpooledTemporaryFile(max_size=config.EXPORT_SPOOL_SIZE, mode="w+b",
+                                                 dir=config.EXPORT_PATH,
+                                                 prefix=f"export_{self.export_format.chat_id}_")
+        else:
+            file = open(self._part_path(len(self.parts) + 1), "w+b")
+        self.parts.append(file)
+        self.part_counts.append(0)
+        return self.export_format.open_part(file, self.compression)
+
+    def reopen(self, part_counts: List[int], append: bool = False):
+        """
+        Открытие готовых частей в каталоге
+
+        Args:
+            part_counts: Сообщений в каждой части
+            append: Продолжить запись в последнюю часть (см. ExportFormat.can_append)
+        """
+        for number in range(1, len(part_counts) + 1):
+            self.parts.append(open(self._part_path(number), "r+b"))
+        self.part_counts = list(part_counts)
+        self.count = sum(part_counts)
+        if append and self.parts:
+            self._part = self.export_format.open_part(self.parts[-1], self.compression, part_counts[-1])
+
+    def write_page(self, messages: List[Message]):
+        """Запись страницы сообщений; часть, в которую не помещается сообщение, закрывается"""
+        while messages:
+            if self._part is None:
+                self._part = self._open_part()
+            written = self._part.add(messages, self.limit)
+            self.count += written
+            self.part_counts[-1] = self._part.count
+            messages = messages[written:]
+            if messages:
+                self._part.close()
+                self._part = None
+
+    def finish(self) -> List[BinaryIO]:
+        """
+        Окончание экспорта
+
+        Returns:
+            Файлы частей, позиция в начале (пустой список, если сообщений нет)
+        """
+        if self._part is not None:
+            self._part.close()
+            self._part = None
+        for file in self.parts:
+            self.export_format.finalize(file, self.count)
+            file.flush()
+            file.seek(0)
+        return self.parts
+
+    def part_sizes(self) -> List[int]:
+        """Размеры частей, байт"""
+        sizes = []
+        for file in self.parts:
+            position = file.tell()
+            file.seek(0, os.SEEK_END)
+            sizes.append(file.tell())
+            file.seek(position)
+        return sizes
+
+    def close(self):
+        """Закрытие файлов частей (временные файлы удаляются)"""
+        for file in self.parts:
+            file.close()
+        self.parts = []
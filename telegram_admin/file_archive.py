@@ -0,0 +1,233 @@
+"""
+Выгрузка файлов чата zip-архивами
+
+/files <chat_id> <days> zip складывает файлы документов в zip-тома не больше
+EXPORT_UPLOAD_LIMIT байт, каждый том - самостоятельный архив:
+
+    <дата>_<message_id>_<имя файла>  - файлы документов
+    manifest.csv                     - какие файлы в томе и к каким сообщениям
+                                       относятся; документы, файлы которых в архив
+                                       не попали (не скачаны, больше тома), - со статусом
+
+Фото, видео, аудио и уже сжатые форматы сохраняются без сжатия (ZIP_STORED):
+повторное сжатие их не уменьшает, остальные файлы сжимаются deflate. Тома
+пишутся с ZIP64 - файлы больше 4 ГБ и больше 65535 записей допустимы при
+большом лимите загрузки (локальный сервер Bot API).
+"""
+import csv
+import io
+import os
+import tempfile
+import zipfile
+from datetime import datetime
+from typing import BinaryIO, Optional
+from config import config
+
+MANIFEST_NAME = "manifest.csv"
+
+# Колонки manifest.csv
+MANIFEST_COLUMNS = ("file", "status", "message_id", "message_date", "user_id", "document_type",
+                    "file_name", "mime_type", "file_size", "file_id")
+
+# Статусы документов в manifest.csv
+STATUS_OK = "ok"
+STATUS_NOT_DOWNLOADED = "not_downloaded"
+STATUS_TOO_LARGE = "too_large"
+
+# Типы документов Telegram, файлы которых уже сжаты
+STORED_DOCUMENT_TYPES = {"photo", "video", "video_note", "animation", "audio", "voice", "sticker"}
+STORED_MIME_PREFIXES = ("image/", "video/", "audio/")
+STORED_EXTENSIONS = {".zip", ".gz", ".tgz", ".bz2", ".xz", ".zst", ".7z", ".rar", ".jpg", ".jpeg", ".png",
+                     ".gif", ".webp", ".heic", ".mp4", ".mov", ".mkv", ".webm", ".mp3", ".m4a", ".ogg",
+                     ".oga", ".opus", ".docx", ".xlsx", ".pptx", ".odt", ".ods", ".epub", ".apk", ".jar"}
+
+# Служебные записи одного файла: локальный заголовок и запись центрального
+# каталога (без имени) с дополнительными полями ZIP64
+ZIP_ENTRY_OVERHEAD = 30 + 20 + 46 + 28
+
+# Запас на конец архива (записи ZIP64 и конец центрального каталога) и заголовки manifest.csv
+ZIP_VOLUME_RESERVE = 4096
+
+
+def is_compressed(document: dict) -> bool:
+    """Файл документа уже сжат (сохраняется в архиве без сжатия)"""
+    if document.get("document_type") in STORED_DOCUMENT_TYPES:
+        return True
+    mime_type = document.get("mime_type") or ""
+    if mime_type.startswith(STORED_MIME_PREFIXES):
+        return True
+    name = document.get("file_name") or document.get("file_path") or ""
+    return os.path.splitext(name)[1].lower() in STORED_EXTENSIONS
+
+
+def _deflate_bound(size: int) -> int:
+    """Наибольший размер данных после deflate (несжимаемые данные хранятся блоками)"""
+    return size + size // 1000 + 64
+
+
+class ZipVolumeWriter:
+    """
+    Запись файлов документов в zip-тома не больше EXPORT_UPLOAD_LIMIT байт
+
+    Тома - SpooledTemporaryFile в EXPORT_PATH (до EXPORT_SPOOL_SIZE байт в памяти).
+    Файл, который не помещается в текущий том, начинает следующий: add и skip
+    возвращают законченный том, его можно отправлять, пока пишется следующий.
+    """
+
+    def __init__(self, chat_id: int, limit: int = None):
+        """
+        Инициализация
+
+        Args:
+            chat_id: ID чата (префикс временных файлов)
+            limit: Максимальный размер тома, байт (по умолчанию EXPORT_UPLOAD_LIMIT)
+        """
+        self.chat_id = chat_id
+        self.limit = limit or config.EXPORT_UPLOAD_LIMIT
+        # Начало выгрузки (имена томов)
+        self.created_at = datetime.now()
+        self.volumes = 0
+        # Документов всего, файлов в архивах, документов без файла в архиве
+        self.documents = 0
+        self.files = 0
+        self.skipped = 0
+        self._volume = None
+        self._zip = None
+        self._names = set()
+        # Строк manifest.csv в текущем томе
+        self._entries = 0
+        self._manifest = None
+        self._manifest_writer = None
+        # Служебные записи файлов тома и размер manifest.csv, байт (дописываются в конце тома)
+        self._entries_size = 0
+        self._manifest_size = 0
+
+    def _open_volume(self):
+        """Новый том"""
+        os.makedirs(config.EXPORT_PATH, exist_ok=True)
+        self._volume = tempfile.SpooledTemporaryFile(max_size=config.EXPORT_SPOOL_SIZE, mode="w+b",
+                                                     dir=config.EXPORT_PATH, prefix=f"files_{self.chat_id}_")
+        self._zip = zipfile.ZipFile(self._volume, "w", allowZip64=True, strict_timestamps=False)
+        self._names = set()
+        self._entries = 0
+        self._manifest = io.StringIO()
+        self._manifest_writer = csv.writer(self._manifest)
+        self._manifest_writer.writerow(MANIFEST_COLUMNS)
+        self._entries_size = ZIP_ENTRY_OVERHEAD + len(MANIFEST_NAME) * 2
+        self._manifest_size = len(self._manifest.getvalue().encode("utf-8"))
+        self.volumes += 1
+
+    def _close_volume(self) -> BinaryIO:
+        """Окончание тома: manifest.csv и центральный каталог"""
+        info = zipfile.ZipInfo(MANIFEST_NAME, date_time=datetime.now().timetuple()[:6])
+        info.compress_type = zipfile.ZIP_DEFLATED
+        self._zip.writestr(info, self._manifest.getvalue().encode("utf-8"))
+        self._zip.close()
+        volume = self._volume
+        volume.seek(0)
+        self._volume = None
+        self._zip = None
+        return volume
+
+    def _reserve(self, size: int, row_size: int, name: str = None) -> Optional[BinaryIO]:
+        """
+        Место в текущем томе под файл и строку manifest.csv
+
+        Returns:
+            Законченный том, если файл начинает следующий
+        """
+        finished = None
+        if self._volume is None:
+            self._open_volume()
+        entry_size = ZIP_ENTRY_OVERHEAD + len(name.encode("utf-8")) * 2 if name is not None else 0
+        volume_size = (self._volume.tell() + self._entries_size + entry_size + size
+                       + _deflate_bound(self._manifest_size + row_size) + ZIP_VOLUME_RESERVE)
+        if self._entries and volume_size > self.limit:
+            finished = self._close_volume()
+            self._open_volume()
+        self._entries_size += entry_size
+        self._manifest_size += row_size
+        self._entries += 1
+        return finished
+
+    def _archive_name(self, document: dict, path: str) -> str:
+        """Имя файла в томе: дата и ID сообщения, имя файла (уникальное в томе)"""
+        file_name = (document.get("file_name") or os.path.basename(path)).replace("/", "_").replace("\\", "_")
+        base = f"{document['message_date']:%Y%m%d_%H%M%S}_{document['message_id']}_{file_name}"
+        name, number = base, 1
+        while name in self._names:
+            number += 1
+            root, extension = os.path.splitext(base)
+            name = f"{root}_{number}{extension}"
+        return name
+
+    @staticmethod
+    def _manifest_row(document: dict, name: str, status: str) -> list:
+        """Строка manifest.csv"""
+        message_date = document.get("message_date")
+        return [name, status, document.get("message_id"),
+                message_date.isoformat() if message_date else None, document.get("user_id"),
+                document.get("document_type"), document.get("file_name"), document.get("mime_type"),
+                document.get("file_size"), document.get("file_id")]
+
+    @staticmethod
+    def _row_size(row: list) -> int:
+        """Размер строки manifest.csv, байт"""
+        buffer = io.StringIO()
+        csv.writer(buffer).writerow(row)
+        return len(buffer.getvalue().encode("utf-8"))
+
+    def add(self, document: dict, path: str) -> Optional[BinaryIO]:
+        """
+        Запись файла документа в том
+
+        Файл больше тома не записывается (статус too_large в manifest.csv).
+
+        Returns:
+            Законченный том, если файл начал следующий
+        """
+        size = os.path.getsize(path)
+        compressed = is_compressed(document)
+        data_size = size if compressed else _deflate_bound(size)
+        name = self._archive_name(document, path)
+        if data_size + ZIP_ENTRY_OVERHEAD + len(name.encode("utf-8")) * 2 + ZIP_VOLUME_RESERVE > self.limit:
+            return self.skip(document, STATUS_TOO_LARGE)
+
+        row = self._manifest_row(document, name, STATUS_OK)
+        finished = self._reserve(data_size, self._row_size(row), name)
+        # Имя проверяется заново: в новом томе совпадений нет
+        name = self._archive_name(document, path)
+        row[0] = name
+        self._zip.write(path, name, compress_type=zipfile.ZIP_STORED if compressed else zipfile.ZIP_DEFLATED)
+        self._names.add(name)
+        self._manifest_writer.writerow(row)
+        self.documents += 1
+        self.files += 1
+        return finished
+
+    def skip(self, document: dict, status: str = STATUS_NOT_DOWNLOADED) -> Optional[BinaryIO]:
+        """
+        Документ без файла в архиве - только строка manifest.csv
+
+        Returns:
+            Законченный том, если строка начала следующий
+        """
+        row = self._manifest_row(document, None, status)
+        finished = self._reserve(0, self._row_size(row))
+        self._manifest_writer.writerow(row)
+        self.documents += 1
+        self.skipped += 1
+        return finished
+
+    def finish(self) -> Optional[BinaryIO]:
+        """Последний том (None, если документов не было)"""
+        if self._volume is None:
+            return None
+        return self._close_volume()
+
+    def close(self):
+        """Удаление незаконченного тома (ошибка при записи)"""
+        if self._volume is not None:
+            self._volume.close()
+            self._volume = None
+            self._zip = None
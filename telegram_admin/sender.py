@@ -0,0 +1,209 @@
+"""
+Отправка ответов админ-бота с ограничением частоты
+
+Все ответы AdminBot (сообщения, файлы, ответы на кнопки) проходят через
+OutboundSender: запрос ждет токен общего ведра (SEND_RATE в секунду) и ведра
+чата (SEND_CHAT_RATE в секунду, до SEND_CHAT_BURST подряд), файлы загружаются
+не больше SEND_MAX_UPLOADS одновременно. RetryAfter от Telegram останавливает
+ведро чата на указанное время, после чего запрос повторяется; ошибки сети
+повторяются с удваивающейся задержкой до SEND_MAX_ATTEMPTS попыток.
+
+Отправка сообщения или файла повторяется только после ошибки соединения, когда
+запрос точно не дошел до Telegram: после таймаута ответа сообщение могло быть уже
+доставлено, и повтор продублировал бы его. Идемпотентные запросы (ответ на кнопку,
+смена клавиатуры) повторяются после любой ошибки сети.
+"""
+import asyncio
+import logging
+from contextlib import nullcontext
+from datetime import timedelta
+from typing import Any, Awaitable, BinaryIO, Callable, Dict, Optional
+import httpx
+from telegram import Message
+from telegram.error import BadRequest, NetworkError, RetryAfter
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# Максимальная задержка между повторами после ошибки сети, сек
+MAX_RETRY_DELAY = 30
+
+# Ошибки httpx, при которых запрос не был отправлен (соединение не установлено)
+UNSENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+# Число ведер чатов, после которого полные (неиспользуемые) ведра удаляются
+MAX_CHAT_BUCKETS = 1024
+
+
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, не больше burst накопленных"""
+
+    __slots__ = ("rate", "burst", "tokens", "updated", "paused_until")
+
+    def __init__(self, rate: float, burst: float, now: float):
+        """Инициализация (ведро полное)"""
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+        # До этого момента токены не выдаются (RetryAfter)
+        self.paused_until = 0.0
+
+    def _refill(self, now: float):
+        """Пополнение за прошедшее время"""
+        if now > self.updated:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Сколько ждать токена, сек (0 - токен есть)"""
+        self._refill(now)
+        wait = self.paused_until - now
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return max(wait, 0.0)
+
+    def take(self, now: float):
+        """Выдача токена (после delay() == 0)"""
+        self._refill(now)
+        self.tokens -= 1
+
+    def pause(self, now: float, seconds: float):
+        """Остановка выдачи на seconds (RetryAfter): после нее доступен один запрос, дальше - по rate"""
+        self.paused_until = max(self.paused_until, now + seconds)
+        self.tokens = 1
+        self.updated = max(self.updated, self.paused_until)
+
+    def is_idle(self, now: float) -> bool:
+        """Ведро полное и не остановлено - его можно удалить"""
+        self._refill(now)
+        return self.tokens >= self.burst and now >= self.paused_until
+
+
+class OutboundSender:
+    """Общая очередь исходящих запросов админ-бота с ограничением частоты и повторами"""
+
+    def __init__(self, rate: float = None, chat_rate: float = None, chat_burst: float = None,
+                 max_uploads: int = None, max_attempts: int = None):
+        """
+        Инициализация
+
+        Args:
+            rate: Запросов в секунду всего (по умолчанию SEND_RATE)
+            chat_rate: Запросов в секунду в один чат (по умолчанию SEND_CHAT_RATE)
+            chat_burst: Запросов в чат подряд без ожидания (по умолчанию SEND_CHAT_BURST)
+            max_uploads: Одновременных загрузок файлов (по умолчанию SEND_MAX_UPLOADS)
+            max_attempts: Попыток при ошибках сети (по умолчанию SEND_MAX_ATTEMPTS)
+        """
+        self.rate = rate or config.SEND_RATE
+        self.chat_rate = chat_rate or config.SEND_CHAT_RATE
+        self.chat_burst = chat_burst or config.SEND_CHAT_BURST
+        self.max_uploads = max_uploads or config.SEND_MAX_UPLOADS
+        self.max_attempts = max_attempts or config.SEND_MAX_ATTEMPTS
+        self._bucket = None
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+        # Семафор создается в рабочем event loop при первой загрузке
+        self._uploads = None
+        self.retries = 0
+
+    def _now(self) -> float:
+        """Время event loop"""
+        return asyncio.get_running_loop().time()
+
+    def _chat_bucket(self, chat_id: int, now: float) -> TokenBucket:
+        """Ведро чата"""
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) >= MAX_CHAT_BUCKETS:
+                for idle_id in [key for key, value in self._chat_buckets.items() if value.is_idle(now)]:
+                    del self._chat_buckets[idle_id]
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst, now)
+        return bucket
+
+    async def _acquire(self, chat_id: Optional[int]):
+        """Ожидание токенов общего ведра и ведра чата"""
+        while True:
+            now = self._now()
+            if self._bucket is None:
+                self._bucket = TokenBucket(self.rate, self.rate, now)
+            chat_bucket = self._chat_bucket(chat_id, now) if chat_id is not None else None
+            wait = self._bucket.delay(now)
+            if chat_bucket is not None:
+                wait = max(wait, chat_bucket.delay(now))
+            if wait <= 0:
+                self._bucket.take(now)
+                if chat_bucket is not None:
+                    chat_bucket.take(now)
+                return
+            await asyncio.sleep(wait)
+
+    @staticmethod
+    def _is_unsent(error: NetworkError) -> bool:
+        """Запрос не дошел до Telegram (ошибка до отправки)"""
+        return isinstance(error.__cause__, UNSENT_ERRORS)
+
+    async def send(self, chat_id: Optional[int], request: Callable[[], Awaitable[Any]],
+                   upload: bool = False, idempotent: bool = False) -> Any:
+        """
+        Выполнение запроса к Bot API с ограничением частоты и повторами
+
+        Args:
+            chat_id: Чат, в который отправляется ответ (None - только общий лимит)
+            request: Функция, создающая запрос (вызывается на каждую попытку)
+            upload: Загрузка файла (не больше SEND_MAX_UPLOADS одновременно)
+            idempotent: Повтор запроса безопасен (иначе повтор только, если запрос
+                не был отправлен)
+
+        Returns:
+            Результат запроса
+        """
+        if upload and self._uploads is None:
+            self._uploads = asyncio.Semaphore(self.max_uploads)
+        attempt = 0
+        while True:
+            async with self._uploads if upload else nullcontext():
+                await self._acquire(chat_id)
+                try:
+                    return await request()
+                except RetryAfter as e:
+                    retry_after = e.retry_after
+                    if isinstance(retry_after, timedelta):
+                        retry_after = retry_after.total_seconds()
+                    # Ограничение частоты запросов не считается неудачной попыткой
+                    logger.warning(f"RetryAfter при отправке в чат {chat_id}: {retry_after} сек")
+                    bucket = self._chat_bucket(chat_id, self._now()) if chat_id is not None else self._bucket
+                    bucket.pause(self._now(), retry_after)
+                    self.retries += 1
+                    continue
+                except BadRequest:
+                    # Запрос неверен - повтор не поможет
+                    raise
+                except NetworkError as e:
+                    if not idempotent and not self._is_unsent(e):
+                        # Запрос мог дойти до Telegram (например, TimedOut при чтении ответа)
+                        raise
+                    attempt += 1
+                    if attempt >= self.max_attempts:
+                        raise
+                    delay = min(config.SEND_RETRY_DELAY * 2 ** (attempt - 1), MAX_RETRY_DELAY)
+                    logger.warning(f"Ошибка отправки в чат {chat_id} (попытка {attempt}): {e}")
+                    self.retries += 1
+            await asyncio.sleep(delay)
+
+    async def reply_text(self, message: Message, text: str, **kwargs) -> Message:
+        """Ответ текстом на сообщение"""
+        return await self.send(message.chat_id, lambda: message.reply_text(text, **kwargs))
+
+    async def reply_document(self, message: Message, document: BinaryIO, **kwargs) -> Message:
+        """
+        Ответ файлом на сообщение
+
+        Файл читается заново с исходной позиции при каждой попытке.
+        """
+        position = document.tell()
+
+        def request():
+            document.seek(position)
+            return message.reply_document(document=document, **kwargs)
+
+        return await self.send(message.chat_id, request, upload=True)
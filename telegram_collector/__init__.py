@@ -2,8 +2,14 @@
 Модуль для сбора сообщений из Telegram
 """
 from .collector import MessageCollector
-
-__all__ = ['MessageCollector']
+from .downloader import DownloadManager
+from .webhook import WebhookServer
+from .update_processor import ChatOrderedUpdateProcessor
+from .sharding import ShardedDispatcher
+from .offsets import UpdateOffsetTracker
+
+__all__ = ['MessageCollector', 'DownloadManager', 'WebhookServer', 'ChatOrderedUpdateProcessor',
+           'ShardedDispatcher', 'UpdateOffsetTracker']
 
 
 
@@ -1,12 +1,11 @@
 """
 Модуль для сбора сообщений из Telegram чатов
 """
-import os
 import logging
 from telegram import Update
 from telegram.ext import ContextTypes
 from datetime import datetime, timezone
-from database.db_manager import DatabaseManager
+from database.write_queue import WriteBehindQueue
 from config import config
 
 logger = logging.getLogger(__name__)
@@ -15,86 +14,9 @@ logger = logging.getLogger(__name__)
 class MessageCollector:
     """Класс для сбора и сохранения сообщений из Telegram"""
     
-    def __init__(self, db_manager: DatabaseManager):
+    def __init__(self, write_queue: WriteBehindQueue):
         """Инициализация сборщика сообщений"""
-        self.db_manager = db_manager
-        self._ensure_download_dir()
-    
-    def _ensure_download_dir(self):
-        """Создание директории для загрузок, если она не существует"""
-        if not os.path.exists(config.DOWNLOAD_PATH):
-            os.makedirs(config.DOWNLOAD_PATH)
-            logger.info(f"Создана директория для загрузок: {config.DOWNLOAD_PATH}")
-    
-    def _get_file_dir(self, chat_id: int) -> str:
-        """Получение директории для файлов чата с организацией по месяцам"""
-        now = datetime.utcnow()
-        month_dir = now.strftime("%Y-%m")
-        file_dir = os.path.join(config.DOWNLOAD_PATH, f"chat_{chat_id}", month_dir)
-        
-        if not os.path.exists(file_dir):
-            os.makedirs(file_dir)
-        
-        return file_dir
-    
-    async def _download_file(self, context: ContextTypes.DEFAULT_TYPE, file_id: str, 
-                            chat_id: int, document_type: str, 
-                            original_filename: str = None) -> str:
-        """
-        Скачивание файла из Telegram на диск
-        
-        Args:
-            context: Контекст Telegram бота
-            file_id: ID файла в Telegram
-            chat_id: ID чата
-            document_type: Тип документа (photo, document, video, etc.)
-            original_filename: Оригинальное имя файла (если есть)
-            
-        Returns:
-            Путь к скачанному файлу или None при ошибке
-        """
-        try:
-            # Получаем информацию о файле
-            file = await context.bot.get_file(file_id)
-            
-            # Формируем имя файла
-            if original_filename:
-                # Используем оригинальное имя с добавлением timestamp для уникальности
-                timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
-                name, ext = os.path.splitext(original_filename)
-                filename = f"{name}_{timestamp}{ext}"
-            else:
-                # Генерируем имя на основе типа и file_unique_id
-                timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
-                # Определяем расширение по типу
-                ext_map = {
-                    'photo': '.jpg',
-                    'voice': '.ogg',
-                    'video': '.mp4',
-                    'audio': '.mp3',
-                    'sticker': '.webp',
-                    'video_note': '.mp4',
-                    'document': ''
-                }
-                ext = ext_map.get(document_type, '')
-                # Если есть file_path в объекте file, берём расширение оттуда
-                if file.file_path and not ext:
-                    _, ext = os.path.splitext(file.file_path)
-                filename = f"{document_type}_{timestamp}{ext}"
-            
-            # Получаем директорию для сохранения
-            file_dir = self._get_file_dir(chat_id)
-            local_path = os.path.join(file_dir, filename)
-            
-            # Скачиваем файл
-            await file.download_to_drive(local_path)
-            logger.info(f"Файл скачан: {local_path}")
-            
-            return local_path
-            
-        except Exception as e:
-            logger.error(f"Ошибка при скачивании файла {file_id}: {e}")
-            return None
+        self.write_queue = write_queue
     
     async def handle_edited_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик отредактированных сообщений"""
@@ -122,7 +44,7 @@ class MessageCollector:
         try:
             # Сохраняем пользователя
             if user:
-                self.db_manager.save_user(
+                self.write_queue.save_user(
                     user_id=user.id,
                     username=user.username,
                     first_name=user.first_name,
@@ -131,7 +53,7 @@ class MessageCollector:
             
             # Сохраняем чат
             chat_type = self._get_chat_type(chat.type)
-            self.db_manager.save_chat(
+            self.write_queue.save_chat(
                 chat_id=chat.id,
                 title=chat.title or chat.username or f"Chat {chat.id}",
                 chat_type=chat_type
@@ -193,7 +115,7 @@ class MessageCollector:
             else:
                 message_date = datetime.utcnow()
             
-            self.db_manager.save_message(
+            self.write_queue.save_message(
                 message_id=message.message_id,
                 chat_id=chat.id,
                 user_id=user.id if user else None,
@@ -241,7 +163,7 @@ class MessageCollector:
         try:
             # Сохраняем пользователя
             if user:
-                self.db_manager.save_user(
+                self.write_queue.save_user(
                     user_id=user.id,
                     username=user.username,
                     first_name=user.first_name,
@@ -250,7 +172,7 @@ class MessageCollector:
             
             # Сохраняем чат
             chat_type = self._get_chat_type(chat.type)
-            self.db_manager.save_chat(
+            self.write_queue.save_chat(
                 chat_id=chat.id,
                 title=chat.title or chat.username or f"Chat {chat.id}",
                 chat_type=chat_type
@@ -339,7 +261,7 @@ class MessageCollector:
             else:
                 message_date = datetime.utcnow()
             
-            saved_message = self.db_manager.save_message(
+            self.write_queue.save_message(
                 message_id=message.message_id,
                 chat_id=chat.id,
                 user_id=user.id if user else None,
@@ -347,100 +269,89 @@ class MessageCollector:
                 message_date=message_date
             )
             
-            # Сохраняем документы/файлы (скачиваем на диск)
+            # Сохраняем документы/файлы (скачиваются на диск в фоне по заданиям из download_jobs
+            # или по запросу администратора - в зависимости от политики скачивания)
             if message.photo:
                 # Для фото берем последнее (самое большое разрешение)
                 photo = message.photo[-1]
-                file_path = await self._download_file(
-                    context, photo.file_id, chat.id, 'photo'
-                )
-                self.db_manager.save_document(
-                    message_db_id=saved_message.id,
+                self.write_queue.save_document(
+                    chat_id=chat.id,
+                    message_id=message.message_id,
                     file_id=photo.file_id,
                     file_unique_id=photo.file_unique_id,
                     file_size=photo.file_size,
                     document_type='photo',
-                    file_path=file_path
+                    download_policy=config.get_media_mode(chat.id, 'photo', photo.file_size)
                 )
             
             if message.document:
                 doc = message.document
-                file_path = await self._download_file(
-                    context, doc.file_id, chat.id, 'document', doc.file_name
-                )
-                self.db_manager.save_document(
-                    message_db_id=saved_message.id,
+                self.write_queue.save_document(
+                    chat_id=chat.id,
+                    message_id=message.message_id,
                     file_id=doc.file_id,
                     file_unique_id=doc.file_unique_id,
                     file_name=doc.file_name,
                     mime_type=doc.mime_type,
                     file_size=doc.file_size,
                     document_type='document',
-                    file_path=file_path
+                    download_policy=config.get_media_mode(chat.id, 'document', doc.file_size)
                 )
             
             if message.video:
                 video = message.video
-                file_path = await self._download_file(
-                    context, video.file_id, chat.id, 'video', video.file_name
-                )
-                self.db_manager.save_document(
-                    message_db_id=saved_message.id,
+                self.write_queue.save_document(
+                    chat_id=chat.id,
+                    message_id=message.message_id,
                     file_id=video.file_id,
                     file_unique_id=video.file_unique_id,
                     file_name=video.file_name,
                     mime_type=video.mime_type,
                     file_size=video.file_size,
                     document_type='video',
-                    file_path=file_path
+                    download_policy=config.get_media_mode(chat.id, 'video', video.file_size)
                 )
             
             if message.audio:
                 audio = message.audio
-                file_path = await self._download_file(
-                    context, audio.file_id, chat.id, 'audio', audio.file_name
-                )
-                self.db_manager.save_document(
-                    message_db_id=saved_message.id,
+                self.write_queue.save_document(
+                    chat_id=chat.id,
+                    message_id=message.message_id,
                     file_id=audio.file_id,
                     file_unique_id=audio.file_unique_id,
                     file_name=audio.file_name,
                     mime_type=audio.mime_type,
                     file_size=audio.file_size,
                     document_type='audio',
-                    file_path=file_path
+                    download_policy=config.get_media_mode(chat.id, 'audio', audio.file_size)
                 )
             
             if message.voice:
                 voice = message.voice
-                file_path = await self._download_file(
-                    context, voice.file_id, chat.id, 'voice'
-                )
-                self.db_manager.save_document(
-                    message_db_id=saved_message.id,
+                self.write_queue.save_document(
+                    chat_id=chat.id,
+                    message_id=message.message_id,
                     file_id=voice.file_id,
                     file_unique_id=voice.file_unique_id,
                     mime_type=voice.mime_type,
                     file_size=voice.file_size,
                     document_type='voice',
-                    file_path=file_path
+                    download_policy=config.get_media_mode(chat.id, 'voice', voice.file_size)
                 )
             
             if message.sticker:
                 sticker = message.sticker
                 mime_type = getattr(sticker, 'mime_type', None) or 'image/webp'
                 file_size = getattr(sticker, 'file_size', None)
-                file_path = await self._download_file(
-                    context, sticker.file_id, chat.id, 'sticker'
-                )
-                self.db_manager.save_document(
-                    message_db_id=saved_message.id,
+                self.write_queue.save_document(
+                    chat_id=chat.id,
+                    message_id=message.message_id,
                     file_id=sticker.file_id,
                     file_unique_id=sticker.file_unique_id,
                     mime_type=mime_type,
                     file_size=file_size,
                     document_type='sticker',
-                    file_path=file_path
+                    download_policy=config.get_media_mode(chat.id, 'sticker', file_size)
                 )
             
             # Сохраняем реакции (если есть)
@@ -469,8 +380,9 @@ class MessageCollector:
                             user_id = reaction.user.id if hasattr(reaction.user, 'id') else None
                         
                         if emoji:
-                            self.db_manager.save_reaction(
-                                message_db_id=saved_message.id,
+                            self.write_queue.save_reaction(
+                                chat_id=chat.id,
+                                message_id=message.message_id,
                                 emoji=emoji,
                                 user_id=user_id
                             )
@@ -498,61 +410,38 @@ class MessageCollector:
             
             # Сохраняем пользователя
             if user:
-                self.db_manager.save_user(
+                self.write_queue.save_user(
                     user_id=user.id,
                     username=user.username,
                     first_name=user.first_name,
                     last_name=user.last_name
                 )
             
-            # Находим сообщение в БД по message_id и chat_id
-            session = self.db_manager.get_session()
-            try:
-                from database.models import Message, Reaction
-                message = session.query(Message).filter(
-                    Message.message_id == reaction_update.message_id,
-                    Message.chat_id == chat.id
-                ).first()
-                
-                if message:
-                    # Удаляем старые реакции этого пользователя (если есть)
-                    if old_reactions:
-                        for old_reaction in old_reactions:
-                            emoji = None
-                            if hasattr(old_reaction, 'emoji'):
-                                emoji = str(old_reaction.emoji)
-                            elif hasattr(old_reaction, 'type') and hasattr(old_reaction.type, 'emoji'):
-                                emoji = str(old_reaction.type.emoji)
-                            
-                            if emoji:
-                                session.query(Reaction).filter(
-                                    Reaction.message_id == message.id,
-                                    Reaction.user_id == user.id,
-                                    Reaction.emoji == emoji
-                                ).delete()
-                    
-                    # Добавляем новые реакции
-                    if new_reactions:
-                        for new_reaction in new_reactions:
-                            emoji = None
-                            if hasattr(new_reaction, 'emoji'):
-                                emoji = str(new_reaction.emoji)
-                            elif hasattr(new_reaction, 'type') and hasattr(new_reaction.type, 'emoji'):
-                                emoji = str(new_reaction.type.emoji)
-                            
-                            if emoji:
-                                self.db_manager.save_reaction(
-                                    message_db_id=message.id,
-                                    emoji=emoji,
-                                    user_id=user.id
-                                )
-                    session.commit()
-            finally:
-                session.close()
+            old_emojis = [emoji for emoji in map(self._get_reaction_emoji, old_reactions) if emoji]
+            new_emojis = [emoji for emoji in map(self._get_reaction_emoji, new_reactions) if emoji]
+            
+            # Удаление старых и добавление новых реакций пользователя
+            # выполняется в одной транзакции при записи пакета
+            if user and (old_emojis or new_emojis):
+                self.write_queue.apply_reaction_change(
+                    chat_id=chat.id,
+                    message_id=reaction_update.message_id,
+                    user_id=user.id,
+                    old_emojis=old_emojis,
+                    new_emojis=new_emojis
+                )
                 
         except Exception as e:
             logger.error(f"Ошибка при обработке реакции: {e}", exc_info=True)
     
+    def _get_reaction_emoji(self, reaction) -> str:
+        """Получение эмодзи из объекта реакции"""
+        if hasattr(reaction, 'emoji'):
+            return str(reaction.emoji)
+        if hasattr(reaction, 'type') and hasattr(reaction.type, 'emoji'):
+            return str(reaction.type.emoji)
+        return None
+    
     def _get_chat_type(self, chat_type: str) -> str:
         """Преобразование типа чата в строку"""
         type_mapping = {
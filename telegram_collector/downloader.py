@@ -0,0 +1,378 @@
+"""
+Фоновое скачивание файлов из Telegram
+"""
+import os
+import asyncio
+import hashlib
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+from telegram import Bot
+from telegram.error import BadRequest, RetryAfter
+from config import config
+from database.async_db_manager import AsyncDatabaseManager
+
+logger = logging.getLogger(__name__)
+
+# Максимальная задержка между повторными попытками (сек)
+MAX_RETRY_DELAY = 3600
+
+# Каталог хранилища внутри DOWNLOAD_PATH, файлы в нем называются по file_unique_id
+MEDIA_STORE_DIR = "media"
+
+# Расширения файлов по типу документа
+EXTENSIONS = {
+    'photo': '.jpg',
+    'voice': '.ogg',
+    'video': '.mp4',
+    'audio': '.mp3',
+    'sticker': '.webp',
+    'video_note': '.mp4',
+    'document': ''
+}
+
+
+class DownloadManager:
+    """
+    Пул обработчиков, скачивающих файлы по заданиям из таблицы download_jobs
+
+    Сборщик сохраняет сообщение и документ сразу, а задание на скачивание
+    создается в той же транзакции. Обработчики берут задания в порядке приоритета
+    (тип файла, затем размер), соблюдая общий лимит одновременных загрузок
+    (DOWNLOAD_WORKERS) и лимит на чат (DOWNLOAD_PER_CHAT_LIMIT), и после
+    скачивания заполняют Document.file_path. Неудачные попытки повторяются
+    с экспоненциальной задержкой.
+
+    Файлы хранятся по file_unique_id и учитываются в media_blobs: повторное
+    вложение того же файла не скачивается, а получает путь к существующему.
+    """
+
+    def __init__(self, db_manager: AsyncDatabaseManager, workers: int = None,
+                 per_chat_limit: int = None):
+        """Инициализация менеджера загрузок"""
+        self.db_manager = db_manager
+        self.workers = workers or config.DOWNLOAD_WORKERS
+        self.per_chat_limit = per_chat_limit or config.DOWNLOAD_PER_CHAT_LIMIT
+        self.bot = None
+        self._active_jobs = {}  # ID задания -> задание
+        self._active_by_chat: Dict[int, int] = {}
+        self._claim_lock = None
+        self._wakeup = None
+        self._tasks: List[asyncio.Task] = []
+        self._draining = False
+        self._waiters: Dict[int, List[asyncio.Future]] = {}  # ID задания -> ожидающие
+        self._ensure_download_dir()
+
+    def _ensure_download_dir(self):
+        """Создание директории для загрузок, если она не существует"""
+        if not os.path.exists(config.DOWNLOAD_PATH):
+            os.makedirs(config.DOWNLOAD_PATH)
+            logger.info(f"Создана директория для загрузок: {config.DOWNLOAD_PATH}")
+
+    async def start(self, bot: Bot):
+        """Запуск обработчиков"""
+        if self._tasks:
+            return
+        self.bot = bot
+        self._claim_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._wakeup.set()  # Сразу подбираем задания, оставшиеся с прошлого запуска
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        logger.info(
+            f"Загрузка файлов запущена (обработчиков: {self.workers}, "
+            f"на чат: {self.per_chat_limit})"
+        )
+
+    async def stop(self, drain_timeout: float = None):
+        """
+        Остановка обработчиков с возвратом незавершенных заданий в очередь
+
+        Новые задания не берутся, начатые загрузки дописываются до drain_timeout
+        секунд (по умолчанию DOWNLOAD_DRAIN_TIMEOUT), остальные прерываются.
+        """
+        if not self._tasks:
+            return
+        if drain_timeout is None:
+            drain_timeout = config.DOWNLOAD_DRAIN_TIMEOUT
+        self._draining = True
+        self._wakeup.set()  # Свободные обработчики завершаются сразу
+        if drain_timeout > 0:
+            if self._active_jobs:
+                logger.info(f"Ожидание завершения загрузок: {len(self._active_jobs)}")
+            await asyncio.wait(self._tasks, timeout=drain_timeout)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._draining = False
+
+        if self._active_jobs:
+            try:
+                await self.db_manager.release_download_jobs(list(self._active_jobs))
+            except Exception as e:
+                logger.error(f"Не удалось вернуть задания на скачивание в очередь: {e}")
+            self._active_jobs.clear()
+            self._active_by_chat.clear()
+        logger.info("Загрузка файлов остановлена")
+
+    def notify(self):
+        """Сигнал обработчикам, что в очереди появились задания"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def on_batch_written(self, operations: List[dict]):
+        """Обработчик записи пакета очередью WriteBehindQueue"""
+        if any(op['op'] == 'document' and not op.get('file_path') for op in operations):
+            self.notify()
+
+    async def fetch(self, document_ids: List[int], timeout: float = None) -> Dict[int, str]:
+        """
+        Скачивание файлов документов по запросу (политика lazy) с ожиданием результата
+
+        Задания ставятся в начало очереди и выполняются обработчиками с соблюдением
+        лимитов. Уже скачанные файлы не скачиваются повторно.
+
+        Args:
+            document_ids: ID документов
+            timeout: Максимальное время ожидания (по умолчанию MEDIA_FETCH_TIMEOUT)
+
+        Returns:
+            Словарь ID документа -> путь к файлу для документов, файл которых есть
+        """
+        job_ids = await self.db_manager.request_downloads(document_ids)
+        if job_ids:
+            loop = asyncio.get_running_loop()
+            futures = []
+            for job_id in job_ids:
+                future = loop.create_future()
+                self._waiters.setdefault(job_id, []).append(future)
+                futures.append(future)
+            self.notify()
+            try:
+                await asyncio.wait(futures, timeout=timeout or config.MEDIA_FETCH_TIMEOUT)
+            finally:
+                for job_id, future in zip(job_ids, futures):
+                    waiters = self._waiters.get(job_id, [])
+                    if future in waiters:
+                        waiters.remove(future)
+                    if not waiters:
+                        self._waiters.pop(job_id, None)
+        return await self.db_manager.get_document_paths(document_ids)
+
+    @property
+    def active_count(self) -> int:
+        """Количество скачиваемых сейчас файлов"""
+        return len(self._active_jobs)
+
+    async def _worker(self):
+        """Цикл обработчика: захват задания, скачивание, ожидание новых заданий"""
+        while not self._draining:
+            job = await self._next_job()
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), config.DOWNLOAD_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            # При отмене задание остается в _active_jobs и возвращается в очередь в stop()
+            await self._process(job)
+            self._finish(job)
+            for future in self._waiters.pop(job['id'], []):
+                if not future.done():
+                    future.set_result(None)
+
+    async def _next_job(self) -> dict:
+        """Захват следующего задания с учетом лимита загрузок на чат"""
+        async with self._claim_lock:
+            self._wakeup.clear()
+            busy_chats = [
+                chat_id for chat_id, count in self._active_by_chat.items()
+                if count >= self.per_chat_limit
+            ]
+            try:
+                jobs = await self.db_manager.claim_download_jobs(1, busy_chats)
+            except Exception as e:
+                logger.error(f"Ошибка при получении заданий на скачивание: {e}")
+                return None
+            if not jobs:
+                return None
+
+            job = jobs[0]
+            self._active_jobs[job['id']] = job
+            self._active_by_chat[job['chat_id']] = self._active_by_chat.get(job['chat_id'], 0) + 1
+            return job
+
+    def _finish(self, job: dict):
+        """Освобождение места в общем лимите и лимите чата"""
+        self._active_jobs.pop(job['id'], None)
+        count = self._active_by_chat.get(job['chat_id'], 0) - 1
+        if count > 0:
+            self._active_by_chat[job['chat_id']] = count
+        else:
+            self._active_by_chat.pop(job['chat_id'], None)
+        # Задания этого чата могли ждать свободного места
+        if count + 1 >= self.per_chat_limit:
+            self.notify()
+
+    async def _process(self, job: dict):
+        """Скачивание файла по заданию и запись результата в БД"""
+        if job['blob_path'] and os.path.exists(job['blob_path']):
+            # Файл с тем же file_unique_id уже скачан - только привязываем документ
+            await self._safe_db_call(self.db_manager.complete_download_job(
+                job['id'], job['document_id'], job['blob_path'], job['file_unique_id']
+            ))
+            return
+
+        try:
+            file_path, file_size, sha256 = await self._download_file(job)
+        except asyncio.CancelledError:
+            raise
+        except RetryAfter as e:
+            retry_after = e.retry_after
+            if isinstance(retry_after, timedelta):
+                retry_after = retry_after.total_seconds()
+            # Ограничение частоты запросов не считается неудачной попыткой
+            await self._retry_later(job, f"RetryAfter: {retry_after} сек", retry_after,
+                                    count_attempt=False)
+            return
+        except BadRequest as e:
+            # Файл недоступен боту (например, больше лимита Bot API) - повтор не поможет
+            logger.error(f"Файл {job['file_id']} не может быть скачан: {e}")
+            await self._safe_db_call(self.db_manager.fail_download_job(job['id'], str(e)))
+            return
+        except Exception as e:
+            delay = min(config.DOWNLOAD_RETRY_DELAY * 2 ** (job['attempts'] - 1), MAX_RETRY_DELAY)
+            await self._retry_later(job, str(e) or type(e).__name__, delay)
+            return
+
+        logger.info(f"Файл скачан: {file_path}")
+        stored_path = await self._safe_db_call(self.db_manager.complete_download_job(
+            job['id'], job['document_id'], file_path, job['file_unique_id'], file_size, sha256
+        ))
+        if stored_path and stored_path != file_path:
+            # Такое же содержимое уже есть в хранилище - копия не нужна
+            os.remove(file_path)
+            logger.info(f"Файл {file_path} совпадает с {stored_path}, копия удалена")
+
+    async def cleanup_media(self) -> int:
+        """
+        Удаление с диска файлов, на которые больше не ссылается ни один документ
+
+        Returns:
+            Количество удаленных файлов
+        """
+        removed = 0
+        for path in await self.db_manager.delete_unreferenced_media_blobs():
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+    async def _retry_later(self, job: dict, error: str, delay: float, count_attempt: bool = True):
+        """Возврат задания в очередь с задержкой или отметка об окончательной ошибке"""
+        if count_attempt and job['attempts'] >= config.DOWNLOAD_MAX_ATTEMPTS:
+            logger.error(
+                f"Файл {job['file_id']} не скачан за {job['attempts']} попыток: {error}"
+            )
+            await self._safe_db_call(self.db_manager.fail_download_job(job['id'], error))
+            return
+
+        logger.warning(
+            f"Ошибка при скачивании файла {job['file_id']} (попытка {job['attempts']}), "
+            f"повтор через {delay:.0f} сек: {error}"
+        )
+        retry_at = datetime.utcnow() + timedelta(seconds=delay)
+        await self._safe_db_call(
+            self.db_manager.fail_download_job(job['id'], error, retry_at, count_attempt)
+        )
+
+    async def _safe_db_call(self, coroutine):
+        """Обновление задания в БД без остановки обработчика при ошибке"""
+        try:
+            return await coroutine
+        except Exception as e:
+            # Задание останется в статусе 'running' и будет взято повторно
+            # после DOWNLOAD_JOB_TIMEOUT
+            logger.error(f"Не удалось обновить задание на скачивание: {e}")
+
+    def _get_file_dir(self, chat_id: int) -> str:
+        """Получение директории для файлов чата с организацией по месяцам"""
+        now = datetime.utcnow()
+        month_dir = now.strftime("%Y-%m")
+        file_dir = os.path.join(config.DOWNLOAD_PATH, f"chat_{chat_id}", month_dir)
+
+        if not os.path.exists(file_dir):
+            os.makedirs(file_dir, exist_ok=True)
+
+        return file_dir
+
+    def _get_store_path(self, file_unique_id: str, ext: str) -> str:
+        """Путь к файлу в хранилище, адресуемом по file_unique_id"""
+        file_dir = os.path.join(config.DOWNLOAD_PATH, MEDIA_STORE_DIR, file_unique_id[:2])
+        if not os.path.exists(file_dir):
+            os.makedirs(file_dir, exist_ok=True)
+        return os.path.join(file_dir, f"{file_unique_id}{ext}")
+
+    async def _download_file(self, job: dict) -> Tuple[str, int, str]:
+        """
+        Скачивание файла из Telegram на диск
+
+        Файлы с file_unique_id сохраняются в хранилище DOWNLOAD_PATH/media под
+        именем file_unique_id, остальные - в папку чата по месяцам.
+
+        Args:
+            job: Задание на скачивание (file_id, file_unique_id, chat_id,
+                document_type, file_name, document_id)
+
+        Returns:
+            (путь к скачанному файлу, размер в байтах, sha256 содержимого или None)
+        """
+        # Получаем информацию о файле
+        file = await self.bot.get_file(job['file_id'])
+
+        document_type = job['document_type']
+        if job['file_name']:
+            name, ext = os.path.splitext(job['file_name'])
+        else:
+            name = document_type
+            ext = EXTENSIONS.get(document_type, '')
+            # Если есть file_path в объекте file, берём расширение оттуда
+            if file.file_path and not ext:
+                _, ext = os.path.splitext(file.file_path)
+
+        if job['file_unique_id']:
+            local_path = self._get_store_path(job['file_unique_id'], ext)
+        else:
+            # Добавляем timestamp для уникальности имени
+            timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
+            file_dir = self._get_file_dir(job['chat_id'])
+            local_path = os.path.join(file_dir, f"{name}_{timestamp}{ext}")
+            # Несколько файлов чата могут скачиваться в одну секунду
+            if os.path.exists(local_path):
+                local_path = os.path.join(file_dir, f"{name}_{timestamp}_{job['document_id']}{ext}")
+
+        # Скачиваем во временный файл, чтобы прерванная загрузка не оставила битый файл
+        partial_path = f"{local_path}.{job['id']}.part"
+        try:
+            await file.download_to_drive(partial_path)
+            sha256 = None
+            if config.MEDIA_CONTENT_HASH:
+                sha256 = await asyncio.to_thread(self._hash_file, partial_path)
+            os.replace(partial_path, local_path)
+        finally:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+
+        return local_path, os.path.getsize(local_path), sha256
+
+    @staticmethod
+    def _hash_file(path: str) -> str:
+        """SHA-256 содержимого файла"""
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
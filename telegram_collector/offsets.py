@@ -0,0 +1,197 @@
+"""
+Сохранение позиции обработанных обновлений между запусками
+"""
+import asyncio
+import json
+import logging
+import os
+from collections import deque
+from typing import Callable
+from config import config
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateOffsetTracker:
+    """
+    Позиция обработанных обновлений Telegram (update_id) в файле на диске
+
+    offset - наибольший update_id, до которого включительно обработаны все полученные
+    обновления. Обновления одного запуска завершаются не по порядку (разные чаты
+    обрабатываются параллельно), поэтому завершенные обновления выше offset
+    хранятся в ограниченном множестве недавно обработанных. После перезапуска
+    обновления с update_id <= offset или из этого множества пропускаются: Telegram
+    повторно присылает обновления, получение которых не было подтверждено.
+
+    Обновление завершается, только когда его данные сохранены: после выхода из
+    обработчика (finish) завершение откладывается через when_durable - до сброса
+    журнала записи на диск или, без журнала, до записи пакета в БД. Обновление,
+    переданное процессу-обработчику (forward), завершается подтверждением этого
+    процесса (complete).
+
+    Файл перезаписывается (с fsync) не чаще раза в UPDATE_OFFSET_FLUSH_INTERVAL
+    секунд, перед записью вызывается before_flush - сброс журнала записи на диск.
+    Та же позиция подтверждает обновления Telegram (см. UpdatePoller).
+    """
+
+    def __init__(self, path: str = None, seen_size: int = None, flush_interval: float = None,
+                 before_flush: Callable[[], None] = None,
+                 when_durable: Callable[[Callable[[], None]], None] = None):
+        """Инициализация"""
+        self.path = path or config.UPDATE_OFFSET_FILE
+        self.seen_size = seen_size or config.UPDATE_SEEN_SIZE
+        self.flush_interval = flush_interval or config.UPDATE_OFFSET_FLUSH_INTERVAL
+        self.before_flush = before_flush
+        self.when_durable = when_durable
+        self.bot_id = None
+        self.offset = 0
+        self.duplicates = 0
+        self._seen = set()
+        self._seen_order = deque()
+        self._in_flight = set()
+        # Переданы процессам-обработчикам, ждут подтверждения
+        self._forwarded = set()
+        self._max_started = 0
+        self._dirty = False
+        self._task = None
+        # Ожидающие сдвига позиции (UpdatePoller)
+        self._advanced = None
+
+    def load(self, bot_id: int):
+        """Чтение сохраненной позиции (позиция другого бота не используется)"""
+        self.bot_id = bot_id
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.error(f"Не удалось прочитать позицию обновлений {self.path}: {e}")
+            return
+        if state.get("bot_id") != bot_id:
+            logger.warning("Сохраненная позиция обновлений относится к другому боту и не используется")
+            return
+        self.offset = self._max_started = state.get("offset", 0)
+        for update_id in state.get("seen", []):
+            self._remember(update_id)
+            self._max_started = max(self._max_started, update_id)
+        logger.info(f"Продолжение с обновления {self.offset + 1}")
+
+    async def start(self):
+        """Запуск периодического сохранения"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Остановка с сохранением итоговой позиции"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._in_flight:
+            logger.warning(f"Остановка с незавершенными обновлениями: {len(self._in_flight)}")
+        self.flush()
+
+    def is_duplicate(self, update_id: int) -> bool:
+        """Обновление уже обработано или обрабатывается"""
+        return update_id <= self.offset or update_id in self._seen or update_id in self._in_flight
+
+    def begin(self, update_id: int):
+        """Начало обработки обновления"""
+        self._in_flight.add(update_id)
+        self._max_started = max(self._max_started, update_id)
+
+    def forward(self, update_id: int):
+        """Обновление передано процессу-обработчику: завершится его подтверждением"""
+        self._forwarded.add(update_id)
+
+    def finish(self, update_id: int):
+        """Выход из обработчика (в том числе с ошибкой): завершение после сохранения данных"""
+        if update_id in self._forwarded:
+            return
+        if self.when_durable is None:
+            self.complete(update_id)
+        else:
+            self.when_durable(lambda: self.complete(update_id))
+
+    def complete(self, update_id: int):
+        """Завершение обновления: его данные сохранены"""
+        self._forwarded.discard(update_id)
+        self._in_flight.discard(update_id)
+        self._remember(update_id)
+        offset = min(self._in_flight) - 1 if self._in_flight else self._max_started
+        if offset > self.offset:
+            self.offset = offset
+            self._dirty = True
+            if self._advanced is not None:
+                self._advanced.set()
+
+    async def wait_advanced(self, offset: int, timeout: float):
+        """
+        Ожидание сдвига позиции дальше offset (не дольше timeout секунд)
+
+        Сначала вызывается before_flush: сброс журнала сразу завершает обновления,
+        обработчики которых уже выполнены.
+        """
+        if self.before_flush is not None:
+            self.before_flush()
+        if self.offset > offset:
+            return
+        if self._advanced is None:
+            self._advanced = asyncio.Event()
+        self._advanced.clear()
+        try:
+            await asyncio.wait_for(self._advanced.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def flush(self):
+        """Запись позиции в файл, если она изменилась"""
+        if self.bot_id is None:
+            return
+        if self.before_flush is not None:
+            # Сброс журнала завершает обновления, ожидающие сохранения данных
+            self.before_flush()
+        if not self._dirty:
+            return
+        state = {
+            "bot_id": self.bot_id,
+            "offset": self.offset,
+            "seen": sorted(update_id for update_id in self._seen if update_id > self.offset)
+        }
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self._dirty = False
+
+    def get_stats(self) -> dict:
+        """Позиция и счетчики для health-эндпоинта"""
+        return {
+            "offset": self.offset,
+            "in_flight": len(self._in_flight),
+            "duplicates_skipped": self.duplicates
+        }
+
+    def _remember(self, update_id: int):
+        """Добавление в ограниченное множество недавно обработанных"""
+        if update_id in self._seen:
+            return
+        self._seen.add(update_id)
+        self._seen_order.append(update_id)
+        if len(self._seen_order) > self.seen_size:
+            self._seen.discard(self._seen_order.popleft())
+
+    async def _run(self):
+        """Периодическое сохранение позиции"""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка при сохранении позиции обновлений: {e}")
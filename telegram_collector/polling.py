@@ -0,0 +1,96 @@
+"""
+Получение обновлений через getUpdates с подтверждением только сохраненных
+"""
+import asyncio
+import logging
+from typing import List
+from telegram.error import Conflict, TelegramError, TimedOut
+from telegram.ext import Application
+from config import config
+from .offsets import UpdateOffsetTracker
+
+logger = logging.getLogger(__name__)
+
+# Длительность long polling одного запроса getUpdates, сек
+POLL_TIMEOUT = 10
+
+# Задержка повтора после ошибки getUpdates, сек (удваивается до MAX_RETRY_DELAY)
+RETRY_DELAY = 1
+MAX_RETRY_DELAY = 30
+
+
+class UpdatePoller:
+    """
+    Цикл getUpdates, подтверждающий Telegram только обновления с сохраненными данными
+
+    Стандартный Updater PTB подтверждает пачку следующим же запросом, до выполнения
+    обработчиков: обновления, полученные перед аварийной остановкой, но не
+    записанные в журнал или БД, Telegram больше не пришлет. Здесь каждый запрос
+    идет с offset = tracker.offset + 1 (см. UpdateOffsetTracker), поэтому
+    подтверждаются только обновления, данные которых сохранены.
+
+    Telegram повторяет неподтвержденные обновления в каждом ответе; уже переданные
+    в Application в этом запуске (номер не больше последнего переданного)
+    пропускаются. Если ответ целиком из таких обновлений (getUpdates отдает не
+    больше 100 за раз), поллер ждет сдвига позиции, а не повторяет запрос сразу.
+    """
+
+    def __init__(self, application: Application, tracker: UpdateOffsetTracker,
+                 allowed_updates: List[str] = None):
+        """Инициализация поллера"""
+        self.application = application
+        self.tracker = tracker
+        self.allowed_updates = allowed_updates
+        self.received_count = 0
+        self._last_queued = 0
+        self._task = None
+
+    async def start(self):
+        """Удаление webhook (getUpdates с ним не работает) и запуск цикла получения"""
+        await self.application.bot.delete_webhook(drop_pending_updates=config.DROP_PENDING_UPDATES)
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"Получение обновлений запущено с обновления {self.tracker.offset + 1}")
+
+    async def stop(self):
+        """
+        Остановка цикла получения
+
+        Переданные в Application обновления обрабатываются до его остановки;
+        Telegram подтверждается при следующем запуске по сохраненной позиции.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+            logger.info("Получение обновлений остановлено")
+
+    async def _run(self):
+        """Получение обновлений и передача новых в update_queue"""
+        delay = RETRY_DELAY
+        while True:
+            offset = self.tracker.offset
+            try:
+                updates = await self.application.bot.get_updates(
+                    offset=offset + 1, timeout=POLL_TIMEOUT, allowed_updates=self.allowed_updates
+                )
+            except TimedOut:
+                continue
+            except TelegramError as e:
+                if isinstance(e, Conflict):
+                    logger.warning("Обнаружен конфликт: другой экземпляр бота уже получает обновления")
+                else:
+                    logger.error(f"Ошибка при получении обновлений, повтор через {delay} сек: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, MAX_RETRY_DELAY)
+                continue
+            delay = RETRY_DELAY
+
+            fresh = [update for update in updates if update.update_id > self._last_queued]
+            for update in fresh:
+                await self.application.update_queue.put(update)
+            if fresh:
+                self._last_queued = fresh[-1].update_id
+                self.received_count += len(fresh)
+            elif updates:
+                # Все полученные обновления уже обрабатываются или ждут сохранения данных
+                await self.tracker.wait_advanced(offset, POLL_TIMEOUT)
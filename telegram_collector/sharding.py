@@ -0,0 +1,285 @@
+"""
+Распределение обновлений по процессам-обработчикам по chat_id
+"""
+import asyncio
+import functools
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+from typing import Callable, List, Optional
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# Сколько обновлений обработчик забирает из очереди за один раз
+WORKER_BATCH_SIZE = 200
+
+# Пауза при заполненной очереди обработчика, сек
+QUEUE_FULL_DELAY = 0.01
+
+# Уведомления обработчиков основному процессу: (тип, значение)
+NOTIFY_DOCUMENTS = "documents"
+NOTIFY_ACKNOWLEDGED = "acknowledged"
+
+# Типы обновлений, которые сохраняет MessageCollector
+COLLECTED_UPDATE_TYPES = ("message", "edited_message", "message_reaction")
+
+
+def get_shard_chat_id(data: dict) -> Optional[int]:
+    """
+    Чат, по которому обновление (в виде JSON Bot API) направляется обработчику
+
+    Возвращает None для обновлений, которые остаются в основном процессе: команды
+    и все, что не сохраняет MessageCollector. Правило повторяет фильтры
+    обработчиков в main.py.
+    """
+    for update_type in COLLECTED_UPDATE_TYPES:
+        payload = data.get(update_type)
+        if payload is None:
+            continue
+        if update_type != "message_reaction":
+            entities = payload.get("entities")
+            if entities and entities[0].get("type") == "bot_command" and entities[0].get("offset") == 0:
+                return None
+        chat = payload.get("chat")
+        return chat.get("id") if chat else None
+    return None
+
+
+class ShardedDispatcher:
+    """
+    Основной процесс: раздает обновления процессам-обработчикам
+
+    Обновления одного чата всегда попадают в один процесс (chat_id % workers)
+    и обрабатываются в нем по порядку. Каждый обработчик держит свои
+    MessageCollector, очередь записи и пул соединений с БД.
+
+    Обработчик подтверждает обновления (по update_id) через общую очередь
+    уведомлений, когда их данные сохранены в его журнале или в БД: до этого
+    обновление считается незавершенным и позиция обновлений его не проходит.
+
+    Остановка: в очередь каждого обработчика кладется None, обработчик
+    дорабатывает полученные обновления, записывает очередь в БД и завершается.
+    Процессы, не завершившиеся за WORKER_SHUTDOWN_TIMEOUT, принудительно
+    останавливаются.
+    """
+
+    def __init__(self, workers: int = None, queue_size: int = None):
+        """Инициализация диспетчера"""
+        self.workers = workers or config.WORKER_PROCESSES
+        self.queue_size = queue_size or config.WORKER_QUEUE_SIZE
+        # spawn: дочерний процесс не наследует event loop и соединения с БД
+        self._context = multiprocessing.get_context("spawn")
+        self._queues = []
+        self._locks = []
+        self._processes: List[Optional[multiprocessing.Process]] = []
+        self._notify_queue = None
+        self._notify_task = None
+        self._on_documents = None
+        self._on_acknowledged = None
+        self._closing = False
+        self.forwarded_count = 0
+
+    async def start(self, on_documents: Callable[[], None] = None,
+                    on_acknowledged: Callable[[int], None] = None):
+        """
+        Запуск процессов-обработчиков
+
+        Args:
+            on_documents: Вызывается, когда обработчик записал документы без файла
+                (сигнал очереди загрузок в основном процессе)
+            on_acknowledged: Вызывается с update_id обновления, данные которого
+                обработчик сохранил
+        """
+        self._closing = False
+        self._on_documents = on_documents
+        self._on_acknowledged = on_acknowledged
+        self._notify_queue = self._context.Queue()
+        self._queues = [self._context.Queue(self.queue_size) for _ in range(self.workers)]
+        # Порядок постановки в очередь сохраняется и при ожидании места в ней
+        self._locks = [asyncio.Lock() for _ in range(self.workers)]
+        self._processes = [None] * self.workers
+        for index in range(self.workers):
+            self._start_worker(index)
+        self._notify_task = asyncio.create_task(self._watch_notifications())
+        logger.info(f"Запущено процессов-обработчиков: {self.workers}")
+
+    async def stop(self):
+        """Остановка обработчиков после обработки всех переданных обновлений"""
+        if not self._processes:
+            return
+        self._closing = True
+        for index in range(self.workers):
+            await self._put(index, None)
+
+        for index, process in enumerate(self._processes):
+            await asyncio.to_thread(process.join, config.WORKER_SHUTDOWN_TIMEOUT)
+            if process.is_alive():
+                logger.error(f"Обработчик {index} не завершился за "
+                             f"{config.WORKER_SHUTDOWN_TIMEOUT} сек, остановка принудительно")
+                process.terminate()
+                await asyncio.to_thread(process.join)
+
+        self._notify_queue.put(None)
+        await self._notify_task
+        self._notify_task = None
+        for worker_queue in self._queues + [self._notify_queue]:
+            worker_queue.close()
+        self._processes = []
+        self._queues = []
+        self._locks = []
+        logger.info("Процессы-обработчики остановлены")
+
+    async def route(self, data: dict) -> bool:
+        """
+        Передача обновления обработчику
+
+        Returns:
+            True, если обновление передано; False - обновление обрабатывается
+            в основном процессе
+        """
+        chat_id = get_shard_chat_id(data)
+        if chat_id is None or self._closing or not self._processes:
+            return False
+        index = chat_id % self.workers
+        self._ensure_worker(index)
+        await self._put(index, data)
+        self.forwarded_count += 1
+        return True
+
+    def get_stats(self) -> dict:
+        """Длина очередей обработчиков"""
+        depths = []
+        for worker_queue in self._queues:
+            try:
+                depths.append(worker_queue.qsize())
+            except NotImplementedError:
+                # macOS: qsize не поддерживается
+                depths.append(None)
+        return {
+            "workers": self.workers,
+            "forwarded": self.forwarded_count,
+            "queue_depths": depths,
+            "alive": [bool(p and p.is_alive()) for p in self._processes]
+        }
+
+    def _start_worker(self, index: int):
+        """Запуск процесса-обработчика"""
+        process = self._context.Process(
+            target=run_worker,
+            args=(index, self._queues[index], self._notify_queue),
+            name=f"collector-worker-{index}",
+            daemon=True
+        )
+        process.start()
+        self._processes[index] = process
+
+    def _ensure_worker(self, index: int):
+        """Перезапуск упавшего обработчика (его очередь сохраняется)"""
+        process = self._processes[index]
+        if not process.is_alive():
+            logger.error(f"Обработчик {index} завершился с кодом {process.exitcode}, перезапуск")
+            self._start_worker(index)
+
+    async def _put(self, index: int, item):
+        """Постановка в очередь обработчика без блокировки event loop"""
+        worker_queue = self._queues[index]
+        async with self._locks[index]:
+            while True:
+                try:
+                    worker_queue.put_nowait(item)
+                    return
+                except queue.Full:
+                    await asyncio.sleep(QUEUE_FULL_DELAY)
+
+    async def _watch_notifications(self):
+        """Передача сигналов от обработчиков: новые документы и подтверждения обновлений"""
+        while True:
+            item = await asyncio.to_thread(self._notify_queue.get)
+            if item is None:
+                return
+            kind, value = item
+            if kind == NOTIFY_DOCUMENTS:
+                if self._on_documents:
+                    self._on_documents()
+            elif kind == NOTIFY_ACKNOWLEDGED and self._on_acknowledged:
+                for update_id in value:
+                    self._on_acknowledged(update_id)
+
+
+def run_worker(index: int, updates_queue, notify_queue):
+    """Точка входа процесса-обработчика"""
+    # Остановкой управляет основной процесс через очередь
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    logging.basicConfig(
+        format=f'%(asctime)s - worker-{index} - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    asyncio.run(_worker_main(index, updates_queue, notify_queue))
+
+
+async def _worker_main(index: int, updates_queue, notify_queue):
+    """Обработка обновлений своих чатов до получения None"""
+    # Импорт внутри процесса: основному процессу эти модули не нужны для маршрутизации
+    from telegram import Update
+    from database.async_db_manager import AsyncDatabaseManager
+    from database.journal import WriteAheadJournal
+    from database.write_queue import WriteBehindQueue
+    from .collector import MessageCollector
+
+    db_manager = AsyncDatabaseManager()
+    journal = (WriteAheadJournal(os.path.join(config.JOURNAL_PATH, f"worker-{index}"))
+               if config.JOURNAL_ENABLED else None)
+    write_queue = WriteBehindQueue(db_manager, journal=journal)
+
+    def on_batch_written(operations: List[dict]):
+        if any(op['op'] == 'document' and not op.get('file_path') for op in operations):
+            notify_queue.put_nowait((NOTIFY_DOCUMENTS, None))
+
+    def acknowledge(update_ids: List[int]):
+        notify_queue.put_nowait((NOTIFY_ACKNOWLEDGED, update_ids))
+
+    write_queue.add_flush_listener(on_batch_written)
+    collector = MessageCollector(write_queue)
+    handlers = {
+        "message": collector.handle_message,
+        "edited_message": collector.handle_edited_message,
+        "message_reaction": collector.handle_message_reaction,
+    }
+    await write_queue.start()
+    logger.info(f"Обработчик {index} запущен")
+
+    processed = 0
+    running = True
+    try:
+        while running:
+            batch = [await asyncio.to_thread(updates_queue.get)]
+            try:
+                while len(batch) < WORKER_BATCH_SIZE:
+                    batch.append(updates_queue.get_nowait())
+            except queue.Empty:
+                pass
+
+            update_ids = []
+            for data in batch:
+                if data is None:
+                    running = False
+                    break
+                update = Update.de_json(data, None)
+                for update_type, handler in handlers.items():
+                    if data.get(update_type) is not None:
+                        await handler(update, None)
+                        break
+                processed += 1
+                if data.get("update_id") is not None:
+                    update_ids.append(data["update_id"])
+            if update_ids:
+                # Подтверждение после сброса журнала на диск или записи пакета в БД
+                write_queue.call_when_durable(functools.partial(acknowledge, update_ids))
+    finally:
+        await write_queue.stop()
+        await db_manager.close()
+        logger.info(f"Обработчик {index} остановлен, обработано обновлений: {processed}")
@@ -0,0 +1,148 @@
+"""
+Параллельная обработка обновлений с сохранением порядка внутри чата
+"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Dict
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+# Предел обновлений, принятых в обработку (ожидающих своей очереди и выполняемых).
+# Параллельность ограничивает отдельный семафор, этот предел лишь защищает память.
+MAX_PENDING_UPDATES = 100000
+
+
+class _ChatLane:
+    """Очередь обновлений одного чата"""
+
+    __slots__ = ("tail", "depth")
+
+    def __init__(self):
+        self.tail = None  # Future последнего принятого обновления чата
+        self.depth = 0  # Принято, но еще не обработано
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Обработчик обновлений: разные чаты параллельно, один чат - строго по порядку
+
+    Обновления одного chat_id выстраиваются в цепочку: следующее начинает выполняться
+    только после завершения предыдущего, поэтому правка не обгоняет исходное
+    сообщение, а реакция - сообщение, к которому относится. Одновременно выполняется
+    не больше max_concurrent обновлений; слот занимает только обновление, чья очередь
+    в чате уже подошла, так что поток из одного чата не блокирует остальные.
+
+    Application вызывает do_process_update в порядке получения обновлений, место
+    в цепочке чата занимается до первого await.
+
+    С tracker (UpdateOffsetTracker) уже обработанные обновления пропускаются,
+    а выполненные передаются ему для сохранения позиции после записи их данных.
+    """
+
+    def __init__(self, max_concurrent: int, tracker=None):
+        """Инициализация обработчика"""
+        if max_concurrent < 1:
+            raise ValueError("max_concurrent должен быть положительным")
+        super().__init__(MAX_PENDING_UPDATES)
+        self.max_concurrent = max_concurrent
+        self.tracker = tracker
+        self._limit = None
+        self._lanes: Dict[int, _ChatLane] = {}
+        self._running = 0
+        self._processed = 0
+
+    async def initialize(self) -> None:
+        """Создание семафора в рабочем event loop"""
+        self._limit = asyncio.Semaphore(self.max_concurrent)
+
+    async def shutdown(self) -> None:
+        """Сброс очередей (Application дожидается своих задач до вызова shutdown)"""
+        if self._lanes:
+            logger.warning(f"Остановка с необработанными обновлениями в {len(self._lanes)} чатах")
+        self._lanes.clear()
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        """Пропуск повторов и учет позиции обработанных обновлений"""
+        update_id = update.update_id if self.tracker is not None and isinstance(update, Update) else None
+        if update_id is None:
+            await self._process_in_order(update, coroutine)
+            return
+
+        if self.tracker.is_duplicate(update_id):
+            # Повторная доставка после перезапуска
+            coroutine.close()
+            self.tracker.duplicates += 1
+            return
+        self.tracker.begin(update_id)
+        try:
+            await self._process_in_order(update, coroutine)
+        finally:
+            self.tracker.finish(update_id)
+
+    async def _process_in_order(self, update: object, coroutine: Awaitable[Any]):
+        """Выполнение обновления после предыдущих обновлений того же чата"""
+        chat_id = self._get_chat_id(update)
+        if chat_id is None:
+            # Обновления без чата не упорядочиваются
+            await self._execute(coroutine)
+            return
+
+        lane = self._lanes.get(chat_id)
+        if lane is None:
+            lane = self._lanes[chat_id] = _ChatLane()
+        previous = lane.tail
+        done = asyncio.get_running_loop().create_future()
+        lane.tail = done
+        lane.depth += 1
+
+        started = False
+        try:
+            if previous is not None and not previous.done():
+                # Предыдущее обновление всегда завершает свой Future, даже при ошибке
+                await asyncio.shield(previous)
+            started = True
+            await self._execute(coroutine)
+        finally:
+            if not started:
+                # Отмена до начала обработки
+                coroutine.close()
+            done.set_result(None)
+            lane.depth -= 1
+            if lane.tail is done:
+                # Последнее обновление чата - очередь больше не нужна
+                self._lanes.pop(chat_id, None)
+
+    async def _execute(self, coroutine: Awaitable[Any]):
+        """Выполнение обработчиков с общим ограничением параллельности"""
+        async with self._limit:
+            self._running += 1
+            try:
+                await coroutine
+            finally:
+                self._running -= 1
+                self._processed += 1
+
+    @staticmethod
+    def _get_chat_id(update: object):
+        """Чат обновления (ключ очереди)"""
+        if isinstance(update, Update) and update.effective_chat:
+            return update.effective_chat.id
+        return None
+
+    def get_stats(self, top: int = 5) -> dict:
+        """
+        Метрики очередей: выполняется сейчас, принято в очереди чатов (включая
+        выполняемые), число чатов с очередью и самые длинные очереди по чатам
+        """
+        depths = sorted(((lane.depth, chat_id) for chat_id, lane in self._lanes.items()), reverse=True)
+        return {
+            "running": self._running,
+            "pending": sum(depth for depth, _ in depths),
+            "max_concurrent": self.max_concurrent,
+            "active_chats": len(depths),
+            "max_chat_depth": depths[0][0] if depths else 0,
+            "top_chats": {str(chat_id): depth for depth, chat_id in depths[:top]},
+            "processed": self._processed
+        }
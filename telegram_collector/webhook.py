@@ -0,0 +1,105 @@
+"""
+HTTP-сервер для приема обновлений Telegram через webhook
+"""
+import hmac
+import json
+import logging
+from typing import Awaitable, Callable, List
+from aiohttp import web
+from telegram import Update
+from telegram.ext import Application
+from config import config
+
+logger = logging.getLogger(__name__)
+
+
+class WebhookServer:
+    """
+    Асинхронный HTTP-сервер (aiohttp), передающий обновления в Application
+
+    POST WEBHOOK_PATH принимает обновление, проверяет заголовок
+    X-Telegram-Bot-Api-Secret-Token и кладет Update в application.update_queue,
+    откуда его забирают обычные обработчики. GET HEALTH_PATH возвращает состояние
+    бота в JSON.
+
+    router (если задан) получает JSON обновления до разбора в Update и возвращает
+    True, если обновление передано на обработку в другое место (процессам-обработчикам).
+    """
+
+    def __init__(self, application: Application, health_callback: Callable[[], dict] = None,
+                 allowed_updates: List[str] = None,
+                 router: Callable[[dict], Awaitable[bool]] = None):
+        """Инициализация сервера"""
+        self.application = application
+        self.health_callback = health_callback
+        self.allowed_updates = allowed_updates
+        self.router = router
+        self.received_count = 0
+        self._runner = None
+
+    async def start(self):
+        """Запуск HTTP-сервера и регистрация webhook в Telegram"""
+        app = web.Application()
+        app.router.add_post(config.WEBHOOK_PATH, self._handle_update)
+        app.router.add_get(config.HEALTH_PATH, self._handle_health)
+
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, config.WEBHOOK_LISTEN, config.WEBHOOK_PORT)
+        await site.start()
+        logger.info(
+            f"Webhook-сервер запущен на {config.WEBHOOK_LISTEN}:{config.WEBHOOK_PORT}"
+            f"{config.WEBHOOK_PATH}"
+        )
+
+        if config.WEBHOOK_URL:
+            await self.application.bot.set_webhook(
+                url=config.WEBHOOK_URL.rstrip("/") + config.WEBHOOK_PATH,
+                secret_token=config.WEBHOOK_SECRET_TOKEN,
+                max_connections=config.WEBHOOK_MAX_CONNECTIONS,
+                allowed_updates=self.allowed_updates
+            )
+            logger.info(f"Webhook зарегистрирован: {config.WEBHOOK_URL}")
+
+    async def stop(self):
+        """
+        Остановка HTTP-сервера
+
+        Webhook в Telegram не удаляется: обновления копятся на стороне Telegram
+        до следующего запуска.
+        """
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+            logger.info("Webhook-сервер остановлен")
+
+    async def _handle_update(self, request: web.Request) -> web.Response:
+        """Прием обновления от Telegram"""
+        token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if not hmac.compare_digest(token, config.WEBHOOK_SECRET_TOKEN):
+            return web.Response(status=403)
+
+        try:
+            data = await request.json()
+            if self.router is not None and await self.router(data):
+                self.received_count += 1
+                return web.Response()
+            update = Update.de_json(data, self.application.bot)
+        except (json.JSONDecodeError, TypeError, ValueError, KeyError, AttributeError) as e:
+            logger.warning(f"Некорректное обновление в webhook: {e}")
+            return web.Response(status=400)
+
+        await self.application.update_queue.put(update)
+        self.received_count += 1
+        return web.Response()
+
+    async def _handle_health(self, request: web.Request) -> web.Response:
+        """Состояние бота"""
+        health = {
+            "status": "ok",
+            "received_updates": self.received_count,
+            "update_queue": self.application.update_queue.qsize()
+        }
+        if self.health_callback:
+            health.update(self.health_callback())
+        return web.json_response(health)
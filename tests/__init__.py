@@ -0,0 +1,3 @@
+"""
+Тесты (запуск: python -m pytest -q)
+"""
@@ -0,0 +1,125 @@
+"""
+Журнал упреждающей записи: добавление, сброс, контрольная точка и восстановление
+"""
+import os
+from datetime import datetime
+import pytest
+from database import journal as journal_module
+from database.journal import WriteAheadJournal, SEGMENT_SUFFIX
+
+
+def segment_files(directory: str) -> list:
+    """Файлы сегментов по возрастанию LSN"""
+    return sorted(name for name in os.listdir(directory) if name.endswith(SEGMENT_SUFFIX))
+
+
+def test_append_sync_read(tmp_path):
+    journal = WriteAheadJournal(str(tmp_path), segment_size=1024 * 1024)
+    journal.open()
+    date = datetime(2025, 1, 2, 3, 4, 5)
+    lsns = [journal.append({"op": "message", "message_id": i, "message_date": date}) for i in range(3)]
+    journal.sync()
+
+    assert lsns == [1, 2, 3]
+    assert journal.lag == 3
+    records = journal.read(0, 10)
+    assert [lsn for lsn, _ in records] == [1, 2, 3]
+    assert records[0][1] == {"op": "message", "message_id": 0, "message_date": date}
+    assert journal.read(1, 1) == [(2, records[1][1])]
+    journal.close()
+
+
+def test_read_sees_unsynced_records(tmp_path):
+    journal = WriteAheadJournal(str(tmp_path))
+    journal.open()
+    journal.append({"op": "user", "user_id": 1})
+    assert journal.read(0, 10) == [(1, {"op": "user", "user_id": 1})]
+    journal.close()
+
+
+def test_checkpoint_survives_reopen(tmp_path):
+    journal = WriteAheadJournal(str(tmp_path))
+    journal.open()
+    for i in range(5):
+        journal.append({"op": "user", "user_id": i})
+    journal.sync()
+    journal.checkpoint(3)
+    journal.close()
+
+    reopened = WriteAheadJournal(str(tmp_path))
+    reopened.open()
+    assert reopened.checkpoint_lsn == 3
+    assert reopened.last_lsn == 5
+    assert reopened.lag == 2
+    assert [op["user_id"] for _, op in reopened.read(reopened.checkpoint_lsn, 10)] == [3, 4]
+    # Нумерация продолжается с последней записи
+    assert reopened.append({"op": "user", "user_id": 5}) == 6
+    reopened.close()
+
+
+def test_reopen_drops_torn_tail(tmp_path):
+    journal = WriteAheadJournal(str(tmp_path))
+    journal.open()
+    journal.append({"op": "user", "user_id": 1})
+    journal.append({"op": "user", "user_id": 2})
+    journal.close()
+    # Аварийная остановка посреди записи строки
+    path = os.path.join(str(tmp_path), segment_files(str(tmp_path))[-1])
+    with open(path, "ab") as f:
+        f.write(b'{"lsn":3,"ts":1.0,"op":{"op":"us')
+    size = os.path.getsize(path)
+
+    reopened = WriteAheadJournal(str(tmp_path))
+    reopened.open()
+    assert reopened.last_lsn == 2
+    assert os.path.getsize(path) < size
+    assert reopened.append({"op": "user", "user_id": 3}) == 3
+    reopened.sync()
+    assert [op["user_id"] for _, op in reopened.read(0, 10)] == [1, 2, 3]
+    reopened.close()
+
+
+def test_segments_rotate_and_are_removed_after_checkpoint(tmp_path):
+    # Каждый sync начинает новый сегмент
+    journal = WriteAheadJournal(str(tmp_path), segment_size=1)
+    journal.open()
+    for i in range(4):
+        journal.append({"op": "user", "user_id": i})
+        journal.sync()
+    assert len(segment_files(str(tmp_path))) == 5
+
+    assert [lsn for lsn, _ in journal.read(0, 10)] == [1, 2, 3, 4]
+    journal.checkpoint(2)
+    assert segment_files(str(tmp_path))[0] == f"{3:020d}{SEGMENT_SUFFIX}"
+    assert [lsn for lsn, _ in journal.read(2, 10)] == [3, 4]
+    journal.close()
+
+    reopened = WriteAheadJournal(str(tmp_path), segment_size=1)
+    reopened.open()
+    assert (reopened.checkpoint_lsn, reopened.last_lsn) == (2, 4)
+    reopened.close()
+
+
+def test_status_of_closed_journal(tmp_path):
+    journal = WriteAheadJournal(str(tmp_path))
+    journal.open()
+    for i in range(3):
+        journal.append({"op": "user", "user_id": i})
+    journal.sync()
+    journal.checkpoint(1)
+    journal.close()
+
+    status = WriteAheadJournal.read_status(str(tmp_path))
+    assert (status["last_lsn"], status["checkpoint_lsn"], status["lag"]) == (3, 1, 2)
+    assert status["oldest_pending"] is not None
+
+
+@pytest.mark.skipif(journal_module.fcntl is None, reason="блокировка файла недоступна")
+def test_journal_is_locked_by_one_process(tmp_path):
+    journal = WriteAheadJournal(str(tmp_path))
+    journal.open()
+    try:
+        with pytest.raises(RuntimeError):
+            WriteAheadJournal(str(tmp_path)).open()
+    finally:
+        journal.close()
@@ -0,0 +1,283 @@
+"""
+Позиция обработанных обновлений: завершение не по порядку, ожидание сохранения данных
+"""
+import asyncio
+import json
+from types import SimpleNamespace
+from telegram import Update
+from config import config
+from database.journal import WriteAheadJournal
+from database.write_queue import WriteBehindQueue
+from telegram_collector.offsets import UpdateOffsetTracker
+from telegram_collector.polling import UpdatePoller
+
+
+def make_tracker(tmp_path, **kwargs) -> UpdateOffsetTracker:
+    tracker = UpdateOffsetTracker(path=str(tmp_path / "offset.json"), seen_size=100,
+                                  flush_interval=60, **kwargs)
+    tracker.load(bot_id=1)
+    return tracker
+
+
+def test_offset_with_out_of_order_completion(tmp_path):
+    tracker = make_tracker(tmp_path)
+    for update_id in range(1, 6):
+        tracker.begin(update_id)
+
+    tracker.finish(3)
+    tracker.finish(5)
+    assert tracker.offset == 0
+    tracker.finish(1)
+    assert tracker.offset == 1
+    tracker.finish(2)
+    assert tracker.offset == 3
+    assert tracker.is_duplicate(5) and not tracker.is_duplicate(6)
+    tracker.finish(4)
+    assert tracker.offset == 5
+
+
+def test_offset_waits_for_durable_data(tmp_path):
+    waiting = []
+    tracker = make_tracker(tmp_path, when_durable=waiting.append)
+    tracker.begin(1)
+    tracker.begin(2)
+    tracker.finish(2)
+    tracker.finish(1)
+    assert tracker.offset == 0
+    # Пока данные не сохранены, обновление остается в обработке
+    assert tracker.is_duplicate(1)
+
+    for callback in waiting:
+        callback()
+    assert tracker.offset == 2
+
+
+def test_forwarded_update_completes_on_acknowledgement(tmp_path):
+    tracker = make_tracker(tmp_path)
+    tracker.begin(1)
+    tracker.begin(2)
+    tracker.forward(1)
+    tracker.finish(1)
+    tracker.finish(2)
+    assert tracker.offset == 0
+
+    tracker.complete(1)
+    assert tracker.offset == 2
+
+
+def test_flush_and_load(tmp_path):
+    flushed = []
+    tracker = make_tracker(tmp_path, before_flush=lambda: flushed.append(True))
+    for update_id in (10, 11, 12):
+        tracker.begin(update_id)
+    tracker.finish(10)
+    tracker.finish(12)
+    tracker.flush()
+
+    assert flushed
+    with open(tmp_path / "offset.json", encoding="utf-8") as f:
+        assert json.load(f) == {"bot_id": 1, "offset": 10, "seen": [12]}
+
+    restarted = make_tracker(tmp_path)
+    assert restarted.offset == 10
+    assert restarted.is_duplicate(12) and not restarted.is_duplicate(11)
+
+    other_bot = UpdateOffsetTracker(path=str(tmp_path / "offset.json"), seen_size=100, flush_interval=60)
+    other_bot.load(bot_id=2)
+    assert other_bot.offset == 0
+
+
+def test_offset_follows_write_queue_without_journal(tmp_path):
+    class SlowDatabase:
+        """Запись пакета ждет разрешения теста"""
+
+        def __init__(self):
+            self.release = asyncio.Event()
+
+        async def save_batch(self, operations):
+            await self.release.wait()
+            return [None] * len(operations)
+
+    async def scenario():
+        db = SlowDatabase()
+        queue = WriteBehindQueue(db, max_batch_size=10, flush_interval=0)
+        tracker = make_tracker(tmp_path, when_durable=queue.call_when_durable)
+        await queue.start()
+
+        tracker.begin(1)
+        queue.save_user(1)
+        tracker.finish(1)
+        await asyncio.sleep(0.05)
+        before = tracker.offset
+
+        db.release.set()
+        await queue.stop()
+        return before, tracker.offset
+
+    assert asyncio.run(scenario()) == (0, 1)
+
+
+def test_offset_follows_journal_sync(tmp_path):
+    class FailingDatabase:
+        async def save_batch(self, operations):
+            raise OSError("БД недоступна")
+
+    async def scenario():
+        queue = WriteBehindQueue(FailingDatabase(), max_batch_size=10, flush_interval=60,
+                                 journal=WriteAheadJournal(str(tmp_path / "journal")))
+        tracker = make_tracker(tmp_path, before_flush=queue.sync_journal,
+                               when_durable=queue.call_when_durable)
+        await queue.start()
+        tracker.begin(1)
+        queue.save_user(1)
+        tracker.finish(1)
+        before = tracker.offset
+        # Сброс журнала перед записью позиции завершает обновление, даже если БД недоступна
+        tracker.flush()
+        after = tracker.offset
+        await queue.stop()
+        return before, after
+
+    assert asyncio.run(scenario()) == (0, 1)
+
+
+def test_offset_not_advanced_past_lost_batch(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "JOURNAL_RETRY_DELAY", 0.01)
+
+    class UnavailableDatabase:
+        async def save_batch(self, operations):
+            raise OSError("БД недоступна")
+
+    async def scenario():
+        queue = WriteBehindQueue(UnavailableDatabase(), max_batch_size=10, flush_interval=0)
+        tracker = make_tracker(tmp_path, when_durable=queue.call_when_durable)
+        await queue.start()
+        tracker.begin(1)
+        queue.save_user(1)
+        tracker.finish(1)
+        await asyncio.sleep(0.05)
+        await queue.stop()
+        tracker.flush()
+        return tracker.offset
+
+    # Обновление будет получено повторно после перезапуска
+    assert asyncio.run(scenario()) == 0
+    assert not (tmp_path / "offset.json").exists()
+
+
+def test_offset_advances_after_retry_without_journal(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "JOURNAL_RETRY_DELAY", 0.01)
+
+    class FlakyDatabase:
+        """Первая запись - ошибка соединения, вторая отвергает операцию пользователя 2"""
+
+        def __init__(self):
+            self.calls = 0
+            self.saved = []
+
+        async def save_batch(self, operations):
+            self.calls += 1
+            if self.calls == 1:
+                raise OSError("БД недоступна")
+            if len(operations) > 1:
+                raise ValueError("нарушено ограничение")
+            if operations[0]["user_id"] == 2:
+                raise ValueError("нарушено ограничение")
+            self.saved.extend(operations)
+            return [None]
+
+    async def scenario():
+        db = FlakyDatabase()
+        queue = WriteBehindQueue(db, max_batch_size=10, flush_interval=0)
+        tracker = make_tracker(tmp_path, when_durable=queue.call_when_durable)
+        await queue.start()
+        for update_id in (1, 2, 3):
+            tracker.begin(update_id)
+            queue.save_user(update_id)
+            tracker.finish(update_id)
+        for _ in range(100):
+            if tracker.offset == 3:
+                break
+            await asyncio.sleep(0.01)
+        await queue.stop()
+        return db, tracker.offset
+
+    db, offset = asyncio.run(scenario())
+    assert [operation["user_id"] for operation in db.saved] == [1, 3]
+    assert offset == 3
+
+
+class FakeBot:
+    """getUpdates: обновления с номером меньше offset подтверждены и удаляются"""
+
+    def __init__(self, update_ids):
+        self.pending = [Update(update_id) for update_id in update_ids]
+        self.requests = 0
+
+    async def delete_webhook(self, drop_pending_updates=False):
+        pass
+
+    async def get_updates(self, offset=None, timeout=None, allowed_updates=None):
+        self.requests += 1
+        self.pending = [update for update in self.pending if update.update_id >= offset]
+        await asyncio.sleep(0.001)
+        return self.pending[:100]
+
+
+def test_poller_confirms_only_saved_updates(tmp_path):
+    async def run(bot, processed):
+        """Запуск до аварийной остановки: завершаются только обновления из processed"""
+        tracker = make_tracker(tmp_path)
+        application = SimpleNamespace(bot=bot, update_queue=asyncio.Queue())
+        poller = UpdatePoller(application, tracker)
+        await poller.start()
+        received = []
+        while True:
+            try:
+                update = await asyncio.wait_for(application.update_queue.get(), 0.2)
+            except asyncio.TimeoutError:
+                break
+            if tracker.is_duplicate(update.update_id):
+                continue
+            tracker.begin(update.update_id)
+            received.append(update.update_id)
+            if update.update_id in processed:
+                tracker.finish(update.update_id)
+        await poller.stop()
+        tracker.flush()
+        return received
+
+    bot = FakeBot([1, 2, 3, 4])
+    assert asyncio.run(run(bot, processed={1, 3})) == [1, 2, 3, 4]
+    # Telegram не получил подтверждения обновлений после 1
+    assert [update.update_id for update in bot.pending] == [2, 3, 4]
+
+    # После перезапуска несохраненные 2 и 4 приходят снова, сохраненное 3 пропускается
+    assert asyncio.run(run(bot, processed={2, 4})) == [2, 4]
+    assert asyncio.run(run(bot, processed=set())) == []
+    assert bot.pending == []
+
+
+def test_poller_waits_while_window_is_unsaved(tmp_path):
+    async def scenario():
+        bot = FakeBot([1, 2])
+        tracker = make_tracker(tmp_path)
+        application = SimpleNamespace(bot=bot, update_queue=asyncio.Queue())
+        poller = UpdatePoller(application, tracker)
+        await poller.start()
+        for _ in range(2):
+            update = await asyncio.wait_for(application.update_queue.get(), 5)
+            tracker.begin(update.update_id)
+        await asyncio.sleep(0.1)
+        # Ответы только из уже переданных обновлений: поллер ждет сдвига позиции
+        idle_requests = bot.requests
+        tracker.finish(1)
+        tracker.finish(2)
+        await asyncio.sleep(0.05)
+        await poller.stop()
+        return idle_requests, application.update_queue.qsize(), tracker.offset
+
+    idle_requests, queued, offset = asyncio.run(scenario())
+    assert idle_requests <= 3
+    assert queued == 0
+    assert offset == 2
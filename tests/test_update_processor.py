@@ -0,0 +1,107 @@
+"""
+Параллельная обработка обновлений: порядок внутри чата и общий предел параллельности
+"""
+import asyncio
+import random
+from datetime import datetime, timezone
+import pytest
+from telegram import Chat, Message, Update
+from telegram_collector.offsets import UpdateOffsetTracker
+from telegram_collector.update_processor import ChatOrderedUpdateProcessor
+
+
+def make_update(update_id: int, chat_id: int) -> Update:
+    """Обновление с сообщением в чате chat_id"""
+    chat = Chat(id=chat_id, type=Chat.SUPERGROUP)
+    message = Message(message_id=update_id, date=datetime.now(timezone.utc), chat=chat)
+    return Update(update_id=update_id, message=message)
+
+
+class Recorder:
+    """Журнал выполнения обработчиков: порядок начала по чатам и параллельность"""
+
+    def __init__(self):
+        self.started = {}
+        self.running = {}
+        self.total = 0
+        self.max_total = 0
+        self.overlaps = 0
+
+    async def handle(self, update: Update, delay: float, fail: bool = False):
+        chat_id = update.effective_chat.id
+        self.started.setdefault(chat_id, []).append(update.update_id)
+        if self.running.get(chat_id):
+            self.overlaps += 1
+        self.running[chat_id] = self.running.get(chat_id, 0) + 1
+        self.total += 1
+        self.max_total = max(self.max_total, self.total)
+        try:
+            await asyncio.sleep(delay)
+            if fail:
+                raise RuntimeError("ошибка обработчика")
+        finally:
+            self.running[chat_id] -= 1
+            self.total -= 1
+
+
+async def process_all(processor, recorder, updates, fail_ids=()):
+    """Передача обновлений обработчику в порядке получения, как это делает Application"""
+    rng = random.Random(1)
+    await processor.initialize()
+    tasks = [
+        asyncio.create_task(processor.do_process_update(
+            update, recorder.handle(update, rng.uniform(0, 0.005), update.update_id in fail_ids)
+        ))
+        for update in updates
+    ]
+    return await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def test_chat_order_under_concurrency():
+    chats = [-100, -200, -300, -400, -500]
+    rng = random.Random(0)
+    updates = [make_update(update_id, rng.choice(chats)) for update_id in range(1, 301)]
+    processor = ChatOrderedUpdateProcessor(max_concurrent=3)
+    recorder = Recorder()
+
+    asyncio.run(process_all(processor, recorder, updates))
+
+    for chat_id in chats:
+        expected = [update.update_id for update in updates if update.effective_chat.id == chat_id]
+        assert recorder.started[chat_id] == expected
+    assert recorder.overlaps == 0
+    # Разные чаты выполняются параллельно, но не больше max_concurrent одновременно
+    assert 1 < recorder.max_total <= 3
+    stats = processor.get_stats()
+    assert (stats["processed"], stats["pending"], stats["active_chats"]) == (300, 0, 0)
+
+
+def test_failed_update_does_not_block_chat():
+    updates = [make_update(update_id, -100) for update_id in range(1, 6)]
+    processor = ChatOrderedUpdateProcessor(max_concurrent=2)
+    recorder = Recorder()
+
+    results = asyncio.run(process_all(processor, recorder, updates, fail_ids={2}))
+
+    assert recorder.started[-100] == [1, 2, 3, 4, 5]
+    assert isinstance(results[1], RuntimeError)
+    assert [result for i, result in enumerate(results) if i != 1] == [None] * 4
+
+
+def test_tracker_skips_duplicates_and_advances_offset(tmp_path):
+    tracker = UpdateOffsetTracker(path=str(tmp_path / "offset.json"), seen_size=100, flush_interval=60)
+    tracker.offset = 2
+    updates = [make_update(update_id, -100 * (update_id % 2 + 1)) for update_id in range(1, 7)]
+    processor = ChatOrderedUpdateProcessor(max_concurrent=2, tracker=tracker)
+    recorder = Recorder()
+
+    asyncio.run(process_all(processor, recorder, updates))
+
+    assert sorted(sum(recorder.started.values(), [])) == [3, 4, 5, 6]
+    assert tracker.duplicates == 2
+    assert tracker.offset == 6
+
+
+def test_max_concurrent_must_be_positive():
+    with pytest.raises(ValueError):
+        ChatOrderedUpdateProcessor(max_concurrent=0)
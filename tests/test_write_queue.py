@@ -0,0 +1,143 @@
+"""
+Очередь отложенной записи: пакеты, журнал и догонка после недоступности БД
+"""
+import asyncio
+import pytest
+from sqlalchemy.exc import OperationalError
+from config import config
+from database.journal import WriteAheadJournal
+from database.write_queue import WriteBehindQueue
+
+
+class FakeDatabase:
+    """БД в памяти: первые failures вызовов save_batch завершаются ошибкой соединения"""
+
+    def __init__(self, failures: int = 0):
+        self.failures = failures
+        self.calls = 0
+        self.saved = []
+
+    async def save_batch(self, operations):
+        self.calls += 1
+        await asyncio.sleep(0)
+        if self.failures:
+            self.failures -= 1
+            raise OperationalError("INSERT", {}, ConnectionRefusedError("БД недоступна"))
+        self.saved.extend(operations)
+        return list(range(len(self.saved) - len(operations) + 1, len(self.saved) + 1))
+
+
+@pytest.fixture(autouse=True)
+def fast_retry(monkeypatch):
+    """Повтор записи из журнала без пауз"""
+    monkeypatch.setattr(config, "JOURNAL_RETRY_DELAY", 0.01)
+    monkeypatch.setattr(config, "JOURNAL_MAX_RETRY_DELAY", 0.01)
+
+
+async def wait_for(condition, timeout: float = 5):
+    """Ожидание условия с ограничением по времени"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not condition():
+        assert loop.time() < deadline, "условие не выполнено"
+        await asyncio.sleep(0.01)
+
+
+def user_ids(operations) -> list:
+    return [operation["user_id"] for operation in operations]
+
+
+def test_batches_without_journal():
+    async def scenario():
+        db = FakeDatabase()
+        queue = WriteBehindQueue(db, max_batch_size=3, flush_interval=0.01)
+        await queue.start()
+        for i in range(7):
+            queue.save_user(i)
+        future = queue.save_message(1, -100, text="текст")
+        assert await asyncio.wait_for(future, 5) == 8
+        await queue.stop()
+        return db
+
+    db = asyncio.run(scenario())
+    assert user_ids(db.saved[:7]) == list(range(7))
+    assert db.calls == 3
+
+
+def test_replay_after_operational_error(tmp_path):
+    async def scenario():
+        db = FakeDatabase(failures=3)
+        queue = WriteBehindQueue(db, max_batch_size=2, flush_interval=0.01,
+                                 journal=WriteAheadJournal(str(tmp_path)))
+        await queue.start()
+        for i in range(3):
+            queue.save_user(i)
+        await wait_for(lambda: queue.replaying)
+        # Пока очередь догоняет журнал, новые операции пишутся только в журнал
+        for i in range(3, 6):
+            queue.save_user(i)
+        await wait_for(lambda: not queue.replaying)
+        queue.save_user(6)
+        await wait_for(lambda: len(db.saved) == 7)
+        await queue.stop()
+        return db, queue
+
+    db, queue = asyncio.run(scenario())
+    assert user_ids(db.saved) == list(range(7))
+    assert queue.journal.lag == 0
+
+
+def test_journal_replayed_on_next_start(tmp_path):
+    async def first_run():
+        # БД недоступна до остановки: операции остаются в журнале
+        db = FakeDatabase(failures=1000)
+        queue = WriteBehindQueue(db, max_batch_size=10, flush_interval=0.01,
+                                 journal=WriteAheadJournal(str(tmp_path)))
+        await queue.start()
+        for i in range(4):
+            queue.save_user(i)
+        await wait_for(lambda: queue.replaying)
+        await queue.stop()
+        return db
+
+    async def second_run():
+        db = FakeDatabase()
+        queue = WriteBehindQueue(db, max_batch_size=10, flush_interval=0.01,
+                                 journal=WriteAheadJournal(str(tmp_path)))
+        await queue.start()
+        assert queue.replaying
+        await wait_for(lambda: not queue.replaying)
+        queue.save_user(4)
+        await queue.stop()
+        return db, queue
+
+    assert asyncio.run(first_run()).saved == []
+    assert WriteAheadJournal.read_status(str(tmp_path))["lag"] == 4
+    db, queue = asyncio.run(second_run())
+    assert user_ids(db.saved) == [0, 1, 2, 3, 4]
+    assert queue.journal.lag == 0
+
+
+def test_rejected_operation_skipped_during_replay(tmp_path):
+    class RejectingDatabase(FakeDatabase):
+        """Операция пользователя 2 нарушает ограничение БД"""
+
+        async def save_batch(self, operations):
+            if self.failures == 0 and any(op["user_id"] == 2 for op in operations):
+                raise ValueError("нарушено ограничение")
+            return await super().save_batch(operations)
+
+    async def scenario():
+        db = RejectingDatabase(failures=1)
+        queue = WriteBehindQueue(db, max_batch_size=10, flush_interval=0.01,
+                                 journal=WriteAheadJournal(str(tmp_path)))
+        await queue.start()
+        for i in range(4):
+            queue.save_user(i)
+        await wait_for(lambda: len(db.saved) == 3 and not queue.replaying)
+        await queue.stop()
+        return db, queue
+
+    db, queue = asyncio.run(scenario())
+    assert user_ids(db.saved) == [0, 1, 3]
+    assert queue.journal.lag == 0
@@ -0,0 +1,3 @@
+"""
+Служебные утилиты обслуживания
+"""
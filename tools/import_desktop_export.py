@@ -0,0 +1,495 @@
+"""
+Импорт истории из экспорта Telegram Desktop (result.json)
+
+Файл разбирается потоком (ijson) и не загружается в память целиком; поддерживаются
+экспорт одного чата и экспорт всего аккаунта (chats.list, left_chats.list).
+Сообщения, пользователи, реакции и вложения копируются пачками через COPY во
+временные таблицы и переносятся в основные INSERT ... ON CONFLICT DO NOTHING,
+поэтому повторный запуск ничего не дублирует, а уже собранные ботом записи
+не перезаписываются. Сообщение, которое уже есть в БД (по chat_id и message_id),
+пропускается вместе с вложением и реакциями. Каждая пачка - отдельная транзакция: прерванный импорт
+достаточно запустить снова.
+
+Файлы из папок экспорта (photos/, files/, voice_messages/ ...) связываются
+жесткой ссылкой (или копируются с другого диска) в DOWNLOAD_PATH/media/tdesktop.
+У вложений нет file_id Telegram, поэтому они получают политику never и не
+ставятся в очередь скачивания.
+
+Запуск:
+    python -m tools.import_desktop_export /path/to/ChatExport_2024-01-01/result.json
+    python -m tools.import_desktop_export --chunk-size 20000 --no-media result.json
+"""
+import argparse
+import io
+import logging
+import os
+import shutil
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Dict, Iterator, Optional, Tuple
+import ijson
+from config import config
+from database.db_manager import DatabaseManager
+from database.operations import ACTIVITY_FIELDS
+from database.partitions import create_partitions, month_start
+from telegram_collector.downloader import MEDIA_STORE_DIR
+
+logger = logging.getLogger(__name__)
+
+# Сообщений в одной пачке COPY (одна транзакция)
+DEFAULT_CHUNK_SIZE = 5000
+
+# Каталог хранилища для файлов из экспортов
+IMPORT_STORE_DIR = "tdesktop"
+
+# Массивы чатов в экспорте всего аккаунта; пустой префикс - экспорт одного чата
+CHAT_PREFIXES = ("", "chats.list.item", "left_chats.list.item")
+
+# Тип чата в экспорте -> (chat_type, способ получить chat_id Bot API)
+CHAT_TYPES = {
+    "personal_chat": ("private", lambda chat_id: chat_id),
+    "bot_chat": ("private", lambda chat_id: chat_id),
+    "saved_messages": ("private", lambda chat_id: chat_id),
+    "private_group": ("group", lambda chat_id: -chat_id),
+    "private_supergroup": ("supergroup", lambda chat_id: -1000000000000 - chat_id),
+    "public_supergroup": ("supergroup", lambda chat_id: -1000000000000 - chat_id),
+    "private_channel": ("channel", lambda chat_id: -1000000000000 - chat_id),
+    "public_channel": ("channel", lambda chat_id: -1000000000000 - chat_id),
+}
+
+# media_type экспорта -> document_type
+MEDIA_TYPES = {
+    "voice_message": "voice",
+    "video_message": "video_note",
+    "video_file": "video",
+    "audio_file": "audio",
+    "sticker": "sticker",
+    "animation": "document",
+}
+
+# Временные таблицы пачки (очищаются при фиксации транзакции)
+STAGING_TABLES = {
+    "import_users": "id bigint, first_name text",
+    "import_messages": "chat_id bigint, message_id bigint, user_id bigint, text text, "
+                       "message_date timestamp, edited_date timestamp",
+    "import_documents": "chat_id bigint, message_id bigint, file_unique_id text, file_name text, "
+                        "mime_type text, file_size bigint, document_type text, file_path text",
+    "import_reactions": "chat_id bigint, message_id bigint, user_id bigint, emoji text",
+    "import_reaction_counts": "chat_id bigint, message_id bigint, emoji text, count integer",
+    # Сообщения, добавленные пачкой: к ним привязываются вложения и реакции
+    "import_inserted": "chat_id bigint, message_id bigint, id bigint, message_date timestamp",
+}
+
+# Прибавление счетчиков активности по строкам CTE activity (chat_id, user_id, day, поля)
+ACTIVITY_UPSERTS = """
+    , chat_activity AS (
+        INSERT INTO chat_activity_daily AS a (chat_id, day, {fields})
+        SELECT chat_id, day, {sums} FROM activity GROUP BY chat_id, day
+        ON CONFLICT (chat_id, day) DO UPDATE SET {updates}
+    ), user_activity AS (
+        INSERT INTO user_activity_daily AS a (chat_id, day, user_id, {fields})
+        SELECT chat_id, day, user_id, {sums} FROM activity WHERE user_id IS NOT NULL
+        GROUP BY chat_id, day, user_id
+        ON CONFLICT (chat_id, day, user_id) DO UPDATE SET {updates}
+    )
+""".format(
+    fields=", ".join(ACTIVITY_FIELDS),
+    sums=", ".join(f"sum({field})" for field in ACTIVITY_FIELDS),
+    updates=", ".join(f"{field} = a.{field} + excluded.{field}" for field in ACTIVITY_FIELDS)
+)
+
+# Перенос пачки из временных таблиц в основные: (таблица, запрос). Счетчики
+# (media_blobs, reaction_counts, активность) меняются только по добавленным строкам.
+# Сообщение пропускается, если чат уже содержит message_id с любой датой: дата старых
+# экспортов (местное время) может не совпасть с сохраненной ботом
+MERGE_STATEMENTS = [
+    ("users", """
+        INSERT INTO users (id, first_name, created_at)
+        SELECT DISTINCT ON (id) id, left(first_name, 255), now() AT TIME ZONE 'utc'
+        FROM import_users
+        ORDER BY id
+        ON CONFLICT (id) DO NOTHING
+    """),
+    ("messages", """
+        WITH inserted AS (
+            INSERT INTO messages (message_id, chat_id, user_id, text, message_date, edited_date, created_at)
+            SELECT DISTINCT ON (i.chat_id, i.message_id)
+                   i.message_id, i.chat_id, i.user_id, i.text, i.message_date, i.edited_date,
+                   now() AT TIME ZONE 'utc'
+            FROM import_messages i
+            WHERE NOT EXISTS (
+                SELECT 1 FROM messages m WHERE m.chat_id = i.chat_id AND m.message_id = i.message_id
+            )
+            ORDER BY i.chat_id, i.message_id
+            ON CONFLICT (chat_id, message_id, message_date) DO NOTHING
+            RETURNING id, chat_id, message_id, user_id, message_date, edited_date
+        ), batch AS (
+            INSERT INTO import_inserted (chat_id, message_id, id, message_date)
+            SELECT chat_id, message_id, id, message_date FROM inserted
+        ), activity AS (
+            SELECT chat_id, user_id, message_date::date AS day, 1 AS messages,
+                   (edited_date IS NOT NULL)::int AS edits, 0 AS media, 0 AS bytes_downloaded, 0 AS reactions
+            FROM inserted
+        )""" + ACTIVITY_UPSERTS + """
+        SELECT count(*) FROM inserted
+    """),
+    ("documents", """
+        WITH inserted AS (
+            INSERT INTO documents (message_id, message_date, file_id, file_unique_id, file_name, mime_type,
+                                   file_size, document_type, file_path, download_policy, created_at)
+            SELECT m.id, m.message_date, d.file_unique_id, d.file_unique_id, left(d.file_name, 255),
+                   left(d.mime_type, 100), d.file_size, d.document_type, d.file_path, 'never',
+                   now() AT TIME ZONE 'utc'
+            FROM import_documents d
+            JOIN import_inserted m ON m.chat_id = d.chat_id AND m.message_id = d.message_id
+            ON CONFLICT (message_id, file_unique_id, message_date) DO NOTHING
+            RETURNING message_id, message_date, file_unique_id, file_path, file_size
+        ), blobs AS (
+            INSERT INTO media_blobs (file_unique_id, file_path, file_size, ref_count, created_at)
+            SELECT file_unique_id, min(file_path), max(file_size), count(*), now() AT TIME ZONE 'utc'
+            FROM inserted
+            WHERE file_path IS NOT NULL
+            GROUP BY file_unique_id
+            ON CONFLICT (file_unique_id) DO UPDATE SET ref_count = media_blobs.ref_count + excluded.ref_count
+        ), activity AS (
+            SELECT m.chat_id, m.user_id, i.message_date::date AS day, 0 AS messages, 0 AS edits, 1 AS media,
+                   CASE WHEN i.file_path IS NOT NULL THEN coalesce(i.file_size, 0) ELSE 0 END AS bytes_downloaded,
+                   0 AS reactions
+            FROM inserted i
+            JOIN messages m ON m.id = i.message_id AND m.message_date = i.message_date
+        )""" + ACTIVITY_UPSERTS + """
+        SELECT count(*) FROM inserted
+    """),
+    ("reactions", """
+        WITH inserted AS (
+            INSERT INTO reactions (message_id, message_date, emoji, user_id, created_at)
+            SELECT DISTINCT m.id, m.message_date, r.emoji, r.user_id, now() AT TIME ZONE 'utc'
+            FROM import_reactions r
+            JOIN import_inserted m ON m.chat_id = r.chat_id AND m.message_id = r.message_id
+            ON CONFLICT DO NOTHING
+            RETURNING message_id, message_date, emoji, user_id
+        ), activity AS (
+            SELECT m.chat_id, i.user_id, i.message_date::date AS day, 0 AS messages, 0 AS edits, 0 AS media,
+                   0 AS bytes_downloaded, 1 AS reactions
+            FROM inserted i
+            JOIN messages m ON m.id = i.message_id AND m.message_date = i.message_date
+        )""" + ACTIVITY_UPSERTS + """
+        SELECT count(*) FROM inserted
+    """),
+    ("reaction_counts", """
+        INSERT INTO reaction_counts (message_id, message_date, emoji, count)
+        SELECT m.id, m.message_date, c.emoji, max(c.count)
+        FROM import_reaction_counts c
+        JOIN import_inserted m ON m.chat_id = c.chat_id AND m.message_id = c.message_id
+        WHERE c.count > 0
+        GROUP BY m.id, m.message_date, c.emoji
+        ON CONFLICT (message_id, emoji) DO UPDATE SET count = excluded.count
+    """),
+]
+
+
+def iter_export(stream) -> Iterator[Tuple[dict, dict]]:
+    """
+    Потоковое чтение экспорта: пары (чат, сообщение)
+
+    Telegram Desktop пишет name, type и id чата перед массивом messages,
+    поэтому к началу массива сведения о чате уже прочитаны.
+    """
+    chat = {}
+    builder = None
+    message_prefix = None
+    chat_fields = {f"{prefix}.{field}".lstrip("."): field
+                   for prefix in CHAT_PREFIXES for field in ("name", "type", "id")}
+
+    for prefix, event, value in ijson.parse(stream, use_float=True):
+        if builder is not None:
+            if prefix == message_prefix and event == "end_map":
+                yield chat, builder.value
+                builder = None
+            else:
+                builder.event(event, value)
+            continue
+
+        if event == "start_map" and prefix in CHAT_PREFIXES:
+            # Начало следующего чата
+            chat = {}
+        elif prefix in chat_fields and event in ("string", "number"):
+            chat[chat_fields[prefix]] = value
+        elif event == "start_map" and prefix.endswith("messages.item"):
+            chat_prefix = prefix[:-len("messages.item")].rstrip(".")
+            if chat_prefix in CHAT_PREFIXES:
+                message_prefix = prefix
+                builder = ijson.ObjectBuilder()
+                builder.event(event, value)
+
+
+def _parse_date(unixtime, fallback: str = None) -> Optional[datetime]:
+    """Дата из поля *_unixtime (UTC без timezone info, как в БД)"""
+    if unixtime:
+        return datetime.fromtimestamp(int(unixtime), timezone.utc).replace(tzinfo=None)
+    if fallback:
+        # Старые экспорты без *_unixtime: местное время компьютера, где делался экспорт
+        return datetime.fromisoformat(fallback)
+    return None
+
+
+def _parse_user_id(from_id) -> Optional[int]:
+    """ID пользователя из from_id вида user123 (сообщения от имени каналов - без пользователя)"""
+    if isinstance(from_id, str) and from_id.startswith("user") and from_id[4:].isdigit():
+        return int(from_id[4:])
+    return None
+
+
+def _message_text(message: dict) -> Optional[str]:
+    """Текст сообщения: строка или список фрагментов с разметкой"""
+    value = message.get("text")
+    if isinstance(value, list):
+        value = "".join(part if isinstance(part, str) else part.get("text", "") for part in value)
+    return value or None
+
+
+def _copy_value(value) -> str:
+    """Значение в текстовом формате COPY"""
+    if value is None:
+        return "\\N"
+    if isinstance(value, datetime):
+        return value.isoformat(sep=" ")
+    if isinstance(value, str):
+        return (value.replace("\x00", "").replace("\\", "\\\\")
+                .replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r"))
+    return str(value)
+
+
+class DesktopExportImporter:
+    """Импорт result.json пачками через COPY"""
+
+    def __init__(self, engine, export_path: str, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                 link_media: bool = True):
+        """Инициализация"""
+        self.engine = engine
+        self.export_path = export_path
+        self.export_dir = os.path.dirname(os.path.abspath(export_path))
+        self.chunk_size = chunk_size
+        self.link_media = link_media
+        self.parsed = 0
+        self.inserted = {table: 0 for table, _ in MERGE_STATEMENTS}
+        self.inserted["chats"] = 0
+        self.files_linked = 0
+        self._rows = {table: [] for table in STAGING_TABLES}
+        self._chats: Dict[int, Tuple[str, str]] = {}
+        self._partition_months = set()
+        self._started = None
+
+    def run(self) -> dict:
+        """Импорт всего файла; возвращает счетчики"""
+        self._started = time.perf_counter()
+        connection = self.engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            for table, columns in STAGING_TABLES.items():
+                cursor.execute(f"CREATE TEMP TABLE {table} ({columns}) ON COMMIT DELETE ROWS")
+            connection.commit()
+
+            with open(self.export_path, "rb") as stream:
+                for chat, message in iter_export(stream):
+                    self._add_message(chat, message)
+                    if len(self._rows["import_messages"]) >= self.chunk_size:
+                        self._flush(connection)
+            self._flush(connection)
+        finally:
+            connection.close()
+        return self.get_stats()
+
+    def get_stats(self) -> dict:
+        """Прочитано сообщений, добавлено строк по таблицам, скорость"""
+        elapsed = max(time.perf_counter() - self._started, 1e-9)
+        rows = sum(self.inserted.values())
+        return {
+            "parsed": self.parsed,
+            "inserted": dict(self.inserted),
+            "files_linked": self.files_linked,
+            "elapsed": elapsed,
+            "messages_per_sec": self.parsed / elapsed,
+            "rows_per_sec": rows / elapsed
+        }
+
+    def _add_message(self, chat: dict, message: dict):
+        """Разбор сообщения экспорта в строки временных таблиц"""
+        chat_type, convert_id = CHAT_TYPES.get(chat.get("type"), (None, None))
+        if convert_id is None or "id" not in chat or message.get("type") != "message":
+            # Служебные сообщения (вступления, закрепления) ботом тоже не сохраняются
+            return
+        chat_id = convert_id(int(chat["id"]))
+        self._chats.setdefault(chat_id, (chat.get("name"), chat_type))
+        message_id = int(message["id"])
+        user_id = _parse_user_id(message.get("from_id"))
+        self.parsed += 1
+
+        if user_id is not None:
+            self._rows["import_users"].append((user_id, message.get("from")))
+        self._rows["import_messages"].append((
+            chat_id, message_id, user_id, _message_text(message),
+            _parse_date(message.get("date_unixtime"), message.get("date")),
+            _parse_date(message.get("edited_unixtime"), message.get("edited"))
+        ))
+
+        document = self._parse_document(chat_id, message)
+        if document is not None:
+            self._rows["import_documents"].append(document)
+
+        for reaction in message.get("reactions") or []:
+            if reaction.get("type") != "emoji" or not reaction.get("emoji"):
+                continue
+            emoji = reaction["emoji"][:50]
+            recent = reaction.get("recent") or []
+            # Счетчик - точное число реакций, а авторы известны только у последних
+            self._rows["import_reaction_counts"].append(
+                (chat_id, message_id, emoji, int(reaction.get("count") or len(recent)))
+            )
+            for item in recent:
+                reactor_id = _parse_user_id(item.get("from_id"))
+                if reactor_id is not None:
+                    self._rows["import_reactions"].append((chat_id, message_id, reactor_id, emoji))
+
+    def _parse_document(self, chat_id: int, message: dict) -> Optional[tuple]:
+        """Вложение сообщения (в экспорте - не больше одного)"""
+        if message.get("photo"):
+            relative_path, document_type = message["photo"], "photo"
+            file_size = message.get("photo_file_size")
+        elif message.get("file"):
+            relative_path = message["file"]
+            document_type = MEDIA_TYPES.get(message.get("media_type"), "document")
+            file_size = message.get("file_size")
+        else:
+            return None
+
+        # Ключ вложения для идемпотентности: у экспорта нет file_unique_id Telegram
+        file_unique_id = f"tdesktop_{chat_id}_{message['id']}"
+        source = os.path.join(self.export_dir, relative_path)
+        file_path = None
+        if self.link_media and os.path.isfile(source):
+            # Иначе в поле строка "(File not included. ...)"
+            file_path = self._link_file(source, chat_id, file_unique_id)
+            file_size = file_size or os.path.getsize(file_path)
+        return (chat_id, int(message["id"]), file_unique_id, message.get("file_name"),
+                message.get("mime_type"), file_size, document_type, file_path)
+
+    def _link_file(self, source: str, chat_id: int, file_unique_id: str) -> str:
+        """Жесткая ссылка на файл экспорта в хранилище (копия, если диски разные)"""
+        _, ext = os.path.splitext(source)
+        target_dir = os.path.join(config.DOWNLOAD_PATH, MEDIA_STORE_DIR, IMPORT_STORE_DIR, f"chat_{chat_id}")
+        target = os.path.join(target_dir, f"{file_unique_id}{ext}")
+        if os.path.exists(target):
+            return target
+        os.makedirs(target_dir, exist_ok=True)
+        try:
+            os.link(source, target)
+        except OSError:
+            shutil.copy2(source, target)
+        self.files_linked += 1
+        return target
+
+    def _flush(self, connection):
+        """Запись накопленной пачки одной транзакцией"""
+        if not self._rows["import_messages"] and not self._chats:
+            return
+        self._ensure_partitions()
+        cursor = connection.cursor()
+        try:
+            self._merge_chats(cursor)
+            for table, rows in self._rows.items():
+                if rows:
+                    self._copy(cursor, table, rows)
+            for table, statement in MERGE_STATEMENTS:
+                cursor.execute(statement)
+                self.inserted[table] += cursor.fetchone()[0] if cursor.description else cursor.rowcount
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        for rows in self._rows.values():
+            rows.clear()
+
+        stats = self.get_stats()
+        logger.info(
+            f"Прочитано сообщений: {stats['parsed']} ({stats['messages_per_sec']:.0f}/с), "
+            f"добавлено строк: {sum(stats['inserted'].values())} ({stats['rows_per_sec']:.0f}/с)"
+        )
+
+    def _ensure_partitions(self):
+        """Секции месяцев пачки (иначе старая история попадет в секции по умолчанию)"""
+        months = {
+            month_start(row[4]) for row in self._rows["import_messages"] if row[4] is not None
+        } - self._partition_months
+        if not months:
+            return
+        with self.engine.begin() as connection:
+            create_partitions(connection, months)
+        self._partition_months.update(months)
+
+    def _merge_chats(self, cursor):
+        """Создание чатов пачки (название сохраненного ботом чата не меняется)"""
+        for chat_id, (title, chat_type) in self._chats.items():
+            cursor.execute(
+                """
+                INSERT INTO chats (id, title, chat_type, created_at)
+                VALUES (%s, left(%s, 255), %s, now() AT TIME ZONE 'utc')
+                ON CONFLICT (id) DO UPDATE SET
+                    title = COALESCE(chats.title, excluded.title),
+                    chat_type = COALESCE(chats.chat_type, excluded.chat_type)
+                RETURNING xmax = 0
+                """,
+                (chat_id, title, chat_type)
+            )
+            self.inserted["chats"] += int(cursor.fetchone()[0])
+        self._chats.clear()
+
+    @staticmethod
+    def _copy(cursor, table: str, rows: list):
+        """COPY строк во временную таблицу"""
+        buffer = io.StringIO()
+        for row in rows:
+            buffer.write("\t".join(map(_copy_value, row)))
+            buffer.write("\n")
+        statement = f"COPY {table} FROM STDIN"
+        if hasattr(cursor, "copy_expert"):
+            # psycopg2
+            buffer.seek(0)
+            cursor.copy_expert(statement, buffer)
+        else:
+            # psycopg 3 (драйвер SQLAlchemy 2.1 для postgresql://)
+            with cursor.copy(statement) as copy:
+                copy.write(buffer.getvalue())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("export", help="Путь к result.json")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE,
+                        help=f"Сообщений в одной транзакции (по умолчанию {DEFAULT_CHUNK_SIZE})")
+    parser.add_argument("--no-media", action="store_true", help="Не связывать файлы экспорта с хранилищем")
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+
+    if not os.path.isfile(args.export):
+        print(f"Файл не найден: {args.export}", file=sys.stderr)
+        sys.exit(1)
+
+    db_manager = DatabaseManager()
+    db_manager.create_tables()
+    importer = DesktopExportImporter(db_manager.engine, args.export, args.chunk_size, not args.no_media)
+    stats = importer.run()
+
+    print("=" * 60)
+    print(f"Прочитано сообщений: {stats['parsed']} за {stats['elapsed']:.1f} с "
+          f"({stats['messages_per_sec']:.0f} сообщений/с)")
+    for table, count in stats['inserted'].items():
+        print(f"  {table}: добавлено {count}")
+    print(f"Связано файлов: {stats['files_linked']}")
+    print(f"Скорость записи: {stats['rows_per_sec']:.0f} строк/с")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Запись в БД операций из журнала, который не использует ни один запущенный процесс
+
+Бот дописывает свой журнал в БД сам. Утилита нужна для журналов, оставшихся
+без владельца, например journal/worker-3 после уменьшения WORKER_PROCESSES.
+Повторная запись идемпотентна: сообщения, документы и реакции не дублируются.
+
+Запуск:
+    python -m tools.replay_journal journal/worker-3
+    python -m tools.replay_journal --status journal/*
+"""
+import argparse
+import asyncio
+import logging
+import sys
+from database.async_db_manager import AsyncDatabaseManager
+from database.journal import WriteAheadJournal
+from database.write_queue import WriteBehindQueue
+
+logger = logging.getLogger(__name__)
+
+
+def print_status(directory: str):
+    """Вывод состояния журнала"""
+    status = WriteAheadJournal.read_status(directory)
+    oldest = status['oldest_pending'].strftime('%Y-%m-%d %H:%M:%S') if status['oldest_pending'] else "-"
+    print(f"{directory}: не записано {status['lag']}, самая старая операция {oldest}, "
+          f"сегментов {status['segments']}, {status['size_bytes'] / 1024 / 1024:.1f} МБ")
+
+
+async def replay(directory: str):
+    """Запись журнала в БД до его конца"""
+    db_manager = AsyncDatabaseManager()
+    write_queue = WriteBehindQueue(db_manager, journal=WriteAheadJournal(directory))
+    await write_queue.start()
+    try:
+        while write_queue.replaying:
+            await asyncio.sleep(0.5)
+    finally:
+        await write_queue.stop()
+        await db_manager.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("directories", nargs="+", help="Каталоги журналов")
+    parser.add_argument("--status", action="store_true", help="Только показать состояние")
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+
+    for directory in args.directories:
+        if args.status:
+            print_status(directory)
+            continue
+        try:
+            asyncio.run(replay(directory))
+        except RuntimeError as e:
+            print(e, file=sys.stderr)
+            sys.exit(1)
+        print_status(directory)
+
+
+if __name__ == "__main__":
+    main()